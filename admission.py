@@ -0,0 +1,412 @@
+"""
+Admission control for chat turns and tool execution.
+
+Chat turns are limited per user and globally. A turn over either limit is
+queued rather than refused: queued turns are served round-robin across
+users, so one user with many tabs cannot push everyone else back, and the
+waiting turn streams 'queued' events with its position until it is
+admitted. Only a user with too many turns already queued gets an
+immediate refusal.
+
+Tool calls draw from a per-user token bucket (bash and grep cost more than
+a file read), so a user running heavy tool loops cannot take over the
+shared tool worker pool.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Any, AsyncIterator, Callable, Iterator, Optional, Tuple
+
+import config
+
+
+MAX_TURNS_PER_USER = getattr(config, 'MAX_TURNS_PER_USER', 2)
+MAX_TURNS_GLOBAL = getattr(config, 'MAX_TURNS_GLOBAL', 32)
+# Queued turns per user beyond which new turns are refused
+MAX_QUEUED_PER_USER = getattr(config, 'MAX_QUEUED_TURNS_PER_USER', 5)
+# Seconds a turn may wait in the queue before it fails
+QUEUE_TIMEOUT = getattr(config, 'TURN_QUEUE_TIMEOUT', 300)
+
+# Tool token bucket: tokens per second and burst size, per user
+TOOL_RATE = getattr(config, 'TOOL_RATE_PER_USER', 4.0)
+TOOL_BURST = getattr(config, 'TOOL_BURST_PER_USER', 16)
+# Cost of a call in tokens (tools not listed cost 1)
+TOOL_COSTS = getattr(config, 'TOOL_RATE_COSTS', {'bash': 4, 'grep': 2})
+
+
+class QueueFull(Exception):
+    """The user already has too many turns waiting."""
+
+
+class QueueTimeout(Exception):
+    """A turn waited longer than QUEUE_TIMEOUT."""
+
+
+class Ticket:
+    """A turn's place in admission control."""
+
+    __slots__ = ('username', 'granted', 'done', 'enqueued_at', 'granted_at')
+
+    def __init__(self, username: str):
+        self.username = username
+        self.granted = False
+        self.done = False
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+
+
+class AdmissionController:
+    """Per-user and global turn limits with a round-robin wait queue."""
+
+    def __init__(self, per_user: int = MAX_TURNS_PER_USER, global_limit: int = MAX_TURNS_GLOBAL,
+                 max_queued: int = MAX_QUEUED_PER_USER, queue_timeout: float = QUEUE_TIMEOUT):
+        """
+        Initialize admission controller.
+
+        Args:
+            per_user: Running turns allowed per user
+            global_limit: Running turns allowed in total
+            max_queued: Waiting turns allowed per user
+            queue_timeout: Seconds a turn may wait
+        """
+        self.per_user = per_user
+        self.global_limit = global_limit
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._running: Dict[str, int] = {}
+        self._total_running = 0
+        self._waiting: Dict[str, deque] = {}
+        # Users with waiting turns, the next one to serve first
+        self._rotation: deque = deque()
+        self._cond = threading.Condition()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timeouts': 0}
+
+    def enqueue(self, username: str) -> Ticket:
+        """
+        Request a slot for a new turn.
+
+        Returns:
+            Ticket, already granted if a slot was free
+
+        Raises:
+            QueueFull: The user has max_queued turns waiting already
+        """
+        with self._cond:
+            ticket = Ticket(username)
+            waiting = self._waiting.get(username)
+            if not waiting and self._can_run(username):
+                self._grant(ticket)
+                return ticket
+            if waiting is not None and len(waiting) >= self.max_queued:
+                self.stats['rejected'] += 1
+                raise QueueFull(f'已有 {len(waiting)} 个请求在排队，请等待当前请求完成')
+
+            if waiting is None:
+                waiting = self._waiting[username] = deque()
+                self._rotation.append(username)
+            waiting.append(ticket)
+            self.stats['queued'] += 1
+            self._notify()
+            return ticket
+
+    def release(self, ticket: Ticket):
+        """Give back a ticket's slot, or leave the queue if it was still waiting."""
+        with self._cond:
+            if ticket.done:
+                return
+            ticket.done = True
+            if ticket.granted:
+                self._running[ticket.username] -= 1
+                if not self._running[ticket.username]:
+                    del self._running[ticket.username]
+                self._total_running -= 1
+            else:
+                self._remove_waiting(ticket)
+            self._dispatch()
+            self._notify()
+
+    def _can_run(self, username: str) -> bool:
+        return (self._total_running < self.global_limit
+                and self._running.get(username, 0) < self.per_user)
+
+    def _grant(self, ticket: Ticket):
+        ticket.granted = True
+        ticket.granted_at = time.monotonic()
+        self._running[ticket.username] = self._running.get(ticket.username, 0) + 1
+        self._total_running += 1
+        self.stats['admitted'] += 1
+
+    def _remove_waiting(self, ticket: Ticket):
+        waiting = self._waiting.get(ticket.username)
+        if waiting is None:
+            return
+        try:
+            waiting.remove(ticket)
+        except ValueError:
+            return
+        if not waiting:
+            del self._waiting[ticket.username]
+            self._rotation.remove(ticket.username)
+
+    def _dispatch(self):
+        """Admit waiting turns round-robin while slots are free (lock held)."""
+        while self._rotation and self._total_running < self.global_limit:
+            for _ in range(len(self._rotation)):
+                username = self._rotation[0]
+                self._rotation.rotate(-1)
+                if self._running.get(username, 0) < self.per_user:
+                    waiting = self._waiting[username]
+                    self._grant(waiting.popleft())
+                    if not waiting:
+                        # The user was just rotated to the back
+                        del self._waiting[username]
+                        self._rotation.pop()
+                    break
+            else:
+                # Everyone waiting is at their per-user limit
+                return
+
+    def _position(self, ticket: Ticket) -> int:
+        """1-based position in round-robin serving order (lock held)."""
+        queues = [self._waiting[username] for username in self._rotation]
+        position = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    if queue[depth] is ticket:
+                        return position
+        return position
+
+    def _waiting_count(self) -> int:
+        return sum(len(queue) for queue in self._waiting.values())
+
+    def _notify(self):
+        """Wake up thread and asyncio waiters (called with the lock held)."""
+        self._cond.notify_all()
+        waiters = self._async_waiters
+        self._async_waiters = []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _check(self, ticket: Ticket, last: Optional[int]) -> Tuple[Optional[Dict[str, Any]], float]:
+        """
+        Inspect a waiting ticket (lock held).
+
+        Returns:
+            (event to send or None, seconds left before the queue timeout)
+
+        Raises:
+            QueueTimeout: The ticket waited too long; it leaves the queue
+        """
+        remaining = ticket.enqueued_at + self.queue_timeout - time.monotonic()
+        if remaining <= 0:
+            self._remove_waiting(ticket)
+            ticket.done = True
+            self.stats['timeouts'] += 1
+            self._notify()
+            raise QueueTimeout('服务器繁忙，排队超时，请稍后重试')
+        position = self._position(ticket)
+        if position == last:
+            return None, remaining
+        return {'type': 'queued', 'position': position, 'waiting': self._waiting_count()}, remaining
+
+    def _admitted_event(self, ticket: Ticket) -> Dict[str, Any]:
+        return {'type': 'admitted', 'waited_ms': round((ticket.granted_at - ticket.enqueued_at) * 1000, 1)}
+
+    def wait(self, ticket: Ticket) -> Iterator[Dict[str, Any]]:
+        """
+        Wait for a ticket to be granted.
+
+        Yields:
+            'queued' events whenever the position changes, then 'admitted';
+            nothing if the ticket was granted straight away
+
+        Raises:
+            QueueTimeout: The ticket waited longer than queue_timeout
+        """
+        last = None
+        while True:
+            with self._cond:
+                if ticket.granted:
+                    break
+                event, remaining = self._check(ticket, last)
+                if event is None:
+                    self._cond.wait(remaining)
+                    continue
+            last = event['position']
+            yield event
+        if last is not None:
+            yield self._admitted_event(ticket)
+
+    async def wait_async(self, ticket: Ticket) -> AsyncIterator[Dict[str, Any]]:
+        """Asyncio variant of wait()."""
+        last = None
+        while True:
+            waiter = None
+            with self._cond:
+                if ticket.granted:
+                    break
+                event, remaining = self._check(ticket, last)
+                if event is None:
+                    waiter = asyncio.Event()
+                    self._async_waiters.append((asyncio.get_running_loop(), waiter))
+            if waiter is not None:
+                try:
+                    await asyncio.wait_for(waiter.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            last = event['position']
+            yield event
+        if last is not None:
+            yield self._admitted_event(ticket)
+
+    def admitted(self, ticket: Ticket, events: Iterator[Dict[str, Any]],
+                 abort: Callable[[Exception], List[Dict[str, Any]]]) -> Iterator[Dict[str, Any]]:
+        """
+        Run a turn's events once its ticket is granted.
+
+        Args:
+            ticket: Ticket from enqueue()
+            events: Event iterator running the turn (e.g. ChatTurn.run())
+            abort: Called with QueueTimeout to get the events closing a
+                turn that never ran (e.g. ChatTurn.abort)
+
+        Yields:
+            Queue events, then the turn's events
+        """
+        try:
+            try:
+                yield from self.wait(ticket)
+            except QueueTimeout as e:
+                yield from abort(e)
+                return
+            yield from events
+        finally:
+            self.release(ticket)
+
+    async def admitted_async(self, ticket: Ticket, events: AsyncIterator[Dict[str, Any]],
+                             abort: Callable[[Exception], List[Dict[str, Any]]]) -> AsyncIterator[Dict[str, Any]]:
+        """Asyncio variant of admitted()."""
+        try:
+            try:
+                async for event in self.wait_async(ticket):
+                    yield event
+            except QueueTimeout as e:
+                # abort() saves the conversation state, keep it off the loop
+                for event in await asyncio.get_running_loop().run_in_executor(None, abort, e):
+                    yield event
+                return
+            async for event in events:
+                yield event
+        finally:
+            self.release(ticket)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Running and waiting turns, by user, and counters."""
+        with self._cond:
+            return {
+                **self.stats,
+                'running': self._total_running,
+                'waiting': self._waiting_count(),
+                'running_by_user': dict(self._running),
+                'waiting_by_user': {username: len(queue) for username, queue in self._waiting.items()},
+                'per_user_limit': self.per_user,
+                'global_limit': self.global_limit
+            }
+
+
+class ToolRateLimiter:
+    """Per-user token buckets for tool calls."""
+
+    def __init__(self, rate: float = TOOL_RATE, burst: float = TOOL_BURST,
+                 costs: Optional[Dict[str, float]] = None):
+        """
+        Initialize tool rate limiter.
+
+        Args:
+            rate: Tokens added per second
+            burst: Bucket size
+            costs: Tokens per call by tool name (default 1)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.costs = TOOL_COSTS if costs is None else costs
+        # username -> [tokens, last refill time]
+        self._buckets: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'throttled': 0, 'wait_ms': 0.0}
+
+    def _cost(self, tool_name: str) -> float:
+        return min(self.costs.get(tool_name, 1), self.burst)
+
+    def _refill(self, username: str) -> List[float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(username)
+        if bucket is None:
+            bucket = self._buckets[username] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def try_acquire(self, username: str, tool_name: str) -> bool:
+        """Take the call's tokens if the bucket has them; never waits."""
+        with self._lock:
+            bucket = self._refill(username)
+            cost = self._cost(tool_name)
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            self.stats['calls'] += 1
+            return True
+
+    def reserve(self, username: str, tool_name: str) -> float:
+        """
+        Take the call's tokens, going into debt if needed.
+
+        Returns:
+            Seconds the caller must wait before running the call
+        """
+        with self._lock:
+            bucket = self._refill(username)
+            bucket[0] -= self._cost(tool_name)
+            self.stats['calls'] += 1
+            delay = max(0.0, -bucket[0] / self.rate) if self.rate > 0 else 0.0
+            if delay:
+                self.stats['throttled'] += 1
+                self.stats['wait_ms'] = round(self.stats['wait_ms'] + delay * 1000, 1)
+            return delay
+
+    def acquire(self, username: str, tool_name: str):
+        """Wait until the user may run the call (on the caller's thread, not a worker)."""
+        delay = self.reserve(username, tool_name)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, username: str, tool_name: str):
+        """Asyncio variant of acquire()."""
+        delay = self.reserve(username, tool_name)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Call and throttling counters."""
+        with self._lock:
+            return {**self.stats, 'rate': self.rate, 'burst': self.burst}
+
+
+# Global instance
+_controller = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """Get the global admission controller instance."""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
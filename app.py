@@ -1,18 +1,33 @@
 from flask import Flask, render_template, request, jsonify, Response, session, redirect, url_for
 from flask_socketio import SocketIO, emit
-import anthropic
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
 import config
 import tools
+import glob_engine
+import grep_engine
+import ripgrep_backend
+import trigram_index
+import workspace_index
 import json
 import database
 import uuid
-import system_prompt
+import prompt_cache
+import context_compactor
+import model_retry
+import model_router
+import turn_metrics
+import stream_replay
 from mcp.security import init_encryption
 from mcp.manager import get_mcp_manager
 from tool_router import get_tool_router
+from model_client import get_client_registry
+from conversation_store import get_conversation_store, VersionConflict
+from chat_pipeline import ChatTurn
+from chat_turns import get_turn_manager
+from admission import get_admission_controller, QueueFull
+from db_writer import get_db_writer
 from operation_logger import (
     get_operation_logs,
     get_pending_operations,
@@ -23,7 +38,10 @@ from operation_logger import (
 import mcp_database
 import skills_database
 import memory_database
+import memory_index
 import threading
+import signal
+import sys
 
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
@@ -37,6 +55,10 @@ ANTHROPIC_AUTH_TOKEN = config.ANTHROPIC_AUTH_TOKEN
 init_encryption(config.SECRET_KEY)
 mcp_manager = get_mcp_manager()
 tool_router = get_tool_router()
+client_registry = get_client_registry()
+conversation_store = get_conversation_store()
+turn_manager = get_turn_manager()
+admission_controller = get_admission_controller()
 
 # 初始化Skills数据库
 try:
@@ -51,6 +73,18 @@ try:
 except Exception as e:
     print(f"Warning: Failed to initialize memory: {e}")
 
+# 初始化会话状态表
+try:
+    database.init_conversation_state_db()
+except Exception as e:
+    print(f"Warning: Failed to initialize conversation state: {e}")
+
+# 初始化聊天轮次事件日志表
+try:
+    database.init_chat_turns_db()
+except Exception as e:
+    print(f"Warning: Failed to initialize chat turns: {e}")
+
 # 登录验证装饰器
 def login_required(f):
     @wraps(f)
@@ -60,6 +94,19 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# 管理员用户（可查看全局统计）
+ADMIN_USERS = getattr(config, 'ADMIN_USERS', ['admin'])
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'username' not in session:
+            return redirect(url_for('login'))
+        if session['username'] not in ADMIN_USERS:
+            return jsonify({'error': '需要管理员权限'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -94,7 +141,7 @@ def index():
 @app.route('/api/files', methods=['GET'])
 @login_required
 def list_files():
-    """列出指定目录下的文件和文件夹"""
+    """列出指定目录下的文件和文件夹（启用工作区索引时从内存中的目录树读取）"""
     try:
         path = request.args.get('path', '/root/claude-web')
 
@@ -108,19 +155,17 @@ def list_files():
             return jsonify({'error': '路径不存在'}), 404
 
         items = []
-        for item in sorted(os.listdir(abs_path)):
-            item_path = os.path.join(abs_path, item)
-            is_dir = os.path.isdir(item_path)
-
+        for entry in workspace_index.scandir(abs_path):
             # 跳过隐藏文件和特殊目录
-            if item.startswith('.') and item not in ['.gitignore', '.env.example']:
+            if entry.name.startswith('.') and entry.name not in ['.gitignore', '.env.example']:
                 continue
 
+            is_dir = entry.is_dir()
             items.append({
-                'name': item,
-                'path': item_path,
+                'name': entry.name,
+                'path': entry.path,
                 'is_dir': is_dir,
-                'size': os.path.getsize(item_path) if not is_dir else 0
+                'size': entry.stat().st_size if not is_dir else 0
             })
 
         return jsonify({
@@ -202,6 +247,7 @@ def model_operations():
                     'sonnet': 'Claude Sonnet 4.5 - 平衡性能和速度',
                     'opus': 'Claude Opus 4.6 - 最强大的模型',
                     'haiku': 'Claude Haiku 3.5 - 最快速的模型',
+                    'auto': '自动 - 按每轮迭代选择模型，简单的工具后续步骤使用 Haiku',
                     'doubao': '豆包大模型 - 中文优化',
                     'kimi': 'Kimi - 代码优化模型',
                     'zhipu': '智谱AI - 高效推理'
@@ -229,6 +275,7 @@ def clear_history():
     """清除对话历史"""
     username = session.get('username')
     deleted_count = database.clear_user_history(username)
+    conversation_store.clear(session.get('session_id'), username)
     # 生成新的会话 ID
     session['session_id'] = str(uuid.uuid4())
     return jsonify({'success': True, 'message': f'已清除 {deleted_count} 条对话历史'})
@@ -240,7 +287,8 @@ def get_history():
     username = session.get('username')
     limit = request.args.get('limit', 100, type=int)
     history = database.get_conversation_history(username, limit)
-    return jsonify({'success': True, 'history': history})
+    version = conversation_store.get_version(session.get('session_id'), username)
+    return jsonify({'success': True, 'history': history, 'conversation_version': version})
 
 @app.route('/api/search', methods=['POST'])
 @login_required
@@ -293,7 +341,7 @@ def export_conversation():
 @app.route('/api/save-message', methods=['POST'])
 @login_required
 def save_message_api():
-    """保存消息到数据库"""
+    """保存消息到数据库（供旧版页面使用；聊天消息现由服务端在本轮中保存）"""
     try:
         data = request.json
         username = session.get('username')
@@ -316,7 +364,6 @@ def chat():
     try:
         data = request.json
         user_message = data.get('message', '')
-        conversation_history = data.get('history', [])
         auto_approve = data.get('auto_approve', False)  # 获取auto_approve参数
         username = session.get('username')
         current_model = session.get('model', config.DEFAULT_MODEL)
@@ -325,180 +372,278 @@ def chat():
         if not ANTHROPIC_AUTH_TOKEN:
             return jsonify({'error': 'API Token 未设置'}), 500
 
-        # 保存用户消息到数据库
-        database.save_message(username, 'user', user_message, current_model, session_id)
-
         # 处理命令
         if user_message.startswith('/'):
             command_result = handle_command(user_message)
             if command_result:
+                database.save_message(username, 'user', user_message, current_model, session_id)
                 return jsonify(command_result)
 
-        # 获取当前模型
+        # 获取当前模型（auto 先使用规划模型，之后每轮迭代由 model_router 选择）
         current_model = session.get('model', config.DEFAULT_MODEL)
-        model_id = config.AVAILABLE_MODELS.get(current_model, config.AVAILABLE_MODELS['sonnet'])
+        turn_model = model_router.resolve(current_model)
+        model_id = config.AVAILABLE_MODELS.get(turn_model, config.AVAILABLE_MODELS['sonnet'])
 
-        client = anthropic.Anthropic(
-            api_key=ANTHROPIC_AUTH_TOKEN,
-            base_url=ANTHROPIC_BASE_URL
-        )
+        # 复用进程级共享客户端（长连接池），避免每条消息重新握手
+        client = client_registry.get_client(ANTHROPIC_BASE_URL, ANTHROPIC_AUTH_TOKEN, turn_model)
+        # 录制模型流，用于离线回放和基准测试（见 stream_replay.py）
+        if stream_replay.RECORD_DIR:
+            client = stream_replay.RecordingClient(client, stream_replay.new_fixture_path(session_id))
 
-        # 构建消息历史
-        messages = []
-        for msg in conversation_history:
-            messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+        # 并发限制：超出每用户或全局上限的轮次排队（按用户轮转），排队过多时直接拒绝
+        try:
+            ticket = admission_controller.enqueue(username)
+        except QueueFull as e:
+            return jsonify({'error': str(e)}), 429
+
+        try:
+            try:
+                messages, previous_turn_end, base_version = begin_chat_turn(data, username, session_id, current_model)
+            except VersionConflict as e:
+                admission_controller.release(ticket)
+                return jsonify({'error': '对话已在其他窗口更新，请重试', 'version': e.current_version}), 409
+
+            turn = ChatTurn(
+                client,
+                turn_model,
+                model_id,
+                messages,
+                previous_turn_end,
+                username,
+                session_id,
+                auto_approve=auto_approve,
+                summary_client=get_summary_client(),
+                fallback_targets=model_retry.build_fallback_targets(
+                    turn_model, ANTHROPIC_BASE_URL, ANTHROPIC_AUTH_TOKEN, client_registry.get_client
+                ),
+                route_targets=model_router.target_factory(
+                    ANTHROPIC_BASE_URL, ANTHROPIC_AUTH_TOKEN, client_registry.get_client
+                ) if model_router.is_auto(current_model) else None,
+                base_version=base_version
+            )
+
+            # 本轮在后台线程中执行（排队时先发送 queued 事件），浏览器断开后可通过 /api/chat/<turn_id>/events 重新接入
+            turn_id = turn_manager.start(username, session_id,
+                                         admission_controller.admitted(ticket, turn.run(), turn.abort))
+        except Exception:
+            admission_controller.release(ticket)
+            raise
+        return Response(turn_manager.stream(turn_id), mimetype='text/event-stream')
 
-        messages.append({
-            "role": "user",
-            "content": user_message
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def begin_chat_turn(data, username, session_id, current_model):
+    """
+    在服务端保存的会话上开始新的一轮，并保存用户消息
+
+    返回 (messages, previous_turn_end, base_version)，版本冲突时抛出 VersionConflict
+    """
+    user_message = data.get('message', '')
+    conversation_history = data.get('history', [])
+
+    # 会话状态以服务端为准：客户端只需发送新消息和上次看到的版本号
+    if conversation_history and 'version' not in data:
+        # 兼容旧客户端：以其上传的历史为准
+        conversation_store.seed(session_id, username, [
+            {"role": msg["role"], "content": msg["content"]} for msg in conversation_history
+        ])
+
+    # previous_turn_end 为上一轮对话末尾的位置（用于提示缓存断点）
+    messages, previous_turn_end, base_version = conversation_store.begin_turn(
+        session_id,
+        username,
+        user_message,
+        version=data.get('version'),
+        regenerate=data.get('regenerate', False)
+    )
+
+    # 保存用户消息到数据库
+    database.save_message(username, 'user', user_message, current_model, session_id)
+    return messages, previous_turn_end, base_version
+
+def get_summary_client():
+    """上下文摘要使用的客户端（未配置摘要模型时为 None）"""
+    if not context_compactor.SUMMARY_MODEL:
+        return None
+    client = client_registry.get_client(
+        ANTHROPIC_BASE_URL, ANTHROPIC_AUTH_TOKEN, context_compactor.SUMMARY_MODEL
+    )
+    # 共享客户端关闭了 SDK 自带重试（由 model_retry 负责），摘要请求仍使用 SDK 重试
+    return client.with_options(max_retries=2)
+
+@app.route('/api/chat/<turn_id>/events', methods=['GET'])
+@login_required
+def chat_turn_events(turn_id):
+    """重新接入聊天轮次的事件流，从 Last-Event-ID 之后开始回放"""
+    try:
+        if turn_manager.get_owner(turn_id) != session.get('username'):
+            return jsonify({'error': '轮次不存在'}), 404
+
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return jsonify({'error': '无效的 Last-Event-ID'}), 400
+
+        return Response(turn_manager.stream(turn_id, last_event_id), mimetype='text/event-stream')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/clients', methods=['GET'])
+@login_required
+def diagnostics_clients():
+    """获取模型API客户端连接池状态"""
+    try:
+        return jsonify({
+            'success': True,
+            'clients': client_registry.get_stats(),
+            'circuit_breakers': model_retry.get_breaker_stats()
         })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        def generate():
-            assistant_response = ""
-            try:
-                # 获取所有工具（包括MCP工具）
-                all_tools = tool_router.get_all_tools()
-
-                # Agentic loop - 持续执行直到Claude不再调用工具
-                max_iterations = 25  # 防止无限循环
-                iteration = 0
-
-                while iteration < max_iterations:
-                    iteration += 1
-
-                    # 调用Claude API
-                    response = client.messages.create(
-                        model=model_id,
-                        max_tokens=4096,
-                        messages=messages,
-                        tools=all_tools,
-                        system=system_prompt.get_system_prompt(),
-                        stream=True
-                    )
-
-                    current_text = ""
-                    tool_uses = []
-                    has_tool_use = False
-
-                    for event in response:
-                        if event.type == "content_block_start":
-                            if hasattr(event.content_block, 'type'):
-                                if event.content_block.type == "tool_use":
-                                    has_tool_use = True
-                                    tool_uses.append({
-                                        "id": event.content_block.id,
-                                        "name": event.content_block.name,
-                                        "input": {}
-                                    })
-
-                        elif event.type == "content_block_delta":
-                            if hasattr(event.delta, 'type'):
-                                if event.delta.type == "text_delta":
-                                    text = event.delta.text
-                                    current_text += text
-                                    assistant_response += text
-                                    yield f"data: {json.dumps({'type': 'text', 'content': text})}\n\n"
-                                elif event.delta.type == "input_json_delta":
-                                    if tool_uses:
-                                        tool_uses[-1]["input_json"] = tool_uses[-1].get("input_json", "") + event.delta.partial_json
-
-                    # 如果没有工具调用，说明对话结束
-                    if not has_tool_use:
-                        break
+@app.route('/api/admin/metrics/turns', methods=['GET'])
+@admin_required
+def admin_turn_metrics():
+    """获取聊天轮次耗时统计（p50/p95/p99），可按时间范围和模型筛选"""
+    try:
+        hours = float(request.args.get('hours', 24))
+        model = request.args.get('model')
+        since = (datetime.utcnow() - timedelta(hours=hours)).strftime('%Y-%m-%d %H:%M:%S')
+        records = database.get_chat_turn_metrics(since, model)
+        return jsonify({'success': True, 'since': since, **turn_metrics.aggregate(records)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def get_process_stats():
+    """当前进程的线程数、内存和文件描述符（用于容量规划和压力测试）"""
+    stats = {
+        'pid': os.getpid(),
+        'threads': threading.active_count(),
+        'turns': turn_manager.get_stats(),
+        'admission': admission_controller.get_stats(),
+        'tool_rate': tool_router.rate_limiter.get_stats(),
+        'db_writer': get_db_writer().get_stats()
+    }
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    stats['rss_mb'] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith('Threads:'):
+                    # 包括非 Python 线程
+                    stats['os_threads'] = int(line.split()[1])
+        stats['open_fds'] = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        pass
+    return stats
+
+@app.route('/api/diagnostics/server', methods=['GET'])
+@login_required
+def diagnostics_server():
+    """获取服务器进程状态（线程、内存、进行中的聊天轮次）"""
+    try:
+        return jsonify({'success': True, 'mode': 'threading', **get_process_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/prompt-cache', methods=['GET'])
+@login_required
+def diagnostics_prompt_cache():
+    """获取提示缓存命中统计"""
+    try:
+        return jsonify({'success': True, 'models': prompt_cache.get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/tool-cache', methods=['GET'])
+@admin_required
+def diagnostics_tool_cache():
+    """获取只读工具结果缓存的命中统计"""
+    try:
+        return jsonify({'success': True, **tool_router.result_cache.get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/tool-catalog', methods=['GET'])
+@admin_required
+def diagnostics_tool_catalog():
+    """获取工具目录的版本和工具数"""
+    try:
+        return jsonify({'success': True, **tool_router.catalog.get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/tool-output', methods=['GET'])
+@admin_required
+def diagnostics_tool_output():
+    """获取超大工具结果的截断和落盘统计"""
+    try:
+        return jsonify({'success': True, **tool_router.output_shaper.get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/glob', methods=['GET'])
+@admin_required
+def diagnostics_glob():
+    """获取 glob 遍历统计"""
+    try:
+        return jsonify({'success': True, **glob_engine.get_glob_engine().get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/grep', methods=['GET'])
+@admin_required
+def diagnostics_grep():
+    """获取 grep 搜索统计（含 ripgrep 后端）"""
+    try:
+        ripgrep = ripgrep_backend.get_ripgrep()
+        return jsonify({
+            'success': True,
+            **grep_engine.get_grep_engine().get_stats(),
+            'ripgrep': ripgrep.get_stats() if ripgrep else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/trigram-index', methods=['GET'])
+@admin_required
+def diagnostics_trigram_index():
+    """获取 trigram 索引的大小和新鲜度"""
+    try:
+        if not trigram_index.ENABLED:
+            return jsonify({'success': True, 'enabled': False})
+        return jsonify({'success': True, **trigram_index.get_trigram_index().get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-                    # 处理所有工具调用
-                    tool_results = []
-                    for tool_use in tool_uses:
-                        if "input_json" not in tool_use:
-                            continue
-
-                        tool_input = json.loads(tool_use["input_json"])
-                        tool_name = tool_use["name"]
-
-                        # 发送工具调用信息
-                        yield f"data: {json.dumps({'type': 'tool_use', 'name': tool_name, 'input': tool_input})}\n\n"
-
-                        # 执行工具
-                        exec_result = tool_router.execute_tool(
-                            tool_name=tool_name,
-                            tool_input=tool_input,
-                            username=username,
-                            session_id=session_id,
-                            auto_approve=auto_approve
-                        )
-
-                        # 检查是否需要用户输入
-                        if exec_result.get('status') == 'success' and exec_result.get('result', {}).get('requires_user_input'):
-                            yield f"data: {json.dumps({'type': 'waiting_user_input'})}\n\n"
-                            if assistant_response:
-                                database.save_message(username, 'assistant', assistant_response, current_model, session_id)
-                            return
-
-                        # 检查是否需要权限
-                        if exec_result['status'] == 'pending_permission':
-                            yield f"data: {json.dumps({'type': 'permission_required', 'log_id': exec_result['log_id'], 'preview': exec_result['preview']})}\n\n"
-                            yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                            if assistant_response:
-                                database.save_message(username, 'assistant', assistant_response, current_model, session_id)
-                            return
-
-                        # 获取执行结果
-                        if exec_result['status'] == 'success':
-                            result = exec_result['result']
-                        else:
-                            result = {'error': exec_result.get('error', '执行失败')}
-
-                        # 发送工具结果
-                        yield f"data: {json.dumps({'type': 'tool_result', 'name': tool_name, 'result': result})}\n\n"
-
-                        # 保存工具结果用于下一轮
-                        tool_results.append({
-                            "tool_use": tool_use,
-                            "result": result
-                        })
-
-                    # 构建下一轮消息
-                    # 添加assistant的响应（包含文本和工具调用）
-                    assistant_content = []
-                    if current_text:
-                        assistant_content.append({"type": "text", "text": current_text})
-                    for tr in tool_results:
-                        assistant_content.append({
-                            "type": "tool_use",
-                            "id": tr["tool_use"]["id"],
-                            "name": tr["tool_use"]["name"],
-                            "input": json.loads(tr["tool_use"]["input_json"])
-                        })
-                    messages.append({"role": "assistant", "content": assistant_content})
-
-                    # 添加工具结果
-                    tool_result_content = []
-                    for tr in tool_results:
-                        tool_result_content.append({
-                            "type": "tool_result",
-                            "tool_use_id": tr["tool_use"]["id"],
-                            "content": json.dumps(tr["result"])
-                        })
-                    messages.append({"role": "user", "content": tool_result_content})
-
-                    # 重置状态，继续下一轮
-                    current_text = ""
-                    tool_uses = []
-
-                # 保存 assistant 响应到数据库
-                if assistant_response:
-                    database.save_message(username, 'assistant', assistant_response, current_model, session_id)
-
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
-
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
-
-        return Response(generate(), mimetype='text/event-stream')
+@app.route('/api/diagnostics/workspace-index', methods=['GET'])
+@admin_required
+def diagnostics_workspace_index():
+    """获取工作区索引的内存占用和监听状态"""
+    try:
+        if not workspace_index.ENABLED:
+            return jsonify({'success': True, 'enabled': False})
+        return jsonify({'success': True, **workspace_index.get_workspace_index().get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/diagnostics/memory', methods=['GET'])
+@login_required
+def diagnostics_memory():
+    """获取记忆检索索引的统计（检索次数、平均耗时、已加载条目数）"""
+    try:
+        return jsonify({'success': True, **memory_index.get_memory_index().get_stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+@app.route('/api/diagnostics/model-router', methods=['GET'])
+@login_required
+def diagnostics_model_router():
+    """获取自动模型选择的统计（各模型选择次数、首字延迟和节省的延迟）"""
+    try:
+        return jsonify({'success': True, **model_router.get_model_router().get_stats()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -546,10 +691,10 @@ def handle_command(command):
                 session['model'] = model
                 return {'type': 'command', 'content': f'✓ 已切换到 {model.upper()} 模型'}
             else:
-                return {'type': 'command', 'content': f'✗ 无效的模型: {model}\n可用模型: sonnet, opus, haiku, doubao, kimi, zhipu'}
+                return {'type': 'command', 'content': f'✗ 无效的模型: {model}\n可用模型: ' + ', '.join(config.AVAILABLE_MODELS)}
         else:
             current = session.get('model', config.DEFAULT_MODEL)
-            return {'type': 'command', 'content': f'当前模型: {current.upper()}\n可用模型: sonnet, opus, haiku'}
+            return {'type': 'command', 'content': f'当前模型: {current.upper()}\n可用模型: ' + ', '.join(config.AVAILABLE_MODELS)}
 
     elif cmd == '/clear':
         return {'type': 'command', 'content': '✓ 对话历史已清除', 'clear': True}
@@ -759,6 +904,8 @@ def operations_approve(log_id):
 
         # 执行已批准的操作
         result = tool_router.execute_approved_operation(log_id)
+        if 'result' in result:
+            result['result'] = tool_router.output_shaper.for_display(result['result'])
 
         return jsonify({'success': True, 'result': result})
 
@@ -1323,6 +1470,12 @@ def memory_export_obsidian():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # grep 工作进程在启动任何线程之前 fork（见 grep_engine.GrepEngine.start_pool）
+    grep_engine.get_grep_engine().start_pool()
+
+    # kill（SIGTERM）时正常退出，让后台写队列写完未落盘的消息和操作日志（见 db_writer.py）
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     # 启动时初始化MCP服务器
     try:
         mcp_manager.start_all_servers()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Optional asyncio serving mode for chat streams.
+
+Serves the chat endpoints on a single aiohttp event loop: the model stream
+(AsyncAnthropic), MCP tool calls and SSE fan-out are all awaited on the
+loop, while direct tools and database writes run on worker pools. An open
+stream costs a task instead of an OS thread, so one process can hold
+thousands of mostly idle streams.
+
+Only the chat endpoints live here; pages, files, settings and the SSH
+terminal stay on the Flask app (python app.py). Both share the Flask
+session cookie and the database. Put them behind one reverse proxy, e.g.
+for nginx:
+
+    location ~ ^/api/chat(/|$) {
+        proxy_pass http://127.0.0.1:5001;
+        proxy_buffering off;
+        proxy_read_timeout 1h;
+    }
+    location / {
+        proxy_pass http://127.0.0.1:5000;
+    }
+
+Usage:
+    python async_server.py [--host 0.0.0.0] [--port 5001]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from typing import Dict, Any, Optional
+
+import flask
+from aiohttp import web
+from itsdangerous import BadSignature
+
+import config
+import database
+import grep_engine
+import model_retry
+import model_router
+import stream_replay
+import app as flask_module
+from admission import QueueFull
+from chat_pipeline import AsyncChatTurn
+from conversation_store import VersionConflict
+
+
+logger = logging.getLogger(__name__)
+
+flask_app = flask_module.app
+client_registry = flask_module.client_registry
+turn_manager = flask_module.turn_manager
+admission_controller = flask_module.admission_controller
+mcp_manager = flask_module.mcp_manager
+
+
+def load_session(request: web.Request) -> Optional[Dict[str, Any]]:
+    """Decode the Flask session cookie of a request."""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(
+            cookie,
+            max_age=int(flask_app.permanent_session_lifetime.total_seconds())
+        )
+    except BadSignature:
+        return None
+
+
+def run_command(request: web.Request, command: str):
+    """
+    Run a chat command (/help, /model...) through the Flask handler.
+
+    Returns:
+        (command result or None, new session cookie value or None)
+    """
+    headers = {'Cookie': request.headers.get('Cookie', '')}
+    with flask_app.test_request_context('/api/chat', method='POST', headers=headers):
+        result = flask_module.handle_command(command)
+        cookie = None
+        if flask.session.modified:
+            serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+            cookie = serializer.dumps(dict(flask.session))
+        return result, cookie
+
+
+def json_error(message: str, status: int, **extra) -> web.Response:
+    return web.json_response({'error': message, **extra}, status=status)
+
+
+async def stream_turn(request: web.Request, turn_id: str, after_id: int) -> web.StreamResponse:
+    """Send a turn's events as an SSE response."""
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache'
+    })
+    await response.prepare(request)
+    try:
+        async for frame in turn_manager.stream_async(turn_id, after_id):
+            await response.write(frame.encode('utf-8'))
+    except (ConnectionResetError, asyncio.CancelledError):
+        # The turn keeps running; the client can reattach with Last-Event-ID
+        pass
+    return response
+
+
+async def chat(request: web.Request) -> web.StreamResponse:
+    """POST /api/chat - same contract as the Flask endpoint."""
+    session = load_session(request)
+    if not session or 'username' not in session:
+        return json_error('未登录', 401)
+
+    try:
+        data = await request.json()
+        user_message = data.get('message', '')
+        auto_approve = data.get('auto_approve', False)
+        username = session['username']
+        current_model = session.get('model', config.DEFAULT_MODEL)
+        session_id = session.get('session_id')
+        loop = asyncio.get_running_loop()
+
+        if not flask_module.ANTHROPIC_AUTH_TOKEN:
+            return json_error('API Token 未设置', 500)
+
+        # 处理命令
+        if user_message.startswith('/'):
+            command_result, cookie = await loop.run_in_executor(None, run_command, request, user_message)
+            if command_result:
+                await loop.run_in_executor(
+                    None, database.save_message, username, 'user', user_message, current_model, session_id
+                )
+                response = web.json_response(command_result)
+                if cookie:
+                    response.set_cookie(flask_app.config['SESSION_COOKIE_NAME'], cookie,
+                                        httponly=True, path='/')
+                return response
+
+        turn_model = model_router.resolve(current_model)
+        model_id = config.AVAILABLE_MODELS.get(turn_model, config.AVAILABLE_MODELS['sonnet'])
+        client = client_registry.get_async_client(
+            flask_module.ANTHROPIC_BASE_URL, flask_module.ANTHROPIC_AUTH_TOKEN, turn_model
+        )
+        if stream_replay.RECORD_DIR:
+            client = stream_replay.AsyncRecordingClient(client, stream_replay.new_fixture_path(session_id))
+
+        try:
+            ticket = admission_controller.enqueue(username)
+        except QueueFull as e:
+            return json_error(str(e), 429)
+
+        try:
+            try:
+                messages, previous_turn_end, base_version = await loop.run_in_executor(
+                    None, flask_module.begin_chat_turn, data, username, session_id, current_model
+                )
+            except VersionConflict as e:
+                admission_controller.release(ticket)
+                return json_error('对话已在其他窗口更新，请重试', 409, version=e.current_version)
+
+            turn = AsyncChatTurn(
+                client,
+                turn_model,
+                model_id,
+                messages,
+                previous_turn_end,
+                username,
+                session_id,
+                auto_approve=auto_approve,
+                summary_client=flask_module.get_summary_client(),
+                fallback_targets=model_retry.build_fallback_targets(
+                    turn_model, flask_module.ANTHROPIC_BASE_URL, flask_module.ANTHROPIC_AUTH_TOKEN,
+                    client_registry.get_async_client
+                ),
+                route_targets=model_router.target_factory(
+                    flask_module.ANTHROPIC_BASE_URL, flask_module.ANTHROPIC_AUTH_TOKEN,
+                    client_registry.get_async_client
+                ) if model_router.is_auto(current_model) else None,
+                base_version=base_version
+            )
+            turn_id = await turn_manager.start_async(
+                username, session_id, admission_controller.admitted_async(ticket, turn.run_async(), turn.abort)
+            )
+        except Exception:
+            admission_controller.release(ticket)
+            raise
+
+    except Exception as e:
+        return json_error(str(e), 500)
+
+    return await stream_turn(request, turn_id, 0)
+
+
+async def chat_turn_events(request: web.Request) -> web.StreamResponse:
+    """GET /api/chat/<turn_id>/events - reattach to a turn after Last-Event-ID."""
+    session = load_session(request)
+    if not session or 'username' not in session:
+        return json_error('未登录', 401)
+
+    turn_id = request.match_info['turn_id']
+    loop = asyncio.get_running_loop()
+    owner = await loop.run_in_executor(None, turn_manager.get_owner, turn_id)
+    if owner != session['username']:
+        return json_error('轮次不存在', 404)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id') or 0
+    try:
+        last_event_id = int(last_event_id)
+    except ValueError:
+        return json_error('无效的 Last-Event-ID', 400)
+
+    return await stream_turn(request, turn_id, last_event_id)
+
+
+async def diagnostics(request: web.Request) -> web.Response:
+    """GET /api/diagnostics/async (and /server) - process, event loop and stream counts."""
+    session = load_session(request)
+    if not session or 'username' not in session:
+        return json_error('未登录', 401)
+
+    return web.json_response({
+        'success': True,
+        'mode': 'asyncio',
+        **flask_module.get_process_stats(),
+        'tasks': len(asyncio.all_tasks()),
+        'clients': client_registry.get_stats(),
+        'circuit_breakers': model_retry.get_breaker_stats()
+    }, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+
+async def on_startup(application: web.Application):
+    # MCP servers are started on this loop so tool calls can be awaited directly
+    try:
+        await mcp_manager.start_all_servers_async()
+    except Exception as e:
+        print(f"Warning: Failed to start MCP servers: {e}")
+
+
+async def on_cleanup(application: web.Application):
+    await client_registry.close_all_async()
+
+
+def create_app() -> web.Application:
+    """Build the aiohttp application."""
+    application = web.Application()
+    application.router.add_post('/api/chat', chat)
+    application.router.add_get('/api/chat/{turn_id}/events', chat_turn_events)
+    application.router.add_get('/api/diagnostics/async', diagnostics)
+    application.router.add_get('/api/diagnostics/server', diagnostics)
+    application.on_startup.append(on_startup)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Asyncio chat stream server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+
+    # Fork the grep workers before any thread is started
+    grep_engine.get_grep_engine().start_pool()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
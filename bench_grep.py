@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+grep 基准测试：在合成的 5 万文件目录树上比较原实现（逐行扫描，只搜前 200 个文件）和 grep_engine
+
+查询覆盖：需要扫描全部文件的罕见字面量、达到 head_limit 后可提前结束的常见正则、
+count 模式。原实现分别按发布时的 200 文件上限和不限文件数运行，并检查结果是否一致。
+
+用法:
+    python bench_grep.py
+    python bench_grep.py --files 50000 --root /tmp/grep-tree --keep
+    python bench_grep.py --workers 4
+"""
+
+import argparse
+import glob as glob_module
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from grep_engine import GrepEngine
+
+WORDS = ('self result value config request response session user model cache index token '
+         'return import from class def for in if else while try except with as yield').split()
+RARE = 'needle_token_4242'
+
+
+def make_tree(root, count, rng):
+    """生成 count 个文件：每个目录 50 个源码文件，约 1% 含 TODO，少量含罕见字面量，另有二进制文件"""
+    for i in range(count):
+        directory = os.path.join(root, f'pkg{i // 2500:02d}', f'mod{i // 50:04d}')
+        if i % 50 == 0:
+            os.makedirs(directory, exist_ok=True)
+        lines = []
+        for n in range(rng.randint(20, 60)):
+            words = ' '.join(rng.choices(WORDS, k=rng.randint(3, 10)))
+            if n % 15 == 0:
+                lines.append(f'def func_{i}_{n}({rng.choice(WORDS)}):')
+            else:
+                lines.append(f'    {words}')
+        if rng.random() < 0.01:
+            lines.append('    # TODO: clean this up')
+        if i % 5000 == 1234:
+            lines.append(f'    marker = "{RARE}"')
+        if i % 1000 == 999:
+            with open(os.path.join(directory, f'blob{i}.bin'), 'wb') as f:
+                f.write(bytes(rng.getrandbits(8) for _ in range(2048)) + b'\0')
+        with open(os.path.join(directory, f'file{i}.py'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def legacy_grep(pattern, path=None, file_pattern=None, case_insensitive=False, output_mode='files_with_matches', context=None, after_context=None, before_context=None, multiline=False, head_limit=100, max_files=200):
+    """原 tools.execute_grep（max_files=None 时不限制文件数）"""
+    try:
+        search_path = path
+        abs_path = os.path.abspath(search_path)
+
+        results = []
+        files_with_matches = set()
+        file_match_counts = {}
+
+        # 编译正则表达式
+        flags = re.IGNORECASE if case_insensitive else 0
+        if multiline:
+            flags |= re.MULTILINE | re.DOTALL
+        regex = re.compile(pattern, flags)
+
+        if os.path.isfile(abs_path):
+            files_to_search = [abs_path]
+        else:
+            # 搜索目录
+            if file_pattern:
+                files_to_search = glob_module.glob(os.path.join(abs_path, '**', file_pattern), recursive=True)
+            else:
+                files_to_search = glob_module.glob(os.path.join(abs_path, '**', '*'), recursive=True)
+
+            files_to_search = [f for f in files_to_search if os.path.isfile(f)][:max_files]
+
+        for file_path in files_to_search:
+            try:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                    if multiline:
+                        content = f.read()
+                        matches = list(regex.finditer(content))
+                        if matches:
+                            files_with_matches.add(file_path)
+                            file_match_counts[file_path] = len(matches)
+                            if output_mode == 'content':
+                                for match in matches[:head_limit]:
+                                    results.append({
+                                        "file": file_path,
+                                        "content": match.group(0)
+                                    })
+                    else:
+                        lines = f.readlines()
+
+                match_count = 0
+                if not multiline:
+                    for line_num, line in enumerate(lines, 1):
+                        if regex.search(line):
+                            match_count += 1
+                            files_with_matches.add(file_path)
+
+                            if output_mode == 'content':
+                                # 计算上下文范围
+                                before = before_context if before_context is not None else (context if context else 0)
+                                after = after_context if after_context is not None else (context if context else 0)
+
+                                # 添加上下文行
+                                context_lines = []
+                                if before or after:
+                                    start = max(0, line_num - 1 - before)
+                                    end = min(len(lines), line_num + after)
+                                    for i in range(start, end):
+                                        prefix = ">" if i == line_num - 1 else " "
+                                        context_lines.append(f"{prefix} {i+1:5d}: {lines[i].rstrip()}")
+                                    results.append({
+                                        "file": file_path,
+                                        "line": line_num,
+                                        "content": '\n'.join(context_lines)
+                                    })
+                                else:
+                                    results.append({
+                                        "file": file_path,
+                                        "line": line_num,
+                                        "content": line.rstrip()
+                                    })
+
+                                if len(results) >= head_limit:
+                                    break
+
+                    if match_count > 0:
+                        file_match_counts[file_path] = match_count
+
+            except:
+                continue
+
+            if output_mode == 'content' and len(results) >= head_limit:
+                break
+
+        # 根据输出模式返回结果
+        if output_mode == 'files_with_matches':
+            return {
+                "success": True,
+                "files": sorted(list(files_with_matches))[:head_limit],
+                "count": len(files_with_matches)
+            }
+        elif output_mode == 'count':
+            count_results = [{"file": f, "matches": c} for f, c in sorted(file_match_counts.items())]
+            return {
+                "success": True,
+                "results": count_results[:head_limit],
+                "total_files": len(count_results)
+            }
+        else:  # content
+            return {
+                "success": True,
+                "results": results[:head_limit],
+                "count": len(results)
+            }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def same(reference, engine, mode, limit):
+    """和不限文件数、不限结果数的原实现比较（原实现的 content 结果不按路径排序）"""
+    if mode == 'files_with_matches':
+        return engine['files'] == reference['files'][:limit]
+    expected = reference['results']
+    actual = engine['results']
+    if mode == 'content':
+        # 稳定排序保留文件内的顺序；原实现的 multiline 结果没有行号
+        expected = sorted(expected, key=lambda r: r['file'])
+        actual = [{key: r[key] for key in r if key != 'line' or 'line' in expected[0]} for r in actual]
+    return actual == expected[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='grep 基准测试')
+    parser.add_argument('--files', type=int, default=50000, help='合成文件数')
+    parser.add_argument('--root', help='目录树位置（已存在时直接使用）')
+    parser.add_argument('--keep', action='store_true', help='保留生成的目录树')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='grep_engine 工作进程数')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='bench-grep-')
+    if not os.path.isdir(root) or not os.listdir(root):
+        os.makedirs(root, exist_ok=True)
+        started = time.perf_counter()
+        make_tree(root, args.files, random.Random(args.seed))
+        print(f"生成 {args.files} 个文件: {time.perf_counter() - started:.1f}s  ({root})")
+
+    engine = GrepEngine(workers=args.workers)
+    engine.start_pool()
+    queries = [
+        ('罕见字面量', RARE, 'files_with_matches', {}),
+        ('常见正则 content', r'def \w+\(self', 'content', {}),
+        ('count 模式', r'TODO|FIXME', 'count', {'head_limit': 1000}),
+        ('带上下文', r'TODO', 'content', {'context': 2}),
+    ]
+    try:
+        # 预热：文件系统缓存和工作进程
+        engine.search(RARE, root)
+        print(f"{'查询':<16}{'原实现(200文件)':>16}{'原实现(全部)':>14}{'grep_engine':>14}  结果一致")
+        for name, pattern, mode, extra in queries:
+            capped, capped_time = timed(legacy_grep, pattern, root, output_mode=mode, **extra)
+            full, full_time = timed(legacy_grep, pattern, root, output_mode=mode, max_files=None, **extra)
+            result, engine_time = timed(engine.search, pattern, root, output_mode=mode, **extra)
+            reference = legacy_grep(pattern, root, output_mode=mode, max_files=None,
+                                    **{**extra, 'head_limit': 10 ** 9})
+            limit = extra.get('head_limit', 100)
+            print(f"{name:<16}{capped_time * 1000:>14.0f}ms{full_time * 1000:>12.0f}ms{engine_time * 1000:>12.0f}ms  "
+                  f"{'是' if same(reference, result, mode, limit) else '否'}")
+        print(f"统计: {engine.get_stats()}")
+    finally:
+        if not args.keep and not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
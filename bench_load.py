@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+/api/chat 并发压力测试（容量规划）
+
+对运行中的服务器逐级增加并发：每一级打开 N 个已登录会话，每个会话在测试时长内
+连续发送消息并读取 SSE 流。统计每级的流/秒、首个事件和首个文本的延迟、事件间隔
+抖动、错误率，并轮询 /api/diagnostics/server 记录服务器的线程和内存峰值，
+从而看到 threading 模式的上限。
+
+模型接口使用本地模拟服务器，不消耗 API 额度:
+    python mock_anthropic.py --port 8090 --script tools --rate 50
+    # config.py: ANTHROPIC_BASE_URL = "http://127.0.0.1:8090"，然后启动 app.py
+    python bench_load.py --url http://127.0.0.1:5000 --steps 10,50,100,200 --duration 30
+
+asyncio 模式（async_server.py）下登录仍走 Flask，聊天流走 --chat-url:
+    python bench_load.py --url http://127.0.0.1:5000 --chat-url http://127.0.0.1:5001
+
+所有会话使用同一个用户登录，会受到并发限制（见 admission.py）：超出的轮次排队
+（统计在"排队"列），排队过多时返回 429。测试服务器本身的容量时，在 config.py 中调大
+MAX_TURNS_PER_USER、MAX_TURNS_GLOBAL 和 MAX_QUEUED_TURNS_PER_USER。
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import aiohttp
+
+import config
+from turn_metrics import percentile
+
+
+def pct(values, p):
+    return percentile(sorted(values), p)
+
+
+def fmt_ms(value):
+    return '-' if value is None else f'{value * 1000:.0f}'
+
+
+class StepStats:
+    """一级并发的统计"""
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.attempts = 0
+        self.completed = 0
+        self.queued = 0
+        self.errors = []
+        self.first_event = []
+        self.first_text = []
+        self.durations = []
+        self.gaps = []
+        self.jitter = []
+        self.server = {'threads': 0, 'os_threads': 0, 'rss_mb': 0.0, 'running_turns': 0}
+        self.elapsed = 0.0
+
+    def record_server(self, stats):
+        server = self.server
+        server['threads'] = max(server['threads'], stats.get('threads', 0))
+        server['os_threads'] = max(server['os_threads'], stats.get('os_threads', 0))
+        server['rss_mb'] = max(server['rss_mb'], stats.get('rss_mb', 0.0))
+        server['running_turns'] = max(server['running_turns'], stats.get('turns', {}).get('running', 0))
+
+    def summary(self):
+        return {
+            'concurrency': self.concurrency,
+            'attempts': self.attempts,
+            'completed': self.completed,
+            'queued': self.queued,
+            'streams_per_second': round(self.completed / self.elapsed, 2) if self.elapsed else 0,
+            'error_rate': round(len(self.errors) / self.attempts, 4) if self.attempts else 0,
+            'first_event_p50': pct(self.first_event, 50),
+            'first_event_p95': pct(self.first_event, 95),
+            'first_text_p50': pct(self.first_text, 50),
+            'first_text_p95': pct(self.first_text, 95),
+            'gap_p50': pct(self.gaps, 50),
+            'gap_p99': pct(self.gaps, 99),
+            'jitter_mean': statistics.mean(self.jitter) if self.jitter else None,
+            'duration_p50': pct(self.durations, 50),
+            'server': dict(self.server)
+        }
+
+
+async def login(http, args):
+    async with http.post(f'{args.url}/login', json={'username': args.username, 'password': args.password}) as r:
+        if r.status != 200:
+            raise RuntimeError(f'登录失败: HTTP {r.status}')
+    # 访问首页以初始化 session_id
+    async with http.get(f'{args.url}/', allow_redirects=False) as r:
+        await r.read()
+
+
+async def one_stream(http, args, state, stats):
+    """发送一条消息并读取整个 SSE 流"""
+    stats.attempts += 1
+    started = time.monotonic()
+    first_event = first_text = last_text = None
+    gaps = []
+    done = False
+    queued = False
+
+    payload = {'message': args.message}
+    if state.get('version') is not None:
+        payload['version'] = state['version']
+
+    async with http.post(f'{args.chat_url}/api/chat', json=payload) as r:
+        if r.status != 200:
+            stats.errors.append(f'HTTP {r.status}')
+            if r.status == 409:
+                state['version'] = (await r.json()).get('version')
+            elif r.status == 429:
+                # 排队已满，稍后再试
+                await asyncio.sleep(1.0)
+            return
+        async for line in r.content:
+            if not line.startswith(b'data: '):
+                continue
+            now = time.monotonic()
+            event = json.loads(line[6:])
+            if first_event is None:
+                first_event = now - started
+            if event['type'] == 'text':
+                if first_text is None:
+                    first_text = now - started
+                else:
+                    gaps.append(now - last_text)
+                last_text = now
+            elif event['type'] == 'queued':
+                if not queued:
+                    stats.queued += 1
+                queued = True
+            elif event['type'] == 'state':
+                state['version'] = event['version']
+            elif event['type'] == 'error':
+                stats.errors.append(event.get('error'))
+                return
+            elif event['type'] in ('done', 'waiting_user_input'):
+                done = True
+
+    if not done:
+        stats.errors.append('stream ended without done')
+        return
+    stats.completed += 1
+    stats.durations.append(time.monotonic() - started)
+    if first_event is not None:
+        stats.first_event.append(first_event)
+    if first_text is not None:
+        stats.first_text.append(first_text)
+    stats.gaps.extend(gaps)
+    if len(gaps) > 1:
+        stats.jitter.append(statistics.pstdev(gaps))
+
+
+async def session_loop(args, stats, deadline, ready):
+    """一个已登录会话：在截止时间前连续发送消息"""
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True), timeout=timeout) as http:
+        try:
+            await login(http, args)
+        except Exception as e:
+            stats.errors.append(repr(e))
+            stats.attempts += 1
+            return
+        finally:
+            ready()
+        state = {}
+        while time.monotonic() < deadline[0]:
+            try:
+                await one_stream(http, args, state, stats)
+            except Exception as e:
+                stats.errors.append(repr(e))
+
+
+async def sample_server(args, stats, stop):
+    """轮询服务器状态，记录线程和内存峰值"""
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as http:
+        try:
+            await login(http, args)
+        except Exception:
+            return
+        while not stop.is_set():
+            try:
+                async with http.get(f'{args.chat_url}/api/diagnostics/server') as r:
+                    if r.status == 200:
+                        stats.record_server(await r.json())
+            except Exception:
+                pass
+            try:
+                await asyncio.wait_for(stop.wait(), args.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def run_step(args, concurrency):
+    stats = StepStats(concurrency)
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(sample_server(args, stats, stop))
+
+    # 所有会话登录完成后才开始计时
+    deadline = [float('inf')]
+    logged_in = asyncio.Event()
+    pending = [concurrency]
+
+    def ready():
+        pending[0] -= 1
+        if pending[0] == 0:
+            logged_in.set()
+
+    sessions = [asyncio.ensure_future(session_loop(args, stats, deadline, ready)) for _ in range(concurrency)]
+    await logged_in.wait()
+    started = time.monotonic()
+    deadline[0] = started + args.duration
+    await asyncio.gather(*sessions)
+    stats.elapsed = time.monotonic() - started
+
+    stop.set()
+    await sampler
+    return stats
+
+
+def print_header():
+    print(f"{'并发':>5} {'流/秒':>7} {'完成':>6} {'排队':>5} {'错误率':>7} {'首事件p50/p95':>14} {'首文本p50/p95':>14} "
+          f"{'间隔p50/p99':>12} {'抖动':>6} {'线程':>6} {'内存MB':>7}")
+
+
+def print_row(summary):
+    server = summary['server']
+    print(f"{summary['concurrency']:>5} {summary['streams_per_second']:>7} {summary['completed']:>6} {summary['queued']:>5} "
+          f"{summary['error_rate'] * 100:>6.1f}% "
+          f"{fmt_ms(summary['first_event_p50']) + '/' + fmt_ms(summary['first_event_p95']):>14} "
+          f"{fmt_ms(summary['first_text_p50']) + '/' + fmt_ms(summary['first_text_p95']):>14} "
+          f"{fmt_ms(summary['gap_p50']) + '/' + fmt_ms(summary['gap_p99']):>12} "
+          f"{fmt_ms(summary['jitter_mean']):>6} "
+          f"{server['os_threads'] or server['threads']:>6} {server['rss_mb']:>7.0f}")
+
+
+async def main_async(args):
+    results = []
+    print_header()
+    for concurrency in args.steps:
+        stats = await run_step(args, concurrency)
+        summary = stats.summary()
+        results.append(summary)
+        print_row(summary)
+        for error in sorted(set(map(str, stats.errors)))[:3]:
+            print(f"      错误示例: {error[:150]}")
+        await asyncio.sleep(args.cooldown)
+    return results
+
+
+def main():
+    default_user = next(iter(config.USERS.items()))
+    parser = argparse.ArgumentParser(description='/api/chat 并发压力测试')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Flask 服务器地址（登录）')
+    parser.add_argument('--chat-url', help='聊天接口地址（默认同 --url）')
+    parser.add_argument('--username', default=default_user[0])
+    parser.add_argument('--password', default=default_user[1])
+    parser.add_argument('--steps', default='10,25,50,100', help='逐级并发会话数，逗号分隔')
+    parser.add_argument('--duration', type=float, default=30, help='每级持续秒数')
+    parser.add_argument('--message', default='load test: please list the workspace')
+    parser.add_argument('--timeout', type=float, default=300, help='单个请求超时（秒）')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='服务器状态轮询间隔（秒）')
+    parser.add_argument('--cooldown', type=float, default=2.0, help='两级之间的间隔（秒）')
+    parser.add_argument('--json', help='把结果写入 JSON 文件')
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+    args.chat_url = (args.chat_url or args.url).rstrip('/')
+    args.steps = [int(step) for step in args.steps.split(',') if step.strip()]
+
+    results = asyncio.run(main_async(args))
+    print("\n时间单位为毫秒；抖动为每个流内文本事件间隔的标准差均值；线程为服务器进程的峰值线程数")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"结果已写入 {args.json}")
+
+
+if __name__ == '__main__':
+    main()
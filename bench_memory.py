@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+记忆检索基准测试：合成大量记忆条目，测量每轮检索（render_for_prompt）的耗时
+
+不访问数据库，直接在 UserMemoryIndex 上构建索引，统计构建时间、检索耗时分布和
+增量更新的耗时。目标是数万条记忆时每轮检索仍在 5ms 以内。
+
+用法:
+    python bench_memory.py
+    python bench_memory.py --entries 50000 --queries 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import turn_metrics
+from memory_index import UserMemoryIndex
+
+WORDS = ('deploy server database backup nginx docker python flask socket cache token model prompt '
+         'test build release migrate index query schema user session config log metric alert').split()
+CJK = ['部署', '服务器', '数据库', '备份', '缓存', '配置', '日志', '用户', '会话', '测试', '发布', '索引', '模型']
+
+
+def make_rows(count, rng):
+    rows = []
+    for i in range(count):
+        words = rng.choices(WORDS, k=rng.randint(8, 40)) + [f'host{rng.randint(0, 5000)}']
+        cjk = ''.join(rng.choices(CJK, k=rng.randint(0, 6)))
+        rows.append({
+            'id': i + 1,
+            'title': ' '.join(rng.choices(WORDS, k=3)),
+            'content': ' '.join(words) + ' ' + cjk,
+            'memory_type': rng.choice(['fact', 'conversation', 'note']),
+            'importance': rng.choices([1, 2, 3, 4, 5], weights=[50, 25, 15, 8, 2])[0],
+            'created_at': f'2026-{rng.randint(1, 9):02d}-{rng.randint(1, 28):02d} 12:00:00'
+        })
+    return rows
+
+
+def make_query(rng):
+    return (' '.join(rng.choices(WORDS, k=rng.randint(3, 12))) + f' host{rng.randint(0, 5000)} '
+            + ''.join(rng.choices(CJK, k=rng.randint(0, 3))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='记忆检索基准测试')
+    parser.add_argument('--entries', type=int, default=20000, help='记忆条目数')
+    parser.add_argument('--queries', type=int, default=1000, help='检索次数')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rows = make_rows(args.entries, rng)
+
+    started = time.perf_counter()
+    index = UserMemoryIndex(rows)
+    build = time.perf_counter() - started
+
+    timings = []
+    selected = 0
+    for _ in range(args.queries):
+        query = make_query(rng)
+        started = time.perf_counter()
+        selected += len(index.search(query))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+
+    updates = []
+    for row in rng.sample(rows, min(200, len(rows))):
+        started = time.perf_counter()
+        index.add(dict(row, content=row['content'] + ' updated'))
+        updates.append(time.perf_counter() - started)
+    updates.sort()
+
+    print(f"条目数: {args.entries}  构建索引: {build * 1000:.0f}ms  词项数: {len(index.postings)}")
+    print(f"检索 {args.queries} 次: p50 {turn_metrics.percentile(timings, 50) * 1000:.2f}ms  "
+          f"p95 {turn_metrics.percentile(timings, 95) * 1000:.2f}ms  "
+          f"p99 {turn_metrics.percentile(timings, 99) * 1000:.2f}ms  "
+          f"平均入选 {selected / args.queries:.1f} 条")
+    print(f"增量更新: p50 {turn_metrics.percentile(updates, 50) * 1000:.3f}ms  "
+          f"p99 {turn_metrics.percentile(updates, 99) * 1000:.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
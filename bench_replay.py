@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+离线回放基准测试：用录制的模型流（stream_replay 回放文件）驱动完整的聊天循环
+
+不需要网络和 API Token。每轮使用一个 ReplayClient，经过与线上相同的路径：
+ChatTurn 循环、工具路由（工具会真实执行）、SSE 编码、事件日志和数据库写入。
+统计吞吐量、首个文本帧延迟、每轮总耗时以及 metrics 事件中的耗时分解。
+
+用法:
+    python bench_replay.py                              # 使用内置的合成回放文件
+    python bench_replay.py --fixture recordings/x.jsonl --turns 200 --concurrency 20
+    python bench_replay.py --speed 0                    # 不模拟 token 速率，测循环本身的开销
+    python bench_replay.py --mode async --turns 500 --concurrency 200
+
+注意: 回放文件中的写操作工具默认需要批准（本轮在 permission_required 处结束），
+加 --auto-approve 会在本机真实执行这些操作。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+import database
+import stream_replay
+import turn_metrics
+from chat_pipeline import ChatTurn, AsyncChatTurn
+from chat_turns import get_turn_manager
+
+
+def write_default_fixture(path):
+    """合成一轮典型的工具调用对话：列目录、读文件、搜索，然后回答"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    answer = "根据读取到的文件内容，这个项目是一个基于 Flask 的 Claude Web 界面。" * 10
+    stream_replay.write_synthetic_fixture(path, [
+        {'text': '我先看一下项目结构。', 'tool_uses': [
+            ('list_directory', {'path': here}),
+            ('read_file', {'file_path': os.path.join(here, 'README.md'), 'limit': 50}),
+            ('grep', {'pattern': 'def ', 'path': here, 'glob': '*.py', 'output_mode': 'count'})
+        ]},
+        {'text': answer}
+    ])
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return 'n/a'
+    p95 = values[max(0, int(len(values) * 0.95) - 1)]
+    return f"p50={statistics.median(values) * 1000:.0f}ms p95={p95 * 1000:.0f}ms"
+
+
+def parse_frame(frame, result, started):
+    """解析一帧 SSE，记录首个文本帧时间和 metrics 事件"""
+    for line in frame.split('\n'):
+        if not line.startswith('data: '):
+            continue
+        event = json.loads(line[6:])
+        if event['type'] == 'text' and result['first_text'] is None:
+            result['first_text'] = time.monotonic() - started
+        elif event['type'] == 'metrics':
+            result['metrics'] = event['metrics']
+        elif event['type'] == 'error':
+            result['error'] = event['error']
+
+
+def new_result():
+    return {'first_text': None, 'total': None, 'metrics': None, 'error': None, 'frames': 0}
+
+
+def run_turn(args, index):
+    """threading 模式：后台线程执行本轮，当前线程读取 SSE 流"""
+    turn_manager = get_turn_manager()
+    result = new_result()
+    started = time.monotonic()
+    client = stream_replay.ReplayClient(args.fixture, speed=args.speed, event_delay=args.event_delay)
+    session_id = f'bench-replay-{index}'
+    turn = ChatTurn(client, args.model, config.AVAILABLE_MODELS[args.model],
+                    [{'role': 'user', 'content': 'benchmark'}], -1,
+                    args.username, session_id, auto_approve=args.auto_approve)
+    turn_id = turn_manager.start(args.username, session_id, turn.run())
+    for frame in turn_manager.stream(turn_id):
+        result['frames'] += 1
+        parse_frame(frame, result, started)
+    result['total'] = time.monotonic() - started
+    return result
+
+
+async def run_turn_async(args, index):
+    """asyncio 模式：本轮作为事件循环上的任务执行"""
+    turn_manager = get_turn_manager()
+    result = new_result()
+    started = time.monotonic()
+    client = stream_replay.AsyncReplayClient(args.fixture, speed=args.speed, event_delay=args.event_delay)
+    session_id = f'bench-replay-{index}'
+    turn = AsyncChatTurn(client, args.model, config.AVAILABLE_MODELS[args.model],
+                         [{'role': 'user', 'content': 'benchmark'}], -1,
+                         args.username, session_id, auto_approve=args.auto_approve)
+    turn_id = await turn_manager.start_async(args.username, session_id, turn.run_async())
+    async for frame in turn_manager.stream_async(turn_id):
+        result['frames'] += 1
+        parse_frame(frame, result, started)
+    result['total'] = time.monotonic() - started
+    return result
+
+
+async def run_all_async(args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(index):
+        async with semaphore:
+            return await run_turn_async(args, index)
+
+    return await asyncio.gather(*[limited(i) for i in range(args.turns)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线回放基准测试')
+    parser.add_argument('--fixture', help='回放文件（默认使用合成的工具调用对话）')
+    parser.add_argument('--mode', choices=['threading', 'async'], default='threading')
+    parser.add_argument('--turns', type=int, default=50, help='总轮数')
+    parser.add_argument('--concurrency', type=int, default=10, help='同时执行的轮数')
+    parser.add_argument('--speed', type=float, default=1.0, help='相对录制时的回放速度，0 表示无延迟')
+    parser.add_argument('--event-delay', type=float, default=None, help='每个事件固定延迟（秒），覆盖录制时间')
+    parser.add_argument('--model', default=config.DEFAULT_MODEL)
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--auto-approve', action='store_true', help='自动批准写操作（会真实执行）')
+    parser.add_argument('--db', help='数据库文件（默认使用临时文件，不影响正式数据）')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-replay-')
+    database.DATABASE_PATH = args.db or os.path.join(workdir, 'bench.db')
+    database.init_db()
+    if not args.fixture:
+        args.fixture = os.path.join(workdir, 'synthetic.jsonl')
+        write_default_fixture(args.fixture)
+    calls = stream_replay.load_fixture(args.fixture)
+
+    print(f"回放文件: {args.fixture}（{len(calls)} 次模型调用）")
+    if args.event_delay is not None:
+        pace = f'每事件 {args.event_delay}s'
+    else:
+        pace = f'x{args.speed}' if args.speed else '无延迟'
+    print(f"模式: {args.mode}  轮数: {args.turns}  并发: {args.concurrency}  速度: {pace}")
+
+    started = time.monotonic()
+    if args.mode == 'threading':
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda i: run_turn(args, i), range(args.turns)))
+    else:
+        results = asyncio.run(run_all_async(args))
+    elapsed = time.monotonic() - started
+
+    errors = [r['error'] for r in results if r['error']]
+    print(f"\n总耗时: {elapsed:.2f}s  吞吐量: {args.turns / elapsed:.1f} 轮/秒  错误: {len(errors)}")
+    print(f"首个文本帧: {percentiles([r['first_text'] for r in results if r['first_text'] is not None])}")
+    print(f"每轮总耗时: {percentiles([r['total'] for r in results])}")
+    print(f"每轮 SSE 帧数: {statistics.mean(r['frames'] for r in results):.1f}")
+
+    records = [{**r['metrics'], 'details': r['metrics']} for r in results if r['metrics']]
+    summary = turn_metrics.aggregate(records)
+    print("\n耗时分解（metrics 事件）:")
+    for field in ('total_ms', 'ttft_ms', 'model_ms', 'tool_ms', 'db_ms'):
+        stats = summary['fields'][field]
+        if stats['count']:
+            print(f"  {field:10s} p50={stats['p50']:>8}  p95={stats['p95']:>8}  p99={stats['p99']:>8}")
+    for name, stats in summary['tools'].items():
+        print(f"  工具 {name:16s} 调用 {stats['count']:>5}  p50={stats['p50']}ms  p95={stats['p95']}ms")
+    for error in sorted(set(errors))[:5]:
+        print(f"  错误示例: {error}")
+
+
+if __name__ == '__main__':
+    main()
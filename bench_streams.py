@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+并发聊天流基准测试：threading 模式（Flask）与 asyncio 模式（async_server.py）对比
+
+启动一个模拟 Anthropic 流式接口（mock_anthropic.py，每个回答持续若干秒、逐段输出文本），
+在同一进程中运行被测服务器，同时打开大量 /api/chat 流，统计：
+完成数、错误数、首个事件延迟、峰值线程数和内存占用。
+
+用法:
+    python bench_streams.py --mode threading --streams 200
+    python bench_streams.py --mode async --streams 2000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+import config
+import mock_anthropic
+
+
+# ---------------------------------------------------------------- 模拟模型接口
+
+def start_in_thread(application, port):
+    """在独立线程的事件循环中运行 aiohttp 应用"""
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(application)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port, backlog=4096).start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name=f'aiohttp-{port}', daemon=True).start()
+    ready.wait()
+
+
+# ---------------------------------------------------------------- 被测服务器
+
+def start_server_under_test(mode, port, mock_url):
+    import app as flask_module
+    flask_module.ANTHROPIC_BASE_URL = mock_url
+    flask_module.ANTHROPIC_AUTH_TOKEN = flask_module.ANTHROPIC_AUTH_TOKEN or 'bench'
+
+    if mode == 'threading':
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', port, flask_module.app, threaded=True)
+        server.socket.listen(4096)
+        threading.Thread(target=server.serve_forever, name='werkzeug', daemon=True).start()
+    else:
+        import async_server
+        start_in_thread(async_server.create_app(), port)
+    return flask_module
+
+
+# ---------------------------------------------------------------- 负载
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def login(http, base_url, username, password):
+    async with http.post(f'{base_url}/login', json={'username': username, 'password': password}) as r:
+        assert r.status == 200, f'登录失败: {r.status}'
+    # 访问首页以初始化 session_id
+    async with http.get(f'{base_url}/', allow_redirects=False) as r:
+        await r.read()
+
+
+async def open_stream(base_url, chat_url, username, password, results):
+    started = time.monotonic()
+    first_event = None
+    jar = aiohttp.CookieJar(unsafe=True)
+    try:
+        async with aiohttp.ClientSession(cookie_jar=jar, timeout=aiohttp.ClientTimeout(total=600)) as http:
+            await login(http, base_url, username, password)
+            started = time.monotonic()
+            async with http.post(f'{chat_url}/api/chat', json={'message': 'benchmark'}) as r:
+                if r.status != 200:
+                    results['errors'].append(f'HTTP {r.status}')
+                    return
+                done = False
+                async for line in r.content:
+                    if not line.startswith(b'data: '):
+                        continue
+                    event = json.loads(line[6:])
+                    if event['type'] == 'text' and first_event is None:
+                        first_event = time.monotonic() - started
+                    if event['type'] == 'error':
+                        results['errors'].append(event.get('error'))
+                        return
+                    if event['type'] == 'done':
+                        done = True
+                if done:
+                    results['completed'] += 1
+                    results['durations'].append(time.monotonic() - started)
+                    if first_event is not None:
+                        results['first_event'].append(first_event)
+                else:
+                    results['errors'].append('stream ended without done')
+    except Exception as e:
+        results['errors'].append(repr(e))
+
+
+async def sample(stats, stop):
+    while not stop.is_set():
+        stats['peak_threads'] = max(stats['peak_threads'], threading.active_count())
+        stats['peak_rss_mb'] = max(stats['peak_rss_mb'], rss_mb())
+        await asyncio.sleep(0.2)
+
+
+async def run_load(args, base_url, chat_url):
+    results = {'completed': 0, 'errors': [], 'durations': [], 'first_event': []}
+    stats = {'peak_threads': threading.active_count(), 'peak_rss_mb': rss_mb()}
+    baseline = dict(stats)
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(sample(stats, stop))
+
+    started = time.monotonic()
+    await asyncio.gather(*[
+        open_stream(base_url, chat_url, args.username, args.password, results)
+        for _ in range(args.streams)
+    ])
+    elapsed = time.monotonic() - started
+    stop.set()
+    await sampler
+    return results, stats, baseline, elapsed
+
+
+def main():
+    default_user = next(iter(config.USERS.items()))
+    parser = argparse.ArgumentParser(description='并发聊天流基准测试')
+    parser.add_argument('--mode', choices=['threading', 'async'], default='threading')
+    parser.add_argument('--streams', type=int, default=200, help='同时打开的流数量')
+    parser.add_argument('--chunks', type=int, default=50, help='每个回答的文本段数')
+    parser.add_argument('--interval', type=float, default=0.1, help='文本段间隔（秒）')
+    parser.add_argument('--username', default=default_user[0])
+    parser.add_argument('--password', default=default_user[1])
+    parser.add_argument('--port', type=int, default=5090)
+    args = parser.parse_args()
+
+    mock = mock_anthropic.create_app('text', tokens=args.chunks, rate=1.0 / args.interval, ttfb=0)
+    start_in_thread(mock, args.port + 1)
+    mock_url = f'http://127.0.0.1:{args.port + 1}'
+
+    if args.mode == 'threading':
+        start_server_under_test('threading', args.port, mock_url)
+        base_url = chat_url = f'http://127.0.0.1:{args.port}'
+    else:
+        # 登录等页面仍由 Flask 提供，聊天流由 asyncio 服务器提供
+        start_server_under_test('threading', args.port, mock_url)
+        start_server_under_test('async', args.port + 2, mock_url)
+        base_url = f'http://127.0.0.1:{args.port}'
+        chat_url = f'http://127.0.0.1:{args.port + 2}'
+
+    results, stats, baseline, elapsed = asyncio.run(run_load(args, base_url, chat_url))
+
+    print(f"模式: {args.mode}  并发流: {args.streams}  每流时长: ~{args.chunks * args.interval:.1f}s")
+    print(f"完成: {results['completed']}  错误: {len(results['errors'])}  总耗时: {elapsed:.1f}s")
+    if results['first_event']:
+        first = sorted(results['first_event'])
+        print(f"首个文本事件: p50={statistics.median(first) * 1000:.0f}ms  "
+              f"p95={first[int(len(first) * 0.95) - 1] * 1000:.0f}ms")
+    if results['durations']:
+        print(f"流时长: p50={statistics.median(results['durations']):.2f}s  max={max(results['durations']):.2f}s")
+    print(f"峰值线程: {stats['peak_threads']} (基线 {baseline['peak_threads']})  "
+          f"峰值内存: {stats['peak_rss_mb']:.0f}MB (基线 {baseline['peak_rss_mb']:.0f}MB)")
+    for error in sorted(set(map(str, results['errors'])))[:5]:
+        print(f"  错误示例: {error}")
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+trigram 索引基准测试：在合成的目录树（同 bench_grep.py）上比较 grep_engine 遍历全部文件和使用 trigram 索引的查询延迟
+
+同时报告索引构建时间、内存/磁盘大小、没有变化时的检查（stat 遍历）时间和修改部分文件后的增量更新时间，
+并检查两种方式的结果是否一致。
+
+用法:
+    python bench_trigram.py
+    python bench_trigram.py --files 50000 --root /tmp/grep-tree --keep
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_grep import RARE, make_tree, timed
+from grep_engine import GrepEngine
+from trigram_index import TrigramIndex
+
+
+def median_time(func, *args, repeat=3, **kwargs):
+    """多次运行取中位数"""
+    times = []
+    for _ in range(repeat):
+        result, elapsed = timed(func, *args, **kwargs)
+        times.append(elapsed)
+    return result, sorted(times)[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='trigram 索引基准测试')
+    parser.add_argument('--files', type=int, default=50000, help='合成文件数')
+    parser.add_argument('--root', help='目录树位置（已存在时直接使用）')
+    parser.add_argument('--keep', action='store_true', help='保留生成的目录树')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='grep_engine 工作进程数')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='bench-trigram-')
+    if not os.path.isdir(root) or not os.listdir(root):
+        os.makedirs(root, exist_ok=True)
+        started = time.perf_counter()
+        make_tree(root, args.files, random.Random(args.seed))
+        print(f"生成 {args.files} 个文件: {time.perf_counter() - started:.1f}s  ({root})")
+
+    index_dir = tempfile.mkdtemp(prefix='bench-trigram-index-')
+    index = TrigramIndex(root, os.path.join(index_dir, 'index.pickle'), max_age=3600)
+    try:
+        _, build_time = timed(index.build)
+        stats = index.get_stats()
+        print(f"构建索引: {build_time:.1f}s  {stats['files']} 个文件, {stats['trigrams']} 个 trigram, "
+              f"{stats['postings']} 条 posting, 内存约 {stats['memory_bytes'] / 1e6:.1f}MB, "
+              f"磁盘 {stats['disk_bytes'] / 1e6:.1f}MB")
+        _, load_time = timed(TrigramIndex(root, index.index_path).load)
+        _, refresh_time = median_time(index.refresh)
+        print(f"从磁盘加载: {load_time * 1000:.0f}ms  无变化时检查: {refresh_time * 1000:.0f}ms")
+
+        full = GrepEngine(workers=args.workers)
+        indexed = GrepEngine(workers=args.workers, index=index)
+        full.start_pool()
+        indexed.start_pool()
+        queries = [
+            ('罕见字面量', RARE, {}),
+            ('罕见正则', r'func_4242_\d+', {'output_mode': 'content'}),
+            ('1% 文件 count', r'TODO|FIXME', {'output_mode': 'count'}),
+            ('忽略大小写', r'todo: clean', {'case_insensitive': True}),
+            ('常见字面量', r'config request', {'output_mode': 'count'}),
+            ('无字面量', r'\(\w\)', {}),
+        ]
+        # 预热：文件系统缓存和工作进程
+        full.search(RARE, root)
+        print(f"{'查询':<16}{'全量扫描':>10}{'索引':>10}{'候选文件':>10}  结果一致")
+        for name, pattern, extra in queries:
+            options = {'head_limit': 10 ** 6, **extra}
+            expected, full_time = median_time(full.search, pattern, root, **options)
+            candidates = index.candidates(root, pattern, options.get('case_insensitive', False))
+            result, index_time = median_time(indexed.search, pattern, root, **options)
+            print(f"{name:<16}{full_time * 1000:>8.0f}ms{index_time * 1000:>8.0f}ms"
+                  f"{'全部' if candidates is None else len(candidates):>10}  "
+                  f"{'是' if result == expected else '否'}")
+
+        # 修改 1% 的文件后增量更新
+        rng = random.Random(args.seed)
+        paths = sorted(index.files)
+        for path in rng.sample(paths, max(1, len(paths) // 100)):
+            with open(path, 'a') as f:
+                f.write('    # changed\n')
+        changed, update_time = timed(index.refresh)
+        print(f"修改 {changed} 个文件后增量更新: {update_time * 1000:.0f}ms")
+        print(f"统计: {index.get_stats()}")
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+        if not args.keep and not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+工作区索引基准测试：在合成的目录树（同 bench_grep.py）上报告内存目录树的构建时间和每 10 万个文件的内存占用，
+并比较 glob、grep 的目录遍历和 list_directory 从磁盘读取与从索引读取的延迟，以及修改文件后变化可见的延迟
+
+内存占用同时给出 get_stats() 的估算值和 tracemalloc 测得的分配量。
+
+用法:
+    python bench_workspace_index.py
+    python bench_workspace_index.py --files 100000 --root /tmp/grep-tree --keep
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_grep import make_tree, timed
+from bench_trigram import median_time
+from glob_engine import GlobEngine
+from grep_engine import walk_files
+from workspace_index import WorkspaceIndex
+
+
+def list_disk(directory):
+    """原 list_directory 的读取方式"""
+    items = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        is_dir = os.path.isdir(path)
+        items.append((name, is_dir, 0 if is_dir else os.path.getsize(path)))
+    return items
+
+
+def list_index(index, directory):
+    index.sync()
+    return [(entry.name, entry.is_dir(), 0 if entry.is_dir() else entry.stat().st_size)
+            for entry in index.entries(directory)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='工作区索引基准测试')
+    parser.add_argument('--files', type=int, default=100000, help='合成文件数')
+    parser.add_argument('--root', help='目录树位置（已存在时直接使用）')
+    parser.add_argument('--keep', action='store_true', help='保留生成的目录树')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='bench-workspace-index-')
+    if not os.path.isdir(root) or not os.listdir(root):
+        os.makedirs(root, exist_ok=True)
+        started = time.perf_counter()
+        make_tree(root, args.files, random.Random(args.seed))
+        print(f"生成 {args.files} 个文件: {time.perf_counter() - started:.1f}s  ({root})")
+
+    tracemalloc.start()
+    index = WorkspaceIndex(root)
+    try:
+        _, build_time = timed(index.rescan)
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = index.get_stats()
+        per_100k = 100000 / stats['files']
+        print(f"构建: {build_time:.2f}s  {stats['files']} 个文件, {stats['directories']} 个目录, "
+              f"{stats['watches']} 个 inotify 监听")
+        print(f"内存: 估算 {stats['memory_bytes'] / 1e6:.1f}MB, tracemalloc {traced / 1e6:.1f}MB  "
+              f"=> 每 10 万个文件 {stats['memory_bytes'] * per_100k / 1e6:.1f}MB "
+              f"(tracemalloc {traced * per_100k / 1e6:.1f}MB)")
+        _, rescan_time = timed(index.rescan)
+        print(f"完整重新扫描（无变化）: {rescan_time:.2f}s")
+
+        # WORKSPACE_INDEX_ENABLED 未设置时，默认的 GlobEngine 和 walk_files 从磁盘读取
+        indexed_glob, disk_glob = GlobEngine(tree=index), GlobEngine()
+        directory = os.path.join(root, sorted(os.listdir(root))[0], 'mod0000')
+        cases = [
+            ("list_directory (50 个条目)", lambda: list_disk(directory), lambda: list_index(index, directory)),
+            ("glob **/*.py limit 100", lambda: disk_glob.glob('**/*.py', root),
+             lambda: indexed_glob.glob('**/*.py', root)),
+            ("glob **/blob*.bin（遍历全部）", lambda: disk_glob.glob('**/blob*.bin', root, limit=100000),
+             lambda: indexed_glob.glob('**/blob*.bin', root, limit=100000)),
+            ("glob **/*.bin 按 mtime", lambda: disk_glob.glob('**/*.bin', root, 'mtime'),
+             lambda: indexed_glob.glob('**/*.bin', root, 'mtime')),
+            ("grep 遍历全部文件", lambda: sum(1 for _ in walk_files(root)),
+             lambda: sum(1 for _ in walk_files(root, tree=index))),
+        ]
+        print(f"\n{'操作':<32}{'磁盘':>10}{'索引':>10}")
+        for name, disk, indexed in cases:
+            expected, disk_time = median_time(disk)
+            actual, index_time = median_time(indexed)
+            same = '' if actual == expected else '  结果不一致!'
+            print(f"{name:<32}{disk_time * 1000:>9.1f}ms{index_time * 1000:>9.1f}ms{same}")
+
+        # 修改文件后到下一次查询可见
+        path = os.path.join(directory, 'bench_new.py')
+        started = time.perf_counter()
+        with open(path, 'w') as f:
+            f.write('x = 1\n')
+        visible = any(item[0] == 'bench_new.py' for item in list_index(index, directory))
+        print(f"\n新文件在下一次查询可见: {visible}, 耗时 {(time.perf_counter() - started) * 1000:.2f}ms")
+        os.remove(path)
+    finally:
+        index.stop()
+        if not args.keep and not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
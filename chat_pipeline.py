@@ -0,0 +1,582 @@
+"""
+Agentic chat loop.
+
+Runs one user turn against the model: streams the response, executes the
+tool calls it makes and feeds the results back until the model stops
+calling tools. Progress is reported as a sequence of event dicts, which
+the caller turns into SSE frames. ChatTurn runs on a thread, AsyncChatTurn
+on an asyncio event loop; both share the per-event logic.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import time
+from typing import Dict, List, Any, AsyncIterator, Callable, Iterator, Optional, Tuple
+
+import database
+import prompt_cache
+import context_compactor
+import memory_index
+import model_retry
+import model_router
+import sse
+import system_prompt
+import turn_metrics
+from tool_router import get_tool_router, ToolBatch, AsyncToolBatch
+from conversation_store import get_conversation_store, VersionConflict
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on model calls per user turn
+MAX_ITERATIONS = 25
+MAX_TOKENS = 4096
+
+
+def _latest_user_text(messages: List[Dict[str, Any]]) -> str:
+    """Text of the latest user message that is not only tool results."""
+    for message in reversed(messages):
+        if message.get('role') != 'user':
+            continue
+        content = message.get('content')
+        if isinstance(content, str):
+            return content
+        text = ' '.join(block.get('text', '') for block in content
+                        if isinstance(block, dict) and block.get('type') == 'text')
+        if text:
+            return text
+    return ""
+
+
+class ChatTurn:
+    """One user turn of the agentic loop."""
+
+    def __init__(self, client, model: str, model_id: str,
+                 messages: List[Dict[str, Any]], previous_turn_end: int,
+                 username: str, session_id: str, auto_approve: bool = False,
+                 summary_client=None, fallback_targets: Optional[List[Any]] = None,
+                 route_targets: Optional[Callable[[str], List[Any]]] = None,
+                 base_version: Optional[int] = None):
+        """
+        Initialize chat turn.
+
+        Args:
+            client: Anthropic client for the model (AsyncAnthropic for AsyncChatTurn)
+            model: Model alias from config.AVAILABLE_MODELS
+            model_id: Model ID sent to the API
+            messages: Working copy of the conversation, ending with the user message
+            previous_turn_end: Index of the last message before this turn, or -1
+            username: Username owning the conversation
+            session_id: Session ID
+            auto_approve: Auto-approve operations (for testing)
+            summary_client: Client for context summaries (optional)
+            fallback_targets: model_retry.ModelTarget list tried after the
+                client fails (optional)
+            route_targets: For 'auto' sessions, model alias -> targets
+                (model_router.target_factory); each iteration then goes to
+                the model the router picks (optional)
+            base_version: Conversation version the turn started from
+                (ConversationStore.begin_turn); the turn's messages are only
+                stored if no other turn was saved since (optional)
+        """
+        self.client = client
+        self.model = model
+        self.model_id = model_id
+        self.messages = messages
+        self.previous_turn_end = previous_turn_end
+        self.base_version = base_version
+        self.username = username
+        self.session_id = session_id
+        self.auto_approve = auto_approve
+
+        self.tool_router = get_tool_router()
+        self.conversation_store = get_conversation_store()
+        self.use_cache = prompt_cache.is_enabled_for(model)
+        self.cache_usage = prompt_cache.CacheUsage()
+        # 上下文压缩：超出模型 token 预算时省略旧工具结果、摘要或丢弃旧轮次
+        self.compactor = context_compactor.create_compactor(model, summary_client)
+        self.assistant_response = ""
+        # 本轮的工具调用和结果（与助手消息一起保存，用于显示历史记录）
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.state_saved = False
+        self.all_tools: List[Dict[str, Any]] = []
+        self.system: Any = None
+        # 文本增量按时间/大小合并为较少的事件
+        self.text_events = sse.TextCoalescer()
+        # 模型调用失败时退避重试，多次失败后切换到备用端点/模型
+        primary = model_retry.ModelTarget(getattr(client, 'base_url', ''), model, model_id, client)
+        self.model_caller = model_retry.ModelCaller([primary] + list(fallback_targets or []))
+        # auto 模式：每轮迭代按消息长度、工具调用和各模型首字延迟选择模型
+        self.route_targets = route_targets
+        self.model_router = model_router.get_model_router()
+        # 耗时分解：首字节/首文本、模型流、工具和数据库写入时间
+        self.metrics = turn_metrics.TurnMetrics(model)
+
+    def _append_iteration(self, current_text: str, tool_results: List[Dict[str, Any]]):
+        """把一轮的 assistant 响应和工具结果追加到消息列表"""
+        assistant_content = []
+        if current_text:
+            assistant_content.append({"type": "text", "text": current_text})
+        for tr in tool_results:
+            assistant_content.append({
+                "type": "tool_use",
+                "id": tr["tool_use"]["id"],
+                "name": tr["tool_use"]["name"],
+                "input": tr["tool_use"]["input"]
+            })
+        self.messages.append({"role": "assistant", "content": assistant_content})
+
+        tool_result_content = []
+        for tr in tool_results:
+            tool_result_content.append({
+                "type": "tool_result",
+                "tool_use_id": tr["tool_use"]["id"],
+                "content": json.dumps(tr["result"])
+            })
+        self.messages.append({"role": "user", "content": tool_result_content})
+
+    def _save_state(self) -> Dict[str, Any]:
+        """保存会话状态，返回 state 事件"""
+        self.state_saved = True
+        with self.metrics.db_timer():
+            version = self.conversation_store.save(self.session_id, self.username, self.messages,
+                                                   self.base_version)
+        return {'type': 'state', 'version': version}
+
+    def _save_interrupted(self):
+        """Keep the completed part of a turn that stopped midway."""
+        try:
+            self.conversation_store.save(self.session_id, self.username, self.messages, self.base_version)
+        except VersionConflict:
+            logger.warning(f"Interrupted turn of session {self.session_id} not saved: conversation changed")
+
+    def _save_assistant_message(self, metadata: Optional[Dict[str, Any]] = None):
+        if self.assistant_response or self.tool_calls:
+            if self.tool_calls:
+                metadata = dict(metadata or {}, toolCalls=self.tool_calls)
+            with self.metrics.db_timer():
+                database.save_message(self.username, 'assistant', self.assistant_response,
+                                      self.model, self.session_id, metadata)
+
+    def _metrics_event(self, status: str) -> Dict[str, Any]:
+        """Finish the turn's metrics record, store it and return the metrics event."""
+        self.metrics.end_tools()
+        record = self.metrics.finish(status, self.cache_usage.totals(), self.model_caller.get_stats())
+        try:
+            database.save_chat_turn_metrics(self.username, self.session_id, record)
+        except Exception as e:
+            logger.error(f"Failed to save turn metrics: {e}")
+        return {'type': 'metrics', 'metrics': record}
+
+    def _compact(self, iteration: int) -> Optional[Dict[str, Any]]:
+        """Compact the context before a model call; returns a compaction event."""
+        compaction = self.compactor.compact(self.messages)
+        if not compaction:
+            return None
+        # 删除的前缀消息使缓存断点位置前移
+        self.previous_turn_end = max(-1, self.previous_turn_end - compaction['messages_removed'])
+        return {'type': 'compaction', 'iteration': iteration, **compaction}
+
+    def _route(self, iteration: int):
+        """Pick the model of an 'auto' turn's next iteration (no-op otherwise)."""
+        if self.route_targets is None:
+            return
+        decision = self.model_router.route(self.messages, iteration)
+        if decision['model'] != self.model_caller.targets[0].model:
+            self.model_caller.retarget(self.route_targets(decision['model']))
+
+    def _record_success(self):
+        """Close a successful model call and feed its latency to the router."""
+        self.metrics.end_call()
+        self.model_caller.record_success()
+        call = self.metrics.calls[-1]
+        # 只有工具调用的响应没有文本，用首字节时间代替
+        self.model_router.record_latency(call['model'], call['ttft_ms'] or call['ttfb_ms'])
+
+    def _select_target(self):
+        """Point the turn at the model target for the next call."""
+        target = self.model_caller.select()
+        self.client = target.client
+        self.model = target.model
+        self.model_id = target.model_id
+
+    def _retry(self, state: "_IterationState", error: Exception) -> Optional[List[Dict[str, Any]]]:
+        """
+        Handle a failed model call.
+
+        Returns:
+            Events to send before retrying the iteration, or None if the
+            error ends the turn
+        """
+        retry = self.model_caller.record_failure(error)
+        if retry is None:
+            return None
+
+        events = []
+        pending = self.text_events.flush()
+        if pending:
+            events.append(pending)
+        # 丢弃失败调用已输出的部分文本，本轮从头重新请求；
+        # 提前开始的只读工具调用结果随之作废
+        discarded = state.current_text
+        if discarded:
+            self.assistant_response = self.assistant_response[:-len(discarded)]
+        # 客户端按 UTF-16 长度删除已显示的文本
+        events.append({'type': 'retry', 'discard_text': len(discarded.encode('utf-16-le')) // 2, **retry})
+        return events
+
+    def _request_params(self) -> Dict[str, Any]:
+        """Parameters of the next streaming model call."""
+        return {
+            'model': self.model_id,
+            'max_tokens': MAX_TOKENS,
+            'messages': prompt_cache.build_messages(self.messages, self.previous_turn_end, self.use_cache),
+            'tools': self.all_tools,
+            'system': self.system,
+            'stream': True
+        }
+
+    def _handle_stream_event(self, state: "_IterationState", event: Any) -> Optional[Dict[str, Any]]:
+        """Process one model stream event; returns a text event when one is due."""
+        if event.type in ("message_start", "message_delta"):
+            self.cache_usage.record_event(event, self.model)
+
+        elif event.type == "content_block_start":
+            if hasattr(event.content_block, 'type'):
+                if event.content_block.type == "tool_use":
+                    state.has_tool_use = True
+                    state.current_tool_use = {
+                        "id": event.content_block.id,
+                        "name": event.content_block.name,
+                        "input": {}
+                    }
+                    state.tool_uses.append(state.current_tool_use)
+
+        elif event.type == "content_block_delta":
+            if hasattr(event.delta, 'type'):
+                if event.delta.type == "text_delta":
+                    self.metrics.text_delta()
+                    text = event.delta.text
+                    state.current_text += text
+                    self.assistant_response += text
+                    return self.text_events.add(text)
+                elif event.delta.type == "input_json_delta":
+                    if state.tool_uses:
+                        state.tool_uses[-1]["input_json"] = state.tool_uses[-1].get("input_json", "") + event.delta.partial_json
+
+        elif event.type == "content_block_stop":
+            current_tool_use = state.current_tool_use
+            if current_tool_use is not None:
+                if "input_json" in current_tool_use:
+                    current_tool_use["input"] = json.loads(current_tool_use["input_json"])
+                    # 只读工具在其输入块结束时立即开始执行，无需等待整轮响应结束
+                    state.tool_batch.add(current_tool_use)
+                state.current_tool_use = None
+            # 文本块结束时发送剩余的合并文本
+            return self.text_events.flush()
+
+        return None
+
+    def _end_stream(self, state: "_IterationState") -> bool:
+        """
+        Finish one model response.
+
+        Returns:
+            True if the turn is over (the model called no tools)
+        """
+        # 如果没有工具调用，说明对话结束
+        if not state.has_tool_use:
+            if state.current_text:
+                self.messages.append({"role": "assistant", "content": state.current_text})
+            return True
+        return False
+
+    def _handle_tool_result(self, state: "_IterationState", tool_use: Dict[str, Any],
+                            exec_result: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Process one finished tool call.
+
+        Returns:
+            (events to send, whether the turn stops here)
+        """
+        tool_name = tool_use["name"]
+        tool_input = tool_use["input"]
+        if 'duration_ms' in exec_result:
+            self.metrics.record_tool(tool_name, exec_result.get('source'), exec_result['duration_ms'],
+                                     exec_result.get('cached', False))
+
+        # 发送工具调用信息
+        events = [{'type': 'tool_use', 'name': tool_name, 'input': tool_input}]
+        self.tool_calls.append(events[0])
+
+        # 检查是否需要用户输入
+        if exec_result.get('status') == 'success' and exec_result.get('result', {}).get('requires_user_input'):
+            # 用户的回答会作为下一条消息，与这些工具结果合并
+            state.tool_results.append({"tool_use": tool_use, "result": exec_result['result']})
+            self._append_iteration(state.current_text, state.tool_results)
+            events.append(self._save_state())
+            self._save_assistant_message()
+            events.append(self._metrics_event('waiting_user_input'))
+            events.append({'type': 'waiting_user_input'})
+            return events, True
+
+        # 检查是否需要权限
+        if exec_result['status'] == 'pending_permission':
+            state.tool_results.append({
+                "tool_use": tool_use,
+                "result": {'status': 'pending_permission', 'message': exec_result.get('message')}
+            })
+            self._append_iteration(state.current_text, state.tool_results)
+            events.append(self._save_state())
+            events.append({'type': 'permission_required', 'log_id': exec_result['log_id'], 'preview': exec_result['preview']})
+            self._save_assistant_message()
+            events.append(self._metrics_event('permission_required'))
+            events.append({'type': 'done'})
+            return events, True
+
+        # 获取执行结果
+        if exec_result['status'] == 'success':
+            result = exec_result['result']
+        else:
+            result = {'error': exec_result.get('error', '执行失败')}
+
+        # 发送工具结果（浏览器显示的结果另有大小上限）
+        events.append({'type': 'tool_result', 'name': tool_name,
+                       'result': self.tool_router.output_shaper.for_display(result)})
+        self.tool_calls.append(events[-1])
+
+        # 保存工具结果用于下一轮
+        state.tool_results.append({
+            "tool_use": tool_use,
+            "result": result
+        })
+        return events, False
+
+    def _finish(self) -> List[Dict[str, Any]]:
+        """Events closing a completed turn."""
+        # 记录本轮 token 用量（含缓存读写）
+        usage = self.cache_usage.totals()
+        prompt_cache.record_turn(self.model, self.cache_usage)
+        model_calls = self.model_caller.get_stats()
+        events = [{'type': 'usage', 'usage': usage, 'model_calls': model_calls}, self._save_state()]
+
+        # 保存 assistant 响应到数据库
+        self._save_assistant_message({'usage': usage, 'model_calls': model_calls})
+
+        events.append(self._metrics_event('completed'))
+        events.append({'type': 'done'})
+        return events
+
+    def _fail(self, error: Exception) -> List[Dict[str, Any]]:
+        """Events closing a failed turn."""
+        logger.error(f"Chat turn failed: {error}")
+        events = []
+        pending = self.text_events.flush()
+        if pending:
+            events.append(pending)
+        conflict = error if isinstance(error, VersionConflict) else None
+        if conflict is None and not self.state_saved:
+            try:
+                events.append(self._save_state())
+            except VersionConflict as e:
+                conflict = e
+        if conflict is not None:
+            # 同一会话的另一轮已先保存：本轮的消息不保存，客户端改用当前版本号
+            events.append({'type': 'state', 'version': conflict.current_version})
+            error = RuntimeError('对话已在其他窗口更新，本轮回复未保存')
+        self.metrics.end_call(failed=True)
+        events.append(self._metrics_event('failed'))
+        events.append({'type': 'error', 'error': str(error), 'model_calls': self.model_caller.get_stats()})
+        return events
+
+    def abort(self, error: Exception) -> List[Dict[str, Any]]:
+        """Events closing a turn that fails before it runs (e.g. admission queue timeout)."""
+        return self._fail(error)
+
+    def _prepare(self):
+        # 获取所有工具（包括MCP工具），静态部分加上缓存断点
+        self.all_tools = prompt_cache.build_tools(self.tool_router.get_all_tools(), self.use_cache)
+        self.system = prompt_cache.build_system(system_prompt.get_system_prompt(), self.use_cache)
+        # 与本轮用户消息相关的记忆放在本轮用户消息中（历史缓存断点之后），记忆变化不影响已缓存的历史
+        memory_text = memory_index.get_memory_index().render_for_prompt(
+            self.username, _latest_user_text(self.messages))
+        prompt_cache.attach_memory(self.messages, memory_text)
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """
+        Run the turn.
+
+        Yields:
+            Chat events (text, tool_use, tool_result, state, usage, done...)
+        """
+        try:
+            self.metrics.start()
+            self._prepare()
+
+            # Agentic loop - 持续执行直到Claude不再调用工具
+            for iteration in range(1, MAX_ITERATIONS + 1):
+                compaction = self._compact(iteration)
+                if compaction:
+                    yield compaction
+
+                self._route(iteration)
+
+                # 调用Claude API；失败时重试本轮（之前各轮的结果保留）
+                while True:
+                    state = _IterationState(
+                        ToolBatch(self.tool_router, self.username, self.session_id, self.auto_approve)
+                    )
+                    response = None
+                    try:
+                        self._select_target()
+                        self.metrics.start_call(iteration, self.model)
+                        response = self.client.messages.create(**self._request_params())
+                        self.metrics.first_byte()
+                        for event in response:
+                            chunk = self._handle_stream_event(state, event)
+                            if chunk:
+                                yield chunk
+                        self._record_success()
+                        break
+                    except Exception as e:
+                        self.metrics.end_call(failed=True)
+                        if response is not None and hasattr(response, 'close'):
+                            response.close()
+                        events = self._retry(state, e)
+                        if events is None:
+                            raise
+                        yield from events
+                        time.sleep(events[-1]['delay'])
+                    finally:
+                        # 中途取消或断开的调用也要释放熔断器的半开探测名额
+                        self.model_caller.release()
+
+                pending = self.text_events.flush()
+                if pending:
+                    yield pending
+
+                if self._end_stream(state):
+                    break
+
+                # 等待工具执行完成：只读工具和MCP工具并发执行，结果按原顺序返回
+                self.metrics.start_tools()
+                for tool_use, exec_result in state.tool_batch.results():
+                    events, stop = self._handle_tool_result(state, tool_use, exec_result)
+                    yield from events
+                    if stop:
+                        return
+                self.metrics.end_tools()
+
+                # 构建下一轮消息：assistant 响应（文本和工具调用）及工具结果
+                self._append_iteration(state.current_text, state.tool_results)
+
+            yield from self._finish()
+
+        except Exception as e:
+            yield from self._fail(e)
+
+        finally:
+            # 中途停止时也保留已完成的部分
+            if not self.state_saved:
+                self._save_interrupted()
+
+
+class AsyncChatTurn(ChatTurn):
+    """
+    Chat turn driven by an asyncio event loop (see async_server.py).
+
+    The model stream and MCP tool calls are awaited on the loop; direct
+    tools and database writes run on the tool router's worker pool.
+    """
+
+    async def run_async(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run the turn.
+
+        Yields:
+            Chat events, the same as ChatTurn.run()
+        """
+        loop = asyncio.get_running_loop()
+        offload = functools.partial(loop.run_in_executor, self.tool_router.executor)
+
+        try:
+            self.metrics.start()
+            await offload(self._prepare)
+
+            for iteration in range(1, MAX_ITERATIONS + 1):
+                compaction = await offload(self._compact, iteration)
+                if compaction:
+                    yield compaction
+                self._route(iteration)
+
+                while True:
+                    state = _IterationState(
+                        AsyncToolBatch(self.tool_router, self.username, self.session_id, self.auto_approve)
+                    )
+                    response = None
+                    try:
+                        self._select_target()
+                        self.metrics.start_call(iteration, self.model)
+                        response = await self.client.messages.create(**self._request_params())
+                        self.metrics.first_byte()
+                        async for event in response:
+                            chunk = self._handle_stream_event(state, event)
+                            if chunk:
+                                yield chunk
+                        self._record_success()
+                        break
+                    except Exception as e:
+                        self.metrics.end_call(failed=True)
+                        if response is not None and hasattr(response, 'close'):
+                            await response.close()
+                        events = self._retry(state, e)
+                        if events is None:
+                            raise
+                        for event in events:
+                            yield event
+                        await asyncio.sleep(events[-1]['delay'])
+                    finally:
+                        self.model_caller.release()
+
+                pending = self.text_events.flush()
+                if pending:
+                    yield pending
+
+                if self._end_stream(state):
+                    break
+
+                self.metrics.start_tools()
+                async for tool_use, exec_result in state.tool_batch.results():
+                    events, stop = await offload(self._handle_tool_result, state, tool_use, exec_result)
+                    for event in events:
+                        yield event
+                    if stop:
+                        return
+                self.metrics.end_tools()
+
+                self._append_iteration(state.current_text, state.tool_results)
+
+            for event in await offload(self._finish):
+                yield event
+
+        except Exception as e:
+            for event in await offload(self._fail, e):
+                yield event
+
+        finally:
+            if not self.state_saved:
+                await offload(self._save_interrupted)
+
+
+class _IterationState:
+    """Progress of one model response within a turn."""
+
+    def __init__(self, tool_batch):
+        self.tool_batch = tool_batch
+        self.current_text = ""
+        self.tool_uses: List[Dict[str, Any]] = []
+        self.has_tool_use = False
+        self.current_tool_use: Optional[Dict[str, Any]] = None
+        self.tool_results: List[Dict[str, Any]] = []
@@ -0,0 +1,381 @@
+"""
+Detached chat turns with replayable event logs.
+
+Each chat turn runs on its own background thread (or, in the asyncio
+serving mode, as a task on the event loop), owned by the server rather
+than by the HTTP response that started it. Its events go to a
+per-turn log: a ring buffer for live readers plus batched writes to the
+chat_turn_events table, so a client whose connection dropped can reattach
+with Last-Event-ID and receive what it missed without the model or tools
+running again.
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, AsyncIterator, Iterator, Optional, Tuple
+
+import config
+import database
+import sse
+
+
+logger = logging.getLogger(__name__)
+
+# Events kept in memory per turn; older ones are read back from the database
+RING_SIZE = getattr(config, 'CHAT_TURN_RING_SIZE', 2000)
+# Events are persisted in batches of this size, or after this many seconds
+PERSIST_BATCH_SIZE = 50
+PERSIST_INTERVAL = 0.5
+# Finished turns stay in memory this long (seconds)
+TURN_RETENTION = getattr(config, 'CHAT_TURN_RETENTION', 600)
+# Persisted events are deleted after this many hours
+EVENT_RETENTION_HOURS = getattr(config, 'CHAT_TURN_EVENT_RETENTION_HOURS', 24)
+# Idle streams send an SSE comment this often (seconds) to detect disconnects
+KEEPALIVE_INTERVAL = 15.0
+
+
+class TurnEventLog:
+    """Ordered events of one chat turn, numbered from 1."""
+
+    def __init__(self, turn_id: str, ring_size: int = RING_SIZE,
+                 auto_persist: bool = True):
+        """
+        Initialize turn event log.
+
+        Args:
+            turn_id: Turn ID
+            ring_size: Number of events kept in memory
+            auto_persist: Persist from append(); otherwise the owner calls
+                persist() when persist_due() says so
+        """
+        self.turn_id = turn_id
+        self.finished = False
+        self.auto_persist = auto_persist
+        # asyncio readers waiting for events: (loop, asyncio.Event)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._events: deque = deque(maxlen=ring_size)
+        self._next_id = 1
+        self._cond = threading.Condition()
+        self._unpersisted: List[Tuple[int, Dict[str, Any]]] = []
+        self._last_persist = time.monotonic()
+
+    def append(self, data: Dict[str, Any]) -> int:
+        """
+        Add an event and wake up readers.
+
+        Returns:
+            Event ID
+        """
+        with self._cond:
+            event_id = self._next_id
+            self._next_id += 1
+            self._events.append((event_id, data))
+            self._unpersisted.append((event_id, data))
+            self._notify()
+
+        if self.auto_persist and self.persist_due():
+            self.persist()
+        return event_id
+
+    def persist_due(self) -> bool:
+        """Check whether enough events or time have accumulated to persist."""
+        return bool(self._unpersisted) and (
+            len(self._unpersisted) >= PERSIST_BATCH_SIZE
+            or time.monotonic() - self._last_persist >= PERSIST_INTERVAL
+        )
+
+    def _notify(self):
+        """Wake up thread and asyncio readers (called with the lock held)."""
+        self._cond.notify_all()
+        waiters = self._async_waiters
+        self._async_waiters = []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def persist(self):
+        """Write events not yet in the database."""
+        with self._cond:
+            batch = self._unpersisted
+            self._unpersisted = []
+        self._last_persist = time.monotonic()
+        if not batch:
+            return
+        try:
+            database.save_chat_turn_events(self.turn_id, batch)
+        except Exception as e:
+            logger.error(f"Failed to persist events of turn {self.turn_id}: {e}")
+
+    def finish(self):
+        """Mark the turn as finished and wake up readers."""
+        with self._cond:
+            self.finished = True
+            self._notify()
+
+    def read(self, after_id: int,
+             timeout: float) -> Tuple[Optional[List[Tuple[int, Dict[str, Any]]]], bool]:
+        """
+        Get events after an ID, waiting up to timeout for new ones.
+
+        Args:
+            after_id: Last event ID the reader has seen
+            timeout: Seconds to wait when there is nothing new
+
+        Returns:
+            (events, finished); events is None when some of them have
+            already left the ring buffer and must be read from the database
+        """
+        with self._cond:
+            if after_id >= self._next_id - 1 and not self.finished:
+                self._cond.wait(timeout)
+            return self._events_after(after_id), self.finished
+
+    async def read_async(self, after_id: int,
+                         timeout: float) -> Tuple[Optional[List[Tuple[int, Dict[str, Any]]]], bool]:
+        """Asyncio variant of read()."""
+        with self._cond:
+            if after_id >= self._next_id - 1 and not self.finished:
+                waiter = asyncio.Event()
+                self._async_waiters.append((asyncio.get_running_loop(), waiter))
+            else:
+                waiter = None
+
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        with self._cond:
+            return self._events_after(after_id), self.finished
+
+    def _events_after(self, after_id: int) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+        oldest = self._events[0][0] if self._events else self._next_id
+        if after_id + 1 < oldest:
+            return None
+        start = max(0, after_id + 1 - oldest)
+        return list(itertools.islice(self._events, start, None))
+
+
+class TurnManager:
+    """Runs chat turns in the background and serves their event streams."""
+
+    def __init__(self):
+        """Initialize turn manager."""
+        self._turns: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._last_db_cleanup = 0.0
+
+    def start(self, username: str, session_id: str,
+              events: Iterator[Dict[str, Any]]) -> str:
+        """
+        Start a turn on a background thread.
+
+        Args:
+            username: Owner of the turn
+            session_id: Session ID
+            events: Event iterator running the turn (e.g. ChatTurn.run())
+
+        Returns:
+            Turn ID; the first event of the turn is {'type': 'turn', 'turn_id': ...}
+        """
+        turn_id, entry = self._register(username, session_id)
+        thread = threading.Thread(
+            target=self._run,
+            args=(entry, events),
+            name=f'chat-turn-{turn_id[:8]}',
+            daemon=True
+        )
+        thread.start()
+        return turn_id
+
+    def _register(self, username: str, session_id: str,
+                  auto_persist: bool = True) -> Tuple[str, Dict[str, Any]]:
+        self._cleanup()
+
+        turn_id = uuid.uuid4().hex
+        database.create_chat_turn(turn_id, username, session_id)
+
+        log = TurnEventLog(turn_id, auto_persist=auto_persist)
+        log.append({'type': 'turn', 'turn_id': turn_id})
+        entry = {
+            'log': log,
+            'username': username,
+            'session_id': session_id,
+            'started_at': time.time(),
+            'finished_at': None
+        }
+        with self._lock:
+            self._turns[turn_id] = entry
+        return turn_id, entry
+
+    def _run(self, entry: Dict[str, Any], events: Iterator[Dict[str, Any]]):
+        log = entry['log']
+        status = 'completed'
+        try:
+            for event in events:
+                log.append(event)
+                if event.get('type') == 'error':
+                    status = 'failed'
+        except Exception as e:
+            logger.error(f"Chat turn {log.turn_id} crashed: {e}")
+            log.append({'type': 'error', 'error': str(e)})
+            status = 'failed'
+        finally:
+            log.persist()
+            log.finish()
+            entry['finished_at'] = time.time()
+            try:
+                database.finish_chat_turn(log.turn_id, status)
+            except Exception as e:
+                logger.error(f"Failed to mark turn {log.turn_id} as finished: {e}")
+
+    async def start_async(self, username: str, session_id: str,
+                          events: AsyncIterator[Dict[str, Any]]) -> str:
+        """
+        Start a turn as a task on the running event loop (asyncio serving mode).
+
+        Database writes go to the default executor.
+
+        Returns:
+            Turn ID
+        """
+        loop = asyncio.get_running_loop()
+        turn_id, entry = await loop.run_in_executor(None, self._register, username, session_id, False)
+        entry['task'] = loop.create_task(self._run_async(entry, events))
+        return turn_id
+
+    async def _run_async(self, entry: Dict[str, Any], events: AsyncIterator[Dict[str, Any]]):
+        loop = asyncio.get_running_loop()
+        log = entry['log']
+        status = 'completed'
+        try:
+            async for event in events:
+                log.append(event)
+                if event.get('type') == 'error':
+                    status = 'failed'
+                if log.persist_due():
+                    await loop.run_in_executor(None, log.persist)
+        except Exception as e:
+            logger.error(f"Chat turn {log.turn_id} crashed: {e}")
+            log.append({'type': 'error', 'error': str(e)})
+            status = 'failed'
+        finally:
+            await loop.run_in_executor(None, log.persist)
+            log.finish()
+            entry['finished_at'] = time.time()
+            try:
+                await loop.run_in_executor(None, database.finish_chat_turn, log.turn_id, status)
+            except Exception as e:
+                logger.error(f"Failed to mark turn {log.turn_id} as finished: {e}")
+
+    def get_owner(self, turn_id: str) -> Optional[str]:
+        """Get the username owning a turn, or None if the turn is unknown."""
+        entry = self._turns.get(turn_id)
+        if entry is not None:
+            return entry['username']
+        turn = database.get_chat_turn(turn_id)
+        return turn['username'] if turn else None
+
+    def stream(self, turn_id: str, after_id: int = 0) -> Iterator[str]:
+        """
+        Stream a turn's events as SSE frames with IDs.
+
+        Args:
+            turn_id: Turn ID
+            after_id: Last event ID the client has seen (Last-Event-ID)
+
+        Yields:
+            SSE frames, until the turn has finished and everything is sent
+        """
+        entry = self._turns.get(turn_id)
+        if entry is None:
+            # Turn finished a while ago (or ran in another process)
+            for event_id, data in database.load_chat_turn_events(turn_id, after_id):
+                yield sse.frame(data, event_id)
+            return
+
+        log = entry['log']
+        while True:
+            events, finished = log.read(after_id, KEEPALIVE_INTERVAL)
+            if events is None:
+                events = database.load_chat_turn_events(turn_id, after_id)
+
+            for event_id, data in events:
+                yield sse.frame(data, event_id)
+                after_id = event_id
+
+            if not events:
+                if finished:
+                    return
+                yield ": keepalive\n\n"
+
+    async def stream_async(self, turn_id: str, after_id: int = 0) -> AsyncIterator[str]:
+        """Asyncio variant of stream()."""
+        loop = asyncio.get_running_loop()
+        entry = self._turns.get(turn_id)
+        if entry is None:
+            events = await loop.run_in_executor(None, database.load_chat_turn_events, turn_id, after_id)
+            for event_id, data in events:
+                yield sse.frame(data, event_id)
+            return
+
+        log = entry['log']
+        while True:
+            events, finished = await log.read_async(after_id, KEEPALIVE_INTERVAL)
+            if events is None:
+                events = await loop.run_in_executor(None, database.load_chat_turn_events, turn_id, after_id)
+
+            for event_id, data in events:
+                yield sse.frame(data, event_id)
+                after_id = event_id
+
+            if not events:
+                if finished:
+                    return
+                yield ": keepalive\n\n"
+
+    def get_stats(self) -> Dict[str, int]:
+        """Counts of turns held in memory."""
+        with self._lock:
+            entries = list(self._turns.values())
+        return {
+            'turns': len(entries),
+            'running': sum(1 for entry in entries if entry['finished_at'] is None)
+        }
+
+    def _cleanup(self):
+        """Forget finished turns and old persisted events."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                turn_id for turn_id, entry in self._turns.items()
+                if entry['finished_at'] is not None and now - entry['finished_at'] > TURN_RETENTION
+            ]
+            for turn_id in expired:
+                del self._turns[turn_id]
+
+        if now - self._last_db_cleanup > 3600:
+            self._last_db_cleanup = now
+            cutoff = datetime.utcnow() - timedelta(hours=EVENT_RETENTION_HOURS)
+            try:
+                database.delete_chat_turns_before(cutoff.strftime('%Y-%m-%d %H:%M:%S'))
+            except Exception as e:
+                logger.error(f"Failed to delete old chat turns: {e}")
+
+
+# Global instance
+_manager = None
+
+
+def get_turn_manager() -> TurnManager:
+    """Get the global turn manager instance."""
+    global _manager
+    if _manager is None:
+        _manager = TurnManager()
+    return _manager
@@ -0,0 +1,296 @@
+"""
+Token-budget-aware context compaction for long agentic sessions.
+
+Keeps the message list sent on every loop iteration bounded. Strategies run
+from cheapest to most lossy, each with its own per-model token budget:
+
+1. elide_tool_results - replace old tool_result contents with a short head
+2. summarize          - fold turns older than the kept window into a summary
+                        written by a cheap model
+3. drop_turns         - drop turns older than the kept window outright
+"""
+
+import json
+import logging
+from typing import Dict, List, Any, Optional, Callable
+
+import config
+from conversation_store import is_plain_user_message
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGETS = {
+    'elide_tool_results': 60000,
+    'summarize': 100000,
+    'drop_turns': 150000
+}
+
+# Per-model budgets, model alias -> strategy -> token budget
+TOKEN_BUDGETS = getattr(config, 'CONTEXT_TOKEN_BUDGETS', {})
+# Turns (a user message and everything answering it) never summarized or dropped
+KEEP_RECENT_TURNS = getattr(config, 'CONTEXT_KEEP_RECENT_TURNS', 2)
+# Tool result messages at the end of the list that are never elided
+KEEP_RECENT_TOOL_RESULTS = getattr(config, 'CONTEXT_KEEP_RECENT_TOOL_RESULTS', 1)
+# Older turns are summarized by this (cheap) model; None disables summaries
+SUMMARY_MODEL = getattr(config, 'CONTEXT_SUMMARY_MODEL', 'haiku')
+# Once a budget is exceeded, compact down to this share of it, so the
+# conversation prefix (and its prompt cache) stays stable for a while
+TARGET_RATIO = getattr(config, 'CONTEXT_TARGET_RATIO', 0.7)
+
+# Characters of an elided tool result kept as its summary
+ELIDED_HEAD_CHARS = 300
+ELIDED_MARKER = "[tool result elided"
+
+SUMMARY_PROMPT = (
+    "Summarize the following earlier part of a conversation between a user and "
+    "a coding assistant. Keep file paths, commands, decisions, open tasks and "
+    "facts the assistant will need later. Be concise.\n\n"
+)
+
+
+def estimate_tokens(value: Any) -> int:
+    """
+    Estimate the token count of a string, content block or message.
+
+    Roughly four ASCII characters per token; non-ASCII text (mostly CJK
+    here) counts about one token per character.
+    """
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        extra = len(value.encode('utf-8')) - len(value)
+        return (len(value) + 3) // 4 + extra // 2
+    if isinstance(value, list):
+        return sum(estimate_tokens(item) for item in value)
+    if isinstance(value, dict):
+        if 'role' in value:
+            return 4 + estimate_tokens(value.get('content'))
+        block_type = value.get('type')
+        if block_type == 'text':
+            return estimate_tokens(value.get('text'))
+        if block_type == 'tool_use':
+            return 8 + estimate_tokens(json.dumps(value.get('input', {}), ensure_ascii=False))
+        if block_type == 'tool_result':
+            return 8 + estimate_tokens(value.get('content'))
+        return estimate_tokens(json.dumps(value, ensure_ascii=False))
+    return estimate_tokens(str(value))
+
+
+def get_budgets(model: str) -> Dict[str, int]:
+    """Get the strategy budgets for a model alias."""
+    budgets = dict(DEFAULT_BUDGETS)
+    budgets.update(TOKEN_BUDGETS.get('default', {}))
+    budgets.update(TOKEN_BUDGETS.get(model, {}))
+    return budgets
+
+
+def make_model_summarizer(client, model_id: str,
+                          max_tokens: int = 1024) -> Callable[[List[Dict[str, Any]]], str]:
+    """
+    Build a summarizer that asks a (cheap) model to condense messages.
+
+    Args:
+        client: Anthropic client
+        model_id: Model used for summaries
+        max_tokens: Summary length limit
+
+    Returns:
+        Function taking a list of messages and returning summary text
+    """
+    def summarize(messages: List[Dict[str, Any]]) -> str:
+        transcript = json.dumps(messages, ensure_ascii=False)
+        response = client.messages.create(
+            model=model_id,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": SUMMARY_PROMPT + transcript}]
+        )
+        return ''.join(block.text for block in response.content if block.type == 'text')
+
+    return summarize
+
+
+class ContextCompactor:
+    """Shrinks a message list in place until it fits the token budgets."""
+
+    def __init__(self, budgets: Dict[str, int],
+                 keep_recent_turns: int = KEEP_RECENT_TURNS,
+                 summarizer: Optional[Callable[[List[Dict[str, Any]]], str]] = None):
+        """
+        Initialize context compactor.
+
+        Args:
+            budgets: Strategy name -> token budget (see get_budgets)
+            keep_recent_turns: Turns kept verbatim by summarize/drop_turns
+            summarizer: Optional function condensing messages into text
+        """
+        self.budgets = budgets
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.summarizer = summarizer
+
+    def compact(self, messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Compact messages in place if any strategy budget is exceeded.
+
+        Args:
+            messages: Canonical message list
+
+        Returns:
+            Compaction stats, or None when nothing had to change
+        """
+        tokens_before = estimate_tokens(messages)
+        if tokens_before <= min(self.budgets.values()):
+            return None
+
+        stats = {
+            'tokens_before': tokens_before,
+            'strategies': [],
+            'elided_results': 0,
+            'summarized_messages': 0,
+            'dropped_messages': 0,
+            'messages_removed': 0
+        }
+        tokens = tokens_before
+
+        budget = self.budgets.get('elide_tool_results')
+        if budget is not None and tokens > budget:
+            tokens = self._elide_tool_results(messages, tokens, int(budget * TARGET_RATIO), stats)
+
+        budget = self.budgets.get('summarize')
+        if budget is not None and tokens > budget and self.summarizer:
+            tokens = self._summarize(messages, tokens, stats)
+
+        budget = self.budgets.get('drop_turns')
+        if budget is not None and tokens > budget:
+            tokens = self._drop_turns(messages, tokens, int(budget * TARGET_RATIO), stats)
+
+        if not stats['strategies']:
+            return None
+
+        stats['tokens_after'] = tokens
+        return stats
+
+    def _kept_window_start(self, messages: List[Dict[str, Any]]) -> int:
+        """Index of the first message of the turns kept verbatim."""
+        turns_seen = 0
+        for index in range(len(messages) - 1, -1, -1):
+            if is_plain_user_message(messages[index]):
+                turns_seen += 1
+                if turns_seen == self.keep_recent_turns:
+                    return index
+        return 0
+
+    def _elide_tool_results(self, messages: List[Dict[str, Any]], tokens: int,
+                            target: int, stats: Dict[str, Any]) -> int:
+        # The newest tool results are what the model is working on right now
+        protected = KEEP_RECENT_TOOL_RESULTS
+        limit = len(messages)
+        for index in range(len(messages) - 1, -1, -1):
+            if protected <= 0:
+                break
+            if _has_tool_result(messages[index]):
+                protected -= 1
+                limit = index
+
+        elided = 0
+        for message in messages[:limit]:
+            if tokens <= target:
+                break
+            if not _has_tool_result(message):
+                continue
+            for block in message['content']:
+                if block.get('type') != 'tool_result':
+                    continue
+                content = block.get('content')
+                if not isinstance(content, str):
+                    content = json.dumps(content, ensure_ascii=False)
+                if len(content) <= ELIDED_HEAD_CHARS or content.startswith(ELIDED_MARKER):
+                    continue
+                old_tokens = estimate_tokens(block)
+                block['content'] = (
+                    f"{ELIDED_MARKER} to save context: ~{estimate_tokens(content)} tokens]\n"
+                    f"{content[:ELIDED_HEAD_CHARS]}..."
+                )
+                tokens -= old_tokens - estimate_tokens(block)
+                elided += 1
+
+        if elided:
+            stats['strategies'].append('elide_tool_results')
+            stats['elided_results'] = elided
+        return tokens
+
+    def _summarize(self, messages: List[Dict[str, Any]], tokens: int,
+                   stats: Dict[str, Any]) -> int:
+        cut = self._kept_window_start(messages)
+        if cut <= 0:
+            return tokens
+
+        old = messages[:cut]
+        try:
+            summary = self.summarizer(old)
+        except Exception as e:
+            logger.error(f"Context summarization failed: {e}")
+            return tokens
+        if not summary:
+            return tokens
+
+        _prepend_text(messages[cut], f"[Summary of {cut} earlier messages]\n{summary}")
+        del messages[:cut]
+
+        stats['strategies'].append('summarize')
+        stats['summarized_messages'] = cut
+        stats['messages_removed'] += cut
+        return estimate_tokens(messages)
+
+    def _drop_turns(self, messages: List[Dict[str, Any]], tokens: int,
+                    target: int, stats: Dict[str, Any]) -> int:
+        window_start = self._kept_window_start(messages)
+        cut = 0
+        # Drop whole turns from the front until the rest fits
+        for index in range(1, window_start + 1):
+            if index == window_start or is_plain_user_message(messages[index]):
+                cut = index
+                if tokens - estimate_tokens(messages[:cut]) <= target:
+                    break
+        if cut <= 0:
+            return tokens
+
+        _prepend_text(messages[cut], f"[{cut} earlier messages were omitted to fit the context window]")
+        del messages[:cut]
+
+        stats['strategies'].append('drop_turns')
+        stats['dropped_messages'] = cut
+        stats['messages_removed'] += cut
+        return estimate_tokens(messages)
+
+
+def _has_tool_result(message: Dict[str, Any]) -> bool:
+    content = message.get('content')
+    return (message['role'] == 'user' and isinstance(content, list)
+            and any(block.get('type') == 'tool_result' for block in content))
+
+
+def _prepend_text(message: Dict[str, Any], text: str):
+    """Put a text block in front of a (user) message's content."""
+    content = message['content']
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    message['content'] = [{"type": "text", "text": text}] + content
+
+
+def create_compactor(model: str, client=None) -> ContextCompactor:
+    """
+    Create a compactor for a model alias.
+
+    Args:
+        model: Model alias from config.AVAILABLE_MODELS
+        client: Anthropic client for SUMMARY_MODEL (None disables summaries)
+
+    Returns:
+        ContextCompactor configured with the model's budgets
+    """
+    summarizer = None
+    summary_model_id = config.AVAILABLE_MODELS.get(SUMMARY_MODEL) if SUMMARY_MODEL else None
+    if client is not None and summary_model_id:
+        summarizer = make_model_summarizer(client, summary_model_id)
+    return ContextCompactor(get_budgets(model), summarizer=summarizer)
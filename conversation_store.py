@@ -0,0 +1,206 @@
+"""
+Server-side canonical conversation state.
+
+Holds the exact Anthropic-format message list of every chat session,
+including the tool_use/tool_result blocks produced during earlier turns,
+so the browser only has to send the new user message and the version it
+last saw.
+"""
+
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+import database
+
+
+logger = logging.getLogger(__name__)
+
+# Sessions kept in memory; older ones are reloaded from the database on demand
+MAX_CACHED_SESSIONS = 500
+
+
+class VersionConflict(Exception):
+    """Raised when a request was built against an outdated conversation."""
+
+    def __init__(self, current_version: int):
+        super().__init__(f"Conversation version conflict (current: {current_version})")
+        self.current_version = current_version
+
+
+def is_plain_user_message(message: Dict[str, Any]) -> bool:
+    """Check whether a message starts a user turn (not a tool_result carrier)."""
+    if message['role'] != 'user':
+        return False
+    content = message['content']
+    if isinstance(content, str):
+        return True
+    return not any(block.get('type') == 'tool_result' for block in content)
+
+
+class ConversationStore:
+    """
+    Canonical message lists keyed by owner and session ID.
+
+    Saves are compare-and-swap against the version a turn started from:
+    of two turns begun on the same version, only the first one to finish
+    is stored and the other gets a VersionConflict.
+    """
+
+    def __init__(self, max_sessions: int = MAX_CACHED_SESSIONS):
+        """
+        Initialize conversation store.
+
+        Args:
+            max_sessions: Number of sessions kept in memory
+        """
+        self.max_sessions = max_sessions
+        # (username, session ID) -> entry, so one user can never read or
+        # replace another user's conversation
+        self._sessions: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, session_id: str, username: str) -> Dict[str, Any]:
+        """Get a session entry, loading it from the database if needed."""
+        key = (username, session_id)
+        entry = self._sessions.get(key)
+        if entry is None:
+            state = database.load_conversation_state(session_id)
+            if state and state['username'] == username:
+                entry = {'messages': state['messages'], 'version': state['version']}
+            else:
+                entry = {'messages': [], 'version': 0}
+            self._sessions[key] = entry
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(key)
+        return entry
+
+    def get_version(self, session_id: str, username: str) -> int:
+        """Get the current version of a session's conversation."""
+        with self._lock:
+            return self._load(session_id, username)['version']
+
+    def begin_turn(self, session_id: str, username: str, user_message: str,
+                   version: Optional[int] = None,
+                   regenerate: bool = False) -> Tuple[List[Dict[str, Any]], int, int]:
+        """
+        Start a user turn on top of the stored conversation.
+
+        Args:
+            session_id: Session ID
+            username: Owner of the session
+            user_message: New user message text
+            version: Version the client last saw (None skips the check)
+            regenerate: Drop the last user turn first and answer it again
+
+        Returns:
+            (working copy of the messages ending with the new user message,
+             index of the last message before this turn or -1,
+             version the turn starts from, to pass to save)
+
+        Raises:
+            VersionConflict: If version does not match the stored one
+        """
+        with self._lock:
+            entry = self._load(session_id, username)
+            if version is not None and version != entry['version']:
+                raise VersionConflict(entry['version'])
+            messages = copy.deepcopy(entry['messages'])
+            base_version = entry['version']
+
+        if regenerate:
+            for index in range(len(messages) - 1, -1, -1):
+                if is_plain_user_message(messages[index]):
+                    del messages[index:]
+                    break
+
+        previous_turn_end = len(messages) - 1
+        append_user_text(messages, user_message)
+        return messages, previous_turn_end, base_version
+
+    def seed(self, session_id: str, username: str, messages: List[Dict[str, Any]]):
+        """Replace a session's conversation, e.g. with history sent by an old client."""
+        with self._lock:
+            entry = self._load(session_id, username)
+            entry['messages'] = copy.deepcopy(messages)
+
+    def save(self, session_id: str, username: str, messages: List[Dict[str, Any]],
+             base_version: Optional[int] = None) -> int:
+        """
+        Store the messages of a finished (or interrupted) turn.
+
+        Args:
+            session_id: Session ID
+            username: Owner of the session
+            messages: The turn's working copy of the conversation
+            base_version: Version returned by begin_turn (None skips the check)
+
+        Returns:
+            New conversation version
+
+        Raises:
+            VersionConflict: If another turn was saved since base_version
+        """
+        with self._lock:
+            entry = self._load(session_id, username)
+            if base_version is not None and base_version != entry['version']:
+                raise VersionConflict(entry['version'])
+            entry['messages'] = messages
+            entry['version'] += 1
+            version = entry['version']
+
+        try:
+            stored = database.save_conversation_state(session_id, username, messages, version)
+        except Exception as e:
+            logger.error(f"Failed to persist conversation state: {e}")
+            return version
+        if not stored:
+            # Another server process stored a newer version (or another user
+            # owns the session ID): reload from the database on next use
+            logger.warning(f"Conversation state of session {session_id} changed elsewhere, not overwritten")
+            with self._lock:
+                if self._sessions.get((username, session_id)) is entry:
+                    del self._sessions[(username, session_id)]
+        return version
+
+    def clear(self, session_id: str, username: str):
+        """Forget a session's conversation."""
+        with self._lock:
+            self._sessions.pop((username, session_id), None)
+        database.delete_conversation_state(session_id, username)
+
+
+def append_user_text(messages: List[Dict[str, Any]], text: str):
+    """
+    Append user text, merging it into a trailing user message.
+
+    A conversation can end with a user message carrying tool results (for
+    example after ask_user_question); the answer then joins that message so
+    roles keep alternating.
+    """
+    if messages and messages[-1]['role'] == 'user':
+        content = messages[-1]['content']
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        messages[-1] = {
+            "role": "user",
+            "content": content + [{"type": "text", "text": text}]
+        }
+    else:
+        messages.append({"role": "user", "content": text})
+
+
+# Global instance
+_store = None
+
+
+def get_conversation_store() -> ConversationStore:
+    """Get the global conversation store instance."""
+    global _store
+    if _store is None:
+        _store = ConversationStore()
+    return _store
@@ -4,6 +4,8 @@ from datetime import datetime
 import os
 from contextlib import contextmanager
 
+from db_writer import get_db_writer
+
 DATABASE_PATH = '/root/claude-web/conversations.db'
 
 @contextmanager
@@ -53,28 +55,247 @@ def init_db():
             CREATE INDEX IF NOT EXISTS idx_content ON conversations(content)
         ''')
 
+    init_conversation_state_db()
+    init_chat_turns_db()
+
     # 初始化MCP相关表
     from mcp_database import init_mcp_db
     init_mcp_db()
 
+def init_conversation_state_db():
+    """初始化会话状态表（服务端保存的完整消息列表）"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_state (
+                session_id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                messages TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_conversation_state_username ON conversation_state(username)
+        ''')
+
+def init_chat_turns_db():
+    """初始化聊天轮次、事件日志（用于断线重连后回放事件）及耗时统计表"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_turns (
+                turn_id TEXT PRIMARY KEY,
+                username TEXT NOT NULL,
+                session_id TEXT,
+                status TEXT NOT NULL DEFAULT 'running',
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                finished_at DATETIME
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_turn_events (
+                turn_id TEXT NOT NULL,
+                event_id INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (turn_id, event_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_turns_created ON chat_turns(created_at)
+        ''')
+        # 每轮的耗时分解（首字节/首文本、模型流、工具、数据库写入）和 token 用量
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_turn_metrics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                session_id TEXT,
+                model TEXT,
+                status TEXT,
+                total_ms REAL,
+                ttfb_ms REAL,
+                ttft_ms REAL,
+                model_ms REAL,
+                tool_ms REAL,
+                db_ms REAL,
+                iterations INTEGER,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                cache_read_input_tokens INTEGER,
+                cache_creation_input_tokens INTEGER,
+                retries INTEGER,
+                details TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_chat_turn_metrics_created ON chat_turn_metrics(created_at)
+        ''')
+
 def save_message(username, role, content, model=None, session_id=None, metadata=None):
-    """保存单条消息"""
+    """保存单条消息（写入后台写队列，不等待磁盘）"""
+    metadata_json = json.dumps(metadata) if metadata else None
+    get_db_writer().execute(DATABASE_PATH, '''
+        INSERT INTO conversations (username, role, content, model, session_id, metadata)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (username, role, content, model, session_id, metadata_json))
+
+def save_conversation_state(session_id, username, messages, version):
+    """保存会话的完整消息列表；只覆盖同一用户的更旧版本，返回是否已写入"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
-        metadata_json = json.dumps(metadata) if metadata else None
+        cursor.execute('''
+            INSERT INTO conversation_state (session_id, username, messages, version, updated_at)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(session_id) DO UPDATE SET
+                messages = excluded.messages, version = excluded.version, updated_at = excluded.updated_at
+            WHERE conversation_state.username = excluded.username AND conversation_state.version < excluded.version
+        ''', (session_id, username, json.dumps(messages), version))
+        return cursor.rowcount > 0
+
+def load_conversation_state(session_id):
+    """读取会话的完整消息列表"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT INTO conversations (username, role, content, model, session_id, metadata)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (username, role, content, model, session_id, metadata_json))
+            SELECT username, messages, version FROM conversation_state WHERE session_id = ?
+        ''', (session_id,))
 
-        message_id = cursor.lastrowid
+        row = cursor.fetchone()
 
-    return message_id
+    if not row:
+        return None
+
+    return {
+        'username': row[0],
+        'messages': json.loads(row[1]),
+        'version': row[2]
+    }
+
+def delete_conversation_state(session_id, username):
+    """删除会话状态"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM conversation_state WHERE session_id = ? AND username = ?',
+                       (session_id, username))
+
+def create_chat_turn(turn_id, username, session_id):
+    """登记一个聊天轮次"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO chat_turns (turn_id, username, session_id) VALUES (?, ?, ?)
+        ''', (turn_id, username, session_id))
+
+def finish_chat_turn(turn_id, status):
+    """标记聊天轮次结束"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE chat_turns SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE turn_id = ?
+        ''', (status, turn_id))
+
+def get_chat_turn(turn_id):
+    """获取聊天轮次信息"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT turn_id, username, session_id, status, created_at, finished_at
+            FROM chat_turns WHERE turn_id = ?
+        ''', (turn_id,))
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+
+    return {
+        'turn_id': row[0],
+        'username': row[1],
+        'session_id': row[2],
+        'status': row[3],
+        'created_at': row[4],
+        'finished_at': row[5]
+    }
+
+def save_chat_turn_events(turn_id, events):
+    """批量保存轮次事件，events 为 (event_id, data) 列表（写入后台写队列）"""
+    get_db_writer().executemany(DATABASE_PATH, '''
+        INSERT OR REPLACE INTO chat_turn_events (turn_id, event_id, data) VALUES (?, ?, ?)
+    ''', [(turn_id, event_id, json.dumps(data)) for event_id, data in events])
+
+CHAT_TURN_METRIC_COLUMNS = [
+    'model', 'status', 'total_ms', 'ttfb_ms', 'ttft_ms', 'model_ms', 'tool_ms', 'db_ms',
+    'iterations', 'input_tokens', 'output_tokens', 'cache_read_input_tokens',
+    'cache_creation_input_tokens', 'retries'
+]
+
+def save_chat_turn_metrics(username, session_id, record):
+    """保存一轮的耗时统计，record 中 calls/tools 等明细存为 JSON（写入后台写队列）"""
+    details = {k: v for k, v in record.items() if k not in CHAT_TURN_METRIC_COLUMNS}
+    get_db_writer().execute(DATABASE_PATH, f'''
+        INSERT INTO chat_turn_metrics (username, session_id, {', '.join(CHAT_TURN_METRIC_COLUMNS)}, details)
+        VALUES (?, ?, {', '.join('?' for _ in CHAT_TURN_METRIC_COLUMNS)}, ?)
+    ''', [username, session_id] + [record.get(c) for c in CHAT_TURN_METRIC_COLUMNS] + [json.dumps(details)])
+
+def get_chat_turn_metrics(since, model=None, limit=10000):
+    """获取某时间之后的轮次耗时统计（最新的在前）"""
+    get_db_writer().flush()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        query = f'''
+            SELECT username, session_id, {', '.join(CHAT_TURN_METRIC_COLUMNS)}, details, created_at
+            FROM chat_turn_metrics WHERE created_at >= ?
+        '''
+        params = [since]
+        if model:
+            query += ' AND model = ?'
+            params.append(model)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    records = []
+    for row in rows:
+        record = dict(row)
+        record['details'] = json.loads(record['details']) if record['details'] else {}
+        records.append(record)
+    return records
+
+def load_chat_turn_events(turn_id, after_id=0):
+    """读取某事件之后的轮次事件"""
+    get_db_writer().flush()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT event_id, data FROM chat_turn_events
+            WHERE turn_id = ? AND event_id > ?
+            ORDER BY event_id
+        ''', (turn_id, after_id))
+        rows = cursor.fetchall()
+
+    return [(row[0], json.loads(row[1])) for row in rows]
+
+def delete_chat_turns_before(cutoff):
+    """删除早于 cutoff（'YYYY-MM-DD HH:MM:SS'）的轮次及其事件"""
+    get_db_writer().flush()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM chat_turn_events WHERE turn_id IN (
+                SELECT turn_id FROM chat_turns WHERE created_at < ?
+            )
+        ''', (cutoff,))
+        cursor.execute('DELETE FROM chat_turns WHERE created_at < ?', (cutoff,))
+        return cursor.rowcount
 
 def get_conversation_history(username, limit=100):
     """获取用户的对话历史"""
+    get_db_writer().flush()
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -106,6 +327,7 @@ def get_conversation_history(username, limit=100):
 
 def search_conversations(username, query, limit=50):
     """搜索对话内容"""
+    get_db_writer().flush()
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -137,6 +359,7 @@ def search_conversations(username, query, limit=50):
 
 def clear_user_history(username):
     """清除用户的所有对话历史"""
+    get_db_writer().flush()
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -144,10 +367,13 @@ def clear_user_history(username):
 
         deleted_count = cursor.rowcount
 
+        cursor.execute('DELETE FROM conversation_state WHERE username = ?', (username,))
+
     return deleted_count
 
 def get_conversation_stats(username):
     """获取用户的对话统计信息"""
+    get_db_writer().flush()
     with get_db_connection() as conn:
         cursor = conn.cursor()
 
@@ -0,0 +1,226 @@
+"""
+Write-behind queue for SQLite writes on the chat hot path.
+
+Saving a chat message, logging a tool call or updating its status used to
+open a connection and commit on the request thread, once per row. Those
+writes are now queued and applied by a single background thread, which
+gathers whatever arrives within BATCH_INTERVAL and commits it as one
+transaction per database file. Writes are applied in the order they were
+queued.
+
+The queue is bounded: when the disk cannot keep up, producers block on
+put instead of memory growing without limit. Readers that must see
+earlier writes (history, operation logs, replayed events) call flush()
+first, and pending writes are flushed when the process exits.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+ENABLED = getattr(config, 'DB_WRITE_BEHIND', True)
+# Maximum queued writes before producers block
+QUEUE_SIZE = getattr(config, 'DB_WRITE_QUEUE_SIZE', 10000)
+# Seconds to gather writes into one transaction, and the most per transaction
+BATCH_INTERVAL = getattr(config, 'DB_WRITE_BATCH_INTERVAL', 0.005)
+BATCH_SIZE = getattr(config, 'DB_WRITE_BATCH_SIZE', 500)
+
+_STOP = object()
+
+# (database path, SQL, parameters, executemany)
+_Write = Tuple[str, str, Any, bool]
+
+
+class DatabaseWriter:
+    """Single background thread applying queued SQLite writes in batches."""
+
+    def __init__(self, queue_size: int = QUEUE_SIZE, interval: float = BATCH_INTERVAL,
+                 batch_size: int = BATCH_SIZE, enabled: bool = ENABLED):
+        """
+        Initialize database writer.
+
+        Args:
+            queue_size: Maximum queued writes before producers block
+            interval: Seconds to gather writes into one transaction
+            batch_size: Maximum writes per transaction
+            enabled: When False, writes are applied on the calling thread
+        """
+        self.interval = interval
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._cond = threading.Condition()
+        self._enqueued = 0
+        self._written = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # Connections owned by the writer thread, per database path
+        self._connections: Dict[str, sqlite3.Connection] = {}
+        self.stats = {'writes': 0, 'batches': 0, 'errors': 0, 'max_batch': 0, 'max_queued': 0}
+
+    def execute(self, db_path: str, sql: str, params: Sequence[Any] = ()):
+        """
+        Queue one statement.
+
+        Args:
+            db_path: Database file (relative paths resolve against the current directory now)
+            sql: SQL statement
+            params: Statement parameters
+        """
+        self._submit((os.path.abspath(db_path), sql, params, False))
+
+    def executemany(self, db_path: str, sql: str, seq_of_params: List[Sequence[Any]]):
+        """Queue one statement for several parameter sets (applied together)."""
+        self._submit((os.path.abspath(db_path), sql, seq_of_params, True))
+
+    def _submit(self, write: _Write):
+        if not self.enabled or self._closed:
+            self._apply_now([write])
+            return
+        self._ensure_started()
+        with self._cond:
+            self._enqueued += 1
+        self._queue.put(write)
+        queued = self._queue.qsize()
+        if queued > self.stats['max_queued']:
+            self.stats['max_queued'] = queued
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every write queued so far has been applied.
+
+        Returns:
+            False if the timeout expired first
+        """
+        with self._cond:
+            target = self._enqueued
+            return self._cond.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self, timeout: float = 10.0):
+        """Apply pending writes and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+    def _connection(self, db_path: str) -> sqlite3.Connection:
+        connection = self._connections.get(db_path)
+        if connection is None:
+            connection = sqlite3.connect(db_path, timeout=30.0)
+            self._connections[db_path] = connection
+        return connection
+
+    def _write(self, batch: List[_Write]):
+        """Apply a batch, one transaction per database file."""
+        by_path: Dict[str, List[_Write]] = {}
+        for write in batch:
+            by_path.setdefault(write[0], []).append(write)
+        for db_path, writes in by_path.items():
+            try:
+                connection = self._connection(db_path)
+                with connection:
+                    for write in writes:
+                        self._apply(connection, write)
+            except Exception as e:
+                # Apply one by one so a single bad write does not lose the batch
+                logger.warning(f"Batch write to {db_path} failed ({e}), retrying one by one")
+                connection = self._connections.pop(db_path, None)
+                if connection is not None:
+                    connection.close()
+                self._apply_now(writes)
+
+        with self._cond:
+            self._written += len(batch)
+            self.stats['writes'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+            self._cond.notify_all()
+
+    @staticmethod
+    def _apply(connection: sqlite3.Connection, write: _Write):
+        _, sql, params, many = write
+        if many:
+            connection.executemany(sql, params)
+        else:
+            connection.execute(sql, params)
+
+    def _apply_now(self, writes: List[_Write]):
+        """Apply writes with a new connection each, logging failures."""
+        for write in writes:
+            try:
+                connection = sqlite3.connect(write[0], timeout=30.0)
+                try:
+                    with connection:
+                        self._apply(connection, write)
+                finally:
+                    connection.close()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Database write failed: {e}; SQL: {write[1].strip()[:200]}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Write counters and queue depth."""
+        with self._cond:
+            return {
+                **self.stats,
+                'queued': self._enqueued - self._written,
+                'avg_batch': round(self.stats['writes'] / self.stats['batches'], 1) if self.stats['batches'] else None,
+                'enabled': self.enabled
+            }
+
+
+# Global instance
+_writer = None
+
+
+def get_db_writer() -> DatabaseWriter:
+    """Get the global database writer instance."""
+    global _writer
+    if _writer is None:
+        _writer = DatabaseWriter()
+    return _writer
@@ -0,0 +1,494 @@
+"""
+Glob engine behind the glob tool.
+
+The old implementation changed the process's working directory to the
+search root, expanded the pattern with glob.glob(recursive=True), sorted
+every match and kept the first 100. os.chdir affects every thread, so a
+concurrent tool call could resolve its paths against the wrong
+directory, and a '**' pattern in a large tree was fully expanded to
+return 100 entries.
+
+This engine matches the pattern while walking from the root with
+os.scandir, never touching the working directory. Each pattern (after
+brace expansion, so '{src,lib}/**/*.{ts,tsx}' works) is a list of path
+components, and the walker keeps the set of components each directory
+may still match, so one walk serves all expansions and only directories
+that can contain a match are listed. Matching follows glob.glob: '*' and
+'?' do not match names starting with '.' unless the component does,
+'**' matches any number of (non-hidden) directories, and directories
+are returned as well as files.
+
+Directories in GLOB_IGNORED_DIRS (.git, node_modules, ...) and entries
+excluded by .gitignore files (of the root, its subdirectories and its
+parents inside the same repository) are pruned unless the pattern names
+them literally. Results sorted by path come out in walk order, so the
+walk stops as soon as the limit is reached; results sorted by mtime
+(newest first) are kept in a heap bounded by the limit. With the
+workspace index enabled (see workspace_index.py), directories are
+listed from its in-memory tree instead of the disk.
+"""
+
+import fnmatch
+import heapq
+import os
+import re
+import threading
+from typing import Dict, List, Any, FrozenSet, Iterator, Optional, Tuple
+
+import config
+import grep_engine
+import workspace_index
+
+
+# Maximum paths returned by the glob tool
+MAX_RESULTS = getattr(config, 'GLOB_MAX_RESULTS', 100)
+# Directories never entered through a wildcard
+IGNORED_DIRS = frozenset(getattr(config, 'GLOB_IGNORED_DIRS', ('.git', 'node_modules', '__pycache__')))
+# Skip entries excluded by .gitignore files
+RESPECT_GITIGNORE = getattr(config, 'GLOB_RESPECT_GITIGNORE', True)
+
+_MAGIC = re.compile(r'[*?[]')
+# Kinds of pattern components
+_LITERAL, _WILDCARD, _RECURSIVE = 'literal', 'wildcard', '**'
+
+# (pattern index, component index)
+State = Tuple[int, int]
+# (regex, negated, directories only, matched against the path rather than the name)
+IgnoreRule = Tuple[Any, bool, bool, bool]
+# (base directory, rules of its .gitignore)
+IgnoreFile = Tuple[str, List[IgnoreRule]]
+
+
+def _translate_gitignore(pattern: str) -> str:
+    """Regex source of a gitignore glob ('**' spans directories, '*' does not)."""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i) and i + 2 == len(pattern) and (i == 0 or pattern[i - 1] == '/'):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            parts.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(parts) + r'\Z'
+
+
+def parse_gitignore(text: str) -> List[IgnoreRule]:
+    """Rules of a .gitignore file, in file order."""
+    rules = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated:
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        # A slash anywhere but at the end anchors the pattern to the .gitignore's directory
+        anchored = '/' in line
+        line = line.lstrip('/')
+        if not line:
+            continue
+        try:
+            rules.append((re.compile(_translate_gitignore(line), re.DOTALL), negated, dir_only, anchored))
+        except re.error:
+            continue
+    return rules
+
+
+def read_gitignore(directory: str) -> Optional[IgnoreFile]:
+    """The .gitignore of a directory, or None if it has none (or no rules)."""
+    try:
+        with open(os.path.join(directory, '.gitignore'), encoding='utf-8', errors='ignore') as f:
+            rules = parse_gitignore(f.read())
+    except OSError:
+        return None
+    return (directory, rules) if rules else None
+
+
+def is_ignored(ignore_files: Tuple[IgnoreFile, ...], path: str, name: str, is_dir: bool) -> bool:
+    """Whether .gitignore rules exclude a path (the last matching rule wins)."""
+    ignored = False
+    for base, rules in ignore_files:
+        rel_path = path[len(base) + 1:]
+        for regex, negated, dir_only, anchored in rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path if anchored else name):
+                ignored = not negated
+    return ignored
+
+
+def parent_ignore_files(root: str) -> Tuple[IgnoreFile, ...]:
+    """.gitignore files of root's parents up to the repository top (none outside a repository)."""
+    if os.path.exists(os.path.join(root, '.git')):
+        return ()
+    parents = []
+    directory = root
+    while True:
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return ()
+        directory = parent
+        parents.append(directory)
+        if os.path.exists(os.path.join(directory, '.git')):
+            break
+    files = [read_gitignore(directory) for directory in reversed(parents)]
+    return tuple(file for file in files if file is not None)
+
+
+class _PathEntry:
+    """os.DirEntry stand-in for a path the pattern names literally."""
+
+    __slots__ = ('name', 'path')
+
+    def __init__(self, directory: str, name: str):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self) -> bool:
+        return os.path.isdir(self.path)
+
+    def is_symlink(self) -> bool:
+        return os.path.islink(self.path)
+
+    def stat(self) -> os.stat_result:
+        return os.stat(self.path)
+
+
+class _CompiledGlob:
+    """Brace-expanded patterns as component lists, with memoized walker states."""
+
+    def __init__(self, pattern: str):
+        self.patterns: List[Tuple[str, ...]] = []
+        for expanded in grep_engine.expand_braces(pattern):
+            components: List[str] = []
+            for component in expanded.split('/'):
+                if component in ('', '.') or (component == '**' and components[-1:] == ['**']):
+                    continue
+                components.append(component)
+            if components and tuple(components) not in self.patterns:
+                self.patterns.append(tuple(components))
+        # (pattern index, position) -> (kind, literal or name matcher, matches hidden names)
+        self.components: Dict[State, Tuple[str, Any, bool]] = {}
+        for index, components in enumerate(self.patterns):
+            for position, component in enumerate(components):
+                if component == '**':
+                    self.components[(index, position)] = (_RECURSIVE, None, False)
+                elif _MAGIC.search(component):
+                    matcher = re.compile(fnmatch.translate(component)).match
+                    self.components[(index, position)] = (_WILDCARD, matcher, component.startswith('.'))
+                else:
+                    self.components[(index, position)] = (_LITERAL, component, True)
+        self._closures: Dict[FrozenSet[State], FrozenSet[State]] = {}
+        self._plans: Dict[FrozenSet[State], Tuple[List[Tuple[str, Any, bool]], bool]] = {}
+
+    def start(self) -> FrozenSet[State]:
+        return self.closure(frozenset((index, 0) for index in range(len(self.patterns))))
+
+    def closure(self, states: FrozenSet[State]) -> FrozenSet[State]:
+        """States plus those reached by letting a non-final '**' match no directory."""
+        result = self._closures.get(states)
+        if result is None:
+            expanded = set(states)
+            stack = list(states)
+            while stack:
+                index, position = stack.pop()
+                if (position < len(self.patterns[index]) - 1
+                        and self.components[(index, position)][0] is _RECURSIVE
+                        and (index, position + 1) not in expanded):
+                    expanded.add((index, position + 1))
+                    stack.append((index, position + 1))
+            result = self._closures[states] = frozenset(expanded)
+        return result
+
+    def plan(self, states: FrozenSet[State]) -> Tuple[List[Tuple[str, Any, bool]], bool]:
+        """
+        (final components, literal only) of a directory's states: the
+        components a file in it must match to be a result, and whether
+        every pending component is a literal name (no listing needed)
+        """
+        result = self._plans.get(states)
+        if result is None:
+            final = []
+            literal_only = True
+            for index, position in states:
+                if position >= len(self.patterns[index]):
+                    continue
+                component = self.components[(index, position)]
+                literal_only = literal_only and component[0] is _LITERAL
+                if position == len(self.patterns[index]) - 1 and component not in final:
+                    final.append(component)
+            result = self._plans[states] = (final, literal_only)
+        return result
+
+    def matched(self, states: FrozenSet[State]) -> bool:
+        return any(position == len(self.patterns[index]) for index, position in states)
+
+    def pending(self, states: FrozenSet[State]) -> bool:
+        return any(position < len(self.patterns[index]) for index, position in states)
+
+
+def _match_name(final: List[Tuple[str, Any, bool]], name: str) -> Optional[bool]:
+    """None if no final component matches; True if a literal one does, else False."""
+    hidden = name.startswith('.')
+    wildcard = False
+    for kind, value, dot in final:
+        if kind is _LITERAL:
+            if value == name:
+                return True
+        elif (not hidden or dot) and (kind is _RECURSIVE or value(name)):
+            wildcard = True
+    return False if wildcard else None
+
+
+class GlobEngine:
+    """Root-relative glob matching on os.scandir, safe to use from any thread."""
+
+    def __init__(self, ignored_dirs=IGNORED_DIRS, respect_gitignore: bool = RESPECT_GITIGNORE,
+                 tree: Optional['workspace_index.WorkspaceIndex'] = None):
+        """
+        Initialize glob engine.
+
+        Args:
+            ignored_dirs: Directory names never entered through a wildcard
+            respect_gitignore: Prune entries excluded by .gitignore files
+            tree: Workspace index to list directories from (default: the
+                global index when WORKSPACE_INDEX_ENABLED is set)
+        """
+        self.ignored_dirs = frozenset(ignored_dirs)
+        self.respect_gitignore = respect_gitignore
+        self.tree = tree
+        self._lock = threading.Lock()
+        self.stats = {'searches': 0, 'dirs_listed': 0, 'entries_scanned': 0,
+                      'pruned': 0, 'stopped_early': 0, 'indexed_listings': 0}
+
+    def _listing(self, directory: str, states: FrozenSet[State], compiled: _CompiledGlob,
+                 literal_only: bool, tree: Optional['workspace_index.WorkspaceIndex']) -> list:
+        """Entries of a directory sorted by name, or just the ones named literally."""
+        names = None
+        if literal_only:
+            names = {compiled.patterns[index][position] for index, position in states
+                     if position < len(compiled.patterns[index])}
+        if tree is not None:
+            entries = tree.entries(directory, names)
+            if entries is not None:
+                with self._lock:
+                    self.stats['indexed_listings'] += 1
+                return entries
+        if literal_only:
+            return [_PathEntry(directory, name) for name in sorted(names)
+                    if os.path.lexists(os.path.join(directory, name))]
+        try:
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            return []
+        with self._lock:
+            self.stats['dirs_listed'] += 1
+            self.stats['entries_scanned'] += len(entries)
+        entries.sort(key=lambda entry: entry.name)
+        return entries
+
+    def _enter(self, entry, states: FrozenSet[State], compiled: _CompiledGlob,
+               ignore_files: Tuple[IgnoreFile, ...]) -> Tuple[FrozenSet[State], bool]:
+        """States after entering a directory, and whether wildcards were pruned there."""
+        name = entry.name
+        hidden = name.startswith('.')
+        ignored = None
+        pruned = False
+        next_states = set()
+        for state in states:
+            index, position = state
+            if position >= len(compiled.patterns[index]):
+                continue
+            kind, value, dot = compiled.components[state]
+            if kind is _LITERAL:
+                if value == name:
+                    next_states.add((index, position + 1))
+                continue
+            if hidden and not dot:
+                continue
+            if kind is _WILDCARD and not value(name):
+                continue
+            if ignored is None:
+                ignored = name in self.ignored_dirs or (
+                    bool(ignore_files) and is_ignored(ignore_files, entry.path, name, True))
+            if ignored:
+                pruned = True
+                continue
+            if kind is _WILDCARD:
+                next_states.add((index, position + 1))
+                continue
+            if position == len(compiled.patterns[index]) - 1:
+                # A trailing '**' matches every entry below, files included
+                next_states.add((index, position + 1))
+            try:
+                if not entry.is_symlink():
+                    next_states.add(state)
+            except OSError:
+                pass
+        return compiled.closure(frozenset(next_states)), pruned
+
+    def iter_matches(self, pattern: str, root: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Matching entries in walk order (each directory's entries sorted by name).
+
+        Args:
+            pattern: Glob pattern, relative to root (or absolute)
+            root: Absolute directory to search
+
+        Yields:
+            (path, entry): path relative to root (absolute for an absolute
+            pattern) and its os.DirEntry (or a stand-in with the same methods)
+        """
+        prefix = ''
+        if os.path.isabs(pattern):
+            root = prefix = os.sep
+        compiled = _CompiledGlob(pattern)
+        if not compiled.patterns:
+            return
+        inherited: Tuple[IgnoreFile, ...] = ()
+        if self.respect_gitignore:
+            inherited = parent_ignore_files(os.path.abspath(root))
+        tree = workspace_index.lookup(os.path.abspath(root), self.tree)
+
+        # Frames: (relative prefix, states, final components, ignore files, entries)
+        stack = []
+
+        def push(directory: str, rel_prefix: str, states: FrozenSet[State], ignore_files):
+            final, literal_only = compiled.plan(states)
+            entries = self._listing(directory, states, compiled, literal_only, tree)
+            if self.respect_gitignore and (literal_only or any(e.name == '.gitignore' for e in entries)):
+                own = read_gitignore(directory)
+                if own is not None:
+                    ignore_files = ignore_files + (own,)
+            stack.append((rel_prefix, states, final, ignore_files, iter(entries)))
+
+        push(root, prefix, compiled.start(), inherited)
+        pruned = 0
+        try:
+            while stack:
+                rel_prefix, states, final, ignore_files, entries = stack[-1]
+                entry = next(entries, None)
+                if entry is None:
+                    stack.pop()
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if not is_dir:
+                    found = _match_name(final, entry.name)
+                    if found is None:
+                        continue
+                    if found is False and ignore_files and is_ignored(ignore_files, entry.path, entry.name, False):
+                        pruned += 1
+                        continue
+                    yield rel_prefix + entry.name, entry
+                    continue
+
+                next_states, was_pruned = self._enter(entry, states, compiled, ignore_files)
+                pruned += was_pruned
+                if not next_states:
+                    continue
+                rel_path = rel_prefix + entry.name
+                if compiled.matched(next_states):
+                    yield rel_path, entry
+                if compiled.pending(next_states):
+                    push(entry.path, rel_path + '/', next_states, ignore_files)
+        finally:
+            with self._lock:
+                self.stats['pruned'] += pruned
+
+    def glob(self, pattern: str, root: str, sort_by: str = 'path', limit: int = MAX_RESULTS) -> Dict[str, Any]:
+        """
+        Run a glob tool call.
+
+        Args:
+            pattern: Glob pattern ('**/*.py', 'src/**/*.{ts,tsx}')
+            root: Absolute directory to search
+            sort_by: 'path' (walk order; stops at the limit) or 'mtime'
+                (most recently modified first)
+            limit: Maximum paths returned
+
+        Returns:
+            The glob tool result; 'truncated' is set when more paths matched
+        """
+        if not os.path.isdir(root):
+            return {"success": False, "error": f"Path not found: {root}"}
+        limit = max(1, int(limit or MAX_RESULTS))
+        truncated = False
+        matches = self.iter_matches(pattern, root)
+        try:
+            if sort_by == 'mtime':
+                # Min-heap of the newest `limit` entries
+                heap: List[Tuple[float, str]] = []
+                for rel_path, entry in matches:
+                    try:
+                        mtime = entry.stat().st_mtime
+                    except OSError:
+                        mtime = 0.0
+                    item = (mtime, rel_path)
+                    if len(heap) < limit:
+                        heapq.heappush(heap, item)
+                    else:
+                        truncated = True
+                        heapq.heappushpop(heap, item)
+                paths = [rel_path for _, rel_path in sorted(heap, key=lambda item: (-item[0], item[1]))]
+            else:
+                paths = []
+                for rel_path, _ in matches:
+                    if len(paths) >= limit:
+                        truncated = True
+                        break
+                    paths.append(rel_path)
+        finally:
+            matches.close()
+
+        with self._lock:
+            self.stats['searches'] += 1
+            self.stats['stopped_early'] += truncated and sort_by != 'mtime'
+        if not paths:
+            return {"success": True, "matches": [], "message": "No files found"}
+        response = {"success": True, "matches": paths, "count": len(paths)}
+        if truncated:
+            response['truncated'] = True
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Walk counters."""
+        with self._lock:
+            return dict(self.stats)
+
+
+# Global instance
+_engine = None
+
+
+def get_glob_engine() -> GlobEngine:
+    """Get the global glob engine instance."""
+    global _engine
+    if _engine is None:
+        _engine = GlobEngine()
+    return _engine
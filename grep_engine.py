@@ -0,0 +1,641 @@
+"""
+Search engine behind the grep tool.
+
+The old implementation expanded '**/*' with glob, searched only the first
+200 files it returned and ran the regex line by line in Python. This
+engine walks the tree with os.scandir (in tree order: the entries of
+each directory sorted by name, as 'rg --sort path' does), skips binary
+files by sniffing their first block, and searches each file as one
+buffer: the file is memory-mapped, checked for
+the pattern's literal (when it is a plain string) without decoding, and
+otherwise decoded once and scanned with a single finditer-style loop,
+mapping match offsets back to line numbers. Only lines that contain a
+match are sliced out and checked again on their own, so results are
+those of a line-by-line search (lines are matched without their newline,
+as grep does).
+
+With the trigram index enabled (see trigram_index.py), only the files
+that contain the pattern's required trigrams are searched. With the
+workspace index enabled (see workspace_index.py), directory listings
+come from its in-memory tree instead of the disk.
+
+Files are searched in batches on a process pool when GREP_WORKERS is
+set and the server started the pool (see GrepEngine.start_pool), and
+results are consumed in walk order so the search stops as soon as
+head_limit results are in. There is no cap on the number of files
+searched.
+"""
+
+import concurrent.futures
+import fnmatch
+import functools
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Any, Callable, Iterable, Iterator, Optional, Tuple
+
+import config
+import trigram_index
+import workspace_index
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+
+# Worker processes (0 or 1: search on the calling thread); the pool only
+# runs if the server forks it at startup with start_pool()
+WORKERS = getattr(config, 'GREP_WORKERS', 0)
+# Files larger than this are skipped (and reported)
+MAX_FILE_BYTES = getattr(config, 'GREP_MAX_FILE_BYTES', 50 * 1024 * 1024)
+# Files per task sent to a worker, and a search this small never uses the pool
+BATCH_FILES = 64
+# Bytes sniffed for a NUL byte to recognise binary files
+SNIFF_BYTES = 8192
+
+# (pattern, case_insensitive, multiline, output_mode, before, after, max_results)
+Query = Tuple[str, bool, bool, str, int, int, int]
+
+
+def expand_braces(pattern: str) -> List[str]:
+    """Expand shell braces: '*.{ts,tsx}' -> ['*.ts', '*.tsx'] (nested braces too)."""
+    depth = 0
+    start = None
+    for i, char in enumerate(pattern):
+        if char == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                options, level, current = [], 0, ''
+                for inner in pattern[start + 1:i]:
+                    if inner == ',' and level == 0:
+                        options.append(current)
+                        current = ''
+                        continue
+                    level += inner == '{'
+                    level -= inner == '}'
+                    current += inner
+                options.append(current)
+                if len(options) == 1:
+                    continue
+                head, tail = pattern[:start], pattern[i + 1:]
+                return [expanded for option in options for expanded in expand_braces(head + option + tail)]
+    return [pattern]
+
+
+def compile_file_filter(file_pattern: Optional[str]) -> Optional[Callable[[str], bool]]:
+    """
+    Filter for the grep tool's file_pattern.
+
+    A pattern without '/' matches file names at any depth ('*.py'); one with
+    '/' matches the trailing path components ('src/*.py'), like the old
+    glob('**/' + file_pattern).
+
+    Returns:
+        relative path -> bool, or None to accept every file
+    """
+    if not file_pattern:
+        return None
+    patterns = []
+    for expanded in expand_braces(file_pattern):
+        parts = [part for part in expanded.split('/') if part and part != '**']
+        if parts:
+            patterns.append(parts)
+
+    def matches(rel_path: str) -> bool:
+        components = rel_path.split('/')
+        for parts in patterns:
+            if len(parts) <= len(components) and all(
+                    fnmatch.fnmatchcase(name, part)
+                    for name, part in zip(components[-len(parts):], parts)):
+                return True
+        return False
+
+    return matches
+
+
+def _listing(directory: str, prefix: str, include_hidden: bool,
+             tree: Optional['workspace_index.WorkspaceIndex'] = None) -> List[Tuple[str, str, bool]]:
+    """Sorted (path, relative path, is directory) entries of a directory."""
+    listed = tree.entries(directory) if tree is not None else None
+    try:
+        if listed is None:
+            with os.scandir(directory) as it:
+                listed = list(it)
+    except OSError:
+        return []
+    entries = []
+    for entry in listed:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if not is_dir and not entry.is_file():
+                continue
+        except OSError:
+            continue
+        if entry.name.startswith('.') and (is_dir or not include_hidden):
+            continue
+        entries.append((entry.path, prefix + entry.name, is_dir))
+    # Directory 'b' (and everything in it) comes before 'b.py', as in ripgrep
+    entries.sort(key=lambda item: item[1])
+    return entries
+
+
+def walk_files(root: str, file_filter: Optional[Callable[[str], bool]] = None,
+               include_hidden: bool = False,
+               tree: Optional['workspace_index.WorkspaceIndex'] = None) -> Iterator[str]:
+    """
+    Files under root in tree order (each directory's entries sorted by name).
+
+    Hidden entries are skipped (as glob('**') did) and symlinked
+    directories are not followed.
+
+    Args:
+        root: Directory (or a single file) to walk
+        file_filter: relative path -> bool (optional)
+        include_hidden: Also yield hidden files (never descends into hidden
+            directories)
+        tree: Workspace index to list directories from (default: the
+            global one, when enabled)
+    """
+    if os.path.isfile(root):
+        yield root
+        return
+    tree = workspace_index.lookup(root, tree)
+    stack = [iter(_listing(root, '', include_hidden, tree))]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        path, rel_path, is_dir = item
+        if is_dir:
+            stack.append(iter(_listing(path, rel_path + '/', include_hidden, tree)))
+        elif file_filter is None or file_filter(rel_path):
+            yield path
+
+
+def _longest_literal(items) -> str:
+    """Longest run of literal characters in a parsed regex sequence."""
+    best = current = ''
+    for op, value in items:
+        if op is sre_parse.LITERAL:
+            current += chr(value)
+            best = max(best, current, key=len)
+        else:
+            current = ''
+    return best
+
+
+def _required_literals(parsed) -> Optional[List[str]]:
+    """Strings of which every match contains at least one, if known."""
+    items = list(parsed)
+    if len(items) == 1:
+        op, value = items[0]
+        if op is sre_parse.BRANCH:
+            branches = [_required_literals(branch) for branch in value[1]]
+            if any(not branch for branch in branches):
+                return None
+            return [literal for branch in branches for literal in branch]
+        if op is sre_parse.SUBPATTERN:
+            # (?i:...) groups match other cases than the literal's
+            return None if value[1] & re.IGNORECASE else _required_literals(value[-1])
+    literal = _longest_literal(items)
+    return [literal] if literal else None
+
+
+@functools.lru_cache(maxsize=64)
+def _prepare(pattern: str, case_insensitive: bool, multiline: bool):
+    """
+    Compiled form of a query pattern (cached per process).
+
+    Returns:
+        (literals, scanner, line regex): literals are UTF-8 strings of which
+        every matching file contains one (None if unknown), checked on the
+        raw bytes before decoding; the scanner runs over the whole file and
+        the line regex confirms each candidate line
+    """
+    flags = re.IGNORECASE if case_insensitive else 0
+    if multiline:
+        scanner = re.compile(pattern, flags | re.MULTILINE | re.DOTALL)
+        line_regex = None
+    else:
+        scanner = re.compile(pattern, flags | re.MULTILINE)
+        line_regex = re.compile(pattern, flags)
+    literals = None
+    if not case_insensitive:
+        try:
+            parsed = sre_parse.parse(pattern, flags)
+            required = None if parsed.state.flags & re.IGNORECASE else _required_literals(parsed)
+        except Exception:
+            required = None
+        # Newlines are normalised after decoding, so they cannot be checked on raw bytes
+        if required and not any('\n' in literal or '\r' in literal for literal in required):
+            literals = tuple(literal.encode('utf-8') for literal in required)
+    return literals, scanner, line_regex
+
+
+def _read_text(path: str, literals: Optional[Tuple[bytes, ...]]) -> Tuple[Optional[str], str]:
+    """
+    Decoded content of a text file.
+
+    Returns:
+        (text, status): status is 'ok', 'binary', 'large', 'error' or
+        'no_literal' (none of the literals occurs; the text is not decoded)
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None, 'error'
+    try:
+        head = os.read(fd, SNIFF_BYTES)
+        if b'\0' in head:
+            return None, 'binary'
+        if len(head) < SNIFF_BYTES:
+            # Whole file already read
+            if literals is not None:
+                for literal in literals:
+                    if literal in head:
+                        break
+                else:
+                    return None, 'no_literal'
+            text = head.decode('utf-8', 'ignore')
+        elif os.fstat(fd).st_size > MAX_FILE_BYTES:
+            return None, 'large'
+        else:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                if literals is not None and all(mapped.find(literal) < 0 for literal in literals):
+                    return None, 'no_literal'
+                text = str(mapped, 'utf-8', 'ignore')
+    except (OSError, ValueError):
+        return None, 'error'
+    finally:
+        os.close(fd)
+
+    # The old search read files in text mode (universal newlines)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, 'ok'
+
+
+def _line_end(text: str, pos: int) -> int:
+    """Offset just past the line containing pos (including its newline)."""
+    end = text.find('\n', pos)
+    return len(text) if end < 0 else end + 1
+
+
+def _context_block(text: str, line_start: int, line_number: int, before: int, after: int) -> str:
+    """The matching line with before/after context, in the old '> 12345: line' format."""
+    starts = [line_start]
+    while len(starts) <= before and starts[0] > 0:
+        starts.insert(0, text.rfind('\n', 0, starts[0] - 1) + 1)
+    first_number = line_number - len(starts) + 1
+    position = _line_end(text, line_start)
+    for _ in range(after):
+        if position >= len(text):
+            break
+        starts.append(position)
+        position = _line_end(text, position)
+
+    lines = []
+    for index, start in enumerate(starts):
+        number = first_number + index
+        prefix = ">" if number == line_number else " "
+        lines.append(f"{prefix} {number:5d}: {text[start:_line_end(text, start)].rstrip()}")
+    return '\n'.join(lines)
+
+
+def search_text(text: str, path: str, query: Query) -> Optional[Dict[str, Any]]:
+    """
+    Search decoded file content.
+
+    Returns:
+        {'file', 'count', 'results'} or None without matches; 'count' is
+        the number of matching lines (matches in multiline mode), and
+        'results' holds up to max_results content results
+    """
+    pattern, case_insensitive, multiline, output_mode, before, after, max_results = query
+    _, scanner, line_regex = _prepare(pattern, case_insensitive, multiline)
+    results: List[Dict[str, Any]] = []
+    want_results = output_mode == 'content'
+    first_only = output_mode == 'files_with_matches'
+
+    if multiline:
+        count = 0
+        for match in scanner.finditer(text):
+            count += 1
+            if want_results and len(results) < max_results:
+                results.append({
+                    "file": path,
+                    "line": text.count('\n', 0, match.start()) + 1,
+                    "content": match.group(0)
+                })
+            if first_only:
+                break
+        return {'file': path, 'count': count, 'results': results} if count else None
+
+    # Scan the whole buffer; a match only nominates its line, which is then
+    # checked on its own so results equal a line-by-line search
+    count = 0
+    line_number = 1
+    counted = 0
+    position = 0
+    length = len(text)
+    while True:
+        match = scanner.search(text, position)
+        if match is None:
+            break
+        start = text.rfind('\n', 0, match.start()) + 1
+        if start < position or (start == length and (length == 0 or text[-1] == '\n')):
+            # Empty match at the end of the last line (already checked), or
+            # after the final newline, which is not a line
+            break
+        end = _line_end(text, match.start())
+        position = end
+        # Lines are matched without their newline, as grep does
+        line = text[start:end - 1] if text[end - 1:end] == '\n' else text[start:end]
+        if not line_regex.search(line):
+            continue
+
+        line_number += text.count('\n', counted, start)
+        counted = start
+        count += 1
+        if first_only:
+            break
+        if want_results and len(results) < max_results:
+            if before or after:
+                content = _context_block(text, start, line_number, before, after)
+            else:
+                content = line.rstrip()
+            results.append({"file": path, "line": line_number, "content": content})
+            if output_mode == 'content' and len(results) >= max_results:
+                break
+    return {'file': path, 'count': count, 'results': results} if count else None
+
+
+def search_file(path: str, query: Query) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Search one file; returns (result or None, read status)."""
+    literals = _prepare(*query[:3])[0]
+    text, status = _read_text(path, literals)
+    if text is None:
+        return None, status
+    return search_text(text, path, query), status
+
+
+def _search_batch(paths: List[str], query: Query) -> List[Tuple[Optional[Dict[str, Any]], str]]:
+    """Worker task: search a batch of files."""
+    return [search_file(path, query) for path in paths]
+
+
+class GrepEngine:
+    """Searches file trees for the grep tool, on a process pool when one helps."""
+
+    def __init__(self, workers: int = WORKERS, batch_files: int = BATCH_FILES,
+                 index: Optional['trigram_index.TrigramIndex'] = None,
+                 tree: Optional['workspace_index.WorkspaceIndex'] = None):
+        """
+        Initialize grep engine.
+
+        Args:
+            workers: Worker processes, forked by start_pool() (0 or 1:
+                search on the calling thread)
+            batch_files: Files per worker task
+            index: Trigram index narrowing the files searched (default: the
+                global index when TRIGRAM_INDEX_ENABLED is set)
+            tree: Workspace index the tree is walked in (default: the global
+                index when WORKSPACE_INDEX_ENABLED is set)
+        """
+        self.workers = workers
+        self.batch_files = batch_files
+        self.index = index
+        self.tree = tree
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {'searches': 0, 'files_searched': 0, 'files_skipped': 0,
+                      'pool_searches': 0, 'stopped_early': 0, 'indexed_searches': 0}
+
+    def start_pool(self) -> bool:
+        """
+        Fork the worker processes. Call once at startup, before any thread runs.
+
+        A process forked while other threads hold locks (logging, the
+        database writer, the MCP loop) can deadlock in the child, so the pool
+        is never created on demand from a request thread: without
+        start_pool() files are searched on the calling thread. Fork server
+        and spawn workers are not used either, as they re-import the main
+        module (app.py and its global services) in every worker.
+
+        Returns:
+            True if the pool is running
+        """
+        if self.workers <= 1:
+            return False
+        with self._lock:
+            if self._pool is not None:
+                return True
+            if 'fork' not in multiprocessing.get_all_start_methods():
+                logger.warning("Grep process pool needs fork, searching in-process")
+                self.workers = 0
+                return False
+            if threading.active_count() > 1:
+                logger.warning("Grep process pool started while other threads are running")
+            try:
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('fork')
+                )
+                # Fork workers are all started by the first task: start them now
+                pool.submit(int).result()
+            except (OSError, ValueError, BrokenProcessPool) as e:
+                logger.warning(f"Grep process pool unavailable ({e}), searching in-process")
+                self.workers = 0
+                return False
+            self._pool = pool
+            return True
+
+    def _get_pool(self) -> Optional[concurrent.futures.ProcessPoolExecutor]:
+        return self._pool
+
+    def _drop_pool(self):
+        # The pool cannot be forked again safely once the server runs threads
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+                self.workers = 0
+
+    def iter_file_results(self, files: Iterable[str], query: Query) -> Iterator[Tuple[Optional[Dict[str, Any]], str]]:
+        """
+        Search files, yielding (result, status) per file in input order.
+
+        The caller may stop iterating at any time; batches not yet started
+        are cancelled.
+        """
+        files = iter(files)
+        batch: List[str] = []
+        for path in files:
+            batch.append(path)
+            if len(batch) >= self.batch_files:
+                break
+        pool = self._get_pool() if len(batch) >= self.batch_files else None
+        if pool is None:
+            # Small search (or no pool): not worth the round trips
+            for path in batch:
+                yield search_file(path, query)
+            for path in files:
+                yield search_file(path, query)
+            return
+
+        with self._lock:
+            self.stats['pool_searches'] += 1
+        in_flight: deque = deque()
+        window = self.workers * 2
+        try:
+            in_flight.append(pool.submit(_search_batch, batch, query))
+            exhausted = False
+            while in_flight:
+                while not exhausted and len(in_flight) < window:
+                    batch = [path for _, path in zip(range(self.batch_files), files)]
+                    if not batch:
+                        exhausted = True
+                        break
+                    in_flight.append(pool.submit(_search_batch, batch, query))
+                yield from in_flight.popleft().result()
+        except BrokenProcessPool:
+            logger.warning("Grep worker pool broke, searching in-process from now on")
+            self._drop_pool()
+            raise
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _indexed_files(self, path: str, pattern: str, case_insensitive: bool,
+                       file_filter: Optional[Callable[[str], bool]],
+                       include_hidden: bool) -> Optional[List[str]]:
+        """Candidate files from the trigram index, or None to walk the tree."""
+        index = self.index
+        if index is None and trigram_index.ENABLED:
+            index = trigram_index.get_trigram_index()
+        if index is None:
+            return None
+        try:
+            files = index.candidates(path, pattern, case_insensitive, file_filter, include_hidden)
+        except Exception as e:
+            logger.warning(f"Trigram index lookup failed ({e}), walking the tree")
+            return None
+        if files is not None:
+            with self._lock:
+                self.stats['indexed_searches'] += 1
+        return files
+
+    def search(self, pattern: str, path: str, file_pattern: Optional[str] = None,
+               case_insensitive: bool = False, output_mode: str = 'files_with_matches',
+               context: Optional[int] = None, after_context: Optional[int] = None,
+               before_context: Optional[int] = None, multiline: bool = False,
+               head_limit: int = 100) -> Dict[str, Any]:
+        """
+        Run a grep tool call.
+
+        Args:
+            pattern: Regular expression
+            path: Absolute file or directory to search
+            file_pattern: Glob for file names, braces allowed ('*.{ts,tsx}')
+            case_insensitive: Ignore case
+            output_mode: 'files_with_matches', 'count' or 'content'
+            context: Lines of context around content results
+            after_context: Lines after (overrides context)
+            before_context: Lines before (overrides context)
+            multiline: Let the pattern span lines (re.MULTILINE | re.DOTALL)
+            head_limit: Maximum files (or content results) returned
+
+        Returns:
+            The grep tool result; 'limit_reached' is set when the search
+            stopped at head_limit and more matches may exist. 'count'
+            ('total_files' in count mode) counts the files or results
+            returned, not every match in the tree
+
+        Raises:
+            re.error: If the pattern is invalid
+        """
+        head_limit = max(1, int(head_limit or 100))
+        before = int(before_context if before_context is not None else (context or 0))
+        after = int(after_context if after_context is not None else (context or 0))
+        # Compile here so an invalid pattern fails before any file is read
+        _prepare(pattern, bool(case_insensitive), bool(multiline))
+        query: Query = (pattern, bool(case_insensitive), bool(multiline), output_mode, before, after, head_limit)
+
+        file_filter = compile_file_filter(file_pattern)
+        include_hidden = bool(file_pattern) and file_pattern.startswith('.')
+        files = self._indexed_files(path, pattern, bool(case_insensitive), file_filter, include_hidden)
+        if files is None:
+            files = walk_files(path, file_filter, include_hidden, self.tree)
+
+        matched: List[Dict[str, Any]] = []
+        results: List[Dict[str, Any]] = []
+        searched = skipped = 0
+        limit_reached = False
+        file_results = self.iter_file_results(files, query)
+        try:
+            for result, status in file_results:
+                searched += 1
+                if status in ('binary', 'large', 'error'):
+                    skipped += 1
+                if result is None:
+                    continue
+                matched.append(result)
+                if output_mode == 'content':
+                    results.extend(result['results'][:head_limit - len(results)])
+                    if len(results) >= head_limit:
+                        limit_reached = True
+                        break
+                elif len(matched) >= head_limit:
+                    limit_reached = True
+                    break
+        finally:
+            file_results.close()
+
+        with self._lock:
+            self.stats['searches'] += 1
+            self.stats['files_searched'] += searched
+            self.stats['files_skipped'] += skipped
+            self.stats['stopped_early'] += limit_reached
+
+        if output_mode == 'files_with_matches':
+            response = {"success": True, "files": [m['file'] for m in matched], "count": len(matched)}
+        elif output_mode == 'count':
+            response = {
+                "success": True,
+                "results": [{"file": m['file'], "matches": m['count']} for m in matched],
+                "total_files": len(matched)
+            }
+        else:
+            response = {"success": True, "results": results, "count": len(results)}
+        if limit_reached:
+            response['limit_reached'] = True
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Search counters."""
+        with self._lock:
+            return {**self.stats, 'workers': self.workers}
+
+
+# Global instance
+_engine = None
+
+
+def get_grep_engine() -> GrepEngine:
+    """Get the global grep engine instance."""
+    global _engine
+    if _engine is None:
+        _engine = GrepEngine()
+    return _engine
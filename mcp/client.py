@@ -4,11 +4,14 @@ Handles connection, tool discovery, and tool execution.
 """
 
 import asyncio
+import logging
 import uuid
 from typing import Dict, Any, List, Optional
 from mcp.transport import MCPTransport
 
 
+logger = logging.getLogger(__name__)
+
 class MCPClient:
     """MCP protocol client."""
 
@@ -25,6 +28,11 @@ class MCPClient:
         self.connected = False
         self.tools = []
         self.server_info = {}
+        # Set when the server sends notifications/tools/list_changed
+        self.tools_changed = False
+        # Serializes requests: each one sends and then reads its response
+        # from the shared transport (see MCPServerManager.call_tool_async)
+        self.lock = asyncio.Lock()
 
     async def connect(self):
         """Establish connection and initialize."""
@@ -48,7 +56,7 @@ class MCPClient:
         }
 
         await self.transport.send(init_request)
-        response = await self.transport.receive()
+        response = await self._receive_response(init_request["id"])
 
         if "error" in response:
             raise RuntimeError(f"Initialize failed: {response['error']}")
@@ -68,14 +76,39 @@ class MCPClient:
             "params": {}
         }
 
+        self.tools_changed = False
         await self.transport.send(tools_request)
-        response = await self.transport.receive()
+        response = await self._receive_response(tools_request["id"])
 
         if "error" in response:
             raise RuntimeError(f"Tool discovery failed: {response['error']}")
 
         self.tools = response.get("result", {}).get("tools", [])
 
+    async def _receive_response(self, request_id: str) -> Dict[str, Any]:
+        """
+        Receive the response to a request, handling notifications sent before it.
+
+        Responses to other requests are dropped: a request that timed out or
+        was cancelled leaves its late response in the transport.
+
+        Args:
+            request_id: ID of the request sent
+
+        Returns:
+            The response with that ID
+        """
+        while True:
+            message = await self.transport.receive()
+            if "id" in message or "method" not in message:
+                if message.get("id") in (request_id, None):
+                    return message
+                logger.warning(f"MCP server {self.server_name}: dropped stale response "
+                               f"(id {message.get('id')}, waiting for {request_id})")
+                continue
+            if message["method"] == "notifications/tools/list_changed":
+                self.tools_changed = True
+
     async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
         """
         Execute a tool call.
@@ -101,7 +134,7 @@ class MCPClient:
         }
 
         await self.transport.send(call_request)
-        response = await self.transport.receive()
+        response = await self._receive_response(call_request["id"])
 
         if "error" in response:
             error = response["error"]
@@ -5,6 +5,7 @@ Manages multiple MCP server connections.
 
 import asyncio
 import logging
+import threading
 from typing import Dict, List, Optional, Any
 from mcp.client import MCPClient
 from mcp.transport import create_transport
@@ -33,18 +34,34 @@ class MCPServerManager:
 
         self.clients: Dict[int, MCPClient] = {}  # server_id -> client
         self.server_names: Dict[str, int] = {}  # server_name -> server_id
+        # Bumped whenever the set of MCP tools may have changed
+        self.tools_version = 0
+        # Event loop the MCP clients live on: a dedicated thread's, or the
+        # asyncio serving mode's (see start_all_servers_async)
         self.loop = None
+        self._loop_thread = None
+        self._loop_guard = threading.Lock()
         self._initialized = True
 
     def _get_or_create_loop(self):
-        """Get or create event loop."""
-        if self.loop is None or self.loop.is_closed():
-            try:
-                self.loop = asyncio.get_event_loop()
-            except RuntimeError:
+        """Get the clients' event loop, starting it on its own thread if needed."""
+        with self._loop_guard:
+            if self.loop is None or self.loop.is_closed():
                 self.loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(self.loop)
-        return self.loop
+                self._loop_thread = threading.Thread(
+                    target=self.loop.run_forever, name='mcp-loop', daemon=True)
+                self._loop_thread.start()
+            return self.loop
+
+    def _run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the clients' loop from any other thread and wait for it."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_or_create_loop())
+        try:
+            return future.result(timeout=timeout)
+        except BaseException:
+            # Timed out or interrupted: don't leave the call running on the loop
+            future.cancel()
+            raise
 
     async def _start_server(self, server_config: Dict[str, Any]) -> bool:
         """
@@ -83,6 +100,7 @@ class MCPServerManager:
             # Store client
             self.clients[server_id] = client
             self.server_names[server_name] = server_id
+            self.tools_version += 1
 
             # Update status
             tools = [tool['name'] for tool in client.tools]
@@ -109,42 +127,29 @@ class MCPServerManager:
                     del self.server_names[name]
                     break
 
+            self.tools_version += 1
             update_server_status(server_id, 'disconnected')
 
     def start_all_servers(self):
         """Start all enabled MCP servers."""
-        loop = self._get_or_create_loop()
-
         servers = get_mcp_servers(enabled_only=True)
 
         async def start_all():
             tasks = [self._start_server(server) for server in servers]
             await asyncio.gather(*tasks, return_exceptions=True)
 
-        if loop.is_running():
-            # If loop is already running, schedule the coroutine
-            asyncio.create_task(start_all())
-        else:
-            # Run in the loop
-            loop.run_until_complete(start_all())
+        self._run(start_all())
 
     def stop_all_servers(self):
         """Stop all MCP servers."""
-        loop = self._get_or_create_loop()
-
         async def stop_all():
             tasks = [self._stop_server(sid) for sid in list(self.clients.keys())]
             await asyncio.gather(*tasks, return_exceptions=True)
 
-        if loop.is_running():
-            asyncio.create_task(stop_all())
-        else:
-            loop.run_until_complete(stop_all())
+        self._run(stop_all())
 
     def restart_server(self, server_id: int) -> bool:
         """Restart a specific MCP server."""
-        loop = self._get_or_create_loop()
-
         async def restart():
             await self._stop_server(server_id)
             from mcp_database import get_mcp_server
@@ -153,11 +158,7 @@ class MCPServerManager:
                 return await self._start_server(server_config)
             return False
 
-        if loop.is_running():
-            future = asyncio.run_coroutine_threadsafe(restart(), loop)
-            return future.result(timeout=30)
-        else:
-            return loop.run_until_complete(restart())
+        return self._run(restart(), timeout=30)
 
     def get_all_tools(self) -> List[Dict[str, Any]]:
         """Get all tools from all connected servers."""
@@ -168,9 +169,51 @@ class MCPServerManager:
 
         return all_tools
 
+    def get_tools_by_server(self) -> Dict[int, List[Dict[str, Any]]]:
+        """Get tool definitions of each connected server, by server ID."""
+        return {server_id: client.get_tool_definitions()
+                for server_id, client in list(self.clients.items())}
+
+    async def _refresh_tools(self, client: MCPClient):
+        """Re-discover a server's tools after it reported a tools/list change."""
+        if not client.tools_changed:
+            return
+        try:
+            await client.discover_tools()
+        except Exception as e:
+            logger.error(f"Failed to refresh tools of MCP server {client.server_name}: {e}")
+            return
+        self.tools_version += 1
+        server_id = self.server_names.get(client.server_name)
+        if server_id is not None:
+            update_server_status(server_id, 'connected', [tool['name'] for tool in client.tools])
+        logger.info(f"MCP server {client.server_name} tools changed ({len(client.tools)} tools)")
+
+    def _get_client(self, tool_name: str) -> MCPClient:
+        """Get the connected client serving an MCP tool name."""
+        if ':' not in tool_name:
+            raise ValueError(f"Invalid MCP tool name: {tool_name}")
+
+        server_name = tool_name.split(':', 1)[0]
+
+        if server_name not in self.server_names:
+            raise ValueError(f"MCP server not found: {server_name}")
+
+        server_id = self.server_names[server_name]
+        client = self.clients.get(server_id)
+
+        if not client:
+            raise RuntimeError(f"MCP server not connected: {server_name}")
+
+        return client
+
     def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
         """
-        Call an MCP tool.
+        Call an MCP tool from a worker thread.
+
+        The call runs on the clients' event loop, so calls to different
+        servers proceed concurrently; calls to the same server are
+        serialized by call_tool_async.
 
         Args:
             tool_name: Tool name in format "server:tool"
@@ -179,30 +222,43 @@ class MCPServerManager:
         Returns:
             Tool execution result
         """
-        if ':' not in tool_name:
-            raise ValueError(f"Invalid MCP tool name: {tool_name}")
+        return self._run(self.call_tool_async(tool_name, arguments))
 
-        server_name, actual_tool_name = tool_name.split(':', 1)
+    async def start_all_servers_async(self):
+        """
+        Start all enabled MCP servers on the running event loop.
 
-        if server_name not in self.server_names:
-            raise ValueError(f"MCP server not found: {server_name}")
+        Used by the asyncio serving mode: the loop becomes the manager's
+        loop, so later calls can await MCP clients directly.
+        """
+        with self._loop_guard:
+            self.loop = asyncio.get_running_loop()
+        servers = get_mcp_servers(enabled_only=True)
+        await asyncio.gather(*[self._start_server(server) for server in servers],
+                             return_exceptions=True)
 
-        server_id = self.server_names[server_name]
-        client = self.clients.get(server_id)
+    async def call_tool_async(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        """
+        Call an MCP tool on the clients' event loop.
 
-        if not client:
-            raise RuntimeError(f"MCP server not connected: {server_name}")
+        Calls to the same server are serialized, since an MCP client sends a
+        request and then reads the next response from its transport.
 
-        loop = self._get_or_create_loop()
+        Args:
+            tool_name: Tool name in format "server:tool"
+            arguments: Tool arguments
 
-        async def call():
-            return await client.call_tool(actual_tool_name, arguments)
+        Returns:
+            Tool execution result
+        """
+        client = self._get_client(tool_name)
+        actual_tool_name = tool_name.split(':', 1)[1]
 
-        if loop.is_running():
-            future = asyncio.run_coroutine_threadsafe(call(), loop)
-            return future.result(timeout=60)
-        else:
-            return loop.run_until_complete(call())
+        async with client.lock:
+            try:
+                return await asyncio.wait_for(client.call_tool(actual_tool_name, arguments), timeout=60)
+            finally:
+                await self._refresh_tools(client)
 
     def is_mcp_tool(self, tool_name: str) -> bool:
         """Check if a tool name is an MCP tool."""
@@ -7,6 +7,8 @@ import json
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 
+import memory_index
+
 
 def get_db_connection():
     """Get database connection."""
@@ -118,6 +120,7 @@ def add_memory_entry(username: str, memory_type: str, content: str,
     conn.commit()
     conn.close()
 
+    memory_index.get_memory_index().on_write(memory_id, username)
     return memory_id
 
 
@@ -155,6 +158,22 @@ def get_memory_entries(username: str, memory_type: str = None,
     return entries
 
 
+def get_all_memory_entries(username: str) -> List[Dict]:
+    """Get all memory entries for a user (used to build the retrieval index)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute('''
+        SELECT id, memory_type, title, content, importance, created_at
+        FROM memory_entries
+        WHERE username = ?
+    ''', (username,))
+
+    entries = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return entries
+
+
 def get_memory_entry(memory_id: int, username: str = None) -> Optional[Dict]:
     """Get a specific memory entry by ID."""
     conn = get_db_connection()
@@ -209,7 +228,6 @@ def update_memory_entry(memory_id: int, username: str = None, **kwargs) -> bool:
     values.append(memory_id)
 
     if username:
-        fields.append('username = ?')
         values.append(username)
 
     query = f"UPDATE memory_entries SET {', '.join(fields)} WHERE id = ?"
@@ -217,6 +235,7 @@ def update_memory_entry(memory_id: int, username: str = None, **kwargs) -> bool:
         query += " AND username = ?"
 
     cursor.execute(query, values)
+    affected = cursor.rowcount
 
     # Update tags table
     if 'tags' in kwargs and kwargs['tags'] is not None:
@@ -228,9 +247,10 @@ def update_memory_entry(memory_id: int, username: str = None, **kwargs) -> bool:
             ''', (memory_id, tag))
 
     conn.commit()
-    affected = cursor.rowcount
     conn.close()
 
+    if affected > 0:
+        memory_index.get_memory_index().on_write(memory_id, username)
     return affected > 0
 
 
@@ -249,6 +269,8 @@ def delete_memory_entry(memory_id: int, username: str = None) -> bool:
     affected = cursor.rowcount
     conn.close()
 
+    if affected > 0:
+        memory_index.get_memory_index().on_delete(memory_id)
     return affected > 0
 
 
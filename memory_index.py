@@ -0,0 +1,371 @@
+"""
+In-memory retrieval index over users' memory entries.
+
+Each chat turn picks the memory entries most relevant to the user's
+message and renders them into a section placed in front of that message
+(see prompt_cache.attach_memory). Scoring combines a BM25-style text
+match (words, plus character bigrams for CJK text), the entry's
+importance and its age. The per-user index is built from the
+database on first use and then kept current by the memory_database write
+functions, so a retrieval only touches the postings of the message's
+rarest terms and stays in the low milliseconds with tens of thousands of
+entries.
+
+Another server process (e.g. async_server.py) does not see those writes,
+so an index is also reloaded once it is older than MAX_AGE seconds. The
+reload reads and builds the new index without holding the lock other
+turns search under: they keep using the old index meanwhile, and writes
+made during the reload are applied to the new one before it is swapped in.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Tuple
+
+import config
+import memory_database
+from context_compactor import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+ENABLED = getattr(config, 'MEMORY_RETRIEVAL_ENABLED', True)
+# Entries injected per turn, and their total token budget
+TOP_K = getattr(config, 'MEMORY_TOP_K', 8)
+TOKEN_BUDGET = getattr(config, 'MEMORY_TOKEN_BUDGET', 1500)
+# Entries at or above this importance are candidates even without a text match
+PIN_IMPORTANCE = getattr(config, 'MEMORY_PIN_IMPORTANCE', 5)
+# Seconds before an index is reloaded from the database
+MAX_AGE = getattr(config, 'MEMORY_INDEX_MAX_AGE', 300)
+
+# Score weights (text match, importance, recency) and recency half-life
+TEXT_WEIGHT = 0.6
+IMPORTANCE_WEIGHT = 0.25
+RECENCY_WEIGHT = 0.15
+HALF_LIFE_DAYS = 30.0
+# Query terms used (rarest first), and the document frequency ratio above
+# which a term is too common to be worth scoring
+MAX_QUERY_TERMS = 32
+MAX_DF_RATIO = 0.05
+# Characters of an entry's content shown in the prompt
+SNIPPET_CHARS = 300
+
+_TOKEN_RE = re.compile(r'[a-z0-9_]{2,}|[\u3400-\u9fff]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of two or more characters, and CJK runs as bigrams."""
+    terms = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if word[0] >= '\u3400':
+            if len(word) == 1:
+                terms.append(word)
+            else:
+                terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            terms.append(word)
+    return terms
+
+
+def _timestamp(value: Any) -> float:
+    if not value:
+        return time.time()
+    try:
+        parsed = datetime.fromisoformat(str(value).replace(' ', 'T'))
+    except ValueError:
+        return time.time()
+    # SQLite CURRENT_TIMESTAMP is UTC
+    return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class _Entry:
+    __slots__ = ('id', 'importance', 'created', 'tf', 'length', 'rendered', 'tokens')
+
+    def __init__(self, row: Dict[str, Any]):
+        self.id = row['id']
+        self.importance = row.get('importance') or 1
+        self.created = _timestamp(row.get('created_at'))
+        title = row.get('title') or ''
+        content = row.get('content') or ''
+        # Title terms count twice
+        self.tf = Counter(tokenize(title) * 2 + tokenize(content))
+        self.length = sum(self.tf.values())
+
+        snippet = content[:SNIPPET_CHARS] + ('…' if len(content) > SNIPPET_CHARS else '')
+        date = datetime.fromtimestamp(self.created).strftime('%Y-%m-%d')
+        label = f"{title} " if title else ''
+        self.rendered = f"- {label}({row.get('memory_type')}, {date}): {snippet}"
+        self.tokens = estimate_tokens(self.rendered)
+
+
+def _base_score(entry: _Entry, now: float) -> float:
+    """Importance and recency part of an entry's score."""
+    importance = (min(max(entry.importance, 1), 5) - 1) / 4
+    recency = 0.5 ** (max(0.0, now - entry.created) / 86400 / HALF_LIFE_DAYS)
+    return IMPORTANCE_WEIGHT * importance + RECENCY_WEIGHT * recency
+
+
+class UserMemoryIndex:
+    """Inverted index over one user's memory entries."""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.entries: Dict[int, _Entry] = {}
+        # term -> {memory id: term frequency}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # IDs of entries important enough to be candidates without a text match,
+        # and the same IDs best first by importance and age (built on demand)
+        self.pinned = set()
+        self._pinned_recent: Optional[List[int]] = None
+        self.total_length = 0
+        self.loaded_at = time.monotonic()
+        for row in rows:
+            self.add(row)
+
+    def add(self, row: Dict[str, Any]):
+        """Add or replace an entry."""
+        self.remove(row['id'])
+        entry = _Entry(row)
+        self.entries[entry.id] = entry
+        if entry.importance >= PIN_IMPORTANCE:
+            self.pinned.add(entry.id)
+            self._pinned_recent = None
+        self.total_length += entry.length
+        for term, count in entry.tf.items():
+            self.postings.setdefault(term, {})[entry.id] = count
+
+    def remove(self, memory_id: int):
+        """Remove an entry if present."""
+        entry = self.entries.pop(memory_id, None)
+        if entry is None:
+            return
+        if memory_id in self.pinned:
+            self.pinned.discard(memory_id)
+            self._pinned_recent = None
+        self.total_length -= entry.length
+        for term in entry.tf:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(memory_id, None)
+                if not posting:
+                    del self.postings[term]
+
+    def search(self, query: str, top_k: int = TOP_K,
+               token_budget: int = TOKEN_BUDGET) -> List[Tuple[float, _Entry]]:
+        """
+        Rank entries for a query.
+
+        Args:
+            query: User message
+            top_k: Maximum number of entries
+            token_budget: Maximum estimated tokens of the rendered entries
+
+        Returns:
+            (score, entry) pairs, best first
+        """
+        count = len(self.entries)
+        if not count:
+            return []
+
+        # Rarest query terms first; very common terms carry no signal
+        max_df = max(20, int(count * MAX_DF_RATIO))
+        terms = [term for term in set(tokenize(query)) if 0 < len(self.postings.get(term, ())) <= max_df]
+        terms.sort(key=lambda term: len(self.postings[term]))
+        terms = terms[:MAX_QUERY_TERMS]
+
+        # BM25 term scores accumulated over the postings
+        text_scores: Dict[int, float] = {}
+        max_text = 0.0
+        avg_length = self.total_length / count or 1.0
+        for term in terms:
+            posting = self.postings[term]
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            max_text += idf
+            for memory_id, tf in posting.items():
+                norm = tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * self.entries[memory_id].length / avg_length))
+                text_scores[memory_id] = text_scores.get(memory_id, 0.0) + idf * norm
+
+        # Without a text match, a pinned entry's score only depends on its
+        # importance and age, so only the best few can make the cut
+        now = time.time()
+        if self._pinned_recent is None:
+            self._pinned_recent = sorted(self.pinned, reverse=True,
+                                         key=lambda memory_id: _base_score(self.entries[memory_id], now))
+        candidates = set(text_scores)
+        candidates.update(self._pinned_recent[:top_k * 4])
+        if not candidates:
+            return []
+
+        scored = []
+        for memory_id in candidates:
+            entry = self.entries[memory_id]
+            text = min(1.0, text_scores.get(memory_id, 0.0) / (2.2 * max_text)) if max_text else 0.0
+            scored.append((TEXT_WEIGHT * text + _base_score(entry, now), entry))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+
+        selected = []
+        tokens = 0
+        for score, entry in scored:
+            if len(selected) >= top_k:
+                break
+            if tokens + entry.tokens > token_budget:
+                continue
+            selected.append((score, entry))
+            tokens += entry.tokens
+        return selected
+
+
+class _Load:
+    """A user's index being (re)loaded, and the writes made meanwhile."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        # (memory id, row to add or None to remove), in write order
+        self.changes: List[Tuple[int, Optional[Dict[str, Any]]]] = []
+
+
+class MemoryIndex:
+    """Per-user memory indexes, loaded lazily and updated on writes."""
+
+    def __init__(self, max_age: float = MAX_AGE):
+        """
+        Initialize memory index.
+
+        Args:
+            max_age: Seconds before a user's index is reloaded from the database
+        """
+        self.max_age = max_age
+        self._users: Dict[str, UserMemoryIndex] = {}
+        self._loading: Dict[str, _Load] = {}
+        self._lock = threading.Lock()
+        self.stats = {'searches': 0, 'loads': 0, 'search_ms': 0.0}
+
+    def _get(self, username: str) -> UserMemoryIndex:
+        while True:
+            with self._lock:
+                index = self._users.get(username)
+                load = self._loading.get(username)
+                if index is not None and (load is not None or
+                                          time.monotonic() - index.loaded_at <= self.max_age):
+                    # Fresh, or being reloaded by another turn: use it meanwhile
+                    return index
+                if load is None:
+                    load = self._loading[username] = _Load()
+                    break
+            # First load of this user in progress on another thread
+            load.done.wait()
+
+        try:
+            index = UserMemoryIndex(memory_database.get_all_memory_entries(username))
+            with self._lock:
+                for memory_id, row in load.changes:
+                    if row is None:
+                        index.remove(memory_id)
+                    else:
+                        index.add(row)
+                self._users[username] = index
+                self.stats['loads'] += 1
+            return index
+        finally:
+            with self._lock:
+                del self._loading[username]
+            load.done.set()
+
+    def on_write(self, memory_id: int, username: Optional[str] = None):
+        """
+        Reflect an added or updated entry in a loaded index.
+
+        Called by memory_database after the write is committed; users whose
+        index is not loaded yet are skipped (the next load reads the entry).
+
+        Args:
+            memory_id: Entry ID
+            username: Owner, looked up when not given
+        """
+        if username is not None and username not in self._users and username not in self._loading:
+            return
+        row = memory_database.get_memory_entry(memory_id, username)
+        if row is None:
+            return
+        with self._lock:
+            load = self._loading.get(row['username'])
+            if load is not None:
+                load.changes.append((memory_id, row))
+            index = self._users.get(row['username'])
+            if index is not None:
+                index.add(row)
+
+    def on_delete(self, memory_id: int):
+        """Remove a deleted entry from whichever loaded index holds it."""
+        with self._lock:
+            for load in self._loading.values():
+                load.changes.append((memory_id, None))
+            for index in self._users.values():
+                index.remove(memory_id)
+
+    def retrieve(self, username: str, query: str) -> List[Dict[str, Any]]:
+        """
+        Pick the memory entries to show for a user message.
+
+        Returns:
+            [{'id', 'score', 'text', 'tokens'}], best first
+        """
+        started = time.perf_counter()
+        index = self._get(username)
+        with self._lock:
+            results = index.search(query)
+        self.stats['searches'] += 1
+        self.stats['search_ms'] = round(self.stats['search_ms'] + (time.perf_counter() - started) * 1000, 2)
+        return [{'id': entry.id, 'score': round(score, 4), 'text': entry.rendered, 'tokens': entry.tokens}
+                for score, entry in results]
+
+    def render_for_prompt(self, username: str, query: str) -> str:
+        """
+        Render the relevant memories as a prompt section.
+
+        Entries are listed in ID order, so the same selection always gives
+        the same text (and the same prompt cache prefix).
+
+        Returns:
+            Section text, or "" when nothing is relevant
+        """
+        if not ENABLED or not query:
+            return ""
+        try:
+            results = self.retrieve(username, query)
+        except Exception as e:
+            # 记忆只是补充信息，检索失败不影响本轮对话
+            logger.warning("Memory retrieval failed for %s: %s", username, e)
+            return ""
+        if not results:
+            return ""
+        lines = [result['text'] for result in sorted(results, key=lambda result: result['id'])]
+        return "# 相关记忆\n以下是与当前请求相关的用户记忆，仅在相关时参考：\n" + "\n".join(lines)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Search counters and index sizes."""
+        with self._lock:
+            searches = self.stats['searches']
+            return {
+                **self.stats,
+                'avg_search_ms': round(self.stats['search_ms'] / searches, 3) if searches else None,
+                'users': len(self._users),
+                'entries': sum(len(index.entries) for index in self._users.values())
+            }
+
+
+# Global instance
+_index = None
+
+
+def get_memory_index() -> MemoryIndex:
+    """Get the global memory index instance."""
+    global _index
+    if _index is None:
+        _index = MemoryIndex()
+    return _index
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+本地模拟 Anthropic Messages API（用于压力测试和容量规划）
+
+提供 POST /v1/messages，按脚本流式返回文本或 tool_use 响应，可配置 token 速率、
+首字节延迟和回答长度。把被测服务器的 ANTHROPIC_BASE_URL 指向它即可，不需要真实 API。
+
+脚本:
+    text   每次调用都直接回答文本
+    tools  用户消息后先调用工具（默认 list_directory，只读，无需批准），
+           收到工具结果后再回答文本；每轮对话两次模型调用
+
+用法:
+    python mock_anthropic.py --port 8090 --script tools --rate 50 --tokens 200
+    # config.py: ANTHROPIC_BASE_URL = "http://127.0.0.1:8090"
+"""
+
+import argparse
+import asyncio
+import json
+import uuid
+
+from aiohttp import web
+
+
+def _sse(event_type, data):
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
+
+
+def _has_tool_result(message):
+    content = message.get('content')
+    return isinstance(content, list) and any(
+        isinstance(block, dict) and block.get('type') == 'tool_result' for block in content
+    )
+
+
+def plan_response(app, body):
+    """根据脚本和对话决定本次调用返回的内容：(文本, tool_use 或 None)"""
+    messages = body.get('messages') or []
+    last = messages[-1] if messages else {}
+    if app['script'] == 'tools' and not _has_tool_result(last):
+        return 'Let me check the workspace.', {
+            'id': f'toolu_{uuid.uuid4().hex[:20]}',
+            'name': app['tool_name'],
+            'input': app['tool_input']
+        }
+    words = [f'token{i} ' for i in range(app['tokens'])]
+    return words, None
+
+
+async def messages(request):
+    """模拟 /v1/messages：流式（stream=true）或一次性返回"""
+    app = request.app
+    body = await request.json()
+    app['stats']['requests'] += 1
+    text, tool_use = plan_response(app, body)
+    chunks = text if isinstance(text, list) else [text]
+    usage = {'input_tokens': 1000, 'output_tokens': len(chunks)}
+
+    await asyncio.sleep(app['ttfb'])
+
+    if not body.get('stream'):
+        content = [{'type': 'text', 'text': ''.join(chunks)}]
+        if tool_use:
+            content.append({'type': 'tool_use', **tool_use})
+        return web.json_response({
+            'id': f'msg_{uuid.uuid4().hex[:20]}', 'type': 'message', 'role': 'assistant',
+            'content': content, 'model': body.get('model'),
+            'stop_reason': 'tool_use' if tool_use else 'end_turn', 'stop_sequence': None,
+            'usage': usage
+        })
+
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+    await response.prepare(request)
+    app['stats']['streams'] += 1
+    try:
+        await response.write(_sse('message_start', {
+            'type': 'message_start',
+            'message': {
+                'id': f'msg_{uuid.uuid4().hex[:20]}', 'type': 'message', 'role': 'assistant',
+                'content': [], 'model': body.get('model'), 'stop_reason': None,
+                'stop_sequence': None, 'usage': {'input_tokens': usage['input_tokens'], 'output_tokens': 1}
+            }
+        }))
+        await response.write(_sse('content_block_start', {
+            'type': 'content_block_start', 'index': 0,
+            'content_block': {'type': 'text', 'text': ''}
+        }))
+        for chunk in chunks:
+            await asyncio.sleep(1.0 / app['rate'])
+            await response.write(_sse('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0,
+                'delta': {'type': 'text_delta', 'text': chunk}
+            }))
+        await response.write(_sse('content_block_stop', {'type': 'content_block_stop', 'index': 0}))
+
+        if tool_use:
+            await response.write(_sse('content_block_start', {
+                'type': 'content_block_start', 'index': 1,
+                'content_block': {'type': 'tool_use', 'id': tool_use['id'], 'name': tool_use['name'], 'input': {}}
+            }))
+            await asyncio.sleep(1.0 / app['rate'])
+            await response.write(_sse('content_block_delta', {
+                'type': 'content_block_delta', 'index': 1,
+                'delta': {'type': 'input_json_delta', 'partial_json': json.dumps(tool_use['input'])}
+            }))
+            await response.write(_sse('content_block_stop', {'type': 'content_block_stop', 'index': 1}))
+
+        await response.write(_sse('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'tool_use' if tool_use else 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': usage['output_tokens']}
+        }))
+        await response.write(_sse('message_stop', {'type': 'message_stop'}))
+    finally:
+        app['stats']['streams'] -= 1
+    return response
+
+
+async def stats(request):
+    """GET /stats - 请求总数和当前打开的流数量"""
+    return web.json_response(request.app['stats'])
+
+
+def create_app(script='text', tokens=100, rate=50.0, ttfb=0.2,
+               tool_name='list_directory', tool_input=None):
+    """
+    创建模拟服务器应用
+
+    Args:
+        script: text 或 tools
+        tokens: 每个文本回答的 token（文本增量）数量
+        rate: 每秒输出的 token 数
+        ttfb: 首字节延迟（秒）
+        tool_name: tools 脚本调用的工具
+        tool_input: 工具参数
+    """
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app['script'] = script
+    app['tokens'] = tokens
+    app['rate'] = rate
+    app['ttfb'] = ttfb
+    app['tool_name'] = tool_name
+    app['tool_input'] = tool_input if tool_input is not None else {'path': '.'}
+    app['stats'] = {'requests': 0, 'streams': 0}
+    app.router.add_post('/v1/messages', messages)
+    app.router.add_get('/stats', stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟 Anthropic Messages API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--script', choices=['text', 'tools'], default='text')
+    parser.add_argument('--tokens', type=int, default=100, help='每个回答的 token 数')
+    parser.add_argument('--rate', type=float, default=50.0, help='每秒 token 数')
+    parser.add_argument('--ttfb', type=float, default=0.2, help='首字节延迟（秒）')
+    parser.add_argument('--tool', default='list_directory', help='tools 脚本调用的工具')
+    parser.add_argument('--tool-input', default='{"path": "."}', help='工具参数（JSON）')
+    args = parser.parse_args()
+
+    app = create_app(args.script, args.tokens, args.rate, args.ttfb,
+                     args.tool, json.loads(args.tool_input))
+    web.run_app(app, host=args.host, port=args.port, backlog=4096)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""
+Process-wide pool of Anthropic API clients.
+
+Clients are shared across /api/chat requests and across the iterations of
+the agentic loop, so TLS sessions and keep-alive connections are reused
+instead of being rebuilt for every user message.
+"""
+
+import hashlib
+import importlib.util
+import logging
+import threading
+import time
+from typing import Dict, List, Any, Tuple
+
+import anthropic
+import httpx
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = getattr(config, 'ANTHROPIC_MAX_CONNECTIONS', 20)
+MAX_KEEPALIVE_CONNECTIONS = getattr(config, 'ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS', 10)
+KEEPALIVE_EXPIRY = getattr(config, 'ANTHROPIC_KEEPALIVE_EXPIRY', 60.0)
+# HTTP/2 needs the optional h2 package (pip install httpx[http2])
+HTTP2 = getattr(config, 'ANTHROPIC_HTTP2', False) and importlib.util.find_spec('h2') is not None
+
+# Streaming turns can run for minutes; only the connect phase is kept short
+REQUEST_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+
+class PoolStats:
+    """Counters for one pooled HTTP client."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waits = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def trace(self, event_name: str, info: Dict[str, Any]):
+        """httpcore trace hook, called for every connection-level event."""
+        if event_name == 'connection.connect_tcp.complete':
+            with self.lock:
+                self.connections_opened += 1
+        elif event_name == 'connection.start_tls.complete':
+            with self.lock:
+                self.tls_handshakes += 1
+
+
+def _async_trace(stats: PoolStats):
+    """httpcore trace hook for async connections (which await their hook)."""
+    async def trace(event_name: str, info: Dict[str, Any]):
+        stats.trace(event_name, info)
+    return trace
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body wrapper that reports when a streamed response is closed."""
+
+    def __init__(self, stream: httpx.SyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+
+class _CountingTransport(httpx.HTTPTransport):
+    """HTTP transport that records pool usage in a PoolStats."""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.stats
+        with stats.lock:
+            stats.requests += 1
+            if stats.in_flight >= MAX_CONNECTIONS:
+                # Every connection is busy, this request queues in the pool
+                stats.waits += 1
+            stats.in_flight += 1
+            stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+
+        def release():
+            with stats.lock:
+                stats.in_flight -= 1
+
+        request.extensions['trace'] = stats.trace
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            release()
+            raise
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, release),
+            extensions=response.extensions
+        )
+
+    def pool_state(self) -> Dict[str, int]:
+        """Snapshot of the underlying httpcore connection pool."""
+        pool = self._pool
+        connections = list(pool.connections)
+        return {
+            'open_connections': len(connections),
+            'idle_connections': sum(1 for conn in connections if conn.is_idle()),
+            'http2_connections': sum(
+                1 for conn in connections if 'HTTP/2' in repr(conn)
+            )
+        }
+
+
+class ClientRegistry:
+    """Shares one Anthropic client per (base_url, token, model family)."""
+
+    def __init__(self):
+        """Initialize client registry."""
+        self._clients: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._async_clients: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, base_url: str, api_key: str,
+                   model_family: str) -> anthropic.Anthropic:
+        """
+        Get the shared client for an endpoint, creating it on first use.
+
+        Args:
+            base_url: API base URL
+            api_key: API token
+            model_family: Model alias from config.AVAILABLE_MODELS
+
+        Returns:
+            Anthropic client backed by a keep-alive connection pool
+        """
+        key = (base_url, api_key, model_family)
+        entry = self._clients.get(key)
+        if entry is not None:
+            return entry['client']
+
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = self._create_entry(base_url, api_key, model_family)
+                self._clients[key] = entry
+        return entry['client']
+
+    def _create_entry(self, base_url: str, api_key: str,
+                      model_family: str) -> Dict[str, Any]:
+        stats = PoolStats()
+        transport = _CountingTransport(
+            stats,
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )
+        )
+        http_client = httpx.Client(transport=transport, timeout=REQUEST_TIMEOUT)
+        client = anthropic.Anthropic(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            # Retries are done by model_retry (backoff, circuit breakers, failover)
+            max_retries=0
+        )
+        logger.info(f"Created pooled Anthropic client for {base_url} ({model_family})")
+
+        return {
+            'client': client,
+            'transport': transport,
+            'stats': stats,
+            'base_url': base_url,
+            'model_family': model_family,
+            'token_id': hashlib.sha256(api_key.encode()).hexdigest()[:8],
+            'created_at': time.time()
+        }
+
+    def get_async_client(self, base_url: str, api_key: str,
+                         model_family: str) -> anthropic.AsyncAnthropic:
+        """
+        Get the shared asyncio client for an endpoint (asyncio serving mode).
+
+        Must be called from the event loop the client will be used on.
+
+        Args:
+            base_url: API base URL
+            api_key: API token
+            model_family: Model alias from config.AVAILABLE_MODELS
+
+        Returns:
+            AsyncAnthropic client backed by a keep-alive connection pool
+        """
+        key = (base_url, api_key, model_family)
+        entry = self._async_clients.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._async_clients.get(key)
+                if entry is None:
+                    entry = self._create_async_entry(base_url, api_key, model_family)
+                    self._async_clients[key] = entry
+        return entry['client']
+
+    def _create_async_entry(self, base_url: str, api_key: str,
+                            model_family: str) -> Dict[str, Any]:
+        stats = PoolStats()
+
+        async def on_request(request: httpx.Request):
+            with stats.lock:
+                stats.requests += 1
+            request.extensions['trace'] = _async_trace(stats)
+
+        http_client = httpx.AsyncClient(
+            http2=HTTP2,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ),
+            timeout=REQUEST_TIMEOUT,
+            event_hooks={'request': [on_request]}
+        )
+        client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            base_url=base_url,
+            http_client=http_client,
+            # Retries are done by model_retry (backoff, circuit breakers, failover)
+            max_retries=0
+        )
+        logger.info(f"Created pooled async Anthropic client for {base_url} ({model_family})")
+
+        return {
+            'client': client,
+            'stats': stats,
+            'base_url': base_url,
+            'model_family': model_family,
+            'token_id': hashlib.sha256(api_key.encode()).hexdigest()[:8],
+            'created_at': time.time()
+        }
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """
+        Get connection pool statistics for every shared client.
+
+        Returns:
+            One dict per client; tokens are reported as a short hash only
+        """
+        with self._lock:
+            entries = list(self._clients.values())
+
+        stats = []
+        for entry in entries:
+            counters = entry['stats']
+            with counters.lock:
+                item = {
+                    'base_url': entry['base_url'],
+                    'model_family': entry['model_family'],
+                    'token_id': entry['token_id'],
+                    'http2': HTTP2,
+                    'max_connections': MAX_CONNECTIONS,
+                    'requests': counters.requests,
+                    'in_flight': counters.in_flight,
+                    'peak_in_flight': counters.peak_in_flight,
+                    'waits': counters.waits,
+                    'connections_opened': counters.connections_opened,
+                    'tls_handshakes': counters.tls_handshakes,
+                    'uptime_seconds': round(time.time() - entry['created_at'], 1)
+                }
+            item.update(entry['transport'].pool_state())
+            stats.append(item)
+
+        with self._lock:
+            async_entries = list(self._async_clients.values())
+        for entry in async_entries:
+            counters = entry['stats']
+            with counters.lock:
+                stats.append({
+                    'base_url': entry['base_url'],
+                    'model_family': entry['model_family'],
+                    'token_id': entry['token_id'],
+                    'async': True,
+                    'http2': HTTP2,
+                    'max_connections': MAX_CONNECTIONS,
+                    'requests': counters.requests,
+                    'connections_opened': counters.connections_opened,
+                    'tls_handshakes': counters.tls_handshakes,
+                    'uptime_seconds': round(time.time() - entry['created_at'], 1)
+                })
+        return stats
+
+    def close_all(self):
+        """Close every pooled client."""
+        with self._lock:
+            entries = list(self._clients.values())
+            self._clients.clear()
+        for entry in entries:
+            entry['client'].close()
+
+    async def close_all_async(self):
+        """Close every pooled asyncio client."""
+        with self._lock:
+            entries = list(self._async_clients.values())
+            self._async_clients.clear()
+        for entry in entries:
+            await entry['client'].close()
+
+
+# Global instance
+_registry = None
+
+
+def get_client_registry() -> ClientRegistry:
+    """Get the global client registry instance."""
+    global _registry
+    if _registry is None:
+        _registry = ClientRegistry()
+    return _registry
@@ -0,0 +1,402 @@
+"""
+Retries, circuit breakers and failover for model calls.
+
+A model call (the request plus its whole response stream) that fails with
+a transient error - 429, 5xx/529 overloaded, a timeout or a dropped
+connection - is retried with jittered exponential backoff, honouring
+retry-after. Each base URL has a circuit breaker that fails fast after
+repeated errors. When a target runs out of attempts the turn fails over to
+the next one in an ordered list: the other configured endpoints, then the
+fallback models (e.g. opus -> sonnet).
+"""
+
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Any, Callable, Optional
+
+import anthropic
+import httpx
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Attempts per target before failing over to the next one
+MAX_ATTEMPTS = getattr(config, 'MODEL_RETRY_MAX_ATTEMPTS', 4)
+# Backoff: random delay up to BASE_DELAY * 2^(attempt-1), at most MAX_DELAY;
+# a longer retry-after moves on to the next target instead of waiting
+BASE_DELAY = getattr(config, 'MODEL_RETRY_BASE_DELAY', 1.0)
+MAX_DELAY = getattr(config, 'MODEL_RETRY_MAX_DELAY', 30.0)
+# Consecutive failures that open a base URL's breaker, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = getattr(config, 'MODEL_BREAKER_FAILURE_THRESHOLD', 5)
+BREAKER_RESET_TIMEOUT = getattr(config, 'MODEL_BREAKER_RESET_TIMEOUT', 30.0)
+# Extra endpoints tried after ANTHROPIC_BASE_URL: [{'base_url': ..., 'auth_token': ...}]
+FALLBACK_ENDPOINTS = getattr(config, 'ANTHROPIC_FALLBACK_ENDPOINTS', [])
+# Model alias -> aliases tried after it, in order
+MODEL_FALLBACKS = getattr(config, 'MODEL_FALLBACKS', {'opus': ['sonnet']})
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Error types sent inside an otherwise successful (200) event stream
+RETRYABLE_STREAM_ERRORS = {'overloaded_error', 'rate_limit_error', 'api_error'}
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check whether a failed model call is worth repeating."""
+    if isinstance(error, (anthropic.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        if error.status_code in RETRYABLE_STATUS_CODES:
+            return True
+        body = error.body if isinstance(error.body, dict) else {}
+        error_type = (body.get('error') or {}).get('type')
+        return error_type in RETRYABLE_STREAM_ERRORS
+    return False
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait (retry-after-ms / retry-after), if any."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+def backoff_delay(attempt: int) -> float:
+    """Jittered exponential backoff ("full jitter") before retry number attempt."""
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Failure tracking for one base URL.
+
+    Closed: calls go through. After BREAKER_FAILURE_THRESHOLD consecutive
+    failures it opens and rejects calls for BREAKER_RESET_TIMEOUT seconds,
+    then lets a single probe call through (half-open); the probe's outcome
+    closes or re-opens it, and a probe that ends without one (cancelled,
+    or failed before reaching the endpoint) is released for the next call.
+    """
+
+    def __init__(self, base_url: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        """
+        Initialize circuit breaker.
+
+        Args:
+            base_url: Base URL the breaker protects
+            failure_threshold: Consecutive failures that open the breaker
+            reset_timeout: Seconds before an open breaker allows a probe
+        """
+        self.base_url = base_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Check whether a call may go to this base URL now."""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                self.probe_in_flight = False
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                    logger.warning(f"Circuit breaker for {self.base_url} opened "
+                                   f"after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that says nothing about the endpoint's health."""
+        with self.lock:
+            self.probe_in_flight = False
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == 'open'
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'base_url': self.base_url,
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(base_url: str) -> CircuitBreaker:
+    """Get the process-wide circuit breaker of a base URL."""
+    base_url = str(base_url).rstrip('/')
+    breaker = _breakers.get(base_url)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(base_url, CircuitBreaker(base_url))
+    return breaker
+
+
+def get_breaker_stats() -> List[Dict[str, Any]]:
+    """State of every circuit breaker."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.get_stats() for breaker in breakers]
+
+
+class ModelTarget:
+    """One (endpoint, model) pair a turn can send its model calls to."""
+
+    def __init__(self, base_url: str, model: str, model_id: str,
+                 client=None, client_factory: Optional[Callable[[], Any]] = None):
+        """
+        Initialize model target.
+
+        Args:
+            base_url: API base URL (circuit breaker key)
+            model: Model alias from config.AVAILABLE_MODELS
+            model_id: Model ID sent to the API
+            client: Client for the endpoint
+            client_factory: Creates the client on first use, if client is None
+        """
+        self.base_url = base_url
+        self.model = model
+        self.model_id = model_id
+        self._client = client
+        self._client_factory = client_factory
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+
+def build_fallback_targets(model: str, base_url: str, api_key: str,
+                           get_client: Callable[[str, str, str], Any]) -> List[ModelTarget]:
+    """
+    Targets tried after the primary (base_url, model), in failover order.
+
+    The requested model is tried on every fallback endpoint first, then each
+    fallback model on every endpoint.
+
+    Args:
+        model: Requested model alias
+        base_url: Primary API base URL
+        api_key: Primary API token
+        get_client: (base_url, api_key, model alias) -> client, e.g.
+            ClientRegistry.get_client or get_async_client
+
+    Returns:
+        List of targets, clients created lazily
+    """
+    endpoints = [(base_url, api_key)] + [
+        (endpoint['base_url'], endpoint.get('auth_token') or api_key)
+        for endpoint in FALLBACK_ENDPOINTS
+    ]
+    models = [model] + [
+        alias for alias in MODEL_FALLBACKS.get(model, [])
+        if alias != model and alias in config.AVAILABLE_MODELS
+    ]
+
+    targets = []
+    for alias in models:
+        for endpoint_url, endpoint_key in endpoints:
+            if alias == model and endpoint_url == base_url:
+                continue
+            targets.append(ModelTarget(
+                endpoint_url,
+                alias,
+                config.AVAILABLE_MODELS[alias],
+                client_factory=lambda u=endpoint_url, k=endpoint_key, a=alias: get_client(u, k, a)
+            ))
+    return targets
+
+
+class ModelCaller:
+    """
+    Retry and failover bookkeeping for the model calls of one chat turn.
+
+    The caller picks a target with select(), makes the call and reports
+    the outcome with record_success() or record_failure(), or calls
+    release() if the call was abandoned. Failover is sticky: once a turn
+    moved to a later target it stays there.
+    """
+
+    def __init__(self, targets: List[ModelTarget]):
+        """
+        Initialize model caller.
+
+        Args:
+            targets: Targets in failover order, the primary first
+        """
+        self.targets = targets
+        self.index = 0
+        self.attempt = 0
+        self.calls = 0
+        self.retries = 0
+        self.failovers = 0
+        # Breaker that admitted the call in progress (it may hold the probe)
+        self._breaker: Optional[CircuitBreaker] = None
+
+    @property
+    def target(self) -> ModelTarget:
+        return self.targets[min(self.index, len(self.targets) - 1)]
+
+    def select(self) -> ModelTarget:
+        """
+        Get the target for the next call, skipping endpoints whose breaker is open.
+
+        Raises:
+            RuntimeError: If every remaining target is unavailable
+        """
+        self.release()
+        while self.index < len(self.targets):
+            breaker = get_circuit_breaker(self.target.base_url)
+            if breaker.allow():
+                self._breaker = breaker
+                self.calls += 1
+                return self.target
+            self._advance()
+        raise RuntimeError('模型服务暂时不可用（所有端点均已熔断），请稍后重试')
+
+    def _advance(self):
+        self.index += 1
+        self.attempt = 0
+        if self.index < len(self.targets):
+            self.failovers += 1
+
+    def retarget(self, targets: List[ModelTarget]):
+        """
+        Send later calls to a new target list (the turn's counters are kept).
+
+        If the new list contains the current target, the turn stays on it
+        with its remaining attempts, so re-routing does not undo a failover
+        or restart the retry budget.
+        """
+        current = (self.target.base_url, self.target.model)
+        self.targets = targets
+        for index, target in enumerate(targets):
+            if (target.base_url, target.model) == current:
+                self.index = index
+                return
+        self.index = 0
+        self.attempt = 0
+
+    def _finish_call(self) -> CircuitBreaker:
+        breaker, self._breaker = self._breaker, None
+        return breaker or get_circuit_breaker(self.target.base_url)
+
+    def record_success(self):
+        self._finish_call().record_success()
+        self.attempt = 0
+
+    def release(self):
+        """End the call in progress without an outcome (cancelled or abandoned); no-op after record_*."""
+        if self._breaker is not None:
+            self._finish_call().release()
+
+    def record_failure(self, error: Exception) -> Optional[Dict[str, Any]]:
+        """
+        Record a failed call and decide what to do next.
+
+        Args:
+            error: The exception raised by the call or its stream
+
+        Returns:
+            Retry info {'attempt', 'delay', 'error', 'model', 'failover'} if
+            the call should be repeated (after 'delay' seconds, on
+            self.target), or None if the error should be raised
+        """
+        breaker = self._finish_call()
+        if not is_retryable(error):
+            if isinstance(error, anthropic.APIStatusError):
+                # The endpoint answered (e.g. 400 prompt too long): it is healthy
+                breaker.record_success()
+            else:
+                breaker.release()
+            return None
+
+        breaker.record_failure()
+        self.attempt += 1
+
+        delay = get_retry_after(error)
+        if delay is None:
+            delay = backoff_delay(self.attempt)
+
+        failover = False
+        if self.attempt >= MAX_ATTEMPTS or delay > MAX_DELAY or breaker.is_open():
+            if self.index + 1 >= len(self.targets):
+                return None
+            self._advance()
+            failover = True
+            delay = 0.0
+
+        self.retries += 1
+        logger.warning(f"Model call failed ({error}); retry {self.retries} on "
+                       f"{self.target.model} in {delay:.1f}s")
+        return {
+            'attempt': self.attempt,
+            'delay': round(delay, 2),
+            'error': str(error),
+            'model': self.target.model,
+            'failover': failover
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-turn call counts."""
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'failovers': self.failovers,
+            'model': self.target.model
+        }
@@ -0,0 +1,254 @@
+"""
+Automatic model selection for the 'auto' model.
+
+A session normally uses one model for every model call, so a trivial
+tool continuation ("the file was written, now run it") waits as long as
+the planning step that started the turn. When the session model is
+'auto' (opt-in: add 'auto' to config.AVAILABLE_MODELS), ModelRouter picks
+the model for each iteration of the agentic loop from cheap local
+features of the conversation:
+
+- iterations that start from the user's message are planning steps and go
+  to the planning model, or the heavy model for long messages
+- iterations that only continue after tool results go to the light model,
+  unless the results are large, contain errors or fan out into many calls
+- the measured time to first token of each model (an exponential moving
+  average over all sessions) vetoes a switch that would not be faster
+
+Every decision is logged with the latency it saved compared to the
+planning model. Calls to different models do not share prompt cache
+entries, so each model's prefix is written to the cache once per turn.
+"""
+
+import collections
+import logging
+import threading
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+import config
+import model_retry
+
+logger = logging.getLogger(__name__)
+
+
+AUTO_MODEL = 'auto'
+# Model for planning steps, for long messages and for simple continuations
+PLANNING_MODEL = getattr(config, 'AUTO_MODEL_PLANNING', 'sonnet')
+HEAVY_MODEL = getattr(config, 'AUTO_MODEL_HEAVY', 'opus')
+LIGHT_MODEL = getattr(config, 'AUTO_MODEL_LIGHT', 'haiku')
+# User messages at least this long go to the heavy model (None: never)
+HEAVY_MIN_CHARS = getattr(config, 'AUTO_MODEL_HEAVY_MIN_CHARS', 4000)
+# The heavy model is skipped while its time to first token is above this
+HEAVY_MAX_TTFT_MS = getattr(config, 'AUTO_MODEL_HEAVY_MAX_TTFT_MS', 10000)
+# Tool continuations stay on the planning model above these limits
+LIGHT_MAX_RESULT_CHARS = getattr(config, 'AUTO_MODEL_LIGHT_MAX_RESULT_CHARS', 8000)
+LIGHT_MAX_TOOL_CALLS = getattr(config, 'AUTO_MODEL_LIGHT_MAX_TOOL_CALLS', 3)
+LIGHT_MAX_DENSITY = getattr(config, 'AUTO_MODEL_LIGHT_MAX_DENSITY', 3.0)
+
+# Weight of a new time-to-first-token sample in the moving average
+TTFT_ALPHA = 0.2
+RECENT_DECISIONS = 50
+
+
+def is_auto(model: str) -> bool:
+    """Check whether a session model is routed per iteration."""
+    return model == AUTO_MODEL
+
+
+def resolve(model: str) -> str:
+    """Model alias the turn starts with: the planning model for 'auto'."""
+    return PLANNING_MODEL if is_auto(model) else model
+
+
+def _content_chars(content: Any) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(_content_chars(block) for block in content)
+    if isinstance(content, dict):
+        return _content_chars(content.get('text') or content.get('content') or '')
+    return 0
+
+
+def _blocks(message: Dict[str, Any], block_type: str) -> List[Dict[str, Any]]:
+    content = message.get('content')
+    if not isinstance(content, list):
+        return []
+    return [block for block in content if isinstance(block, dict) and block.get('type') == block_type]
+
+
+def extract_features(messages: List[Dict[str, Any]], iteration: int) -> Dict[str, Any]:
+    """
+    Routing features of the next model call.
+
+    Args:
+        messages: Conversation so far, ending with the message the call answers
+        iteration: Iteration of the agentic loop (1 = answering the user)
+
+    Returns:
+        Dict with 'tool_continuation' (the last message is only tool
+        results), 'message_chars', 'tool_calls' (results in the last
+        message), 'tool_errors' and 'density' (tool calls per iteration so
+        far in this turn)
+    """
+    last = messages[-1] if messages else {}
+    results = _blocks(last, 'tool_result')
+    continuation = bool(results) and len(results) == len(last.get('content') or [])
+
+    tool_uses = 0
+    if continuation:
+        # Tool calls of this turn: assistant messages after the user's message
+        for message in reversed(messages[:-1]):
+            if message.get('role') == 'user' and not _blocks(message, 'tool_result'):
+                break
+            if message.get('role') == 'assistant':
+                tool_uses += len(_blocks(message, 'tool_use'))
+
+    return {
+        'iteration': iteration,
+        'tool_continuation': continuation,
+        'message_chars': _content_chars(last.get('content')),
+        'tool_calls': len(results),
+        'tool_errors': sum(1 for block in results
+                           if block.get('is_error') or '"success": false' in str(block.get('content', ''))),
+        'density': round(tool_uses / max(1, iteration - 1), 2) if continuation else 0.0
+    }
+
+
+class ModelRouter:
+    """Per-iteration model choice for 'auto' sessions, with latency tracking."""
+
+    def __init__(self, planning_model: str = PLANNING_MODEL, heavy_model: Optional[str] = HEAVY_MODEL,
+                 light_model: Optional[str] = LIGHT_MODEL):
+        """
+        Initialize model router.
+
+        Args:
+            planning_model: Model for planning steps and complex continuations
+            heavy_model: Model for long user messages (None: not used)
+            light_model: Model for simple tool continuations (None: not used)
+        """
+        self.planning_model = planning_model
+        self.heavy_model = heavy_model if heavy_model in config.AVAILABLE_MODELS else None
+        self.light_model = light_model if light_model in config.AVAILABLE_MODELS else None
+        self._lock = threading.Lock()
+        # model alias -> moving average of time to first token (ms), sample count
+        self.ttft_ms: Dict[str, float] = {}
+        self.samples: Dict[str, int] = collections.Counter()
+        self.decisions: Dict[str, int] = collections.Counter()
+        self.saved_ms = 0.0
+        self.recent = collections.deque(maxlen=RECENT_DECISIONS)
+
+    def record_latency(self, model: str, ttft_ms: Optional[float]):
+        """Add a time-to-first-token sample of a successful model call."""
+        if ttft_ms is None:
+            return
+        with self._lock:
+            previous = self.ttft_ms.get(model)
+            self.ttft_ms[model] = ttft_ms if previous is None else previous + TTFT_ALPHA * (ttft_ms - previous)
+            self.samples[model] += 1
+
+    def _choose(self, features: Dict[str, Any]) -> Tuple[str, str]:
+        """(model, reason) for the features; called with the lock held."""
+        if not features['tool_continuation']:
+            if (self.heavy_model and HEAVY_MIN_CHARS is not None
+                    and features['message_chars'] >= HEAVY_MIN_CHARS):
+                if self.ttft_ms.get(self.heavy_model, 0) > HEAVY_MAX_TTFT_MS:
+                    return self.planning_model, 'heavy model slow'
+                return self.heavy_model, 'long message'
+            return self.planning_model, 'planning'
+
+        if not self.light_model:
+            return self.planning_model, 'continuation'
+        if features['tool_errors']:
+            return self.planning_model, 'tool error'
+        if features['message_chars'] > LIGHT_MAX_RESULT_CHARS:
+            return self.planning_model, 'large tool results'
+        if features['tool_calls'] > LIGHT_MAX_TOOL_CALLS or features['density'] > LIGHT_MAX_DENSITY:
+            return self.planning_model, 'many tool calls'
+        light = self.ttft_ms.get(self.light_model)
+        planning = self.ttft_ms.get(self.planning_model)
+        if light is not None and planning is not None and light >= planning:
+            return self.planning_model, 'light model slower'
+        return self.light_model, 'simple continuation'
+
+    def route(self, messages: List[Dict[str, Any]], iteration: int) -> Dict[str, Any]:
+        """
+        Choose the model for the next call of an 'auto' turn.
+
+        Args:
+            messages: Conversation so far
+            iteration: Iteration of the agentic loop
+
+        Returns:
+            Decision dict: 'model', 'reason', 'features' and 'saved_ms'
+            (expected time to first token saved compared to the planning
+            model, None until both models have been measured)
+        """
+        features = extract_features(messages, iteration)
+        with self._lock:
+            model, reason = self._choose(features)
+            baseline = self.ttft_ms.get(self.planning_model)
+            chosen = self.ttft_ms.get(model)
+            saved = round(baseline - chosen, 1) if baseline is not None and chosen is not None else None
+            decision = {'model': model, 'reason': reason, 'features': features, 'saved_ms': saved}
+            self.decisions[model] += 1
+            if saved is not None:
+                self.saved_ms += saved
+            self.recent.append({'model': model, 'reason': reason, 'iteration': iteration, 'saved_ms': saved})
+
+        logger.info(f"Auto model: iteration {iteration} -> {model} ({reason}; "
+                    f"results {features['message_chars']} chars, {features['tool_calls']} tool calls, "
+                    f"saved {'?' if saved is None else f'{saved:.0f}'}ms)")
+        return decision
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Decision counts, latency saved and per-model time to first token."""
+        with self._lock:
+            return {
+                'models': {'planning': self.planning_model, 'heavy': self.heavy_model, 'light': self.light_model},
+                'decisions': dict(self.decisions),
+                'saved_ms': round(self.saved_ms, 1),
+                'ttft_ms': {model: round(value, 1) for model, value in self.ttft_ms.items()},
+                'samples': dict(self.samples),
+                'recent': list(self.recent)
+            }
+
+
+def target_factory(base_url: str, api_key: str,
+                   get_client: Callable[[str, str, str], Any]) -> Callable[[str], List[model_retry.ModelTarget]]:
+    """
+    Build the failover targets of routed models for one turn.
+
+    Args:
+        base_url: Primary API base URL
+        api_key: Primary API token
+        get_client: (base_url, api_key, model alias) -> client
+
+    Returns:
+        model alias -> [primary target] + fallback targets, built once per alias
+    """
+    targets: Dict[str, List[model_retry.ModelTarget]] = {}
+
+    def build(model: str) -> List[model_retry.ModelTarget]:
+        if model not in targets:
+            primary = model_retry.ModelTarget(
+                base_url, model, config.AVAILABLE_MODELS[model],
+                client_factory=lambda: get_client(base_url, api_key, model)
+            )
+            targets[model] = [primary] + model_retry.build_fallback_targets(model, base_url, api_key, get_client)
+        return targets[model]
+
+    return build
+
+
+# Global instance
+_router = None
+
+
+def get_model_router() -> ModelRouter:
+    """Get the global model router instance."""
+    global _router
+    if _router is None:
+        _router = ModelRouter()
+    return _router
@@ -4,15 +4,23 @@ Operation logging and permission management system.
 
 import sqlite3
 import json
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple
 import os
 import re
 
+from db_writer import get_db_writer
+
+
+DB_PATH = 'conversations.db'
+# Operation log IDs reserved from the database at a time (see _allocate_log_id)
+ID_BLOCK_SIZE = 1000
+
 
 def get_db_connection():
     """Get database connection."""
-    conn = sqlite3.connect('conversations.db')
+    conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -123,12 +131,64 @@ def get_operation_preview(tool_name: str, tool_input: Dict[str, Any]) -> str:
 
 # Operation Logging
 
+_id_lock = threading.Lock()
+# Database path the current block belongs to, and its next and last ID
+_id_block = (None, 1, 0)
+
+
+def _reserve_ids(db_path: str) -> Tuple[int, int]:
+    """
+    Reserve a block of operation log IDs.
+
+    Moves the table's AUTOINCREMENT counter past the block, so IDs handed
+    out by SQLite (or by another server process reserving its own block)
+    never collide with it.
+
+    Returns:
+        (first ID, last ID)
+    """
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'operation_logs'").fetchone()
+        top = conn.execute('SELECT MAX(id) FROM operation_logs').fetchone()[0] or 0
+        first = max(row[0] if row else 0, top) + 1
+        last = first + ID_BLOCK_SIZE - 1
+        if row:
+            conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'operation_logs'", (last,))
+        else:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('operation_logs', ?)", (last,))
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return first, last
+
+
+def _allocate_log_id() -> int:
+    """Next operation log ID, so the insert can be queued instead of awaited."""
+    global _id_block
+    db_path = os.path.abspath(DB_PATH)
+    with _id_lock:
+        block_path, next_id, last_id = _id_block
+        if block_path != db_path or next_id > last_id:
+            next_id, last_id = _reserve_ids(db_path)
+        _id_block = (db_path, next_id + 1, last_id)
+        return next_id
+
+
 def log_operation(username: str, session_id: str, tool_name: str,
                   tool_input: Dict[str, Any], tool_source: str = 'direct',
                   mcp_server_id: Optional[int] = None) -> int:
     """
     Log a tool operation.
 
+    The row is written by the background database writer; the ID is
+    allocated up front.
+
     Args:
         username: Username executing the operation
         session_id: Session ID
@@ -151,15 +211,14 @@ def log_operation(username: str, session_id: str, tool_name: str,
     elif ':' in tool_name:
         operation_type = 'api_call'
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    cursor.execute('''
+    log_id = _allocate_log_id()
+    get_db_writer().execute(DB_PATH, '''
         INSERT INTO operation_logs
-        (username, session_id, operation_type, tool_name, tool_source,
+        (id, username, session_id, operation_type, tool_name, tool_source,
          mcp_server_id, input_data, status, requires_permission)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
+        log_id,
         username,
         session_id,
         operation_type,
@@ -171,10 +230,6 @@ def log_operation(username: str, session_id: str, tool_name: str,
         requires_permission
     ))
 
-    log_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-
     return log_id
 
 
@@ -183,7 +238,7 @@ def update_operation_status(log_id: int, status: str,
                             error_message: str = None,
                             permission_granted: bool = None):
     """
-    Update operation log status.
+    Update operation log status (written by the background database writer).
 
     Args:
         log_id: Operation log ID
@@ -192,9 +247,6 @@ def update_operation_status(log_id: int, status: str,
         error_message: Error message if failed
         permission_granted: Whether permission was granted
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     updates = ['status = ?', 'completed_at = ?']
     values = [status, datetime.now().isoformat()]
 
@@ -213,10 +265,7 @@ def update_operation_status(log_id: int, status: str,
     values.append(log_id)
 
     query = f"UPDATE operation_logs SET {', '.join(updates)} WHERE id = ?"
-    cursor.execute(query, values)
-
-    conn.commit()
-    conn.close()
+    get_db_writer().execute(DB_PATH, query, values)
 
 
 def get_operation_logs(username: str = None, session_id: str = None,
@@ -234,6 +283,7 @@ def get_operation_logs(username: str = None, session_id: str = None,
     Returns:
         List of operation log dictionaries
     """
+    get_db_writer().flush()
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -298,6 +348,7 @@ def reject_permission(log_id: int, reason: str = None) -> bool:
 
 def cleanup_old_logs(days: int = 30):
     """Delete operation logs older than specified days."""
+    get_db_writer().flush()
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -317,6 +368,7 @@ def cleanup_old_logs(days: int = 30):
 
 def get_operation_stats(username: str = None, session_id: str = None) -> Dict:
     """Get operation statistics."""
+    get_db_writer().flush()
     conn = get_db_connection()
     cursor = conn.cursor()
 
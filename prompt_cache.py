@@ -0,0 +1,228 @@
+"""
+Prompt caching helpers for the chat pipeline.
+
+Adds cache-control breakpoints to the request parts that repeat across the
+iterations of the agentic loop, and collects the cache usage reported in
+the stream so hit rates can be checked per turn.
+"""
+
+import threading
+from typing import Dict, List, Any, Optional
+
+import config
+
+
+# At most four breakpoints are used per request: system prompt, tool list,
+# end of the previous turn and end of the request
+EPHEMERAL = {"type": "ephemeral"}
+
+ENABLED = getattr(config, 'PROMPT_CACHE_ENABLED', True)
+# Only models whose endpoint understands cache_control get breakpoints
+CACHE_MODELS = getattr(config, 'PROMPT_CACHE_MODELS', ['sonnet', 'opus', 'haiku'])
+
+
+def is_enabled_for(model: str) -> bool:
+    """Check whether prompt caching applies to a model alias."""
+    return ENABLED and model in CACHE_MODELS
+
+
+def build_system(system_text: str, cache: bool = True) -> Any:
+    """
+    Build the system parameter, with a breakpoint after the static prompt.
+
+    Args:
+        system_text: System prompt text
+        cache: Whether to add a cache breakpoint
+
+    Returns:
+        System blocks, or the plain string when caching is off
+    """
+    if not cache:
+        return system_text
+    return [{"type": "text", "text": system_text, "cache_control": EPHEMERAL}]
+
+
+def attach_memory(messages: List[Dict[str, Any]], memory_text: Optional[str]):
+    """
+    Put the turn's memory section in front of the new user text.
+
+    The section joins the current turn's user message, after the history
+    breakpoint, and stays in the stored conversation: a different
+    selection of memories in a later turn leaves the system prompt, the
+    tools and the whole earlier history cached.
+
+    Args:
+        messages: Working copy of the conversation, ending with this turn's
+            user message (modified in place)
+        memory_text: Relevant memories for this turn (see memory_index.py)
+    """
+    if not memory_text or not messages or messages[-1]["role"] != "user":
+        return
+    content = messages[-1]["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    memory_block = {"type": "text", "text": memory_text}
+    messages[-1] = {"role": "user", "content": content[:-1] + [memory_block, content[-1]]}
+
+
+def build_tools(tools: List[Dict[str, Any]], cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Build the tools parameter, with a breakpoint after the last tool.
+
+    The tool definitions themselves are shared and never modified.
+    """
+    if not cache or not tools:
+        return tools
+    cached = list(tools)
+    cached[-1] = dict(cached[-1], cache_control=EPHEMERAL)
+    return cached
+
+
+def _with_breakpoint(message: Dict[str, Any]) -> Dict[str, Any]:
+    content = message["content"]
+    if isinstance(content, str):
+        if not content:
+            return message
+        blocks = [{"type": "text", "text": content, "cache_control": EPHEMERAL}]
+    else:
+        if not content:
+            return message
+        blocks = list(content)
+        blocks[-1] = dict(blocks[-1], cache_control=EPHEMERAL)
+    return {"role": message["role"], "content": blocks}
+
+
+def build_messages(messages: List[Dict[str, Any]], previous_turn_end: int,
+                   cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Build the messages parameter with moving cache breakpoints.
+
+    One breakpoint sits on the last message of the previous user turn, so
+    every request of the current turn reads the conversation prefix from
+    the cache; the other sits on the last message of this request, so the
+    next iteration reads everything the current one wrote.
+
+    Args:
+        messages: Canonical message list (left untouched)
+        previous_turn_end: Index of the last message before this turn, or -1
+        cache: Whether to add cache breakpoints
+
+    Returns:
+        Shallow copy of messages with breakpoints applied
+    """
+    if not cache or not messages:
+        return messages
+
+    cached = list(messages)
+    last = len(cached) - 1
+    if 0 <= previous_turn_end < last:
+        cached[previous_turn_end] = _with_breakpoint(cached[previous_turn_end])
+    cached[last] = _with_breakpoint(cached[last])
+    return cached
+
+
+class CacheUsage:
+    """Token usage of one chat turn, accumulated over its iterations."""
+
+    def __init__(self):
+        self.iterations: List[Dict[str, int]] = []
+
+    def record_event(self, event: Any, model: Optional[str] = None):
+        """
+        Record usage from a stream event.
+
+        message_start carries the input side (including cache reads and
+        writes), message_delta carries the final output token count.
+
+        Args:
+            event: Stream event
+            model: Model alias that served the iteration (retries, failover
+                and the auto router can change it within a turn)
+        """
+        if event.type == "message_start":
+            usage = getattr(event.message, 'usage', None)
+            self.iterations.append({
+                'model': model,
+                'input_tokens': _usage_value(usage, 'input_tokens'),
+                'output_tokens': _usage_value(usage, 'output_tokens'),
+                'cache_creation_input_tokens': _usage_value(usage, 'cache_creation_input_tokens'),
+                'cache_read_input_tokens': _usage_value(usage, 'cache_read_input_tokens')
+            })
+        elif event.type == "message_delta" and self.iterations:
+            usage = getattr(event, 'usage', None)
+            output_tokens = _usage_value(usage, 'output_tokens')
+            if output_tokens:
+                self.iterations[-1]['output_tokens'] = output_tokens
+
+    def totals(self) -> Dict[str, Any]:
+        """Summed usage plus the share of input tokens served from cache."""
+        totals = {
+            'iterations': len(self.iterations),
+            'input_tokens': 0,
+            'output_tokens': 0,
+            'cache_creation_input_tokens': 0,
+            'cache_read_input_tokens': 0
+        }
+        for usage in self.iterations:
+            for key in ('input_tokens', 'output_tokens',
+                        'cache_creation_input_tokens', 'cache_read_input_tokens'):
+                totals[key] += usage[key]
+        totals['cache_hit_rate'] = _hit_rate(totals)
+        return totals
+
+
+def _usage_value(usage: Any, name: str) -> int:
+    if usage is None:
+        return 0
+    return getattr(usage, name, None) or 0
+
+
+def _hit_rate(totals: Dict[str, int]) -> Optional[float]:
+    prompt_tokens = (totals['input_tokens'] + totals['cache_creation_input_tokens']
+                     + totals['cache_read_input_tokens'])
+    if not prompt_tokens:
+        return None
+    return round(totals['cache_read_input_tokens'] / prompt_tokens, 4)
+
+
+# Process-wide totals, per model alias
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def record_turn(model: str, usage: CacheUsage):
+    """
+    Add a finished turn's usage to the process-wide totals.
+
+    Each iteration counts toward the model that served it; a turn counts
+    toward every model it used.
+
+    Args:
+        model: Model alias for iterations recorded without one
+        usage: The turn's usage
+    """
+    with _stats_lock:
+        for iteration in usage.iterations:
+            stats = _stats.setdefault(iteration['model'] or model, {
+                'turns': 0,
+                'iterations': 0,
+                'input_tokens': 0,
+                'output_tokens': 0,
+                'cache_creation_input_tokens': 0,
+                'cache_read_input_tokens': 0
+            })
+            stats['iterations'] += 1
+            for key in ('input_tokens', 'output_tokens',
+                        'cache_creation_input_tokens', 'cache_read_input_tokens'):
+                stats[key] += iteration[key]
+        for used in {iteration['model'] or model for iteration in usage.iterations}:
+            _stats[used]['turns'] += 1
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Process-wide cache usage per model alias, with hit rates."""
+    with _stats_lock:
+        stats = {model: dict(values) for model, values in _stats.items()}
+    for values in stats.values():
+        values['cache_hit_rate'] = _hit_rate(values)
+    return stats
@@ -0,0 +1,299 @@
+"""
+ripgrep backend for the grep tool.
+
+When `rg` is on the PATH (and GREP_BACKEND allows it), the grep tool runs
+`rg --json` and maps its events onto the tool's output modes: 'match'
+and 'context' events become content results (with the same per-match
+'> 12345: line' context blocks grep_engine builds), the first match of a
+file a files_with_matches entry, and the per-file 'end' statistics the
+count results. The output is read as a stream and rg is killed as soon
+as head_limit results are in.
+
+rg is run with options that reproduce grep_engine's file selection:
+.gitignore rules are not applied, hidden files are searched only for
+file patterns starting with '.' (other file patterns get a trailing
+'!.*' glob, since an include glob overrides rg's hidden-file filter),
+hidden directories never, binary files and files over
+GREP_MAX_FILE_BYTES are skipped, and files come out in tree order
+(--sort path, which also makes rg search on one thread).
+
+rg uses Rust regex syntax. Patterns are still validated with Python's re
+so errors do not change, and a pattern rg rejects (look-around,
+backreferences) is searched by grep_engine instead, as are single files.
+Remaining differences are edge cases: rg does not search symlinked
+files, matches invalid UTF-8 bytes instead of dropping them, a
+multiline pattern's '\\n' does not match a '\\r\\n' line ending, and a
+multiline pattern matching an empty line ('^$') does not match at the
+end of a file that ends with a newline, where Python's re sees one more.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+from typing import Dict, List, Any, Optional
+
+import config
+import grep_engine
+import trigram_index
+
+logger = logging.getLogger(__name__)
+
+
+# 'auto': rg when installed (unless the trigram index narrows searches),
+# 'ripgrep': rg when installed, 'python': always grep_engine
+BACKEND = getattr(config, 'GREP_BACKEND', 'auto')
+RIPGREP_PATH = getattr(config, 'RIPGREP_PATH', None) or shutil.which('rg')
+
+
+def _text(data: Dict[str, Any]) -> str:
+    """Text of an rg JSON string field (invalid UTF-8 comes base64-encoded)."""
+    if 'text' in data:
+        return data['text']
+    return base64.b64decode(data['bytes']).decode('utf-8', 'ignore')
+
+
+def _raw(data: Dict[str, Any]) -> bytes:
+    if 'text' in data:
+        return data['text'].encode('utf-8')
+    return base64.b64decode(data['bytes'])
+
+
+def file_globs(file_pattern: Optional[str]) -> List[str]:
+    """rg --glob arguments matching like grep_engine.compile_file_filter."""
+    if not file_pattern:
+        return []
+    globs = []
+    for expanded in grep_engine.expand_braces(file_pattern):
+        parts = [part for part in expanded.split('/') if part and part != '**']
+        if not parts:
+            continue
+        glob = '/'.join(parts)
+        if len(parts) > 1:
+            # Trailing path components, at any depth
+            glob = '**/' + glob
+        elif glob.startswith('!'):
+            glob = '\\' + glob
+        globs.append(glob)
+    return globs
+
+
+class _ContextBlocks:
+    """Builds grep_engine's per-match context blocks from rg's merged context lines."""
+
+    def __init__(self, before: int, after: int):
+        self.before = before
+        self.after = after
+        self.lines: Dict[int, str] = {}
+        self.pending: List[int] = []
+
+    def add(self, line_number: int, text: str, is_match: bool) -> List[Dict[str, Any]]:
+        """Record a line; returns the blocks of matches whose after-context is complete."""
+        self.lines[line_number] = text
+        if is_match:
+            self.pending.append(line_number)
+        done = []
+        while self.pending and self.pending[0] + self.after <= line_number:
+            done.append(self._block(self.pending.pop(0)))
+        if not self.pending:
+            # Keep only what the next match can use as before-context
+            for number in [n for n in self.lines if n < line_number - self.before]:
+                del self.lines[number]
+        return done
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Blocks of the matches still waiting at the end of the file."""
+        done = [self._block(line_number) for line_number in self.pending]
+        self.lines.clear()
+        self.pending.clear()
+        return done
+
+    def _block(self, line_number: int) -> Dict[str, Any]:
+        lines = []
+        for number in range(max(1, line_number - self.before), line_number + self.after + 1):
+            if number in self.lines:
+                prefix = ">" if number == line_number else " "
+                lines.append(f"{prefix} {number:5d}: {self.lines[number].rstrip()}")
+        return {'line': line_number, 'content': '\n'.join(lines)}
+
+
+class RipgrepBackend:
+    """Runs grep tool calls with `rg --json`."""
+
+    def __init__(self, binary: str = RIPGREP_PATH):
+        """
+        Initialize ripgrep backend.
+
+        Args:
+            binary: Path of the rg executable
+        """
+        self.binary = binary
+        self._lock = threading.Lock()
+        self.stats = {'searches': 0, 'fallbacks': 0, 'stopped_early': 0}
+
+    def _command(self, pattern: str, path: str, file_pattern: Optional[str], case_insensitive: bool,
+                 output_mode: str, before: int, after: int, multiline: bool) -> List[str]:
+        args = [self.binary, '--json', '--no-config', '--no-ignore', '--no-messages',
+                '--sort', 'path', '--encoding', 'none', '--crlf',
+                '--max-filesize', str(grep_engine.MAX_FILE_BYTES)]
+        if case_insensitive:
+            args.append('--ignore-case')
+        if multiline:
+            # grep_engine ignores context in multiline mode
+            args += ['--multiline', '--multiline-dotall']
+        elif output_mode == 'content':
+            if before:
+                args += ['--before-context', str(before)]
+            if after:
+                args += ['--after-context', str(after)]
+        if output_mode == 'files_with_matches':
+            args += ['--max-count', '1']
+        if file_pattern and file_pattern.startswith('.'):
+            # Hidden files, but still no hidden directories
+            args += ['--hidden', '--glob', '!.*/']
+        for glob in file_globs(file_pattern):
+            args += ['--glob', glob]
+        if file_pattern and not file_pattern.startswith('.'):
+            # An include glob overrides rg's hidden filter; the last matching glob wins
+            args += ['--glob', '!.*']
+        return args + ['--regexp', pattern, '--', path]
+
+    def search(self, pattern: str, path: str, file_pattern: Optional[str] = None,
+               case_insensitive: bool = False, output_mode: str = 'files_with_matches',
+               context: Optional[int] = None, after_context: Optional[int] = None,
+               before_context: Optional[int] = None, multiline: bool = False,
+               head_limit: int = 100) -> Optional[Dict[str, Any]]:
+        """
+        Run a grep tool call with rg (same arguments as GrepEngine.search).
+
+        Returns:
+            The grep tool result, or None when rg cannot run this search (a
+            single file, a pattern rg rejects, rg failing to start): the
+            caller searches with grep_engine instead
+
+        Raises:
+            re.error: If the pattern is not a valid Python regex
+        """
+        flags = re.IGNORECASE if case_insensitive else 0
+        re.compile(pattern, flags | (re.MULTILINE | re.DOTALL if multiline else 0))
+        if not os.path.isdir(path):
+            return None
+        head_limit = max(1, int(head_limit or 100))
+        before = int(before_context if before_context is not None else (context or 0))
+        after = int(after_context if after_context is not None else (context or 0))
+        args = self._command(pattern, path, file_pattern, bool(case_insensitive),
+                             output_mode, before, after, bool(multiline))
+
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            logger.warning(f"Could not run ripgrep ({e}), using the Python grep engine")
+            return self._fallback()
+
+        files: List[str] = []
+        counts: List[Dict[str, Any]] = []
+        results: List[Dict[str, Any]] = []
+        blocks = _ContextBlocks(before, after) if before or after else None
+        completed = limit_reached = False
+        try:
+            for raw_line in process.stdout:
+                event = json.loads(raw_line)
+                kind = event['type']
+                data = event.get('data', {})
+                if kind == 'summary':
+                    completed = True
+                    break
+                if kind not in ('match', 'context', 'end'):
+                    continue
+                file_path = _text(data['path'])
+
+                if output_mode == 'files_with_matches':
+                    if kind == 'match' and (not files or files[-1] != file_path):
+                        files.append(file_path)
+                        limit_reached = len(files) >= head_limit
+                elif output_mode == 'count':
+                    if kind == 'end':
+                        stats = data['stats']
+                        matches = stats['matches'] if multiline else stats['matched_lines']
+                        if matches:
+                            counts.append({"file": file_path, "matches": matches})
+                            limit_reached = len(counts) >= head_limit
+                elif multiline:
+                    if kind == 'match':
+                        lines = _raw(data['lines'])
+                        for submatch in data['submatches']:
+                            results.append({
+                                "file": file_path,
+                                "line": data['line_number'] + lines.count(b'\n', 0, submatch['start']),
+                                "content": _text(submatch['match']).replace('\r\n', '\n')
+                            })
+                elif blocks is not None:
+                    if kind == 'end':
+                        found = blocks.finish()
+                    else:
+                        found = blocks.add(data['line_number'], _text(data['lines']), kind == 'match')
+                    results.extend({"file": file_path, **block} for block in found)
+                elif kind == 'match':
+                    results.append({
+                        "file": file_path,
+                        "line": data['line_number'],
+                        "content": _text(data['lines']).rstrip()
+                    })
+
+                if output_mode == 'content' and len(results) >= head_limit:
+                    del results[head_limit:]
+                    limit_reached = True
+                if limit_reached:
+                    break
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+        if not completed and not limit_reached:
+            # rg rejected the pattern (or died) before searching
+            return self._fallback()
+
+        with self._lock:
+            self.stats['searches'] += 1
+            self.stats['stopped_early'] += limit_reached
+        if output_mode == 'files_with_matches':
+            response = {"success": True, "files": files, "count": len(files)}
+        elif output_mode == 'count':
+            response = {"success": True, "results": counts, "total_files": len(counts)}
+        else:
+            response = {"success": True, "results": results, "count": len(results)}
+        if limit_reached:
+            response['limit_reached'] = True
+        return response
+
+    def _fallback(self) -> None:
+        with self._lock:
+            self.stats['fallbacks'] += 1
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Search counters."""
+        with self._lock:
+            return {**self.stats, 'binary': self.binary}
+
+
+# Global instance
+_backend = None
+
+
+def get_ripgrep() -> Optional[RipgrepBackend]:
+    """Get the global ripgrep backend, or None when grep_engine should search."""
+    global _backend
+    if BACKEND == 'python' or not RIPGREP_PATH:
+        return None
+    if BACKEND == 'auto' and trigram_index.ENABLED:
+        return None
+    if _backend is None:
+        _backend = RipgrepBackend()
+    return _backend
@@ -0,0 +1,104 @@
+"""
+Server-sent event encoding for the chat stream.
+
+Frames are encoded with orjson when it is installed, and streamed text
+deltas are coalesced so a long answer goes out as a few hundred events
+instead of one event (and one socket write) per token.
+"""
+
+import json
+import time
+from typing import Dict, Any, Optional
+
+import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Buffered text is flushed once it is this old (seconds) or this large (bytes)
+TEXT_FLUSH_INTERVAL = getattr(config, 'SSE_TEXT_FLUSH_INTERVAL', 0.03)
+TEXT_FLUSH_BYTES = getattr(config, 'SSE_TEXT_FLUSH_BYTES', 1024)
+
+
+def dumps(data: Any) -> str:
+    """Encode data as compact JSON text."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode('utf-8')
+        except TypeError:
+            # e.g. non-string keys or integers beyond 64 bits
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def frame(data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """
+    Encode one SSE frame.
+
+    Args:
+        data: Event data
+        event_id: Event ID, echoed back by clients as Last-Event-ID
+
+    Returns:
+        Frame text
+    """
+    if event_id is None:
+        return f"data: {dumps(data)}\n\n"
+    return f"id: {event_id}\ndata: {dumps(data)}\n\n"
+
+
+class TextCoalescer:
+    """
+    Merges text deltas into batched 'text' events.
+
+    add() returns an event when the buffer is due; flush() must be called
+    before any other event is sent so text and events stay in order.
+    """
+
+    def __init__(self, interval: float = TEXT_FLUSH_INTERVAL,
+                 max_bytes: int = TEXT_FLUSH_BYTES):
+        """
+        Initialize text coalescer.
+
+        Args:
+            interval: Maximum age of buffered text in seconds
+            max_bytes: Maximum size of buffered text in bytes
+        """
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._parts = []
+        self._size = 0
+        self._started = 0.0
+
+    def add(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Buffer a text delta.
+
+        Returns:
+            A text event to send if the buffer is due, otherwise None
+        """
+        if not self._parts:
+            self._started = time.monotonic()
+        self._parts.append(text)
+        self._size += len(text.encode('utf-8'))
+
+        if self._size >= self.max_bytes or time.monotonic() - self._started >= self.interval:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """
+        Emit all buffered text.
+
+        Returns:
+            A text event to send, or None if nothing is buffered
+        """
+        if not self._parts:
+            return None
+        text = ''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        return {'type': 'text', 'content': text}
@@ -1,4 +1,6 @@
 let conversationHistory = [];
+let conversationVersion = null; // 服务端会话状态版本号
+let pendingRegenerate = false;
 let isProcessing = false;
 let currentFilePath = null;
 let currentModel = 'sonnet';
@@ -337,6 +339,7 @@ async function clearHistory() {
 
         if (response.ok) {
             conversationHistory = [];
+            conversationVersion = null;
             chatContainer.innerHTML = '<div class="welcome-message"><h2>👋 你好！我是 Claude</h2><p>我可以帮助你解答问题、编写代码、分析文档等。请随时向我提问！</p></div>';
             addSystemMessage('✓ 对话历史已清除');
         }
@@ -398,6 +401,134 @@ function scrollToBottom() {
     chatContainer.scrollTop = chatContainer.scrollHeight;
 }
 
+// 读取 SSE 流：缓存跨数据块的不完整行，逐个事件回调 onEvent(data, eventId)
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let eventId = null;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (line.startsWith('id: ')) {
+                eventId = parseInt(line.slice(4), 10);
+                continue;
+            }
+            if (!line.startsWith('data: ')) continue;
+            let data;
+            try {
+                data = JSON.parse(line.slice(6));
+            } catch (e) {
+                // 忽略 JSON 解析错误
+                continue;
+            }
+            onEvent(data, eventId);
+        }
+    }
+}
+
+// 读取聊天轮次的事件流；连接中断时按 Last-Event-ID 重新接入，只回放错过的事件
+async function readTurnStream(response, onEvent) {
+    const maxReconnects = 5;
+    let turnId = null;
+    let lastEventId = 0;
+    let finished = false;
+
+    const handleEvent = (data, eventId) => {
+        if (eventId) lastEventId = eventId;
+        if (data.type === 'turn') {
+            turnId = data.turn_id;
+            return;
+        }
+        if (data.type === 'done' || data.type === 'error' || data.type === 'waiting_user_input') {
+            finished = true;
+        }
+        onEvent(data);
+    };
+
+    try {
+        await readEventStream(response, handleEvent);
+    } catch (e) {
+        console.log('Chat stream interrupted:', e);
+    }
+
+    let attempts = 0;
+    while (!finished && turnId && attempts < maxReconnects) {
+        attempts++;
+        await new Promise(resolve => setTimeout(resolve, 1000 * attempts));
+        try {
+            const retry = await fetch(`/api/chat/${turnId}/events`, {
+                headers: { 'Last-Event-ID': String(lastEventId) }
+            });
+            if (!retry.ok) break;
+            const before = lastEventId;
+            await readEventStream(retry, handleEvent);
+            if (lastEventId === before) {
+                // 没有新事件且连接正常结束（例如服务端重启后轮次已无法继续），不再重试
+                break;
+            }
+            attempts = 0;
+        } catch (e) {
+            console.log('Reconnect failed:', e);
+        }
+    }
+}
+
+// 流式文本增量渲染：只追加新文本，同一动画帧内的更新合并为一次 DOM 操作
+function createTextRenderer(messageDiv) {
+    let textDiv = null;
+    let textNode = null;
+    let pending = '';
+    let frameRequested = false;
+
+    function render() {
+        frameRequested = false;
+        if (!pending) return;
+        if (!textDiv) {
+            textDiv = document.createElement('div');
+            textDiv.className = 'message-content';
+            textNode = document.createTextNode('');
+            textDiv.appendChild(textNode);
+            messageDiv.appendChild(textDiv);
+        }
+        textNode.appendData(pending);
+        pending = '';
+        scrollToBottom();
+    }
+
+    return {
+        append(text) {
+            pending += text;
+            if (!frameRequested) {
+                frameRequested = true;
+                requestAnimationFrame(render);
+            }
+        },
+        // 立即渲染尚未显示的文本
+        flush: render,
+        // 删除末尾 count 个字符（模型调用重试时丢弃未完成的输出）
+        discard(count) {
+            render();
+            if (!textNode || count <= 0) return;
+            const removed = Math.min(count, textNode.length);
+            textNode.deleteData(textNode.length - removed, removed);
+        },
+        // 结束当前文本段，之后的文本显示在新的段落中
+        endSegment() {
+            render();
+            textDiv = null;
+            textNode = null;
+        }
+    };
+}
+
 // 自动调整输入框高度
 messageInput.addEventListener('input', function() {
     this.style.height = 'auto';
@@ -487,16 +618,14 @@ async function sendMessage() {
         // 获取auto_approve设置
         const autoApprove = document.getElementById('autoApproveToggle').checked;
 
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                message: message,
-                history: conversationHistory.slice(0, -1),
-                auto_approve: autoApprove
-            })
+        const regenerate = pendingRegenerate;
+        pendingRegenerate = false;
+
+        // 服务端保存完整对话，只需发送新消息和版本号
+        const response = await postChatMessage({
+            message: message,
+            auto_approve: autoApprove,
+            regenerate: regenerate
         });
 
         removeTypingIndicator();
@@ -515,150 +644,175 @@ async function sendMessage() {
         chatContainer.appendChild(messageDiv);
 
         let fullResponse = '';
-        let currentTextDiv = null;
+        const textRenderer = createTextRenderer(messageDiv);
         let toolCalls = []; // 记录工具调用
 
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    try {
-                        const data = JSON.parse(line.slice(6));
-                        console.log('Received SSE data:', data); // 调试日志
-
-                        if (data.type === 'text') {
-                            // 文本内容
-                            if (!currentTextDiv) {
-                                currentTextDiv = document.createElement('div');
-                                currentTextDiv.className = 'message-content';
-                                messageDiv.appendChild(currentTextDiv);
-                            }
-                            fullResponse += data.content;
-                            currentTextDiv.textContent = fullResponse;
-                            scrollToBottom();
-
-                        } else if (data.type === 'tool_use') {
-                            // 工具调用
-                            const toolDiv = document.createElement('div');
-                            toolDiv.className = 'tool-use';
-                            toolDiv.innerHTML = `
-                                <div class="tool-header">🔧 ${data.name}</div>
-                                <pre class="tool-input">${JSON.stringify(data.input, null, 2)}</pre>
-                            `;
-                            messageDiv.appendChild(toolDiv);
-                            scrollToBottom();
-
-                            // 记录工具调用
-                            toolCalls.push({
-                                type: 'tool_use',
-                                name: data.name,
-                                input: data.input
-                            });
-
-                        } else if (data.type === 'tool_result') {
-                            // 工具结果
-                            console.log('Tool result received:', data);
-
-                            // 检查是否是用户问题
-                            if (data.result && data.result.requires_user_input && data.result.questions) {
-                                // 显示用户问题界面
-                                console.log('Showing user questions:', data.result.questions);
-                                showUserQuestions(data.result.questions, messageDiv);
-                                scrollToBottom();
-                            } else {
-                                // 正常的工具结果
-                                const resultDiv = document.createElement('div');
-                                resultDiv.className = 'tool-result';
-
-                                let resultContent = '';
-                                if (data.result && data.result.success) {
-                                    resultContent = data.result.output || data.result.content || data.result.message || JSON.stringify(data.result, null, 2);
-                                } else if (data.result) {
-                                    resultContent = `❌ Error: ${data.result.error}`;
-                                } else {
-                                    resultContent = JSON.stringify(data.result, null, 2);
-                                }
-
-                                resultDiv.innerHTML = `
-                                    <div class="tool-result-header">📋 Result</div>
-                                    <pre class="tool-result-content">${resultContent}</pre>
-                                `;
-                                messageDiv.appendChild(resultDiv);
-                                scrollToBottom();
-                            }
-
-                            // 记录工具结果
-                            toolCalls.push({
-                                type: 'tool_result',
-                                name: data.name,
-                                result: data.result
-                            });
-
-                            // 重置文本容器，为后续文本做准备
-                            currentTextDiv = null;
-
-                        } else if (data.type === 'permission_required') {
-                            // 需要权限审批
-                            console.log('Permission required:', data); // 调试日志
-
-                            const permissionDiv = document.createElement('div');
-                            permissionDiv.className = 'permission-request';
-                            permissionDiv.id = `permission-${data.log_id}`;
-
-                            // 转义HTML以防止XSS，但保留换行
-                            const previewText = (data.preview || '此操作需要您的批准')
-                                .replace(/&/g, '&amp;')
-                                .replace(/</g, '&lt;')
-                                .replace(/>/g, '&gt;')
-                                .replace(/\n/g, '<br>');
-
-                            permissionDiv.innerHTML = `
-                                <div class="permission-header">⚠️ 需要权限审批</div>
-                                <div class="permission-preview">${previewText}</div>
-                                <div class="permission-actions">
-                                    <button class="approve-btn" onclick="approvePermission(${data.log_id})">批准</button>
-                                    <button class="reject-btn" onclick="rejectPermission(${data.log_id})">拒绝</button>
-                                </div>
-                            `;
-                            messageDiv.appendChild(permissionDiv);
-                            scrollToBottom();
-
-                            // 确保权限请求可见
-                            console.log('Permission div added to DOM:', permissionDiv);
-
-                        } else if (data.type === 'waiting_user_input') {
-                            // 等待用户输入（ask_user_question）
-                            console.log('Waiting for user input');
-                            // 显示提示信息
-                            const waitingDiv = document.createElement('div');
-                            waitingDiv.className = 'waiting-input';
-                            waitingDiv.innerHTML = `
-                                <div class="waiting-header">⏸️ 等待用户回答</div>
-                                <div class="waiting-message">Claude正在等待您回答上面的问题</div>
-                            `;
-                            messageDiv.appendChild(waitingDiv);
-                            scrollToBottom();
-
-                        } else if (data.type === 'error') {
-                            const errorDiv = document.createElement('div');
-                            errorDiv.className = 'message-content error';
-                            errorDiv.textContent = `错误: ${data.error}`;
-                            messageDiv.appendChild(errorDiv);
-                        }
-                    } catch (e) {
-                        // 忽略 JSON 解析错误
+        await readTurnStream(response, (data) => {
+            if (data.type === 'text') {
+                // 文本内容：只追加新文本
+                fullResponse += data.content;
+                textRenderer.append(data.content);
+                return;
+            }
+
+            // 其他事件前先渲染已收到的文本，保持显示顺序
+            textRenderer.flush();
+            console.log('Received SSE data:', data); // 调试日志
+
+            if (data.type === 'tool_use') {
+                // 工具调用
+                const toolDiv = document.createElement('div');
+                toolDiv.className = 'tool-use';
+                toolDiv.innerHTML = `
+                    <div class="tool-header">🔧 ${data.name}</div>
+                    <pre class="tool-input">${JSON.stringify(data.input, null, 2)}</pre>
+                `;
+                messageDiv.appendChild(toolDiv);
+                scrollToBottom();
+
+                // 记录工具调用
+                toolCalls.push({
+                    type: 'tool_use',
+                    name: data.name,
+                    input: data.input
+                });
+
+            } else if (data.type === 'tool_result') {
+                // 工具结果
+                console.log('Tool result received:', data);
+
+                // 检查是否是用户问题
+                if (data.result && data.result.requires_user_input && data.result.questions) {
+                    // 显示用户问题界面
+                    console.log('Showing user questions:', data.result.questions);
+                    showUserQuestions(data.result.questions, messageDiv);
+                    scrollToBottom();
+                } else {
+                    // 正常的工具结果
+                    const resultDiv = document.createElement('div');
+                    resultDiv.className = 'tool-result';
+
+                    let resultContent = '';
+                    if (data.result && data.result.success) {
+                        resultContent = data.result.output || data.result.content || data.result.message || JSON.stringify(data.result, null, 2);
+                    } else if (data.result) {
+                        resultContent = `❌ Error: ${data.result.error}`;
+                    } else {
+                        resultContent = JSON.stringify(data.result, null, 2);
                     }
+
+                    resultDiv.innerHTML = `
+                        <div class="tool-result-header">📋 Result</div>
+                        <pre class="tool-result-content">${resultContent}</pre>
+                    `;
+                    messageDiv.appendChild(resultDiv);
+                    scrollToBottom();
+                }
+
+                // 记录工具结果
+                toolCalls.push({
+                    type: 'tool_result',
+                    name: data.name,
+                    result: data.result
+                });
+
+                // 结束当前文本段，后续文本另起一段
+                textRenderer.endSegment();
+
+            } else if (data.type === 'permission_required') {
+                // 需要权限审批
+                console.log('Permission required:', data); // 调试日志
+
+                const permissionDiv = document.createElement('div');
+                permissionDiv.className = 'permission-request';
+                permissionDiv.id = `permission-${data.log_id}`;
+
+                // 转义HTML以防止XSS，但保留换行
+                const previewText = (data.preview || '此操作需要您的批准')
+                    .replace(/&/g, '&amp;')
+                    .replace(/</g, '&lt;')
+                    .replace(/>/g, '&gt;')
+                    .replace(/\n/g, '<br>');
+
+                permissionDiv.innerHTML = `
+                    <div class="permission-header">⚠️ 需要权限审批</div>
+                    <div class="permission-preview">${previewText}</div>
+                    <div class="permission-actions">
+                        <button class="approve-btn" onclick="approvePermission(${data.log_id})">批准</button>
+                        <button class="reject-btn" onclick="rejectPermission(${data.log_id})">拒绝</button>
+                    </div>
+                `;
+                messageDiv.appendChild(permissionDiv);
+                scrollToBottom();
+
+                // 确保权限请求可见
+                console.log('Permission div added to DOM:', permissionDiv);
+
+            } else if (data.type === 'waiting_user_input') {
+                // 等待用户输入（ask_user_question）
+                console.log('Waiting for user input');
+                // 显示提示信息
+                const waitingDiv = document.createElement('div');
+                waitingDiv.className = 'waiting-input';
+                waitingDiv.innerHTML = `
+                    <div class="waiting-header">⏸️ 等待用户回答</div>
+                    <div class="waiting-message">Claude正在等待您回答上面的问题</div>
+                `;
+                messageDiv.appendChild(waitingDiv);
+                scrollToBottom();
+
+            } else if (data.type === 'state') {
+                conversationVersion = data.version;
+
+            } else if (data.type === 'compaction') {
+                // 上下文已压缩
+                console.log('Context compacted:', data);
+                const noticeDiv = document.createElement('div');
+                noticeDiv.className = 'message-content compaction-notice';
+                noticeDiv.textContent = `📦 上下文已压缩: ~${data.tokens_before} → ~${data.tokens_after} tokens (${data.strategies.join(', ')})`;
+                messageDiv.appendChild(noticeDiv);
+
+            } else if (data.type === 'metrics') {
+                // 本轮耗时分解（首字节/首文本、模型、工具、数据库）
+                console.log('Turn metrics:', data.metrics);
+
+            } else if (data.type === 'queued') {
+                // 并发达到上限，本轮在服务端排队
+                let queueDiv = messageDiv.querySelector('.queue-notice');
+                if (!queueDiv) {
+                    queueDiv = document.createElement('div');
+                    queueDiv.className = 'message-content retry-notice queue-notice';
+                    messageDiv.appendChild(queueDiv);
+                }
+                queueDiv.textContent = `⏳ 服务器繁忙，正在排队（第 ${data.position} 位）`;
+
+            } else if (data.type === 'admitted') {
+                const queueDiv = messageDiv.querySelector('.queue-notice');
+                if (queueDiv) queueDiv.remove();
+
+            } else if (data.type === 'retry') {
+                // 模型调用失败后重试本轮：删除未完成的输出并提示
+                console.warn('Model call retry:', data);
+                if (data.discard_text) {
+                    fullResponse = fullResponse.slice(0, -data.discard_text);
+                    textRenderer.discard(data.discard_text);
                 }
+                textRenderer.endSegment();
+                const noticeDiv = document.createElement('div');
+                noticeDiv.className = 'message-content retry-notice';
+                noticeDiv.textContent = data.failover
+                    ? `🔁 切换到 ${data.model} 重试`
+                    : `🔁 模型服务繁忙，${data.delay}s 后重试（第 ${data.attempt} 次）`;
+                messageDiv.appendChild(noticeDiv);
+
+            } else if (data.type === 'error') {
+                const errorDiv = document.createElement('div');
+                errorDiv.className = 'message-content error';
+                errorDiv.textContent = `错误: ${data.error}`;
+                messageDiv.appendChild(errorDiv);
             }
-        }
+        });
+        textRenderer.flush();
 
         // 添加时间显示
         const timeDiv = document.createElement('div');
@@ -688,28 +842,9 @@ async function sendMessage() {
             toolCalls: toolCalls // 保存工具调用信息
         };
 
+        // 助手消息（含工具调用）由服务端在本轮结束时保存
         conversationHistory.push(assistantMessage);
 
-        // 保存到数据库
-        try {
-            await fetch('/api/save-message', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    role: 'assistant',
-                    content: fullResponse,
-                    metadata: {
-                        html: messageDiv.innerHTML,
-                        toolCalls: toolCalls
-                    }
-                })
-            });
-        } catch (error) {
-            console.error('保存消息失败:', error);
-        }
-
     } catch (error) {
         removeTypingIndicator();
         addMessage('assistant', `错误: ${error.message}`);
@@ -720,6 +855,25 @@ async function sendMessage() {
     messageInput.focus();
 }
 
+// 发送聊天请求；若对话已在其他窗口更新（409），同步版本号后重试一次
+async function postChatMessage(payload) {
+    const send = () => fetch('/api/chat', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ ...payload, version: conversationVersion })
+    });
+
+    let response = await send();
+    if (response.status === 409) {
+        const conflict = await response.json();
+        conversationVersion = conflict.version;
+        response = await send();
+    }
+    return response;
+}
+
 // 处理命令
 async function handleCommand(command) {
     try {
@@ -729,8 +883,7 @@ async function handleCommand(command) {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
-                message: command,
-                history: []
+                message: command
             })
         });
 
@@ -1378,34 +1531,15 @@ async function continueConversationWithAnswers(answerText, answers) {
             content: answerText
         });
 
-        // 保存用户答案到数据库
-        await fetch('/api/save-message', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                role: 'user',
-                content: answerText
-            })
-        });
-
         // 显示用户答案消息
         addMessage('user', answerText);
 
         // 显示输入指示器
         showTypingIndicator();
 
-        // 继续对话
-        const response = await fetch('/api/chat', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                message: answerText,
-                history: conversationHistory.slice(0, -1)
-            })
+        // 继续对话（答案会与服务端保存的工具结果合并）
+        const response = await postChatMessage({
+            message: answerText
         });
 
         removeTypingIndicator();
@@ -1422,57 +1556,27 @@ async function continueConversationWithAnswers(answerText, answers) {
         chatContainer.appendChild(messageDiv);
 
         let fullResponse = '';
-        let currentTextDiv = null;
-
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
-
-        while (true) {
-            const { done, value } = await reader.read();
-            if (done) break;
-
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
-
-            for (const line of lines) {
-                if (line.startsWith('data: ')) {
-                    try {
-                        const data = JSON.parse(line.slice(6));
-
-                        if (data.type === 'text') {
-                            if (!currentTextDiv) {
-                                currentTextDiv = document.createElement('div');
-                                currentTextDiv.className = 'message-content';
-                                messageDiv.appendChild(currentTextDiv);
-                            }
-                            fullResponse += data.content;
-                            currentTextDiv.textContent = fullResponse;
-                            scrollToBottom();
-                        }
-                    } catch (e) {
-                        // Ignore parse errors
-                    }
-                }
+        const textRenderer = createTextRenderer(messageDiv);
+
+        await readTurnStream(response, (data) => {
+            if (data.type === 'text') {
+                fullResponse += data.content;
+                textRenderer.append(data.content);
+            } else if (data.type === 'retry' && data.discard_text) {
+                fullResponse = fullResponse.slice(0, -data.discard_text);
+                textRenderer.discard(data.discard_text);
+            } else if (data.type === 'state') {
+                conversationVersion = data.version;
             }
-        }
+        });
+        textRenderer.flush();
 
-        // 保存 assistant 响应
+        // 用户答案和 assistant 响应由服务端保存
         if (fullResponse) {
             conversationHistory.push({
                 role: 'assistant',
                 content: fullResponse
             });
-
-            await fetch('/api/save-message', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    role: 'assistant',
-                    content: fullResponse
-                })
-            });
         }
 
     } catch (error) {
@@ -1878,8 +1982,9 @@ function regenerateMessage() {
         conversationHistory.pop();
     }
 
-    // 重新发送
+    // 重新发送（服务端丢弃上一轮后重新回答）
     messageInput.value = lastUserMessage;
+    pendingRegenerate = true;
     sendMessage();
 }
 
@@ -1900,12 +2005,43 @@ function copyMessage(button) {
 }
 
 // ========== 加载历史消息时也增强显示 ==========
+// 显示历史消息中的工具调用和结果
+function renderHistoryToolCalls(messageDiv, toolCalls) {
+    toolCalls.forEach(call => {
+        const div = document.createElement('div');
+        const header = document.createElement('div');
+        const body = document.createElement('pre');
+        if (call.type === 'tool_use') {
+            div.className = 'tool-use';
+            header.className = 'tool-header';
+            header.textContent = `🔧 ${call.name}`;
+            body.className = 'tool-input';
+            body.textContent = JSON.stringify(call.input, null, 2);
+        } else {
+            const result = call.result || {};
+            div.className = 'tool-result';
+            header.className = 'tool-result-header';
+            header.textContent = '📋 Result';
+            body.className = 'tool-result-content';
+            body.textContent = result.error ? `❌ Error: ${result.error}`
+                : (result.output || result.content || result.message || JSON.stringify(result, null, 2));
+        }
+        div.appendChild(header);
+        div.appendChild(body);
+        messageDiv.appendChild(div);
+    });
+}
+
 const originalLoadHistoryFromDB = loadHistoryFromDB;
 loadHistoryFromDB = async function() {
     try {
         const response = await fetch('/api/history?limit=50');
         const data = await response.json();
 
+        if (response.ok) {
+            conversationVersion = data.conversation_version;
+        }
+
         if (response.ok && data.history && data.history.length > 0) {
             const welcomeMessage = chatContainer.querySelector('.welcome-message');
             if (welcomeMessage) {
@@ -1919,6 +2055,10 @@ loadHistoryFromDB = async function() {
                 if (msg.metadata && msg.metadata.html) {
                     messageDiv.innerHTML = msg.metadata.html;
                 } else {
+                    // 服务端保存的工具调用记录
+                    if (msg.metadata && msg.metadata.toolCalls) {
+                        renderHistoryToolCalls(messageDiv, msg.metadata.toolCalls);
+                    }
                     const contentDiv = document.createElement('div');
                     contentDiv.className = 'message-content';
                     contentDiv.textContent = msg.content;
@@ -0,0 +1,445 @@
+"""
+Record and replay model streams.
+
+RecordingClient wraps an Anthropic client and tees every streamed
+messages.create() call into a JSONL fixture: the raw stream events
+(message_start, content_block_start/delta/stop, tool_use blocks...) with
+their arrival times, plus any error. ReplayClient serves those calls back
+in order, with the recorded timing (optionally scaled) or a fixed
+per-event delay, so the agentic loop - SSE encoding, tool routing and
+database writes - can be run and benchmarked without network access.
+
+Fixture lines:
+
+    {"call": 1, "t": 0.41, "request": {"model": ..., "messages": 5, "tools": 12}}
+    {"call": 1, "t": 0.43, "event": {"type": "content_block_delta", ...}}
+    {"call": 1, "t": 2.10, "error": {"message": ..., "status_code": 529}}
+
+'t' is seconds since the call was sent; the request line is written when
+the response headers arrived.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+import anthropic
+import httpx
+import pydantic
+from anthropic.types import RawMessageStreamEvent
+
+import config
+
+
+# Directory for fixtures of live chat turns; None disables recording
+RECORD_DIR = getattr(config, 'MODEL_STREAM_RECORD_DIR', None)
+
+_event_adapter = pydantic.TypeAdapter(RawMessageStreamEvent)
+_fixtures: Dict[str, List[Dict[str, Any]]] = {}
+_fixtures_lock = threading.Lock()
+
+
+def new_fixture_path(session_id: Optional[str] = None) -> str:
+    """Path of a new fixture file in RECORD_DIR."""
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(session_id or 'turn')[:8]}-{uuid.uuid4().hex[:6]}.jsonl"
+    return os.path.join(RECORD_DIR, name)
+
+
+# ---------------------------------------------------------------- recording
+
+def _request_summary(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """What a fixture keeps of a request (not the conversation itself)."""
+    return {
+        'model': kwargs.get('model'),
+        'max_tokens': kwargs.get('max_tokens'),
+        'messages': len(kwargs.get('messages') or []),
+        'tools': len(kwargs.get('tools') or [])
+    }
+
+
+def _error_info(error: Exception) -> Dict[str, Any]:
+    info = {'type': type(error).__name__, 'message': str(error)}
+    if isinstance(error, anthropic.APIStatusError):
+        info['status_code'] = error.status_code
+        info['body'] = error.body
+        retry_after = error.response.headers.get('retry-after')
+        if retry_after:
+            info['headers'] = {'retry-after': retry_after}
+    return info
+
+
+class _CallRecorder:
+    """Lines of one recorded call, written to the fixture when the call ends."""
+
+    def __init__(self, path: str, call: int, kwargs: Dict[str, Any]):
+        self.path = path
+        self.call = call
+        self.request = _request_summary(kwargs)
+        self.started = time.monotonic()
+        self.lines: List[Dict[str, Any]] = []
+
+    def _elapsed(self) -> float:
+        return round(time.monotonic() - self.started, 4)
+
+    def response(self):
+        self.lines.append({'call': self.call, 't': self._elapsed(), 'request': self.request})
+
+    def event(self, event: Any):
+        self.lines.append({
+            'call': self.call,
+            't': self._elapsed(),
+            'event': event.model_dump(mode='json', exclude_unset=True)
+        })
+
+    def error(self, error: Exception):
+        if not self.lines:
+            self.response()
+        self.lines.append({'call': self.call, 't': self._elapsed(), 'error': _error_info(error)})
+        self.write()
+
+    def write(self):
+        if not self.lines:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for line in self.lines:
+                f.write(json.dumps(line, ensure_ascii=False) + '\n')
+        self.lines = []
+
+
+class _RecordingStream:
+    def __init__(self, stream, recorder: _CallRecorder):
+        self._stream = stream
+        self._recorder = recorder
+
+    def __iter__(self):
+        try:
+            for event in self._stream:
+                self._recorder.event(event)
+                yield event
+        except Exception as e:
+            self._recorder.error(e)
+            raise
+        finally:
+            # Also keeps what arrived when the reader stops early
+            self._recorder.write()
+
+    def close(self):
+        self._stream.close()
+
+
+class _RecordingMessages:
+    def __init__(self, owner: "RecordingClient"):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        owner = self._owner
+        if not kwargs.get('stream'):
+            return owner.client.messages.create(**kwargs)
+        owner.calls += 1
+        recorder = _CallRecorder(owner.path, owner.calls, kwargs)
+        try:
+            stream = owner.client.messages.create(**kwargs)
+        except Exception as e:
+            recorder.error(e)
+            raise
+        recorder.response()
+        return _RecordingStream(stream, recorder)
+
+
+class RecordingClient:
+    """Anthropic client wrapper that records streamed calls to a fixture."""
+
+    def __init__(self, client, path: str):
+        """
+        Initialize recording client.
+
+        Args:
+            client: Client to wrap
+            path: Fixture file, appended to
+        """
+        self.client = client
+        self.path = path
+        self.calls = 0
+        self.messages = _RecordingMessages(self)
+
+    def __getattr__(self, name):
+        # base_url, with_options... come from the wrapped client
+        return getattr(self.client, name)
+
+
+class _AsyncRecordingStream(_RecordingStream):
+    async def __aiter__(self):
+        try:
+            async for event in self._stream:
+                self._recorder.event(event)
+                yield event
+        except Exception as e:
+            self._recorder.error(e)
+            raise
+        finally:
+            # Also keeps what arrived when the reader stops early
+            self._recorder.write()
+
+    async def close(self):
+        await self._stream.close()
+
+
+class _AsyncRecordingMessages(_RecordingMessages):
+    async def create(self, **kwargs):
+        owner = self._owner
+        if not kwargs.get('stream'):
+            return await owner.client.messages.create(**kwargs)
+        owner.calls += 1
+        recorder = _CallRecorder(owner.path, owner.calls, kwargs)
+        try:
+            stream = await owner.client.messages.create(**kwargs)
+        except Exception as e:
+            recorder.error(e)
+            raise
+        recorder.response()
+        return _AsyncRecordingStream(stream, recorder)
+
+
+class AsyncRecordingClient(RecordingClient):
+    """AsyncAnthropic client wrapper that records streamed calls to a fixture."""
+
+    def __init__(self, client, path: str):
+        super().__init__(client, path)
+        self.messages = _AsyncRecordingMessages(self)
+
+
+# ---------------------------------------------------------------- replay
+
+def load_fixture(path: str) -> List[Dict[str, Any]]:
+    """
+    Parse a fixture file (cached per path).
+
+    Returns:
+        One dict per call: {'request', 'ttfb', 'events': [(t, event)], 'error'}
+    """
+    calls = _fixtures.get(path)
+    if calls is not None:
+        return calls
+
+    by_call: Dict[int, Dict[str, Any]] = {}
+    with open(path, encoding='utf-8') as f:
+        for raw in f:
+            if not raw.strip():
+                continue
+            line = json.loads(raw)
+            call = by_call.setdefault(line['call'], {
+                'request': None, 'ttfb': 0.0, 'events': [], 'error': None
+            })
+            if 'request' in line:
+                call['request'] = line['request']
+                call['ttfb'] = line.get('t', 0.0)
+            elif 'event' in line:
+                call['events'].append((line.get('t', 0.0), _event_adapter.validate_python(line['event'])))
+            elif 'error' in line:
+                call['error'] = line['error']
+
+    calls = [by_call[number] for number in sorted(by_call)]
+    with _fixtures_lock:
+        _fixtures[path] = calls
+    return calls
+
+
+def replay_error(info: Dict[str, Any]) -> Exception:
+    """Rebuild a recorded error: API status errors keep their status, the rest become connection errors."""
+    status_code = info.get('status_code')
+    if status_code is None:
+        return httpx.ReadError(info.get('message', 'replayed connection error'))
+    request = httpx.Request('POST', 'https://replay.invalid/v1/messages')
+    response = httpx.Response(status_code, headers=info.get('headers') or {}, request=request)
+    return anthropic.APIStatusError(info.get('message', ''), response=response, body=info.get('body'))
+
+
+class _ReplayStream:
+    def __init__(self, call: Dict[str, Any], client: "ReplayClient"):
+        self._call = call
+        self._client = client
+
+    def _delays(self):
+        previous = self._call['ttfb']
+        for t, event in self._call['events']:
+            yield self._client.delay(t - previous), event
+            previous = t
+
+    def __iter__(self):
+        for delay, event in self._delays():
+            if delay > 0:
+                time.sleep(delay)
+            yield event
+        if self._call['error']:
+            raise replay_error(self._call['error'])
+
+    def close(self):
+        pass
+
+
+class _ReplayMessages:
+    def __init__(self, client: "ReplayClient"):
+        self._client = client
+
+    def create(self, **kwargs):
+        call = self._client.next_call(kwargs)
+        delay = self._client.delay(call['ttfb'])
+        if delay > 0:
+            time.sleep(delay)
+        if call['error'] and not call['events']:
+            raise replay_error(call['error'])
+        return _ReplayStream(call, self._client)
+
+
+class ReplayClient:
+    """
+    Stand-in for an Anthropic client that replays a fixture.
+
+    Every messages.create() returns the next recorded call, so one
+    ReplayClient replays one recorded turn; use a new one per turn.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, event_delay: Optional[float] = None,
+                 base_url: str = 'replay'):
+        """
+        Initialize replay client.
+
+        Args:
+            path: Fixture file
+            speed: Replay speed relative to the recording (2 = twice as
+                fast, 0 = no delays at all)
+            event_delay: Fixed delay before every event (and before the
+                response), in seconds; overrides the recorded timing
+            base_url: Reported base URL (circuit breaker key)
+        """
+        self.path = path
+        self.speed = speed
+        self.event_delay = event_delay
+        self.base_url = base_url
+        self.calls = load_fixture(path)
+        self.requests: List[Dict[str, Any]] = []
+        self.messages = _ReplayMessages(self)
+
+    def next_call(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if len(self.requests) >= len(self.calls):
+            raise RuntimeError(f'Replay fixture {self.path} has no more recorded calls')
+        self.requests.append(_request_summary(kwargs))
+        return self.calls[len(self.requests) - 1]
+
+    def delay(self, recorded: float) -> float:
+        """Delay to apply for a recorded interval."""
+        if self.event_delay is not None:
+            return self.event_delay
+        if not self.speed:
+            return 0.0
+        return max(0.0, recorded) / self.speed
+
+    def with_options(self, **kwargs) -> "ReplayClient":
+        return self
+
+
+class _AsyncReplayStream(_ReplayStream):
+    async def __aiter__(self):
+        for delay, event in self._delays():
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield event
+        if self._call['error']:
+            raise replay_error(self._call['error'])
+
+    async def close(self):
+        pass
+
+
+class _AsyncReplayMessages(_ReplayMessages):
+    async def create(self, **kwargs):
+        call = self._client.next_call(kwargs)
+        delay = self._client.delay(call['ttfb'])
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if call['error'] and not call['events']:
+            raise replay_error(call['error'])
+        return _AsyncReplayStream(call, self._client)
+
+
+class AsyncReplayClient(ReplayClient):
+    """ReplayClient for AsyncChatTurn."""
+
+    def __init__(self, path: str, speed: float = 1.0, event_delay: Optional[float] = None,
+                 base_url: str = 'replay'):
+        super().__init__(path, speed, event_delay, base_url)
+        self.messages = _AsyncReplayMessages(self)
+
+
+def write_synthetic_fixture(path: str, calls: List[Dict[str, Any]],
+                            model_id: str = 'claude-sonnet-4-5', chunk_chars: int = 8,
+                            ttfb: float = 0.3, event_interval: float = 0.02):
+    """
+    Write a fixture without recording a live model.
+
+    Args:
+        path: Fixture file (overwritten)
+        calls: One dict per model call: {'text': answer text,
+            'tool_uses': [(tool name, input dict), ...]}, or {'error': error
+            info as in recorded fixtures} for a call that fails
+        model_id: Model ID reported in message_start
+        chunk_chars: Characters per text delta
+        ttfb: Seconds before the response of each call
+        event_interval: Seconds between events
+    """
+    lines = []
+    for number, spec in enumerate(calls, 1):
+        text = spec.get('text', '')
+        tool_uses = spec.get('tool_uses', [])
+        events = [{
+            'type': 'message_start',
+            'message': {
+                'id': f'msg_synthetic_{number}', 'type': 'message', 'role': 'assistant',
+                'content': [], 'model': model_id, 'stop_reason': None, 'stop_sequence': None,
+                'usage': {'input_tokens': 1000, 'output_tokens': 1}
+            }
+        }]
+        index = 0
+        if text:
+            events.append({'type': 'content_block_start', 'index': 0,
+                           'content_block': {'type': 'text', 'text': ''}})
+            for i in range(0, len(text), chunk_chars):
+                events.append({'type': 'content_block_delta', 'index': 0,
+                               'delta': {'type': 'text_delta', 'text': text[i:i + chunk_chars]}})
+            events.append({'type': 'content_block_stop', 'index': 0})
+            index = 1
+        for name, tool_input in tool_uses:
+            events.append({'type': 'content_block_start', 'index': index, 'content_block': {
+                'type': 'tool_use', 'id': f'toolu_synthetic_{number}_{index}', 'name': name, 'input': {}
+            }})
+            events.append({'type': 'content_block_delta', 'index': index,
+                           'delta': {'type': 'input_json_delta', 'partial_json': json.dumps(tool_input)}})
+            events.append({'type': 'content_block_stop', 'index': index})
+            index += 1
+        events.append({
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'tool_use' if tool_uses else 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': max(1, len(text) // 4)}
+        })
+        events.append({'type': 'message_stop'})
+
+        lines.append({'call': number, 't': ttfb, 'request': {'model': model_id}})
+        if spec.get('error'):
+            lines.append({'call': number, 't': ttfb, 'error': spec['error']})
+            continue
+        t = ttfb
+        for event in events:
+            t = round(t + event_interval, 4)
+            lines.append({'call': number, 't': t, 'event': event})
+
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+    with _fixtures_lock:
+        _fixtures.pop(path, None)
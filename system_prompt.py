@@ -35,6 +35,7 @@ You are an interactive tool that helps users with coding, debugging, file operat
 - Use specialized tools (Read, Edit, Write) instead of bash commands for file operations
 - Use Grep with appropriate output_mode for different search needs
 - For large files, use offset and limit parameters in Read tool
+- Large tool results are truncated; use read_tool_output with their output_handle when the elided part matters
 - Provide clear descriptions for bash commands
 
 # Best Practices
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+并发限制测试：每用户/全局上限、按用户轮转的排队顺序、排队超时和工具令牌桶
+"""
+
+import sys
+import os
+import threading
+import time
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from admission import AdmissionController, ToolRateLimiter, QueueFull
+
+
+def test_limits():
+    """测试每用户和全局上限"""
+    print("\n测试并发上限...")
+    controller = AdmissionController(per_user=2, global_limit=3, max_queued=2)
+    a1, a2, a3 = (controller.enqueue('alice') for _ in range(3))
+    assert a1.granted and a2.granted and not a3.granted, "每用户上限未生效"
+    b1 = controller.enqueue('bob')
+    assert b1.granted
+    c1 = controller.enqueue('carol')
+    assert not c1.granted, "全局上限未生效"
+
+    controller.enqueue('alice')
+    try:
+        controller.enqueue('alice')
+        assert False, "排队数超过上限时应拒绝"
+    except QueueFull:
+        pass
+
+    controller.release(b1)
+    assert c1.granted, "空出的名额应给到未达上限的用户"
+    print("  ✓ 每用户上限、全局上限和排队上限正常")
+
+
+def test_round_robin():
+    """测试排队按用户轮转，而不是先到先得"""
+    print("\n测试轮转调度...")
+    controller = AdmissionController(per_user=5, global_limit=1, max_queued=10)
+    running = controller.enqueue('alice')
+    alice = [controller.enqueue('alice') for _ in range(3)]
+    bob = controller.enqueue('bob')
+
+    with controller._cond:
+        positions = [controller._position(t) for t in alice + [bob]]
+    assert positions == [1, 3, 4, 2], f"排队位置不正确: {positions}"
+
+    controller.release(running)
+    assert alice[0].granted
+    controller.release(alice[0])
+    assert bob.granted and not alice[1].granted, "第二个名额应轮到 bob"
+    print("  ✓ 多个用户排队时轮流获得名额")
+
+
+def test_queue_events():
+    """测试排队事件和超时"""
+    print("\n测试排队事件...")
+    controller = AdmissionController(per_user=1, global_limit=1, max_queued=5, queue_timeout=5)
+    running = controller.enqueue('alice')
+    ticket = controller.enqueue('bob')
+    events = []
+
+    def consume():
+        events.extend(controller.admitted(ticket, iter([{'type': 'done'}]), lambda e: []))
+
+    reader = threading.Thread(target=consume)
+    reader.start()
+    time.sleep(0.1)
+    controller.release(running)
+    reader.join(2)
+    types = [e['type'] for e in events]
+    assert types == ['queued', 'admitted', 'done'], f"事件顺序不正确: {types}"
+    assert events[0]['position'] == 1
+    assert controller.get_stats()['running'] == 0, "轮次结束后未释放名额"
+
+    controller = AdmissionController(per_user=1, global_limit=1, queue_timeout=0.2)
+    controller.enqueue('alice')
+    ticket = controller.enqueue('bob')
+    events = list(controller.admitted(ticket, iter([{'type': 'done'}]),
+                                      lambda e: [{'type': 'error', 'error': str(e)}]))
+    assert [e['type'] for e in events] == ['queued', 'error'], "排队超时后不应执行本轮"
+    assert controller.get_stats()['waiting'] == 0
+    print("  ✓ 排队位置事件、入队执行和超时正常")
+
+
+def test_tool_bucket():
+    """测试工具令牌桶"""
+    print("\n测试工具令牌桶...")
+    limiter = ToolRateLimiter(rate=10, burst=4, costs={'bash': 4})
+    assert limiter.try_acquire('alice', 'read_file')
+    assert not limiter.try_acquire('alice', 'bash'), "令牌不足时不应立即执行"
+    assert limiter.try_acquire('bob', 'bash'), "令牌桶应按用户独立"
+    delay = limiter.reserve('alice', 'bash')
+    assert 0.05 < delay <= 0.15, f"等待时间不正确: {delay}"
+    print(f"  ✓ 令牌不足时等待 {delay:.2f}s")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("并发限制测试")
+    print("=" * 60)
+
+    try:
+        test_limits()
+        test_round_robin()
+        test_queue_events()
+        test_tool_bucket()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+聊天循环端到端测试：用回放文件代替真实模型，覆盖工具调用、重试和录制
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import model_retry
+import stream_replay
+from chat_pipeline import ChatTurn
+from testenv import TempDatabase
+
+WORKDIR = tempfile.mkdtemp(prefix='test-chat-replay-')
+db = TempDatabase(WORKDIR)
+_saved_delay = model_retry.BASE_DELAY
+
+
+def setup_module(module=None):
+    db.start()
+    model_retry.BASE_DELAY = 0.01
+
+
+def teardown_module(module=None):
+    model_retry.BASE_DELAY = _saved_delay
+    db.stop()
+
+
+def run_turn(client, session_id):
+    """执行一轮，返回事件列表"""
+    messages = [{'role': 'user', 'content': '看一下这个目录'}]
+    turn = ChatTurn(client, 'sonnet', 'claude-sonnet-4-5', messages, -1, 'test', session_id)
+    return list(turn.run()), messages
+
+
+def half_open_breaker(base_url):
+    """熔断后已过等待时间，下一次调用为半开探测"""
+    breaker = model_retry.get_circuit_breaker(base_url)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+    return breaker
+
+
+def test_tool_turn():
+    """测试工具调用轮次"""
+    print("\n测试工具调用轮次...")
+    fixture = os.path.join(WORKDIR, 'tools.jsonl')
+    stream_replay.write_synthetic_fixture(fixture, [
+        {'text': '我先看一下。', 'tool_uses': [('list_directory', {'path': WORKDIR})]},
+        {'text': '目录里有测试数据库。'}
+    ])
+    client = stream_replay.ReplayClient(fixture, speed=0)
+    events, messages = run_turn(client, 'replay-tools')
+    types = [e['type'] for e in events]
+
+    assert types[-1] == 'done', f"轮次未正常结束: {types}"
+    assert 'tool_use' in types and 'tool_result' in types, "缺少工具事件"
+    result = next(e for e in events if e['type'] == 'tool_result')['result']
+    assert result['success'], f"工具执行失败: {result}"
+    text = ''.join(e['content'] for e in events if e['type'] == 'text')
+    assert text == '我先看一下。目录里有测试数据库。', f"文本不一致: {text}"
+    assert [m['role'] for m in messages] == ['user', 'assistant', 'user', 'assistant']
+    metrics = next(e for e in events if e['type'] == 'metrics')['metrics']
+    assert metrics['iterations'] == 2 and 'list_directory' in metrics['tools']
+    assert len(client.requests) == 2
+    print("  ✓ 工具调用、消息历史和耗时统计正常")
+
+
+def test_retry_turn():
+    """测试模型调用失败后重试"""
+    print("\n测试失败重试...")
+    fixture = os.path.join(WORKDIR, 'retry.jsonl')
+    stream_replay.write_synthetic_fixture(fixture, [
+        {'error': {'message': 'Overloaded', 'status_code': 529}},
+        {'text': '重试成功'}
+    ])
+    events, _ = run_turn(stream_replay.ReplayClient(fixture, speed=0), 'replay-retry')
+    types = [e['type'] for e in events]
+
+    assert types.count('retry') == 1 and types[-1] == 'done', f"重试未生效: {types}"
+    usage = next(e for e in events if e['type'] == 'usage')
+    assert usage['model_calls']['retries'] == 1
+    print("  ✓ 529 后重试并完成")
+
+
+def test_half_open_probe():
+    """测试半开探测以不可重试的错误结束或中途断开时，熔断器不会一直拒绝调用"""
+    print("\n测试半开探测...")
+    fixture = os.path.join(WORKDIR, 'bad-request.jsonl')
+    stream_replay.write_synthetic_fixture(fixture, [
+        {'error': {'message': 'prompt is too long', 'status_code': 400}}
+    ])
+    breaker = half_open_breaker('replay-probe-400')
+    events, _ = run_turn(stream_replay.ReplayClient(fixture, speed=0, base_url='replay-probe-400'), 'probe-400')
+    assert events[-1]['type'] == 'error', [e['type'] for e in events]
+    assert breaker.get_stats()['state'] == 'closed', "端点已正常响应，应关闭熔断器"
+    assert [breaker.allow() for _ in range(3)] == [True, True, True]
+
+    # 浏览器断开，轮次在探测调用的流中途被关闭
+    fixture = os.path.join(WORKDIR, 'abandoned.jsonl')
+    stream_replay.write_synthetic_fixture(fixture, [{'text': '第一段。' * 50}])
+    breaker = half_open_breaker('replay-probe-closed')
+    client = stream_replay.ReplayClient(fixture, speed=0, base_url='replay-probe-closed')
+    turn = ChatTurn(client, 'sonnet', 'claude-sonnet-4-5', [{'role': 'user', 'content': 'hi'}], -1,
+                    'test', 'probe-closed')
+    stream = turn.run()
+    assert next(e for e in stream if e['type'] == 'text')
+    stream.close()
+    assert breaker.get_stats()['state'] == 'half_open' and breaker.allow(), "中断的探测应释放名额"
+    print("  ✓ 400 关闭熔断器，中断的探测释放名额")
+
+
+def test_record_roundtrip():
+    """测试录制后回放得到相同的事件"""
+    print("\n测试录制与回放...")
+    source = os.path.join(WORKDIR, 'tools.jsonl')
+    recorded = os.path.join(WORKDIR, 'recorded.jsonl')
+    recorder = stream_replay.RecordingClient(stream_replay.ReplayClient(source, speed=0), recorded)
+    original, _ = run_turn(recorder, 'replay-record')
+    replayed, _ = run_turn(stream_replay.ReplayClient(recorded, speed=0), 'replay-record-2')
+
+    def strip(events):
+        return [e for e in events if e['type'] in ('text', 'tool_use', 'done')]
+
+    assert strip(original) == strip(replayed), "回放事件与录制时不一致"
+    assert len(stream_replay.load_fixture(recorded)) == 2
+    print("  ✓ 录制文件可完整回放")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("聊天循环回放测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_tool_turn()
+        test_retry_turn()
+        test_half_open_probe()
+        test_record_roundtrip()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+服务端会话状态测试：同一会话并发的两轮只保存先完成的一轮，不同用户的会话互不可见
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+from conversation_store import ConversationStore, VersionConflict
+from testenv import TempDatabase
+
+db = TempDatabase(tempfile.mkdtemp(prefix='test-conversation-store-'))
+
+
+def setup_module(module=None):
+    db.start()
+
+
+def teardown_module(module=None):
+    db.stop()
+
+
+def test_concurrent_turns():
+    """测试同一版本上开始的两轮：后完成的一轮被拒绝，不覆盖先完成的一轮"""
+    print("\n测试并发轮次...")
+    store = ConversationStore()
+    first, _, first_base = store.begin_turn('s1', 'alice', 'first', version=0)
+    second, _, second_base = store.begin_turn('s1', 'alice', 'second', version=0)
+    assert first_base == second_base == 0
+
+    first.append({'role': 'assistant', 'content': 'answer one'})
+    assert store.save('s1', 'alice', first, first_base) == 1
+    second.append({'role': 'assistant', 'content': 'answer two'})
+    try:
+        store.save('s1', 'alice', second, second_base)
+        assert False, "后完成的一轮应被拒绝"
+    except VersionConflict as e:
+        assert e.current_version == 1
+
+    # 内存和数据库中都是先完成的一轮
+    assert database.load_conversation_state('s1')['messages'] == first
+    messages, _, base = ConversationStore().begin_turn('s1', 'alice', 'next')
+    assert base == 1 and messages[:2] == first
+    print("  ✓ 第二轮得到 VersionConflict，第一轮的消息保留")
+
+
+def test_owner_scope():
+    """测试另一用户使用同一会话 ID 时既读不到也覆盖不了原会话"""
+    print("\n测试会话归属...")
+    store = ConversationStore()
+    messages, _, base = store.begin_turn('s2', 'alice', 'secret')
+    store.save('s2', 'alice', messages, base)
+
+    assert store.get_version('s2', 'mallory') == 0
+    stolen, _, base = store.begin_turn('s2', 'mallory', 'hi')
+    assert stolen == [{'role': 'user', 'content': 'hi'}], "不应看到其他用户的消息"
+    store.save('s2', 'mallory', stolen, base)
+    assert database.load_conversation_state('s2')['messages'] == messages, "不应覆盖其他用户的会话"
+    assert store.get_version('s2', 'alice') == 1
+
+    store.clear('s2', 'mallory')
+    assert database.load_conversation_state('s2')['username'] == 'alice'
+    print("  ✓ 会话按用户隔离")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("会话状态测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_concurrent_turns()
+        test_owner_scope()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+数据库后台写队列测试：批量写入、写入顺序、flush、失败隔离和预分配的操作日志 ID
+"""
+
+import sys
+import os
+import sqlite3
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+import mcp_database
+import operation_logger
+from db_writer import DatabaseWriter
+from testenv import TempDatabase
+
+WORKDIR = tempfile.mkdtemp(prefix='test-db-writer-')
+DB = os.path.join(WORKDIR, 'items.db')
+db = TempDatabase(WORKDIR)
+
+
+def count(sql, params=()):
+    conn = sqlite3.connect(DB)
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def setup_module(module=None):
+    db.start()
+    conn = sqlite3.connect(DB)
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT UNIQUE)')
+    conn.close()
+
+
+def teardown_module(module=None):
+    db.stop()
+
+
+def test_batching():
+    """测试批量写入、顺序和 flush"""
+    print("\n测试批量写入...")
+    writer = DatabaseWriter(interval=0.05, batch_size=1000)
+    for i in range(200):
+        writer.execute(DB, 'INSERT INTO items (id, value) VALUES (?, ?)', (i, f'v{i}'))
+    writer.execute(DB, 'UPDATE items SET value = ? WHERE id = ?', ('updated', 199))
+    writer.executemany(DB, 'INSERT INTO items (id, value) VALUES (?, ?)', [(1000, 'a'), (1001, 'b')])
+
+    assert writer.flush(5), "flush 超时"
+    assert count('SELECT COUNT(*) FROM items') == 202
+    assert count("SELECT COUNT(*) FROM items WHERE id = 199 AND value = 'updated'") == 1, "写入顺序不正确"
+    stats = writer.get_stats()
+    assert stats['batches'] < 10 and stats['queued'] == 0, f"写入未合并为批次: {stats}"
+
+    # 一条失败的写入不影响同批的其他写入
+    writer.execute(DB, 'INSERT INTO items (id, value) VALUES (?, ?)', (2000, 'x'))
+    writer.execute(DB, 'INSERT INTO items (id, value) VALUES (?, ?)', (2001, 'x'))
+    writer.execute(DB, 'INSERT INTO items (id, value) VALUES (?, ?)', (2002, 'y'))
+    writer.flush(5)
+    assert count('SELECT COUNT(*) FROM items WHERE id >= 2000') == 2
+    assert writer.get_stats()['errors'] == 1
+
+    # 关闭时写完队列中的数据
+    writer.execute(DB, 'INSERT INTO items (id, value) VALUES (?, ?)', (3000, 'z'))
+    writer.close()
+    assert count('SELECT COUNT(*) FROM items WHERE id = 3000') == 1, "关闭时未写完队列"
+    print(f"  ✓ {stats['writes']} 次写入合并为 {stats['batches']} 个事务")
+
+
+def test_operation_log_ids():
+    """测试操作日志 ID 预分配，以及写入后可立即读到"""
+    print("\n测试操作日志 ID...")
+    # operation_logger 使用当前目录（setup_module 切换到的临时目录）下的 conversations.db
+    mcp_database.init_mcp_db()
+    first = operation_logger.log_operation('alice', 's1', 'read_file', {'file_path': '/a'})
+    second = operation_logger.log_operation('alice', 's1', 'bash', {'command': 'ls'})
+    assert second == first + 1
+    operation_logger.update_operation_status(second, 'completed', output_data={'output': 'ok'})
+
+    logs = operation_logger.get_operation_logs(session_id='s1')
+    assert {log['id'] for log in logs} == {first, second}, "读取前应写完队列"
+    assert next(log for log in logs if log['id'] == second)['output_data'] == {'output': 'ok'}
+
+    # 其他进程（或未预分配的插入）得到的 ID 在已预留的区间之后
+    conn = sqlite3.connect(os.path.join(WORKDIR, 'conversations.db'))
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO operation_logs (username, operation_type, tool_name, tool_source, status)
+            VALUES ('bob', 'tool_call', 'glob', 'direct', 'completed')
+        ''')
+    conn.close()
+    assert cursor.lastrowid >= first + operation_logger.ID_BLOCK_SIZE, "预留的 ID 区间被占用"
+    print(f"  ✓ 预分配 ID {first}、{second}，其他插入从 {cursor.lastrowid} 开始")
+
+
+def test_messages():
+    """测试聊天消息经写队列保存后可在历史中读到"""
+    print("\n测试消息保存...")
+    database.save_message('alice', 'user', 'hello', 'sonnet', 's1')
+    database.save_message('alice', 'assistant', 'hi', 'sonnet', 's1', {'toolCalls': []})
+    history = database.get_conversation_history('alice')
+    assert sorted(m['content'] for m in history) == ['hello', 'hi'], "历史记录不完整"
+    print("  ✓ 读取历史前写完队列")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("数据库后台写队列测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_batching()
+        test_operation_log_ids()
+        test_messages()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+glob 引擎测试：与 glob.glob 结果一致、大括号、忽略目录和 .gitignore、达到上限提前结束、按修改时间排序和多线程调用
+"""
+
+import sys
+import os
+import glob
+import tempfile
+import threading
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tools
+from glob_engine import GlobEngine, parse_gitignore, is_ignored
+
+WORKDIR = tempfile.mkdtemp(prefix='test-glob-engine-')
+
+
+def write(rel_path, content='x\n'):
+    path = os.path.join(WORKDIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def setup_module(module=None):
+    for rel_path in ('src/app.py', 'src/util.ts', 'src/view.tsx', 'src/deep/a/b/mod.py', 'b/inner.py',
+                     'b.py', 'README.md', '.env', '.hidden/secret.py', 'docs/notes.md',
+                     'node_modules/pkg/index.js', '.git/config', 'build/out.js', 'logs/debug.log',
+                     'logs/keep.log', 'src/deep/gen/skip.py', 'src/deep/gen/keep.py'):
+        write(rel_path)
+    write('.gitignore', 'build/\n*.log\n!keep.log\n/docs/*.tmp\n')
+    write('src/deep/.gitignore', 'gen/skip.py\n')
+    write('docs/draft.tmp')
+    for i in range(300):
+        write(f'many/file{i:03d}.txt')
+
+
+def test_glob_parity():
+    """测试不忽略任何目录时与 glob.glob 的匹配结果一致"""
+    print("\n测试与 glob.glob 一致...")
+    engine = GlobEngine(ignored_dirs=(), respect_gitignore=False)
+    for pattern in ('*', '**/*.py', 'src/**/*.ts', '*/*', 'src/?iew.tsx', '.hidden/*', '**/.env',
+                    'many/file1[0-2]*.txt', '**/deep/**/*.py', 'src/deep/a/b/mod.py', 'missing/*'):
+        expected = sorted(glob.glob(pattern, root_dir=WORKDIR, recursive=True))
+        actual = [path for path, _ in engine.iter_matches(pattern, WORKDIR)]
+        assert sorted(actual) == expected, f"{pattern}: {actual} != {expected}"
+    assert engine.glob('**/*.{ts,tsx}', WORKDIR)['matches'] == ['src/util.ts', 'src/view.tsx']
+    # 目录树顺序：目录 b 在 b.py 之前
+    assert engine.glob('**/*.py', WORKDIR)['matches'][:3] == ['b/inner.py', 'b.py', 'src/app.py']
+    print("  ✓ 11 个模式与 glob.glob 一致，支持大括号")
+
+
+def test_ignored():
+    """测试跳过 .git、node_modules 和 .gitignore 中的条目，字面路径不受影响"""
+    print("\n测试忽略规则...")
+    rules = parse_gitignore('# c\nbuild/\n*.log\n!keep.log\n/docs/*.tmp\na/**/z\n')
+    files = ((WORKDIR, rules),)
+    assert is_ignored(files, os.path.join(WORKDIR, 'x/build'), 'build', True)
+    assert not is_ignored(files, os.path.join(WORKDIR, 'x/build'), 'build', False), "build/ 只匹配目录"
+    assert is_ignored(files, os.path.join(WORKDIR, 'a/b/c/z'), 'z', False)
+    assert not is_ignored(files, os.path.join(WORKDIR, 'x/docs/a.tmp'), 'a.tmp', False), "/docs 锚定在根目录"
+
+    engine = GlobEngine()
+    matches = engine.glob('**/*', WORKDIR, limit=1000)['matches']
+    for ignored in ('node_modules', 'build', 'logs/debug.log', 'docs/draft.tmp', 'src/deep/gen/skip.py'):
+        assert ignored not in matches, f"{ignored} 应被忽略: {matches}"
+    for kept in ('logs/keep.log', 'src/deep/gen/keep.py', 'docs/notes.md'):
+        assert kept in matches, f"{kept} 不应被忽略"
+    assert engine.glob('node_modules/*/*.js', WORKDIR)['matches'] == ['node_modules/pkg/index.js']
+    assert engine.glob('src/deep/gen/skip.py', WORKDIR)['matches'] == ['src/deep/gen/skip.py']
+    # 从子目录搜索时仍应用父目录（同一仓库内）的 .gitignore
+    os.makedirs(os.path.join(WORKDIR, '.git'), exist_ok=True)
+    assert 'debug.log' not in engine.glob('*', os.path.join(WORKDIR, 'logs'))['matches']
+    assert engine.get_stats()['pruned'] > 0
+    print("  ✓ 忽略目录、.gitignore（含否定、锚定、子目录规则）")
+
+
+def test_limits_and_mtime():
+    """测试达到上限提前结束和按修改时间排序"""
+    print("\n测试数量限制和排序...")
+    engine = GlobEngine()
+    result = engine.glob('**/*.txt', WORKDIR, limit=10)
+    assert result['matches'] == [f'many/file{i:03d}.txt' for i in range(10)] and result['truncated']
+    assert engine.get_stats()['stopped_early'] == 1
+
+    for i in range(300):
+        path = os.path.join(WORKDIR, f'many/file{i:03d}.txt')
+        os.utime(path, (1_000_000 + i, 1_000_000 + (i * 7919) % 300))
+    result = engine.glob('many/*.txt', WORKDIR, sort_by='mtime', limit=3)
+    expected = sorted(range(300), key=lambda i: -((i * 7919) % 300))[:3]
+    assert result['matches'] == [f'many/file{i:03d}.txt' for i in expected], result
+    assert engine.glob('nothing*', WORKDIR)['matches'] == []
+    assert not engine.glob('*', os.path.join(WORKDIR, 'missing'))['success']
+    print("  ✓ 提前结束，按修改时间取最新的文件")
+
+
+def test_threads():
+    """测试多线程同时调用 glob 工具时不改变工作目录、结果互不影响"""
+    print("\n测试多线程...")
+    cwd = os.getcwd()
+    errors = []
+
+    def run(sub, expected):
+        for _ in range(20):
+            result = tools.execute_glob('*', os.path.join(WORKDIR, sub))
+            if result.get('matches') != expected:
+                errors.append((sub, result))
+
+    threads = [threading.Thread(target=run, args=('src', ['app.py', 'deep', 'util.ts', 'view.tsx'])),
+               threading.Thread(target=run, args=('b', ['inner.py']))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors[:2]
+    assert os.getcwd() == cwd, "不应切换工作目录"
+    print("  ✓ 并发调用结果正确")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("glob 引擎测试")
+    print("=" * 60)
+
+    try:
+        setup_module()
+        test_glob_parity()
+        test_ignored()
+        test_limits_and_mtime()
+        test_threads()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+grep 后端一致性测试：ripgrep 后端（rg --json）和 grep_engine 在相同测试文件上返回相同结果（未安装 rg 时跳过）
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tools
+import ripgrep_backend
+from grep_engine import GrepEngine
+from ripgrep_backend import RipgrepBackend, file_globs
+
+WORKDIR = tempfile.mkdtemp(prefix='test-grep-backends-')
+
+
+def write(rel_path, content):
+    path = os.path.join(WORKDIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(path, mode) as f:
+        f.write(content)
+    return path
+
+
+def setup_module(module=None):
+    write('src/app.py', 'import os\n\ndef main():\n    return run()\n\ndef run():\n    pass\n')
+    write('src/util.ts', 'export function run() {}\r\nexport const x = 1;   \r\n')
+    write('src/view.tsx', 'const View = () => run();\n')
+    # 目录 b 和文件 b.py、b-c.py：按目录树顺序排列
+    write('b/inner.py', 'def run(): return 1\n')
+    write('b.py', 'run = 1\n')
+    write('b-c.py', 'run = 2\n')
+    write('docs/notes.md', 'TODO: write docs   \nnothing here\nTODO again\nmore\nTODO last\n')
+    write('data/blob.bin', b'\x89PNG\x00\x00 def main run')
+    write('.hidden/secret.py', 'def main(): pass\n')
+    write('.env', 'SECRET=1\n')
+    write('.env.py', 'def run(): pass\n')
+    write('gitignored.log', 'run in ignored file\n')
+    write('.gitignore', '*.log\n')
+    lines = ''.join(f'line {n} {"match" if n % 7 == 0 else "plain"}\n' for n in range(1, 60))
+    write('ctx/long.txt', lines)
+    for i in range(120):
+        write(f'many/file{i:03d}.txt', 'filler\n' * 3 + ('needle\n' if i % 40 == 5 else ''))
+
+
+CASES = [
+    ('run', {}),
+    ('run', {'output_mode': 'count'}),
+    (r'run\(\)', {'output_mode': 'content'}),
+    ('RUN', {'case_insensitive': True, 'output_mode': 'content'}),
+    (r'def \w+', {'file_pattern': '*.py'}),
+    ('run', {'file_pattern': '**/*.py', 'output_mode': 'content'}),
+    ('^def', {'file_pattern': '*.py', 'output_mode': 'count'}),
+    ('run', {'file_pattern': '*.{ts,tsx}', 'output_mode': 'count'}),
+    ('run', {'file_pattern': 'src/*.py', 'output_mode': 'content'}),
+    ('SECRET', {'file_pattern': '.env'}),
+    (r'\s+$', {'output_mode': 'content'}),
+    ('^export const', {'output_mode': 'content'}),
+    ('TODO', {'output_mode': 'content', 'context': 1}),
+    ('match', {'output_mode': 'content', 'before_context': 2, 'after_context': 8}),
+    ('match', {'output_mode': 'content', 'after_context': 3, 'head_limit': 4}),
+    (r'main\(\):\n\s+return', {'multiline': True, 'output_mode': 'content'}),
+    (r'TODO.*?\n', {'multiline': True, 'output_mode': 'count'}),
+    ('filler', {'head_limit': 5}),
+    ('filler', {'output_mode': 'count', 'head_limit': 7}),
+    ('filler', {'output_mode': 'content', 'head_limit': 10}),
+    ('needle', {}),
+]
+
+
+def test_file_globs():
+    """测试 file_pattern 到 rg --glob 的转换"""
+    print("\n测试 glob 转换...")
+    assert file_globs('*.{ts,tsx}') == ['*.ts', '*.tsx']
+    assert file_globs('src/*.py') == ['**/src/*.py'] and file_globs('**/*.py') == ['*.py']
+    assert file_globs(None) == []
+    print("  ✓ 大括号和带目录的模式")
+
+
+def test_parity():
+    """测试两个后端在所有输出模式和参数上的结果一致"""
+    print("\n测试后端一致性...")
+    if not ripgrep_backend.RIPGREP_PATH:
+        print("  - 未安装 rg，跳过")
+        return
+    rg = RipgrepBackend()
+    engine = GrepEngine(workers=0)
+    for pattern, options in CASES:
+        expected = engine.search(pattern, WORKDIR, **options)
+        actual = rg.search(pattern, WORKDIR, **options)
+        assert actual == expected, f"{pattern} {options}\nrg:     {actual}\npython: {expected}"
+    stats = rg.get_stats()
+    assert stats['searches'] == len(CASES) and stats['fallbacks'] == 0, stats
+    assert stats['stopped_early'] == 4, stats
+    print(f"  ✓ {len(CASES)} 个查询结果一致")
+
+
+def test_fallback():
+    """测试 rg 不支持的正则、单个文件和无效正则"""
+    print("\n测试回退...")
+    if not ripgrep_backend.RIPGREP_PATH:
+        print("  - 未安装 rg，跳过")
+        return
+    rg = RipgrepBackend()
+    assert rg.search(r'def (?=main)', WORKDIR) is None, "rg 不支持的正则应交给 grep_engine"
+    assert rg.search('run', os.path.join(WORKDIR, 'b.py')) is None
+    assert rg.get_stats()['fallbacks'] == 1
+
+    result = tools.execute_grep(r'def (?=main)', path=WORKDIR)
+    assert result['files'] == [os.path.join(WORKDIR, 'src/app.py')], result
+    assert not tools.execute_grep('(', path=WORKDIR)['success'], "无效正则应返回错误"
+    assert not tools.execute_grep(r'\p{L}', path=WORKDIR)['success'], "按 Python 正则校验"
+    print("  ✓ 回退到 grep_engine，错误与原来一致")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("grep 后端一致性测试")
+    print("=" * 60)
+
+    try:
+        setup_module()
+        test_file_globs()
+        test_parity()
+        test_fallback()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
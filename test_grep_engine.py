@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+grep 搜索引擎测试：输出模式、上下文、二进制文件、文件名过滤、不限文件数、head_limit 提前结束和多进程搜索
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tools
+from grep_engine import GrepEngine, expand_braces
+
+WORKDIR = tempfile.mkdtemp(prefix='test-grep-engine-')
+
+
+def write(rel_path, content):
+    path = os.path.join(WORKDIR, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(path, mode) as f:
+        f.write(content)
+    return path
+
+
+def setup_module(module=None):
+    write('src/app.py', 'import os\n\ndef main():\n    return run()\n\ndef run():\n    pass\n')
+    write('src/util.ts', 'export function run() {}\r\nexport const x = 1;\r\n')
+    write('src/view.tsx', 'const View = () => run();\n')
+    write('docs/notes.md', 'TODO: write docs   \nnothing here\n')
+    write('data/blob.bin', b'\x89PNG\x00\x00 def main run')
+    write('.hidden/secret.py', 'def main(): pass\n')
+    # 超过原实现 200 个文件上限的目录
+    for i in range(300):
+        write(f'many/file{i:03d}.txt', 'filler\n' * 3 + ('needle\n' if i == 299 else ''))
+
+
+def test_output_modes():
+    """测试三种输出模式、上下文和行号"""
+    print("\n测试输出模式...")
+    engine = GrepEngine(workers=0)
+    result = engine.search(r'def \w+', WORKDIR)
+    assert result['files'] == [os.path.join(WORKDIR, 'src/app.py')], f"二进制或隐藏文件不应被搜索: {result}"
+
+    result = engine.search(r'run\(\)', WORKDIR, output_mode='count')
+    assert [(os.path.basename(r['file']), r['matches']) for r in result['results']] == \
+        [('app.py', 2), ('util.ts', 1), ('view.tsx', 1)], result
+
+    result = engine.search('def run', WORKDIR, output_mode='content', context=1)
+    assert result['results'] == [{
+        'file': os.path.join(WORKDIR, 'src/app.py'), 'line': 6,
+        'content': '      5: \n>     6: def run():\n      7:     pass'
+    }], result
+
+    # 行按不含换行符匹配；CRLF 文件的行号正确
+    result = engine.search(r'\s+$', WORKDIR, output_mode='content')
+    assert [r['line'] for r in result['results']] == [1], f"只有第一行有行尾空白: {result}"
+    result = engine.search('^export const', WORKDIR, output_mode='content', file_pattern='*.ts')
+    assert result['results'][0]['line'] == 2 and result['results'][0]['content'] == 'export const x = 1;'
+
+    result = engine.search(r'main\(\):\n\s+return', WORKDIR, output_mode='content', multiline=True)
+    assert result['count'] == 1 and result['results'][0]['line'] == 3
+    print("  ✓ files_with_matches / count / content 结果正确")
+
+
+def test_file_pattern_and_limits():
+    """测试文件名过滤（含大括号）、不限文件数和 head_limit"""
+    print("\n测试文件过滤和数量限制...")
+    assert expand_braces('*.{ts,tsx}') == ['*.ts', '*.tsx']
+    engine = GrepEngine(workers=0)
+    result = engine.search('run', WORKDIR, file_pattern='*.{ts,tsx}')
+    assert [os.path.basename(f) for f in result['files']] == ['util.ts', 'view.tsx'], result
+    assert engine.search('run', WORKDIR, file_pattern='src/*.py')['count'] == 1
+
+    result = engine.search('needle', WORKDIR)
+    assert result['files'] == [os.path.join(WORKDIR, 'many/file299.txt')], "第 300 个文件也应被搜索"
+
+    result = engine.search('filler', WORKDIR, head_limit=5)
+    assert result['count'] == 5 and result['limit_reached'], result
+    assert result['files'] == sorted(result['files']), "结果应按路径排序"
+    assert engine.get_stats()['stopped_early'] == 1
+
+    assert not tools.execute_grep('(', path=WORKDIR)['success'], "无效正则应返回错误"
+    print("  ✓ 大括号模式、300 个文件全部搜索、head_limit 提前结束")
+
+
+def test_process_pool():
+    """测试多进程搜索结果与单线程一致"""
+    print("\n测试多进程搜索...")
+    inline = GrepEngine(workers=0)
+    pooled = GrepEngine(workers=2, batch_files=16)
+    # 未在启动时 fork 进程池时在当前线程搜索
+    assert pooled.search('filler', WORKDIR, head_limit=1000)['count'] == 300
+    assert pooled.get_stats()['pool_searches'] == 0
+    assert pooled.start_pool()
+    for pattern, mode in (('filler', 'count'), ('needle|TODO', 'files_with_matches'), ('run', 'content')):
+        expected = inline.search(pattern, WORKDIR, output_mode=mode, head_limit=1000)
+        assert pooled.search(pattern, WORKDIR, output_mode=mode, head_limit=1000) == expected, pattern
+    assert pooled.search('filler', WORKDIR, head_limit=3)['files'] == inline.search('filler', WORKDIR, head_limit=3)['files']
+    assert pooled.get_stats()['pool_searches'] == 4
+    print("  ✓ 多进程和单线程结果一致")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("grep 搜索引擎测试")
+    print("=" * 60)
+
+    try:
+        setup_module()
+        test_output_modes()
+        test_file_pattern_and_limits()
+        test_process_pool()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+记忆检索测试：相关度排序、中文匹配、token 预算，以及增删改后索引同步
+"""
+
+import sys
+import os
+import tempfile
+import threading
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import memory_database
+import memory_index
+import prompt_cache
+from memory_index import MemoryIndex, UserMemoryIndex, tokenize
+from testenv import TempDatabase
+
+# memory_database 使用当前目录下的 conversations.db，TempDatabase 切换到临时目录并在结束时恢复
+db = TempDatabase(tempfile.mkdtemp(prefix='test-memory-'))
+
+
+def setup_module(module=None):
+    db.start()
+
+
+def teardown_module(module=None):
+    db.stop()
+
+
+def row(memory_id, title, content, importance=1, created_at='2026-01-01 00:00:00'):
+    return {'id': memory_id, 'title': title, 'content': content, 'memory_type': 'fact',
+            'importance': importance, 'created_at': created_at}
+
+
+def test_ranking():
+    """测试文本匹配、重要度和中文分词"""
+    print("\n测试相关度排序...")
+    assert tokenize('部署脚本 deploy.sh') == ['部署', '署脚', '脚本', 'deploy', 'sh']
+
+    rows = [row(i, f'note {i}', f'unrelated filler text number {i}') for i in range(1, 200)]
+    rows.append(row(500, 'Deploy', 'production deploy uses deploy.sh on the gateway host'))
+    rows.append(row(501, '数据库', '用户偏好使用 PostgreSQL 数据库，备份在每周日'))
+    rows.append(row(502, 'Editor', 'prefers vim keybindings', importance=5))
+    index = UserMemoryIndex(rows)
+
+    ids = [entry.id for _, entry in index.search('how do I deploy to the gateway?')]
+    assert ids[0] == 500, f"最相关的记忆应排第一: {ids}"
+    assert 502 in ids, "高重要度的记忆应参与排序"
+    assert len(ids) == 2, f"不相关的记忆不应入选: {ids}"
+
+    ids = [entry.id for _, entry in index.search('数据库备份怎么做')]
+    assert ids[0] == 501, f"中文查询未匹配: {ids}"
+    print("  ✓ 英文和中文查询都能找到相关记忆")
+
+
+def test_budget():
+    """测试 top-k 和 token 预算"""
+    print("\n测试 token 预算...")
+    rows = [row(i, 'deploy', 'deploy ' + 'x' * 200) for i in range(20)]
+    index = UserMemoryIndex(rows)
+    assert len(index.search('deploy', top_k=5, token_budget=100000)) == 5
+    results = index.search('deploy', top_k=20, token_budget=200)
+    assert results and sum(entry.tokens for _, entry in results) <= 200, "超出 token 预算"
+    print(f"  ✓ 预算内选出 {len(results)} 条")
+
+
+def test_database_sync():
+    """测试数据库写入后索引同步，以及系统提示的渲染"""
+    print("\n测试索引同步...")
+    saved = memory_index._index
+    try:
+        memory_database.init_memory_db()
+        index = MemoryIndex()
+        # 写入钩子使用全局实例
+        memory_index._index = index
+
+        first = memory_database.add_memory_entry('alice', 'fact', 'the staging server runs on port 8443',
+                                                 title='Staging')
+        assert 'staging' in index.render_for_prompt('alice', 'which port does staging use?')
+        assert index.render_for_prompt('bob', 'which port does staging use?') == ''
+
+        # 索引加载后的新增、修改和删除立即生效
+        second = memory_database.add_memory_entry('alice', 'fact', 'grafana dashboards live in /srv/grafana')
+        assert 'grafana' in index.render_for_prompt('alice', 'where is grafana?')
+        assert memory_database.update_memory_entry(first, 'alice', content='the staging server runs on port 9443')
+        assert '9443' in index.render_for_prompt('alice', 'staging port')
+        assert memory_database.delete_memory_entry(second, 'alice')
+        assert index.render_for_prompt('alice', 'where is grafana?') == ''
+        assert index.get_stats()['loads'] == 2, "写入后不应重新加载整个索引"  # alice 和 bob 各一次
+
+        text = index.render_for_prompt('alice', 'staging port')
+        history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+        messages = history + [{"role": "user", "content": "staging port"}]
+        prompt_cache.attach_memory(messages, text)
+        assert messages[:2] == history, "历史消息不变"
+        assert messages[-1]['content'] == [{"type": "text", "text": text}, {"type": "text", "text": "staging port"}]
+        cached = prompt_cache.build_messages(messages, 1)
+        assert 'cache_control' in cached[1]['content'][-1] and 'cache_control' not in cached[2]['content'][0], \
+            "记忆应放在历史缓存断点之后"
+        print("  ✓ 增删改后索引同步，记忆放在本轮用户消息之前")
+    finally:
+        memory_index._index = saved
+
+
+def test_reload():
+    """测试过期重新加载不阻塞其他检索，且加载期间的写入不丢失"""
+    print("\n测试重新加载...")
+    saved = memory_index._index, memory_database.get_all_memory_entries
+    try:
+        memory_database.init_memory_db()
+        index = MemoryIndex(max_age=0)
+        memory_index._index = index
+        memory_database.add_memory_entry('carol', 'fact', 'the backup job runs nightly at 02:00')
+        assert 'backup' in index.render_for_prompt('carol', 'when does the backup run?')
+
+        searched = []
+
+        def slow_load(username):
+            rows = saved[1](username)
+            # 加载期间：其他线程的检索不应等待，新写入应出现在新索引中
+            worker = threading.Thread(target=lambda: searched.append(index.retrieve('carol', 'backup')))
+            worker.start()
+            worker.join(5)
+            memory_database.add_memory_entry('carol', 'fact', 'the cache server is redis on port 6380')
+            return rows
+
+        memory_database.get_all_memory_entries = slow_load
+        text = index.render_for_prompt('carol', 'which port does the cache server use?')
+        assert searched and searched[0], "重新加载期间的检索被阻塞或未使用旧索引"
+        assert '6380' in text, "加载期间的写入丢失"
+        print("  ✓ 加载在锁外进行，期间的写入合并到新索引")
+    finally:
+        memory_index._index, memory_database.get_all_memory_entries = saved
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("记忆检索测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_ranking()
+        test_budget()
+        test_database_sync()
+        test_reload()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+自动模型选择测试：规划步骤和工具后续步骤的模型选择、首字延迟否决，以及 auto 轮次中按迭代切换模型
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+import model_retry
+import model_router
+import prompt_cache
+import stream_replay
+from chat_pipeline import ChatTurn
+from model_router import ModelRouter
+from testenv import TempDatabase
+
+WORKDIR = tempfile.mkdtemp(prefix='test-model-router-')
+db = TempDatabase(WORKDIR)
+_saved_router = model_router._router
+
+
+def setup_module(module=None):
+    db.start()
+
+
+def teardown_module(module=None):
+    model_router._router = _saved_router
+    db.stop()
+
+
+def tool_turn(results, text='看一下这个目录'):
+    """用户消息 + 一次 assistant 工具调用 + 工具结果"""
+    uses = [{'type': 'tool_use', 'id': f't{i}', 'name': 'glob', 'input': {}} for i in range(len(results))]
+    return [
+        {'role': 'user', 'content': text},
+        {'role': 'assistant', 'content': uses},
+        {'role': 'user', 'content': [
+            {'type': 'tool_result', 'tool_use_id': f't{i}', 'content': json.dumps(result)}
+            for i, result in enumerate(results)
+        ]}
+    ]
+
+
+def test_decisions():
+    """测试规划步骤、简单后续步骤和需要规划模型的后续步骤"""
+    print("\n测试模型选择...")
+    router = ModelRouter('sonnet', 'opus', 'haiku')
+
+    assert router.route([{'role': 'user', 'content': '好的，运行吧'}], 1)['model'] == 'sonnet'
+    assert router.route([{'role': 'user', 'content': 'x' * 5000}], 1)['model'] == 'opus', "长消息应使用 heavy 模型"
+
+    decision = router.route(tool_turn([{'success': True, 'files': ['a.py']}]), 2)
+    assert decision['model'] == 'haiku' and decision['reason'] == 'simple continuation', decision
+    assert decision['features']['tool_continuation'] and decision['features']['tool_calls'] == 1
+
+    assert router.route(tool_turn([{'success': False, 'error': 'x'}]), 2)['reason'] == 'tool error'
+    assert router.route(tool_turn([{'success': True, 'content': 'x' * 20000}]), 2)['reason'] == 'large tool results'
+    assert router.route(tool_turn([{'success': True}] * 6), 2)['reason'] == 'many tool calls'
+    print("  ✓ 规划步骤用 sonnet，简单后续步骤用 haiku")
+
+
+def test_latency():
+    """测试按实测首字延迟否决切换，并统计节省的延迟"""
+    print("\n测试首字延迟...")
+    router = ModelRouter('sonnet', 'opus', 'haiku')
+    router.record_latency('sonnet', 1200)
+    router.record_latency('haiku', 400)
+    decision = router.route(tool_turn([{'success': True}]), 2)
+    assert decision['model'] == 'haiku' and decision['saved_ms'] == 800, decision
+
+    # haiku 变慢后不再切换
+    for _ in range(20):
+        router.record_latency('haiku', 3000)
+    assert router.route(tool_turn([{'success': True}]), 3)['reason'] == 'light model slower'
+
+    router.record_latency('opus', 15000)
+    assert router.route([{'role': 'user', 'content': 'x' * 5000}], 1)['reason'] == 'heavy model slow'
+
+    stats = router.get_stats()
+    assert stats['saved_ms'] == 800 and stats['decisions'] == {'haiku': 1, 'sonnet': 2}, stats
+    print(f"  ✓ 首字延迟 {stats['ttft_ms']}")
+
+
+def test_auto_turn():
+    """测试 auto 轮次：第一轮用规划模型，工具结果之后切换到 haiku"""
+    print("\n测试 auto 轮次...")
+    fixture = os.path.join(WORKDIR, 'tools.jsonl')
+    stream_replay.write_synthetic_fixture(fixture, [
+        {'text': '我先看一下。', 'tool_uses': [('list_directory', {'path': WORKDIR})]},
+        {'text': '目录里有测试数据库。'}
+    ])
+    client = stream_replay.ReplayClient(fixture, speed=0)
+    model_router._router = ModelRouter('sonnet', 'opus', 'haiku')
+
+    def route_targets(model):
+        return [model_retry.ModelTarget('replay', model, config.AVAILABLE_MODELS[model], client)]
+
+    before = prompt_cache.get_stats()
+    messages = [{'role': 'user', 'content': '看一下这个目录'}]
+    turn = ChatTurn(client, model_router.resolve('auto'), config.AVAILABLE_MODELS['sonnet'],
+                    messages, -1, 'test', 'auto-turn', route_targets=route_targets)
+    events = list(turn.run())
+
+    assert events[-1]['type'] == 'done', f"轮次未正常结束: {[e['type'] for e in events]}"
+    models = [request['model'] for request in client.requests]
+    assert models == [config.AVAILABLE_MODELS['sonnet'], config.AVAILABLE_MODELS['haiku']], models
+    stats = model_router.get_model_router().get_stats()
+    assert stats['decisions'] == {'sonnet': 1, 'haiku': 1} and set(stats['samples']) == {'sonnet', 'haiku'}
+    cache_stats = prompt_cache.get_stats()
+    for model in ('sonnet', 'haiku'):
+        iterations = cache_stats[model]['iterations'] - before.get(model, {}).get('iterations', 0)
+        assert iterations == 1, f"缓存用量应记在实际使用的模型上: {cache_stats}"
+    print(f"  ✓ 两次调用分别使用 {models}")
+
+
+def test_retarget():
+    """测试重新路由：新目标列表包含当前目标时保留故障转移位置和重试次数"""
+    print("\n测试重新路由...")
+    def targets(*pairs):
+        return [model_retry.ModelTarget(url, model, config.AVAILABLE_MODELS[model], object())
+                for url, model in pairs]
+
+    caller = model_retry.ModelCaller(targets(('primary', 'opus'), ('backup', 'opus'), ('primary', 'sonnet')))
+    caller.index, caller.attempt = 2, 1
+    caller.retarget(targets(('primary', 'sonnet'), ('backup', 'sonnet')))
+    assert (caller.index, caller.attempt) == (0, 1), "当前目标在新列表中，应保留重试次数"
+
+    caller.index = 1
+    caller.retarget(targets(('primary', 'haiku'), ('backup', 'haiku'), ('backup', 'sonnet')))
+    assert (caller.target.base_url, caller.target.model) == ('backup', 'sonnet') and caller.attempt == 1, \
+        "不应回到已故障转移离开的目标"
+
+    caller.retarget(targets(('primary', 'haiku')))
+    assert (caller.index, caller.attempt) == (0, 0)
+    print("  ✓ 重新路由不重置故障转移和重试预算")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("自动模型选择测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_decisions()
+        test_latency()
+        test_auto_turn()
+        test_retarget()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+只读工具结果缓存测试：命中、文件变化失效、写操作失效和会话隔离
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from testenv import TempDatabase
+from tool_router import ToolRouter
+
+WORKDIR = tempfile.mkdtemp(prefix='test-tool-cache-')
+db = TempDatabase(WORKDIR)
+
+router = ToolRouter()
+FILE = os.path.join(WORKDIR, 'a.txt')
+
+
+def setup_module(module=None):
+    db.start()
+
+
+def teardown_module(module=None):
+    db.stop()
+
+
+def run(tool_name, tool_input, session_id='s1'):
+    return router.execute_tool(tool_name, tool_input, 'test', session_id, auto_approve=True)
+
+
+def test_hit():
+    """测试重复读取命中缓存"""
+    print("\n测试缓存命中...")
+    with open(FILE, 'w') as f:
+        f.write('hello\n')
+    first = run('read_file', {'file_path': FILE})
+    second = run('read_file', {'file_path': FILE})
+    assert not first.get('cached') and second.get('cached'), "第二次读取未命中缓存"
+    assert first['result'] == second['result']
+
+    # 未规范化的路径共用缓存
+    assert run('read_file', {'file_path': os.path.join(WORKDIR, '.', 'a.txt')}).get('cached')
+    assert run('list_directory', {'path': WORKDIR}).get('cached') is None
+    assert run('list_directory', {'path': WORKDIR}).get('cached')
+    print("  ✓ 重复调用命中缓存")
+
+
+def test_fingerprint():
+    """测试文件在会话外被修改后失效"""
+    print("\n测试文件变化失效...")
+    with open(FILE, 'w') as f:
+        f.write('changed, longer content\n')
+    result = run('read_file', {'file_path': FILE})
+    assert not result.get('cached'), "文件变化后仍命中缓存"
+    assert 'changed' in result['result']['content']
+    print("  ✓ mtime/大小变化后重新读取")
+
+
+def test_write_invalidates():
+    """测试本会话写操作后清空缓存"""
+    print("\n测试写操作失效...")
+    run('list_directory', {'path': WORKDIR})
+    assert run('list_directory', {'path': WORKDIR}).get('cached')
+    run('bash', {'command': 'true'})
+    result = run('list_directory', {'path': WORKDIR})
+    assert not result.get('cached'), "bash 执行后仍命中缓存"
+
+    run('write_file', {'file_path': os.path.join(WORKDIR, 'b.txt'), 'content': 'b'})
+    names = [item['name'] for item in run('list_directory', {'path': WORKDIR})['result']['items']]
+    assert 'b.txt' in names, "写入文件后目录列表过期"
+    print("  ✓ bash / write_file 执行后缓存失效")
+
+
+def test_isolation():
+    """测试会话隔离和失败结果不缓存"""
+    print("\n测试会话隔离...")
+    run('read_file', {'file_path': FILE}, session_id='s1')
+    assert not run('read_file', {'file_path': FILE}, session_id='s2').get('cached')
+
+    missing = os.path.join(WORKDIR, 'missing.txt')
+    run('read_file', {'file_path': missing})
+    assert not run('read_file', {'file_path': missing}).get('cached'), "失败结果被缓存"
+
+    stats = router.result_cache.get_stats()
+    assert stats['hits'] > 0 and stats['misses'] > 0 and stats['invalidations'] > 0
+    print(f"  ✓ 统计: {stats['hits']} 命中 / {stats['misses']} 未命中")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("工具结果缓存测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_hit()
+        test_fingerprint()
+        test_write_invalidates()
+        test_isolation()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
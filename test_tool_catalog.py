@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+工具目录测试：按 MCP 工具版本重建、名称索引、参数校验和 tools/list_changed 通知
+"""
+
+import sys
+import os
+import asyncio
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tools
+from mcp.client import MCPClient
+from tool_catalog import ToolCatalog
+
+
+class StubManager:
+    """只提供目录需要的接口：tools_version 和 get_tools_by_server()"""
+
+    def __init__(self):
+        self.tools_version = 0
+        self.servers = {}
+        self.calls = 0
+
+    def get_tools_by_server(self):
+        self.calls += 1
+        return self.servers
+
+
+class ScriptedTransport:
+    """按顺序返回预设消息的传输层（id 为 REQUEST 的消息是对最近一次请求的响应）"""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def receive(self):
+        message = self.messages.pop(0)
+        if message.get('id') == REQUEST:
+            message = dict(message, id=self.sent[-1]['id'])
+        return message
+
+
+REQUEST = object()
+
+
+def test_rebuild():
+    """测试只在 MCP 工具版本变化时重建"""
+    print("\n测试目录重建...")
+    manager = StubManager()
+    catalog = ToolCatalog(manager)
+    first = catalog.get_tools()
+    assert catalog.get_tools() is first and manager.calls == 1, "版本未变化时重建了目录"
+    assert len(first) == len(tools.TOOLS)
+
+    manager.servers = {7: [{'name': 'fs:stat', 'description': '',
+                            'input_schema': {'type': 'object', 'required': ['path']}}]}
+    manager.tools_version += 1
+    second = catalog.get_tools()
+    assert second is not first and len(second) == len(tools.TOOLS) + 1
+    assert catalog.get('fs:stat') == ('mcp', 7, second[-1])
+    assert catalog.get('read_file').source == 'direct'
+    assert catalog.get_stats()['rebuilds'] == 2
+    print("  ✓ 版本变化时重建，名称索引正确")
+
+
+def test_validate():
+    """测试参数校验"""
+    print("\n测试参数校验...")
+    manager = StubManager()
+    manager.servers = {7: [{'name': 'fs:stat', 'description': '',
+                            'input_schema': {'type': 'object', 'required': ['path']}}]}
+    catalog = ToolCatalog(manager)
+    assert catalog.validate_input('fs:stat', {'path': '/'}) is None
+    assert 'path' in catalog.validate_input('fs:stat', {})
+    assert 'Unknown tool' in catalog.validate_input('fs:missing', {})
+    assert catalog.validate_input('read_file', 'x') is not None
+    print("  ✓ 未知工具、非对象参数和缺少必填参数被拒绝")
+
+
+def test_list_changed():
+    """测试 MCP 客户端处理 tools/list_changed 通知"""
+    print("\n测试 tools/list_changed 通知...")
+    client = MCPClient(ScriptedTransport([
+        {'jsonrpc': '2.0', 'method': 'notifications/tools/list_changed'},
+        {'jsonrpc': '2.0', 'id': REQUEST, 'result': {'content': []}}
+    ]), 'fs')
+    client.connected = True
+    result = asyncio.run(client.call_tool('stat', {'path': '/'}))
+    assert result == {'content': []}, "通知被当作响应返回"
+    assert client.tools_changed, "未记录工具列表变化"
+    print("  ✓ 通知被跳过并标记工具列表变化")
+
+
+def test_stale_response():
+    """测试超时或取消的调用留下的迟到响应不会被当作下一次调用的结果"""
+    print("\n测试迟到的响应...")
+    client = MCPClient(ScriptedTransport([
+        {'jsonrpc': '2.0', 'id': 'timed-out-call', 'result': {'content': ['old']}},
+        {'jsonrpc': '2.0', 'id': REQUEST, 'result': {'content': ['new']}}
+    ]), 'fs')
+    client.connected = True
+    result = asyncio.run(client.call_tool('stat', {'path': '/'}))
+    assert result == {'content': ['new']}, f"返回了上一次调用的响应: {result}"
+    print("  ✓ 按请求 ID 匹配响应，丢弃迟到的响应")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("工具目录测试")
+    print("=" * 60)
+
+    try:
+        test_rebuild()
+        test_validate()
+        test_list_changed()
+        test_stale_response()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+工具结果大小上限测试：首尾截断标记、完整输出落盘和分页读取、列表截断、浏览器显示上限
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tool_output
+import tools
+from testenv import TempDatabase
+from tool_output import ToolOutputShaper, ToolOutputStore
+from tool_router import ToolRouter
+
+WORKDIR = tempfile.mkdtemp(prefix='test-tool-output-')
+db = TempDatabase(WORKDIR)
+
+store = ToolOutputStore(os.path.join(WORKDIR, 'outputs'))
+shaper = ToolOutputShaper(store, limits={'bash': {'max_bytes': 4000}, 'ask_user_question': None},
+                          max_bytes=8000, max_tokens=100000, display_max_bytes=2000)
+_saved_store = tool_output._store
+
+
+def setup_module(module=None):
+    db.start()
+    # read_tool_output 使用全局实例
+    tool_output._store = store
+
+
+def teardown_module(module=None):
+    tool_output._store = _saved_store
+    db.stop()
+
+
+def test_truncate_and_spill():
+    """测试超长输出的首尾截断和完整输出分页读取"""
+    print("\n测试截断和落盘...")
+    output = '\n'.join(f'line {i:05d} ' + 'x' * 40 for i in range(20000))
+    result = shaper.shape('bash', {'success': True, 'output': output, 'return_code': 0})
+
+    assert len(json.dumps(result)) <= 4000, "结果超出上限"
+    assert result['truncated'] and result['output_bytes'] == len(output)
+    assert result['output'].startswith('line 00000') and result['output'].endswith('x' * 40), "应保留首尾"
+    assert 'bytes elided' in result['output'] and result['output_handle'] in result['output']
+
+    # 相同内容得到相同句柄
+    again = shaper.shape('bash', {'success': True, 'output': output, 'return_code': 0})
+    assert again['output_handle'] == result['output_handle']
+
+    page = tools.execute_tool('read_tool_output', {'handle': result['output_handle'], 'offset': 10000, 'limit': 5})
+    assert page['success'] and page['content'].split('\n')[0].endswith('line 10000 ' + 'x' * 40), "分页内容不正确"
+    assert page['next_offset'] == 10005 and page['total_lines'] == 20000
+    assert not tools.execute_tool('read_tool_output', {'handle': '../../etc/passwd'})['success']
+    print(f"  ✓ {len(output)} 字节的输出截断为 {len(json.dumps(result))} 字节，完整输出可分页读取")
+
+
+def test_lists_and_limits():
+    """测试列表截断、未超限的结果和不截断的工具"""
+    print("\n测试列表和按工具的上限...")
+    small = {'success': True, 'content': 'hello'}
+    assert shaper.shape('read_file', small) is small, "未超限的结果不应改变"
+
+    matches = [{'file': f'/src/module_{i}.py', 'line': i} for i in range(5000)]
+    result = shaper.shape('grep', {'success': True, 'matches': matches, 'count': 5000})
+    assert len(json.dumps(result)) <= 8000
+    assert result['matches'][0] == matches[0] and result['matches'][-1] == matches[-1], "应保留首尾条目"
+    assert any(isinstance(item, str) and 'items elided' in item for item in result['matches'])
+
+    questions = {'success': True, 'requires_user_input': True, 'questions': ['q' * 20000]}
+    assert shaper.shape('ask_user_question', questions) is questions, "ask_user_question 不应截断"
+    print("  ✓ 列表保留首尾条目，按工具的上限生效")
+
+
+def test_display_and_router():
+    """测试浏览器显示上限，以及经过工具路由执行的结果"""
+    print("\n测试显示上限和工具路由...")
+    path = os.path.join(WORKDIR, 'big.txt')
+    with open(path, 'w') as f:
+        f.write('\n'.join('相关内容 ' * 10 for _ in range(1500)))
+
+    router = ToolRouter()
+    router.output_shaper = shaper
+    executed = router.execute_tool('read_file', {'file_path': path}, 'test', 's1', auto_approve=True)
+    result = executed['result']
+    assert result['truncated'] and len(json.dumps(result)) <= 8000, "路由执行的结果未截断"
+    assert router.execute_tool('read_file', {'file_path': path}, 'test', 's1')['result'] == result, \
+        "缓存中应为截断后的结果"
+
+    shown = shaper.for_display(result)
+    assert len(json.dumps(shown, ensure_ascii=False)) <= 2000, "显示结果超出上限"
+    assert shown['output_handle'] == result['output_handle']
+    print("  ✓ 路由结果和缓存都已截断，浏览器显示使用更小的上限")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("工具结果大小上限测试")
+    print("=" * 60)
+
+    setup_module()
+    try:
+        test_truncate_and_spill()
+        test_lists_and_limits()
+        test_display_and_router()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        teardown_module()
+
+if __name__ == '__main__':
+    sys.exit(main())
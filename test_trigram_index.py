@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+trigram 索引测试：从正则提取 trigram、索引与全量搜索结果一致、按 mtime/大小增量更新、文件变更通知和磁盘持久化
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from grep_engine import GrepEngine
+from trigram_index import TrigramIndex, trigram_query
+
+WORKDIR = tempfile.mkdtemp(prefix='test-trigram-index-')
+ROOT = os.path.join(WORKDIR, 'tree')
+INDEX_PATH = os.path.join(WORKDIR, 'index', 'index.pickle')
+
+
+def write(rel_path, content):
+    path = os.path.join(ROOT, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(path, mode) as f:
+        f.write(content)
+    return path
+
+
+def setup_module(module=None):
+    write('src/app.py', 'import os\n\ndef main():\n    return run()\n\ndef run():\n    pass\n')
+    write('src/util.ts', 'export function Run() {}\r\nexport const x = 1;\r\n')
+    write('src/Kelvin.txt', 'temperature: 300K\n')
+    write('docs/notes.md', 'TODO: write docs\nfoo\nbar\n')
+    write('data/blob.bin', b'\x89PNG\x00\x00 def main run')
+    write('.hidden/secret.py', 'def main(): pass\n')
+    write('.env', 'SECRET_TOKEN=1\n')
+    for i in range(200):
+        write(f'many/file{i:03d}.txt', f'filler {i}\n' + ('needle\n' if i % 50 == 7 else ''))
+
+
+def test_query():
+    """测试从正则中提取必需的 trigram"""
+    print("\n测试 trigram 提取...")
+    assert trigram_query('needle_token') == ('lit', 'needle_token')
+    assert trigram_query('foo|barbaz') == ('or', [('lit', 'foo'), ('lit', 'barbaz')])
+    assert trigram_query(r'def \w+\(self') == ('and', [('lit', 'def '), ('lit', '(self')])
+    assert trigram_query(r'(abc)+x?') == ('lit', 'abc')
+    assert trigram_query(r'x{0,3}\w') is None, "可选部分不是必需的"
+    assert trigram_query('a.b') is None and trigram_query('ab|cdef') is None
+    # 换行符在磁盘上可能是 \r\n；忽略大小写时 k/s/i 可以匹配非 ASCII 字符
+    assert trigram_query(r'line1\nline2') == ('and', [('lit', 'line1'), ('lit', 'line2')])
+    assert trigram_query('TASK', case_insensitive=True) is None
+    assert trigram_query('(?i)todo list') == ('lit', 'todo l')
+    print("  ✓ 字面量、分支、重复和大小写规则正确")
+
+
+def test_search_parity():
+    """测试使用索引的搜索结果与遍历全部文件一致，且只读取候选文件"""
+    print("\n测试搜索结果一致...")
+    index = TrigramIndex(ROOT, INDEX_PATH, max_age=3600)
+    assert index.build() == 206, index.get_stats()
+    indexed = GrepEngine(workers=0, index=index)
+    plain = GrepEngine(workers=0)
+    cases = [
+        ('needle', {}), ('run', {'output_mode': 'count'}), ('RUN', {'case_insensitive': True}),
+        ('def main', {'file_pattern': '*.py'}), ('SECRET_TOKEN', {'file_pattern': '.env'}),
+        ('todo|filler 19', {'output_mode': 'content', 'case_insensitive': True}),
+        ('300k', {'case_insensitive': True}), (r'foo\nbar', {'multiline': True, 'output_mode': 'content'}),
+        (r'\w+\(\)', {'output_mode': 'content'}), ('filler', {'head_limit': 5})
+    ]
+    for pattern, options in cases:
+        expected = plain.search(pattern, ROOT, **options)
+        assert indexed.search(pattern, ROOT, **options) == expected, (pattern, expected)
+        sub = os.path.join(ROOT, 'src')
+        assert indexed.search(pattern, sub, **options) == plain.search(pattern, sub, **options), pattern
+
+    before = indexed.get_stats()['files_searched']
+    assert indexed.search('needle', ROOT)['count'] == 4
+    assert indexed.get_stats()['files_searched'] - before == 4, "只应读取包含 trigram 的文件"
+    assert index.candidates(os.path.join(ROOT, 'src'), 'needle') == []
+    assert index.candidates('/tmp', 'needle') is None, "索引外的目录应遍历文件"
+    stats = index.get_stats()
+    assert stats['files'] == 206 and stats['trigrams'] > 0 and stats['disk_bytes'] > 0, stats
+    print(f"  ✓ {len(cases)} 个查询结果一致，索引 {stats['trigrams']} 个 trigram")
+
+
+def test_incremental():
+    """测试文件修改、删除、新增后的增量更新、变更通知和从磁盘加载"""
+    print("\n测试增量更新...")
+    index = TrigramIndex(ROOT, INDEX_PATH, max_age=3600)
+    assert index.load() and len(index.files) == 206, "应从磁盘加载索引"
+    assert index.refresh() == 0, "文件未变化时不应重新索引"
+    engine = GrepEngine(workers=0, index=index)
+
+    write('docs/notes.md', 'TODO: write docs\nfresh_marker\n')
+    os.remove(os.path.join(ROOT, 'many/file007.txt'))
+    write('new/added.py', 'fresh_marker = 1\n')
+    # 未检查变化前仍使用旧索引，标记过期后重新检查
+    assert engine.search('fresh_marker', ROOT)['count'] == 0
+    index.mark_stale()
+    result = engine.search('fresh_marker', ROOT)
+    assert [os.path.relpath(f, ROOT) for f in result['files']] == ['docs/notes.md', 'new/added.py'], result
+    assert engine.search('needle', ROOT)['count'] == 3
+    assert index.stats['files_indexed'] == 2 and index.dead == 2, index.get_stats()
+
+    # 文件变更通知立即更新索引
+    path = write('new/added.py', 'watched_marker = 2\n')
+    index.notify_changed([path, os.path.join(ROOT, 'docs/notes.md')])
+    assert engine.search('watched_marker', ROOT)['files'] == [path]
+    os.remove(path)
+    index.notify_changed([path])
+    assert engine.search('watched_marker', ROOT)['count'] == 0 and path not in index.files
+
+    index._compact()
+    assert engine.search('fresh_marker', ROOT)['count'] == 1 and index.dead == 0
+    print(f"  ✓ 增量更新 {index.stats['files_indexed']} 个文件")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("trigram 索引测试")
+    print("=" * 60)
+
+    try:
+        setup_module()
+        test_query()
+        test_search_parity()
+        test_incremental()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+工作区索引测试：内存目录树与磁盘一致、inotify 实时更新、定期扫描回退、变化通知，以及 glob/grep/list_directory 使用索引的结果不变
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+
+# 添加项目路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tools
+import workspace_index
+from glob_engine import GlobEngine
+from grep_engine import GrepEngine
+from tool_cache import ToolResultCache
+from trigram_index import TrigramIndex
+from workspace_index import WorkspaceIndex, F_DIR, F_FILE, F_IGNORED, F_LINK
+
+WORKDIR = tempfile.mkdtemp(prefix='test-workspace-index-')
+ROOT = os.path.join(WORKDIR, 'repo')
+
+
+def write(rel_path, content='x\n'):
+    path = os.path.join(ROOT, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def setup_module(module=None):
+    for rel_path in ('src/app.py', 'src/util.ts', 'src/deep/mod.py', 'b/inner.py', 'b.py', 'README.md',
+                     '.env', '.hidden/secret.py', 'node_modules/pkg/index.js', '.git/config',
+                     'build/out.js', 'logs/debug.log', 'logs/keep.log'):
+        write(rel_path, f'def run(): pass  # {rel_path}\n')
+    write('.gitignore', 'build/\n*.log\n!keep.log\n')
+    os.symlink(os.path.join(ROOT, 'src'), os.path.join(ROOT, 'link'))
+    for i in range(60):
+        write(f'many/file{i:02d}.txt', 'needle\n' if i % 20 == 3 else 'hay\n')
+
+
+def snapshot(index):
+    """目录路径 -> {名称: (标记, 大小, 修改时间)}（符号链接的目标在查询时重新 stat，只比较标记）"""
+    return {path: {name: record[0] if record[0] & F_LINK else record for name, record in node.records().items()}
+            for path, node in index.dirs.items()}
+
+
+def fresh_snapshot():
+    index = WorkspaceIndex(ROOT, use_inotify=False)
+    index.rescan()
+    return snapshot(index)
+
+
+def test_build():
+    """测试首次扫描：条目与磁盘一致，类型和忽略标记，排除的目录不扫描"""
+    print("\n测试构建目录树...")
+    index = WorkspaceIndex(ROOT, use_inotify=False)
+    index.rescan()
+    names = [entry.name for entry in index.entries(ROOT)]
+    assert names == sorted(os.listdir(ROOT)), names
+    records = index.dirs[ROOT].records()
+    assert records['src'][0] & F_DIR and not records['src'][0] & F_IGNORED
+    assert records['link'][0] & F_LINK and index.entries(os.path.join(ROOT, 'link')) is None, "不进入符号链接"
+    assert records['README.md'][0] & F_FILE and records['README.md'][1] == os.path.getsize(os.path.join(ROOT, 'README.md'))
+    for ignored in ('node_modules', 'build', '.git'):
+        assert records[ignored][0] & F_IGNORED, ignored
+    logs = index.dirs[os.path.join(ROOT, 'logs')].records()
+    assert logs['debug.log'][0] & F_IGNORED and not logs['keep.log'][0] & F_IGNORED
+    assert index.dirs[os.path.join(ROOT, 'node_modules', 'pkg')].records()['index.js'][0] & F_IGNORED, \
+        "忽略目录中的条目也标记为忽略"
+    assert os.path.join(ROOT, '.git') not in index.dirs, ".git 不扫描"
+    assert index.entries(os.path.join(ROOT, 'src'), ['app.py', 'missing'])[0].name == 'app.py'
+    stats = index.get_stats()
+    assert stats['entries'] > 70 and stats['memory_bytes'] > 0 and stats['memory_mb_per_100k_entries']
+    print(f"  ✓ {stats['entries']} 个条目，约 {stats['memory_mb_per_100k_entries']}MB / 10 万条目")
+
+
+def test_inotify_updates():
+    """测试 inotify：创建、修改、删除、移动和替换目录后立即与重新扫描的结果一致，并发布变化的路径"""
+    print("\n测试 inotify 更新...")
+    index = WorkspaceIndex(ROOT)
+    index.rescan()
+    if index.get_stats()['inotify'] is False:
+        print("  - inotify 不可用，跳过")
+        return
+    published = []
+    index.subscribe(published.extend)
+    try:
+        write('src/new.py', 'def new(): pass\n')
+        write('src/app.py', 'def run(): return 42\n')
+        os.remove(os.path.join(ROOT, 'b.py'))
+        write('pkg/a/b/c.py')
+        assert index.sync()
+        assert snapshot(index) == fresh_snapshot()
+        for rel_path in ('src/new.py', 'src/app.py', 'b.py', 'pkg', 'pkg/a/b/c.py'):
+            assert os.path.join(ROOT, rel_path) in published, rel_path
+
+        published.clear()
+        shutil.move(os.path.join(ROOT, 'pkg'), os.path.join(ROOT, 'moved'))
+        shutil.move(os.path.join(ROOT, 'moved', 'a'), os.path.join(WORKDIR, 'outside'))
+        shutil.rmtree(os.path.join(ROOT, 'b'))
+        write('b/replaced.py')
+        index.sync()
+        assert snapshot(index) == fresh_snapshot()
+        for rel_path in ('pkg/a/b/c.py', 'moved', 'b/inner.py', 'b/replaced.py'):
+            assert os.path.join(ROOT, rel_path) in published, rel_path
+        # 移出索引的目录不再被监听
+        write(os.path.join(WORKDIR, 'outside', 'later.py'))
+        index.sync()
+        assert snapshot(index) == fresh_snapshot()
+        assert sorted(index._watches) == sorted(index.dirs), "每个目录一个监听"
+
+        # .gitignore 变化后重新计算忽略标记
+        write('.gitignore', 'build/\n*.log\n!keep.log\n*.ts\n')
+        index.sync()
+        assert index.dirs[os.path.join(ROOT, 'src')].records()['util.ts'][0] & F_IGNORED
+        assert snapshot(index) == fresh_snapshot()
+        assert index.get_stats()['events'] > 0
+    finally:
+        index.stop()
+    print("  ✓ 变化立即可见，移动/删除的目录发布其下所有路径")
+
+
+def test_polling():
+    """测试没有 inotify 时：标记过期后下次查询重新扫描"""
+    print("\n测试定期扫描回退...")
+    index = WorkspaceIndex(ROOT, use_inotify=False, poll_interval=3600)
+    index.rescan()
+    published = []
+    index.subscribe(published.extend)
+    path = write('poll/new.txt')
+    index.sync()
+    assert 'poll' not in index.dirs[ROOT].records(), "扫描间隔内不重新扫描"
+    index.mark_stale()
+    index.sync()
+    assert index.dirs[os.path.join(ROOT, 'poll')].records()['new.txt'][0] & F_FILE
+    assert path in published and index.get_stats()['rescans'] == 2
+    print("  ✓ 写文件的工具执行后重新扫描")
+
+
+def test_engines():
+    """测试 glob 和 grep 使用索引时结果与从磁盘读取一致，修改后立即可见"""
+    print("\n测试 glob/grep 使用索引...")
+    index = WorkspaceIndex(ROOT)
+    index.rescan()
+    try:
+        indexed_glob, disk_glob = GlobEngine(tree=index), GlobEngine()
+        for pattern in ('**/*', '**/*.py', 'src/*', 'node_modules/*/*.js', '.hidden/*', 'link/*.py',
+                        '*.md', 'logs/*', 'many/file0?.txt'):
+            for sort_by in ('path', 'mtime'):
+                expected = disk_glob.glob(pattern, ROOT, sort_by, limit=1000)
+                assert indexed_glob.glob(pattern, ROOT, sort_by, limit=1000) == expected, (pattern, sort_by)
+        assert indexed_glob.get_stats()['indexed_listings'] > 0
+        assert indexed_glob.glob('*', os.path.join(ROOT, 'src')) == disk_glob.glob('*', os.path.join(ROOT, 'src'))
+
+        indexed_grep, disk_grep = GrepEngine(workers=0, tree=index), GrepEngine(workers=0)
+        for pattern, options in (('needle', {}), ('run', {'output_mode': 'count'}),
+                                 ('def', {'file_pattern': '*.py', 'output_mode': 'content'}),
+                                 ('SECRET|run', {'file_pattern': '.env'})):
+            assert indexed_grep.search(pattern, ROOT, **options) == disk_grep.search(pattern, ROOT, **options)
+
+        path = write('many/zz_new.txt', 'needle\n')
+        assert path in indexed_grep.search('needle', ROOT)['files'], "新文件立即可见"
+        assert 'many/zz_new.txt' in indexed_glob.glob('many/*', ROOT, limit=1000)['matches']
+        os.remove(path)
+        assert 'many/zz_new.txt' not in indexed_glob.glob('many/*', ROOT, limit=1000)['matches']
+    finally:
+        index.stop()
+    print("  ✓ 结果一致")
+
+
+def test_feed_subscribers():
+    """测试 list_directory 使用全局索引，trigram 索引和工具结果缓存根据变化通知更新"""
+    print("\n测试变化通知...")
+    index = WorkspaceIndex(ROOT)
+    index.rescan()
+    saved = workspace_index.ENABLED, workspace_index._index
+    workspace_index.ENABLED, workspace_index._index = True, index
+    try:
+        src = os.path.join(ROOT, 'src')
+        expected = {"success": True, "path": src,
+                    "items": [{"name": name, "type": "directory" if os.path.isdir(os.path.join(src, name)) else "file",
+                               "size": 0 if os.path.isdir(os.path.join(src, name))
+                               else os.path.getsize(os.path.join(src, name))}
+                              for name in sorted(os.listdir(src))]}
+        assert tools.execute_list_directory(src) == expected
+        before = index.get_stats()['listings']
+        tools.execute_list_directory(src)
+        assert index.get_stats()['listings'] == before + 1, "应从索引读取"
+
+        trigrams = TrigramIndex(ROOT, None, max_age=3600)
+        assert trigrams.follow(index)
+        trigrams.build()
+        engine = GrepEngine(workers=0, index=trigrams, tree=index)
+        refreshes = trigrams.get_stats()['refreshes']
+        path = write('src/fresh.py', 'unusual_token = 1\n')
+        assert engine.search('unusual_token', ROOT)['files'] == [path]
+        os.remove(path)
+        assert engine.search('unusual_token', ROOT)['files'] == []
+        assert trigrams.get_stats()['refreshes'] == refreshes, "不应遍历目录树"
+
+        cache = ToolResultCache()
+        index.subscribe(cache.invalidate_paths)
+        readme = os.path.join(ROOT, 'README.md')
+        for tool_name, tool_input in (('read_file', {'file_path': readme}), ('list_directory', {'path': src}),
+                                      ('glob', {'pattern': '*', 'path': ROOT})):
+            cache.store('s1', tool_name, tool_input, ('fp',), {'success': True})
+        write('src/deep/changed.py')
+        index.sync()
+        assert cache.get_stats()['entries'] == 1, "src 下的变化使目录结果失效，README 的结果保留"
+        write('README.md', 'changed\n')
+        index.sync()
+        assert cache.get_stats()['entries'] == 0
+    finally:
+        workspace_index.ENABLED, workspace_index._index = saved
+        index.stop()
+    print("  ✓ trigram 索引不遍历即更新，缓存按路径失效")
+
+
+def main():
+    """运行所有测试"""
+    print("=" * 60)
+    print("工作区索引测试")
+    print("=" * 60)
+
+    try:
+        setup_module()
+        test_build()
+        test_inotify_updates()
+        test_polling()
+        test_engines()
+        test_feed_subscribers()
+
+        print("\n" + "=" * 60)
+        print("✅ 所有测试通过！")
+        print("=" * 60)
+        return 0
+
+    except AssertionError as e:
+        print(f"\n❌ 测试失败: {e}")
+        return 1
+    except Exception as e:
+        print(f"\n❌ 测试错误: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
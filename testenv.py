@@ -0,0 +1,43 @@
+"""
+测试用的临时数据库和工作目录
+
+使用数据库的测试模块在 setup_module 中调用 start()、在 teardown_module 中调用 stop()
+（直接运行脚本时由 main() 调用）：database.DATABASE_PATH 指向临时目录中的数据库，
+当前目录切换到临时目录（operation_logger、mcp_database、memory_database 使用相对路径
+conversations.db），结束时恢复两者并删除临时目录，不影响之后运行的测试。
+"""
+
+import os
+import shutil
+
+import database
+from db_writer import get_db_writer
+
+
+class TempDatabase:
+    """一个测试模块的临时数据库"""
+
+    def __init__(self, workdir: str):
+        """
+        Args:
+            workdir: 临时目录（stop() 时删除）
+        """
+        self.workdir = workdir
+        self._saved = None
+
+    def start(self):
+        """切换到临时目录中的数据库并建表"""
+        self._saved = (database.DATABASE_PATH, os.getcwd())
+        database.DATABASE_PATH = os.path.join(self.workdir, 'test.db')
+        os.chdir(self.workdir)
+        database.init_db()
+
+    def stop(self):
+        """写完后台写队列，恢复数据库路径和当前目录，删除临时目录"""
+        if self._saved is None:
+            return
+        get_db_writer().flush(10)
+        database.DATABASE_PATH, cwd = self._saved
+        self._saved = None
+        os.chdir(cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
@@ -0,0 +1,234 @@
+"""
+Session-scoped cache of read-only tool results.
+
+Within one agentic turn the model often reads the same file or lists the
+same directory several times. Results of tools whose TOOL_METADATA entry
+has a 'cache' kind are kept per session, keyed by tool name and normalized
+input, and stored with a validity fingerprint taken before the tool ran:
+
+- 'file': mtime, size and inode of the file
+- 'directory': mtime of the directory (or of the search root for glob)
+
+A lookup recomputes the fingerprint (one stat call) and only returns the
+entry if it still matches. A directory mtime does not change when nested
+files change, so entries also expire after TTL seconds, and every entry of
+a session is dropped as soon as a tool that modifies the filesystem
+(write_file, edit_file, bash) runs in that session. With the workspace
+index enabled, its change feed also drops the entries of every session
+whose file, or a file under whose directory, changed (invalidate_paths).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+import config
+import tools
+
+
+ENABLED = getattr(config, 'TOOL_CACHE_ENABLED', True)
+# Seconds an entry stays valid even if its fingerprint still matches
+TTL = getattr(config, 'TOOL_CACHE_TTL', 60)
+MAX_ENTRIES_PER_SESSION = getattr(config, 'TOOL_CACHE_MAX_ENTRIES', 128)
+MAX_SESSIONS = getattr(config, 'TOOL_CACHE_MAX_SESSIONS', 256)
+
+
+def _normalize_input(tool_input: Dict[str, Any]) -> Dict[str, Any]:
+    """Input with path fields made absolute, so ./a and a share an entry."""
+    normalized = dict(tool_input)
+    for field in ('file_path', 'path'):
+        if normalized.get(field):
+            normalized[field] = os.path.abspath(normalized[field])
+    return normalized
+
+
+def _target_path(kind: str, tool_input: Dict[str, Any]) -> Optional[str]:
+    if kind == 'file':
+        path = tool_input.get('file_path')
+    else:
+        path = tool_input.get('path') or tools.DEFAULT_SEARCH_PATH
+    return os.path.abspath(path) if path else None
+
+
+def fingerprint(kind: str, tool_input: Dict[str, Any]) -> Optional[Tuple]:
+    """
+    Validity fingerprint of the path a cached tool reads.
+
+    Args:
+        kind: 'file' or 'directory' (TOOL_METADATA cache kind)
+        tool_input: Tool input
+
+    Returns:
+        Fingerprint tuple, or None if the path cannot be stat'ed (the
+        result is then not cached)
+    """
+    path = _target_path(kind, tool_input)
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if kind == 'file':
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    return (st.st_mtime_ns, st.st_ino)
+
+
+class ToolResultCache:
+    """Per-session LRU cache of read-only tool results."""
+
+    def __init__(self, ttl: float = TTL, max_entries: int = MAX_ENTRIES_PER_SESSION,
+                 max_sessions: int = MAX_SESSIONS):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: Seconds an entry stays valid
+            max_entries: Entries kept per session (least recently used dropped)
+            max_sessions: Sessions kept (least recently used dropped)
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'invalidations': 0, 'evictions': 0}
+
+    @staticmethod
+    def cache_kind(tool_name: str) -> Optional[str]:
+        """Cache kind of a tool, or None if its results are never cached."""
+        if not ENABLED:
+            return None
+        metadata = tools.TOOL_METADATA.get(tool_name)
+        if metadata is None or metadata['requires_permission']:
+            return None
+        return metadata.get('cache')
+
+    @staticmethod
+    def invalidates(tool_name: str) -> bool:
+        """Whether running the tool may change what cached tools return."""
+        metadata = tools.TOOL_METADATA.get(tool_name)
+        return metadata is not None and metadata['requires_permission']
+
+    @staticmethod
+    def _key(tool_name: str, tool_input: Dict[str, Any]) -> str:
+        normalized = _normalize_input(tool_input)
+        return tool_name + '\0' + json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+
+    def lookup(self, session_id: str, tool_name: str,
+               tool_input: Dict[str, Any]) -> Tuple[Optional[Any], Optional[Tuple]]:
+        """
+        Look up a tool result.
+
+        Args:
+            session_id: Session the call belongs to
+            tool_name: Tool name
+            tool_input: Tool input
+
+        Returns:
+            (cached result or None, current fingerprint); pass the
+            fingerprint to store() after executing on a miss
+        """
+        kind = self.cache_kind(tool_name)
+        if kind is None:
+            return None, None
+        current = fingerprint(kind, tool_input)
+        key = self._key(tool_name, tool_input)
+
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            entry = entries.get(key) if entries is not None else None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None, current
+            if current is None or entry['fingerprint'] != current or \
+                    time.monotonic() - entry['stored_at'] > self.ttl:
+                del entries[key]
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return None, current
+            entries.move_to_end(key)
+            self._sessions.move_to_end(session_id)
+            self.stats['hits'] += 1
+            return entry['result'], current
+
+    def store(self, session_id: str, tool_name: str, tool_input: Dict[str, Any],
+              fp: Optional[Tuple], result: Any):
+        """
+        Store a tool result taken with fingerprint fp.
+
+        Failed results (success: False) and results without a fingerprint
+        are not stored.
+        """
+        kind = self.cache_kind(tool_name)
+        if kind is None or fp is None:
+            return
+        if not isinstance(result, dict) or not result.get('success'):
+            return
+        key = self._key(tool_name, tool_input)
+
+        with self._lock:
+            entries = self._sessions.get(session_id)
+            if entries is None:
+                entries = self._sessions[session_id] = OrderedDict()
+                while len(self._sessions) > self.max_sessions:
+                    _, dropped = self._sessions.popitem(last=False)
+                    self.stats['evictions'] += len(dropped)
+            self._sessions.move_to_end(session_id)
+            entries[key] = {'fingerprint': fp, 'result': result, 'stored_at': time.monotonic(),
+                            'kind': kind, 'path': _target_path(kind, tool_input)}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate_session(self, session_id: str):
+        """Drop every cached result of a session."""
+        with self._lock:
+            entries = self._sessions.pop(session_id, None)
+            if entries:
+                self.stats['invalidations'] += len(entries)
+
+    def invalidate_paths(self, paths: List[str]):
+        """
+        Drop the entries (of every session) that read changed paths: file
+        results of a changed file, directory results of a changed path or
+        of one of its parent directories.
+
+        Args:
+            paths: Absolute paths that changed (workspace index change feed)
+        """
+        changed = set(paths)
+        parents = set()
+        for path in changed:
+            directory = os.path.dirname(path)
+            while directory not in parents:
+                parents.add(directory)
+                parent = os.path.dirname(directory)
+                if parent == directory:
+                    break
+                directory = parent
+
+        with self._lock:
+            for entries in self._sessions.values():
+                stale = [key for key, entry in entries.items()
+                         if entry['path'] in changed or (entry['kind'] != 'file' and entry['path'] in parents)]
+                for key in stale:
+                    del entries[key]
+                self.stats['invalidations'] += len(stale)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else None,
+                'sessions': len(self._sessions),
+                'entries': sum(len(entries) for entries in self._sessions.values()),
+                'enabled': ENABLED,
+                'ttl': self.ttl
+            }
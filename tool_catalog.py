@@ -0,0 +1,118 @@
+"""
+Versioned catalog of the tools offered to the model.
+
+The merged list of direct tools and MCP tools only changes when an MCP
+server connects, disconnects or reports a tools/list change, each of which
+bumps MCPServerManager.tools_version. The catalog is rebuilt lazily when
+that version moves; between rebuilds every chat request gets the same list
+object, and tool lookups (source, MCP server, input schema) are a single
+dictionary hit in the name index.
+"""
+
+import logging
+import threading
+from typing import Dict, List, Any, NamedTuple, Optional
+
+import tools
+
+
+logger = logging.getLogger(__name__)
+
+
+class ToolEntry(NamedTuple):
+    """Index entry of one tool."""
+    source: str  # 'direct' or 'mcp'
+    server_id: Optional[int]  # MCP server ID, None for direct tools
+    schema: Dict[str, Any]  # Tool definition as sent to the API
+
+
+class ToolCatalog:
+    """Merged tool list and name index, rebuilt when the MCP tools change."""
+
+    def __init__(self, mcp_manager):
+        """
+        Initialize tool catalog.
+
+        Args:
+            mcp_manager: MCPServerManager providing MCP tools and tools_version
+        """
+        self.mcp_manager = mcp_manager
+        self.tools: List[Dict[str, Any]] = []
+        self.index: Dict[str, ToolEntry] = {}
+        self.version = 0
+        self.rebuilds = 0
+        self._built_for: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Rebuild if the MCP manager's tool version changed since the last build."""
+        mcp_version = self.mcp_manager.tools_version
+        if self._built_for == mcp_version:
+            return
+        with self._lock:
+            if self._built_for == mcp_version:
+                return
+
+            merged = list(tools.TOOLS)
+            index = {tool['name']: ToolEntry('direct', None, tool) for tool in tools.TOOLS}
+            try:
+                for server_id, mcp_tools in self.mcp_manager.get_tools_by_server().items():
+                    for tool in mcp_tools:
+                        merged.append(tool)
+                        index[tool['name']] = ToolEntry('mcp', server_id, tool)
+            except Exception as e:
+                logger.error(f"Failed to get MCP tools: {e}")
+
+            # Publish the index before the list, readers of either see a complete build
+            self.index = index
+            self.tools = merged
+            self.version += 1
+            self.rebuilds += 1
+            self._built_for = mcp_version
+
+    def get_tools(self) -> List[Dict[str, Any]]:
+        """
+        Get the merged tool list.
+
+        Returns:
+            Tool definitions for the API; shared between requests, do not modify
+        """
+        self._refresh()
+        return self.tools
+
+    def get(self, tool_name: str) -> Optional[ToolEntry]:
+        """Look up a tool by name, None if it is not offered."""
+        self._refresh()
+        return self.index.get(tool_name)
+
+    def validate_input(self, tool_name: str, tool_input: Any) -> Optional[str]:
+        """
+        Check a tool call against the catalog.
+
+        Only checks what the schema makes cheap to check: the tool exists,
+        the input is an object and the required properties are present.
+
+        Returns:
+            Error message, or None if the call is valid
+        """
+        entry = self.get(tool_name)
+        if entry is None:
+            return f"Unknown tool: {tool_name}"
+        if not isinstance(tool_input, dict):
+            return f"Invalid input for {tool_name}: expected an object"
+        missing = [name for name in entry.schema.get('input_schema', {}).get('required', [])
+                   if name not in tool_input]
+        if missing:
+            return f"Missing required parameter(s) for {tool_name}: {', '.join(missing)}"
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Catalog version and size."""
+        self._refresh()
+        return {
+            'version': self.version,
+            'mcp_tools_version': self._built_for,
+            'rebuilds': self.rebuilds,
+            'tools': len(self.tools),
+            'mcp_tools': sum(1 for entry in self.index.values() if entry.source == 'mcp')
+        }
@@ -0,0 +1,331 @@
+"""
+Size limits for tool results.
+
+A tool result goes into the model context whole (as JSON), so one bash
+command printing megabytes, a long read_file or a large MCP response can
+fill the context window on its own. ToolOutputShaper keeps every result
+under a per-tool byte and token ceiling before it is logged, cached or
+sent to the model:
+
+- long strings keep their head and tail around an "N bytes elided" marker
+- long lists keep their first and last items around an "N items elided"
+  marker
+
+The complete output is first written to a content-addressed store on disk
+(file name = SHA-256 of the text), and the markers name its handle so the
+model can page through it with the read_tool_output tool. Results shown in
+the browser (SSE tool_result events) are capped the same way with a
+smaller display limit.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+import config
+from context_compactor import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+# Ceiling for the JSON text of a tool result sent to the model
+MAX_BYTES = getattr(config, 'TOOL_OUTPUT_MAX_BYTES', 50000)
+MAX_TOKENS = getattr(config, 'TOOL_OUTPUT_MAX_TOKENS', 12000)
+# Per-tool overrides: {tool name: {'max_bytes': ..., 'max_tokens': ...}},
+# or None for results that must never be cut
+DEFAULT_LIMITS = {
+    'read_file': {'max_bytes': 100000, 'max_tokens': 25000},
+    'bash': {'max_bytes': 30000, 'max_tokens': 8000},
+    'ask_user_question': None
+}
+LIMITS = {**DEFAULT_LIMITS, **getattr(config, 'TOOL_OUTPUT_LIMITS', {})}
+# Ceiling for results shown in the browser
+DISPLAY_MAX_BYTES = getattr(config, 'TOOL_OUTPUT_DISPLAY_MAX_BYTES', 20000)
+# Spilled outputs are removed after this many seconds without being written again
+STORE_DIR = getattr(config, 'TOOL_OUTPUT_DIR', '/root/claude-web/tool_outputs')
+RETENTION = getattr(config, 'TOOL_OUTPUT_RETENTION', 7 * 86400)
+
+# Lines and bytes returned per read_tool_output page
+PAGE_LINES = 400
+PAGE_MAX_BYTES = 24000
+PRUNE_INTERVAL = 3600
+
+_HANDLE_RE = re.compile(r'^[0-9a-f]{24}$')
+
+
+class ToolOutputStore:
+    """Content-addressed store of complete tool outputs."""
+
+    def __init__(self, directory: str = STORE_DIR, retention: float = RETENTION):
+        """
+        Initialize output store.
+
+        Args:
+            directory: Directory holding the outputs
+            retention: Seconds before an output is removed
+        """
+        self.directory = directory
+        self.retention = retention
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, handle: str) -> str:
+        return os.path.join(self.directory, handle[:2], f"{handle}.txt")
+
+    def put(self, text: str) -> str:
+        """
+        Store a complete output.
+
+        Returns:
+            Handle of the output (the same text always gets the same handle)
+        """
+        data = text.encode('utf-8')
+        handle = hashlib.sha256(data).hexdigest()[:24]
+        path = self._path(handle)
+        if os.path.exists(path):
+            # Refresh its age
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        self._maybe_prune()
+        return handle
+
+    def read(self, handle: str, offset: int = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Read a page of a stored output.
+
+        Args:
+            handle: Output handle
+            offset: First line (0-based)
+            limit: Maximum number of lines (default PAGE_LINES)
+
+        Returns:
+            Page with numbered lines, in the read_file result format, plus
+            'next_offset' (None on the last page)
+        """
+        if not handle or not _HANDLE_RE.match(handle):
+            return {"success": False, "error": f"Invalid output handle: {handle}"}
+        path = self._path(handle)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                lines = f.read().split('\n')
+        except FileNotFoundError:
+            return {"success": False, "error": f"Output not found (expired?): {handle}"}
+
+        offset = max(0, int(offset or 0))
+        limit = max(1, int(limit or PAGE_LINES))
+        page = []
+        size = 0
+        for number in range(offset, min(len(lines), offset + limit)):
+            line = lines[number]
+            if len(line) > PAGE_MAX_BYTES:
+                line = elide(line, PAGE_MAX_BYTES // 2)
+            size += len(line) + 1
+            if page and size > PAGE_MAX_BYTES:
+                break
+            page.append(f"{number + 1:5d}→{line}")
+
+        end = offset + len(page)
+        return {
+            "success": True,
+            "handle": handle,
+            "content": '\n'.join(page),
+            "offset": offset,
+            "total_lines": len(lines),
+            "total_bytes": os.path.getsize(path),
+            "next_offset": end if end < len(lines) else None
+        }
+
+    def _maybe_prune(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < PRUNE_INTERVAL:
+                return
+            self._last_prune = now
+        try:
+            for name in os.listdir(self.directory):
+                bucket = os.path.join(self.directory, name)
+                if not os.path.isdir(bucket):
+                    continue
+                for entry in os.scandir(bucket):
+                    if now - entry.stat().st_mtime > self.retention:
+                        os.remove(entry.path)
+        except OSError as e:
+            logger.warning(f"Failed to prune tool outputs: {e}")
+
+
+def _hint(handle: Optional[str]) -> str:
+    return f'; full output: read_tool_output(handle="{handle}")' if handle else ''
+
+
+def elide(text: str, keep: int, handle: Optional[str] = None) -> str:
+    """
+    Keep about keep characters of text: its head and tail around a marker.
+
+    Cuts fall on line boundaries when one is close.
+    """
+    if len(text) <= keep:
+        return text
+    half = max(1, keep // 2)
+    head = text[:half]
+    newline = head.rfind('\n')
+    if newline > half * 0.8:
+        head = head[:newline + 1]
+    tail = text[-half:]
+    newline = tail.find('\n')
+    if 0 <= newline < half * 0.2:
+        tail = tail[newline + 1:]
+    elided = len(text[len(head):len(text) - len(tail)].encode('utf-8'))
+    return f"{head}\n… [{elided} bytes elided{_hint(handle)}] …\n{tail}"
+
+
+def _shrink(value: Any, max_chars: int, max_items: int, handle: Optional[str]) -> Any:
+    if isinstance(value, str):
+        return elide(value, max_chars, handle)
+    if isinstance(value, list):
+        if len(value) > max_items:
+            head = max(1, max_items // 2)
+            tail = max(1, max_items - head)
+            marker = f"… [{len(value) - head - tail} items elided{_hint(handle)}] …"
+            value = value[:head] + [marker] + value[-tail:]
+        return [_shrink(item, max_chars, max_items, handle) for item in value]
+    if isinstance(value, dict):
+        return {key: _shrink(item, max_chars, max_items, handle) for key, item in value.items()}
+    return value
+
+
+def _largest_string(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    items = value.values() if isinstance(value, dict) else value if isinstance(value, list) else ()
+    return max((_largest_string(item) for item in items), key=len, default='')
+
+
+class ToolOutputShaper:
+    """Caps tool results to per-tool ceilings, spilling full outputs to a store."""
+
+    def __init__(self, store: Optional[ToolOutputStore] = None,
+                 limits: Optional[Dict[str, Any]] = None,
+                 max_bytes: int = MAX_BYTES, max_tokens: int = MAX_TOKENS,
+                 display_max_bytes: int = DISPLAY_MAX_BYTES):
+        """
+        Initialize output shaper.
+
+        Args:
+            store: Store for complete outputs (default: the global store)
+            limits: Per-tool overrides (default LIMITS)
+            max_bytes: Default byte ceiling
+            max_tokens: Default token ceiling
+            display_max_bytes: Byte ceiling of results shown in the browser
+        """
+        self.store = store or get_output_store()
+        self.limits = LIMITS if limits is None else limits
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.display_max_bytes = display_max_bytes
+        self._lock = threading.Lock()
+        self.stats = {'shaped': 0, 'spilled_bytes': 0, 'sent_bytes': 0}
+
+    def get_limits(self, tool_name: str) -> Optional[Tuple[int, int]]:
+        """(max bytes, max tokens) of a tool, or None if it is never cut."""
+        if tool_name in self.limits and self.limits[tool_name] is None:
+            return None
+        override = self.limits.get(tool_name) or {}
+        return override.get('max_bytes', self.max_bytes), override.get('max_tokens', self.max_tokens)
+
+    def shape(self, tool_name: str, result: Any) -> Any:
+        """
+        Cap a tool result for the model context.
+
+        Args:
+            tool_name: Tool that produced the result
+            result: Raw result
+
+        Returns:
+            The result itself if it fits, otherwise a copy with long strings
+            and lists cut; dict results then also carry 'truncated',
+            'output_handle' and 'output_bytes'
+        """
+        limits = self.get_limits(tool_name)
+        if limits is None:
+            return result
+        max_bytes, max_tokens = limits
+        text = json.dumps(result)
+        if len(text) <= max_bytes and estimate_tokens(text) <= max_tokens:
+            return result
+
+        # Spill the output itself when one string dominates (bash output,
+        # file content), otherwise the whole result as indented JSON
+        largest = _largest_string(result)
+        full = largest if len(largest) * 2 > len(text) else json.dumps(result, indent=2, ensure_ascii=False)
+        try:
+            handle = self.store.put(full)
+        except OSError as e:
+            # Still cut the result; the elided part is just not retrievable
+            logger.warning(f"Failed to store tool output: {e}")
+            handle = None
+        full_bytes = len(full.encode('utf-8'))
+
+        shaped = self._fit(result, max_bytes, max_tokens, handle, {
+            'truncated': True, 'output_handle': handle, 'output_bytes': full_bytes
+        })
+        with self._lock:
+            self.stats['shaped'] += 1
+            self.stats['spilled_bytes'] += full_bytes
+            self.stats['sent_bytes'] += len(json.dumps(shaped))
+        return shaped
+
+    def for_display(self, result: Any) -> Any:
+        """Cap a result shown in the browser (nothing is spilled again)."""
+        text = json.dumps(result, ensure_ascii=False)
+        if len(text) <= self.display_max_bytes:
+            return result
+        handle = result.get('output_handle') if isinstance(result, dict) else None
+        return self._fit(result, self.display_max_bytes, None, handle, {'truncated': True}, ensure_ascii=False)
+
+    def _fit(self, result: Any, max_bytes: int, max_tokens: Optional[int],
+             handle: Optional[str], extra: Dict[str, Any], ensure_ascii: bool = True) -> Any:
+        """Shrink strings and lists until the result's JSON fits the ceilings."""
+        max_chars = max_bytes
+        max_items = 1000
+        while True:
+            shaped = _shrink(result, max_chars, max_items, handle)
+            if isinstance(shaped, dict):
+                shaped.update(extra)
+            text = json.dumps(shaped, ensure_ascii=ensure_ascii)
+            over = max(len(text) / max_bytes,
+                       estimate_tokens(text) / max_tokens if max_tokens else 0)
+            if over <= 1:
+                return shaped
+            if max_chars <= 200 and max_items <= 2:
+                # Too many small fields to cut: send a preview instead
+                preview = elide(json.dumps(result, ensure_ascii=False), max_bytes // 2, handle)
+                return {'preview': preview, **extra}
+            max_chars = max(200, int(max_chars / over * 0.9))
+            max_items = max(2, int(max_items / over * 0.9))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Counts of capped results and spilled bytes."""
+        with self._lock:
+            return {**self.stats, 'max_bytes': self.max_bytes, 'max_tokens': self.max_tokens}
+
+
+# Global instance
+_store = None
+
+
+def get_output_store() -> ToolOutputStore:
+    """Get the global tool output store instance."""
+    global _store
+    if _store is None:
+        _store = ToolOutputStore()
+    return _store
@@ -2,9 +2,18 @@
 Unified tool router that combines direct tools and MCP tools.
 """
 
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, AsyncIterator, Iterator, Tuple
 import tools
+import trigram_index
+import workspace_index
+from tool_cache import ToolResultCache
+from tool_output import ToolOutputShaper
+from tool_catalog import ToolCatalog
+from admission import ToolRateLimiter
 from mcp.manager import get_mcp_manager
 from operation_logger import (
     log_operation,
@@ -16,6 +25,17 @@ from operation_logger import (
 
 logger = logging.getLogger(__name__)
 
+# Upper bound on tool calls executing concurrently across all chat turns
+MAX_TOOL_WORKERS = 8
+
+
+def _timing(is_mcp: bool, started: float) -> Dict[str, Any]:
+    """Source and duration of a tool execution that began at started."""
+    return {
+        'source': 'mcp' if is_mcp else 'direct',
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
 
 class ToolRouter:
     """Routes tool execution between direct tools and MCP tools."""
@@ -24,27 +44,34 @@ class ToolRouter:
         """Initialize tool router."""
         self.direct_tools = tools.TOOLS
         self.mcp_manager = get_mcp_manager()
+        self.catalog = ToolCatalog(self.mcp_manager)
+        self.executor = ThreadPoolExecutor(
+            max_workers=MAX_TOOL_WORKERS,
+            thread_name_prefix='tool-worker'
+        )
+        self.result_cache = ToolResultCache()
+        # Results that read files changed by anyone are dropped at once
+        workspace_index.subscribe(self.result_cache.invalidate_paths)
+        self.output_shaper = ToolOutputShaper()
+        self.rate_limiter = ToolRateLimiter()
 
     def get_all_tools(self) -> List[Dict[str, Any]]:
         """
         Get combined list of direct tools and MCP tools.
 
         Returns:
-            List of tool definitions for Claude API
+            List of tool definitions for Claude API, from the tool catalog
+            (rebuilt only when the MCP tools change; do not modify)
         """
-        all_tools = []
-
-        # Add direct tools
-        all_tools.extend(self.direct_tools)
-
-        # Add MCP tools
-        try:
-            mcp_tools = self.mcp_manager.get_all_tools()
-            all_tools.extend(mcp_tools)
-        except Exception as e:
-            logger.error(f"Failed to get MCP tools: {e}")
+        return self.catalog.get_tools()
 
-        return all_tools
+    def is_mcp_tool(self, tool_name: str) -> bool:
+        """Check if a tool is served by an MCP server, via the catalog index."""
+        entry = self.catalog.get(tool_name)
+        if entry is None:
+            # Not offered (e.g. its server disconnected): fall back to the name format
+            return self.mcp_manager.is_mcp_tool(tool_name)
+        return entry.source == 'mcp'
 
     def execute_tool(self, tool_name: str, tool_input: Dict[str, Any],
                      username: str, session_id: str,
@@ -60,17 +87,109 @@ class ToolRouter:
             auto_approve: Auto-approve operations (for testing)
 
         Returns:
-            Tool execution result with status
+            Tool execution result with status; executed calls also carry
+            'source' (direct/mcp) and 'duration_ms' of the execution itself,
+            and 'cached': True when a read-only result came from the
+            session's result cache. Results over the tool's size ceiling
+            are cut (see tool_output.py)
         """
-        # Determine tool source
-        is_mcp = self.mcp_manager.is_mcp_tool(tool_name)
-        tool_source = 'mcp' if is_mcp else 'direct'
+        log_id, pending = self._begin_operation(tool_name, tool_input, username,
+                                                session_id, auto_approve)
+        if pending is not None:
+            return pending
 
-        # Get MCP server ID if applicable
-        mcp_server_id = None
-        if is_mcp:
-            server_name = tool_name.split(':', 1)[0]
-            mcp_server_id = self.mcp_manager.server_names.get(server_name)
+        # Execute the tool
+        is_mcp = self.is_mcp_tool(tool_name)
+        started = time.perf_counter()
+        cached, fingerprint = self.result_cache.lookup(session_id, tool_name, tool_input)
+        if cached is not None:
+            timing = _timing(False, started)
+            return {**self._complete_operation(log_id, cached), **timing, 'cached': True}
+
+        try:
+            if is_mcp:
+                result = self._execute_mcp_tool(tool_name, tool_input)
+            else:
+                result = self._execute_direct_tool(tool_name, tool_input)
+        except Exception as e:
+            timing = _timing(is_mcp, started)
+            self._after_execute(session_id, tool_name)
+            return {**self._fail_operation(log_id, e), **timing}
+
+        result = self.output_shaper.shape(tool_name, result)
+        timing = _timing(is_mcp, started)
+        if fingerprint is not None:
+            self.result_cache.store(session_id, tool_name, tool_input, fingerprint, result)
+        self._after_execute(session_id, tool_name)
+        return {**self._complete_operation(log_id, result), **timing}
+
+    def _after_execute(self, session_id: str, tool_name: str):
+        """
+        Drop the session's cached results after a filesystem-modifying tool
+        ran, and have the grep trigram index and the workspace index (when
+        it is not watching with inotify) look for changed files.
+        """
+        if self.result_cache.invalidates(tool_name):
+            self.result_cache.invalidate_session(session_id)
+            trigram_index.mark_stale()
+            workspace_index.mark_stale()
+
+    async def execute_tool_async(self, tool_name: str, tool_input: Dict[str, Any],
+                                 username: str, session_id: str,
+                                 auto_approve: bool = False) -> Dict[str, Any]:
+        """
+        Execute a tool from an asyncio event loop.
+
+        MCP calls are awaited on the running loop (the one the MCP servers
+        were started on); direct tools and operation log writes run on the
+        worker pool so the loop is never blocked.
+
+        Returns:
+            Tool execution result with status, as execute_tool
+        """
+        loop = asyncio.get_running_loop()
+        if not self.is_mcp_tool(tool_name):
+            return await loop.run_in_executor(
+                self.executor, self.execute_tool,
+                tool_name, tool_input, username, session_id, auto_approve
+            )
+
+        log_id, pending = await loop.run_in_executor(
+            self.executor, self._begin_operation,
+            tool_name, tool_input, username, session_id, auto_approve
+        )
+        if pending is not None:
+            return pending
+
+        started = time.perf_counter()
+        try:
+            result = await self.mcp_manager.call_tool_async(tool_name, tool_input)
+        except Exception as e:
+            timing = _timing(True, started)
+            return {**await loop.run_in_executor(self.executor, self._fail_operation, log_id, e), **timing}
+
+        result = await loop.run_in_executor(self.executor, self.output_shaper.shape, tool_name, result)
+        timing = _timing(True, started)
+        return {**await loop.run_in_executor(self.executor, self._complete_operation, log_id, result), **timing}
+
+    def _begin_operation(self, tool_name: str, tool_input: Dict[str, Any],
+                         username: str, session_id: str,
+                         auto_approve: bool) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """
+        Log a tool call and check its permission.
+
+        Returns:
+            (log ID, None if the call may run, otherwise the result to
+            return instead: pending_permission, or an error for calls that
+            do not match the tool catalog)
+        """
+        # Determine tool source and MCP server ID from the catalog index
+        entry = self.catalog.get(tool_name)
+        if entry is not None:
+            tool_source, mcp_server_id = entry.source, entry.server_id
+        else:
+            tool_source = 'mcp' if self.mcp_manager.is_mcp_tool(tool_name) else 'direct'
+            mcp_server_id = None
 
         # Log operation
         log_id = log_operation(
@@ -82,46 +201,59 @@ class ToolRouter:
             mcp_server_id=mcp_server_id
         )
 
+        invalid = self.catalog.validate_input(tool_name, tool_input)
+        if invalid:
+            return log_id, self._fail_operation(log_id, ValueError(invalid))
+
         # Check if permission is required
         requires_permission = check_requires_permission(tool_name, tool_input)
 
         if requires_permission and not auto_approve:
             # Return pending status - user must approve
             preview = get_operation_preview(tool_name, tool_input)
-            return {
+            return log_id, {
                 'status': 'pending_permission',
                 'log_id': log_id,
                 'preview': preview,
                 'message': '此操作需要用户批准'
             }
 
-        # Execute the tool
-        try:
-            if is_mcp:
-                result = self._execute_mcp_tool(tool_name, tool_input)
-            else:
-                result = self._execute_direct_tool(tool_name, tool_input)
+        return log_id, None
 
-            # Update log with success
-            update_operation_status(log_id, 'completed', output_data=result)
+    def _complete_operation(self, log_id: int, result: Any) -> Dict[str, Any]:
+        # Update log with success
+        update_operation_status(log_id, 'completed', output_data=result)
 
-            return {
-                'status': 'success',
-                'log_id': log_id,
-                'result': result
-            }
+        return {
+            'status': 'success',
+            'log_id': log_id,
+            'result': result
+        }
 
-        except Exception as e:
-            logger.error(f"Tool execution failed: {e}")
+    def _fail_operation(self, log_id: int, error: Exception) -> Dict[str, Any]:
+        logger.error(f"Tool execution failed: {error}")
 
-            # Update log with error
-            update_operation_status(log_id, 'failed', error_message=str(e))
+        # Update log with error
+        update_operation_status(log_id, 'failed', error_message=str(error))
 
-            return {
-                'status': 'error',
-                'log_id': log_id,
-                'error': str(e)
-            }
+        return {
+            'status': 'error',
+            'log_id': log_id,
+            'error': str(error)
+        }
+
+    def is_concurrent_safe(self, tool_name: str) -> bool:
+        """
+        Check whether a tool may run alongside other tool calls.
+
+        MCP tools and direct tools flagged as read-only in
+        tools.TOOL_METADATA qualify; everything else (writes, bash,
+        ask_user_question, unknown tools) must run in call order.
+        """
+        if self.is_mcp_tool(tool_name):
+            return True
+        metadata = tools.TOOL_METADATA.get(tool_name)
+        return metadata is not None and not metadata['requires_permission']
 
     def _execute_direct_tool(self, tool_name: str, tool_input: Dict[str, Any]) -> Any:
         """Execute a direct tool."""
@@ -169,10 +301,14 @@ class ToolRouter:
         tool_input = operation['input_data']
 
         try:
-            if self.mcp_manager.is_mcp_tool(tool_name):
-                result = self._execute_mcp_tool(tool_name, tool_input)
-            else:
-                result = self._execute_direct_tool(tool_name, tool_input)
+            try:
+                if self.is_mcp_tool(tool_name):
+                    result = self._execute_mcp_tool(tool_name, tool_input)
+                else:
+                    result = self._execute_direct_tool(tool_name, tool_input)
+            finally:
+                self._after_execute(operation['session_id'], tool_name)
+            result = self.output_shaper.shape(tool_name, result)
 
             # Update log with success
             update_operation_status(log_id, 'completed', output_data=result)
@@ -200,6 +336,138 @@ class ToolRouter:
         self.mcp_manager.start_all_servers()
 
 
+class ToolBatch:
+    """
+    Tool calls of one assistant turn, dispatched as they arrive.
+
+    Concurrency-safe calls are started on the router's worker pool as soon
+    as they are added, as long as no barrier call (a write, bash,
+    ask_user_question...) came before them in the turn and the user's tool
+    token bucket allows it. Everything else is deferred until results()
+    reaches it, which waits for the bucket on the turn's own thread.
+    """
+
+    def __init__(self, router: ToolRouter, username: str, session_id: str,
+                 auto_approve: bool = False):
+        """
+        Initialize tool batch.
+
+        Args:
+            router: Router executing the calls
+            username: Username executing the tools
+            session_id: Session ID
+            auto_approve: Auto-approve operations (for testing)
+        """
+        self.router = router
+        self.username = username
+        self.session_id = session_id
+        self.auto_approve = auto_approve
+        self.calls: List[Dict[str, Any]] = []
+        self.futures: Dict[int, Future] = {}
+        self._barrier_seen = False
+
+    def add(self, tool_call: Dict[str, Any]):
+        """
+        Register a complete tool call, starting it early when safe.
+
+        Args:
+            tool_call: Dict with 'name' and 'input' keys
+        """
+        index = len(self.calls)
+        self.calls.append(tool_call)
+
+        if self._barrier_seen or not self.router.is_concurrent_safe(tool_call['name']):
+            self._barrier_seen = True
+            return
+
+        if self.router.rate_limiter.try_acquire(self.username, tool_call['name']):
+            self.futures[index] = self._submit(tool_call)
+
+    def _submit(self, tool_call: Dict[str, Any]) -> Future:
+        return self.router.executor.submit(
+            self.router.execute_tool, tool_call['name'], tool_call['input'],
+            self.username, self.session_id, self.auto_approve
+        )
+
+    def results(self) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Wait for the calls and yield their results in call order.
+
+        Each run of consecutive concurrency-safe calls executes on the
+        worker pool at once; any other call acts as a barrier and only runs
+        after everything before it has finished. Calls past the point where
+        the caller stops iterating are never started.
+
+        Yields:
+            (tool_call, execution result) tuples
+        """
+        calls = self.calls
+        index = 0
+        while index < len(calls):
+            start = index
+            while index < len(calls) and self.router.is_concurrent_safe(calls[index]['name']):
+                if index not in self.futures:
+                    self.router.rate_limiter.acquire(self.username, calls[index]['name'])
+                    self.futures[index] = self._submit(calls[index])
+                index += 1
+
+            for i in range(start, index):
+                yield calls[i], self.futures[i].result()
+
+            if index < len(calls):
+                call = calls[index]
+                index += 1
+                self.router.rate_limiter.acquire(self.username, call['name'])
+                yield call, self.router.execute_tool(
+                    call['name'], call['input'],
+                    self.username, self.session_id, self.auto_approve
+                )
+
+
+class AsyncToolBatch(ToolBatch):
+    """
+    ToolBatch for the asyncio serving mode.
+
+    Same ordering and barrier rules, but calls run as tasks on the event
+    loop via ToolRouter.execute_tool_async.
+    """
+
+    def _submit(self, tool_call: Dict[str, Any]) -> "asyncio.Task":
+        return asyncio.ensure_future(self.router.execute_tool_async(
+            tool_call['name'], tool_call['input'],
+            self.username, self.session_id, self.auto_approve
+        ))
+
+    async def results(self) -> AsyncIterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Wait for the calls and yield their results in call order.
+
+        Yields:
+            (tool_call, execution result) tuples
+        """
+        calls = self.calls
+        index = 0
+        while index < len(calls):
+            start = index
+            while index < len(calls) and self.router.is_concurrent_safe(calls[index]['name']):
+                if index not in self.futures:
+                    await self.router.rate_limiter.acquire_async(self.username, calls[index]['name'])
+                    self.futures[index] = self._submit(calls[index])
+                index += 1
+
+            for i in range(start, index):
+                yield calls[i], await self.futures[i]
+
+            if index < len(calls):
+                call = calls[index]
+                index += 1
+                await self.router.rate_limiter.acquire_async(self.username, call['name'])
+                yield call, await self.router.execute_tool_async(
+                    call['name'], call['input'],
+                    self.username, self.session_id, self.auto_approve
+                )
+
+
 # Global instance
 _router = None
 
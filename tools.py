@@ -1,11 +1,18 @@
 import os
 import subprocess
-import glob as glob_module
-import re
 from pathlib import Path
 import requests
 from bs4 import BeautifulSoup
 
+import glob_engine
+import grep_engine
+import ripgrep_backend
+import tool_output
+import workspace_index
+
+# glob 和 grep 未指定路径时的搜索目录
+DEFAULT_SEARCH_PATH = '/root/claude-web'
+
 # 工具定义
 TOOLS = [
     {
@@ -113,6 +120,11 @@ TOOLS = [
                 "path": {
                     "type": "string",
                     "description": "The directory to search in (defaults to current directory)"
+                },
+                "sort_by": {
+                    "type": "string",
+                    "enum": ["path", "mtime"],
+                    "description": "Order of the results: by path (default) or most recently modified first"
                 }
             },
             "required": ["pattern"]
@@ -163,7 +175,7 @@ TOOLS = [
                 },
                 "head_limit": {
                     "type": "number",
-                    "description": "Limit output to first N results (default 100)"
+                    "description": "Limit output to first N results (default 100). The search stops once N results are found, so in 'files_with_matches' and 'count' modes 'count' / 'total_files' is the number of files returned, not the total; 'limit_reached': true means more matches may exist"
                 }
             },
             "required": ["pattern"]
@@ -264,6 +276,28 @@ TOOLS = [
             },
             "required": ["questions"]
         }
+    },
+    {
+        "name": "read_tool_output",
+        "description": "Read the complete output of an earlier tool call whose result was truncated. Truncated results carry an output_handle and elision markers naming it. Returns numbered lines; page with offset and limit.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "handle": {
+                    "type": "string",
+                    "description": "The output_handle of the truncated result"
+                },
+                "offset": {
+                    "type": "number",
+                    "description": "The line number to start reading from (0-based)"
+                },
+                "limit": {
+                    "type": "number",
+                    "description": "The number of lines to read (default 400)"
+                }
+            },
+            "required": ["handle"]
+        }
     }
 ]
 
@@ -439,146 +473,40 @@ def execute_edit_file(file_path, old_string, new_string, replace_all=False):
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def execute_glob(pattern, path=None):
-    """查找匹配的文件"""
+def execute_glob(pattern, path=None, sort_by='path'):
+    """查找匹配的文件（从搜索目录遍历，不切换进程的工作目录；见 glob_engine.py）"""
     try:
-        search_path = path or '/root/claude-web'
+        search_path = path or DEFAULT_SEARCH_PATH
         abs_path = os.path.abspath(search_path)
-
-        # 切换到搜索目录
-        original_dir = os.getcwd()
-        os.chdir(abs_path)
-
-        matches = glob_module.glob(pattern, recursive=True)
-        matches = sorted(matches)[:100]  # 限制结果数量
-
-        os.chdir(original_dir)
-
-        if not matches:
-            return {"success": True, "matches": [], "message": "No files found"}
-
-        return {
-            "success": True,
-            "matches": matches,
-            "count": len(matches)
-        }
+        return glob_engine.get_glob_engine().glob(pattern, abs_path, sort_by)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 def execute_grep(pattern, path=None, file_pattern=None, case_insensitive=False, output_mode='files_with_matches', context=None, after_context=None, before_context=None, multiline=False, head_limit=100):
-    """搜索文件内容"""
+    """搜索文件内容（遍历整个目录树，不限文件数；达到 head_limit 后提前结束，见 grep_engine.py）
+
+    安装了 rg 时用 ripgrep 搜索（见 ripgrep_backend.py），rg 不支持的正则仍由 grep_engine 搜索
+    """
     try:
-        search_path = path or '/root/claude-web'
+        search_path = path or DEFAULT_SEARCH_PATH
         abs_path = os.path.abspath(search_path)
-
-        results = []
-        files_with_matches = set()
-        file_match_counts = {}
-
-        # 编译正则表达式
-        flags = re.IGNORECASE if case_insensitive else 0
-        if multiline:
-            flags |= re.MULTILINE | re.DOTALL
-        regex = re.compile(pattern, flags)
-
-        if os.path.isfile(abs_path):
-            files_to_search = [abs_path]
-        else:
-            # 搜索目录
-            if file_pattern:
-                files_to_search = glob_module.glob(os.path.join(abs_path, '**', file_pattern), recursive=True)
-            else:
-                files_to_search = glob_module.glob(os.path.join(abs_path, '**', '*'), recursive=True)
-
-            files_to_search = [f for f in files_to_search if os.path.isfile(f)][:200]  # 限制文件数
-
-        for file_path in files_to_search:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    if multiline:
-                        content = f.read()
-                        matches = list(regex.finditer(content))
-                        if matches:
-                            files_with_matches.add(file_path)
-                            file_match_counts[file_path] = len(matches)
-                            if output_mode == 'content':
-                                for match in matches[:head_limit]:
-                                    results.append({
-                                        "file": file_path,
-                                        "content": match.group(0)
-                                    })
-                    else:
-                        lines = f.readlines()
-
-                match_count = 0
-                if not multiline:
-                    for line_num, line in enumerate(lines, 1):
-                        if regex.search(line):
-                            match_count += 1
-                            files_with_matches.add(file_path)
-
-                            if output_mode == 'content':
-                                # 计算上下文范围
-                                before = before_context if before_context is not None else (context if context else 0)
-                                after = after_context if after_context is not None else (context if context else 0)
-
-                                # 添加上下文行
-                                context_lines = []
-                                if before or after:
-                                    start = max(0, line_num - 1 - before)
-                                    end = min(len(lines), line_num + after)
-                                    for i in range(start, end):
-                                        prefix = ">" if i == line_num - 1 else " "
-                                        context_lines.append(f"{prefix} {i+1:5d}: {lines[i].rstrip()}")
-                                    results.append({
-                                        "file": file_path,
-                                        "line": line_num,
-                                        "content": '\n'.join(context_lines)
-                                    })
-                                else:
-                                    results.append({
-                                        "file": file_path,
-                                        "line": line_num,
-                                        "content": line.rstrip()
-                                    })
-
-                                if len(results) >= head_limit:
-                                    break
-
-                    if match_count > 0:
-                        file_match_counts[file_path] = match_count
-
-            except:
-                continue
-
-            if output_mode == 'content' and len(results) >= head_limit:
-                break
-
-        # 根据输出模式返回结果
-        if output_mode == 'files_with_matches':
-            return {
-                "success": True,
-                "files": sorted(list(files_with_matches))[:head_limit],
-                "count": len(files_with_matches)
-            }
-        elif output_mode == 'count':
-            count_results = [{"file": f, "matches": c} for f, c in sorted(file_match_counts.items())]
-            return {
-                "success": True,
-                "results": count_results[:head_limit],
-                "total_files": len(count_results)
-            }
-        else:  # content
-            return {
-                "success": True,
-                "results": results[:head_limit],
-                "count": len(results)
-            }
+        backend = ripgrep_backend.get_ripgrep()
+        if backend is not None:
+            result = backend.search(
+                pattern, abs_path, file_pattern, case_insensitive, output_mode,
+                context, after_context, before_context, multiline, head_limit
+            )
+            if result is not None:
+                return result
+        return grep_engine.get_grep_engine().search(
+            pattern, abs_path, file_pattern, case_insensitive, output_mode,
+            context, after_context, before_context, multiline, head_limit
+        )
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 def execute_list_directory(path):
-    """列出目录内容"""
+    """列出目录内容（启用工作区索引时从内存中的目录树读取，见 workspace_index.py）"""
     try:
         abs_path = os.path.abspath(path)
 
@@ -589,14 +517,13 @@ def execute_list_directory(path):
             return {"success": False, "error": f"Path is not a directory: {path}"}
 
         items = []
-        for item in sorted(os.listdir(abs_path)):
-            item_path = os.path.join(abs_path, item)
-            is_dir = os.path.isdir(item_path)
+        for entry in workspace_index.scandir(abs_path):
+            is_dir = entry.is_dir()
 
             items.append({
-                "name": item,
+                "name": entry.name,
                 "type": "directory" if is_dir else "file",
-                "size": 0 if is_dir else os.path.getsize(item_path)
+                "size": 0 if is_dir else entry.stat().st_size
             })
 
         return {
@@ -688,6 +615,13 @@ def execute_ask_user_question(questions):
         "questions": questions
     }
 
+def execute_read_tool_output(handle, offset=None, limit=None):
+    """分页读取被截断的工具输出（完整内容见 tool_output.py 的输出存储）"""
+    try:
+        return tool_output.get_output_store().read(handle, offset, limit)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 def execute_tool(tool_name, tool_input):
     """执行工具调用"""
     if tool_name == "bash":
@@ -713,7 +647,7 @@ def execute_tool(tool_name, tool_input):
             tool_input.get("replace_all", False)
         )
     elif tool_name == "glob":
-        return execute_glob(tool_input.get("pattern"), tool_input.get("path"))
+        return execute_glob(tool_input.get("pattern"), tool_input.get("path"), tool_input.get("sort_by", 'path'))
     elif tool_name == "grep":
         return execute_grep(
             tool_input.get("pattern"),
@@ -735,10 +669,17 @@ def execute_tool(tool_name, tool_input):
         return execute_web_search(tool_input.get("query"))
     elif tool_name == "ask_user_question":
         return execute_ask_user_question(tool_input.get("questions"))
+    elif tool_name == "read_tool_output":
+        return execute_read_tool_output(
+            tool_input.get("handle"),
+            tool_input.get("offset"),
+            tool_input.get("limit")
+        )
     else:
         return {"success": False, "error": f"Unknown tool: {tool_name}"}
 
 # 工具元数据 - 用于权限检查
+# cache: 结果可在会话内缓存（file 按文件 mtime/大小校验，directory 按目录 mtime 校验，见 tool_cache.py）
 TOOL_METADATA = {
     "bash": {
         "requires_permission": True,
@@ -754,11 +695,13 @@ TOOL_METADATA = {
     },
     "read_file": {
         "requires_permission": False,
-        "description": "只读操作，无需权限"
+        "description": "只读操作，无需权限",
+        "cache": "file"
     },
     "glob": {
         "requires_permission": False,
-        "description": "只读操作，无需权限"
+        "description": "只读操作，无需权限",
+        "cache": "directory"
     },
     "grep": {
         "requires_permission": False,
@@ -766,7 +709,8 @@ TOOL_METADATA = {
     },
     "list_directory": {
         "requires_permission": False,
-        "description": "只读操作，无需权限"
+        "description": "只读操作，无需权限",
+        "cache": "directory"
     },
     "web_fetch": {
         "requires_permission": False,
@@ -775,5 +719,9 @@ TOOL_METADATA = {
     "web_search": {
         "requires_permission": False,
         "description": "只读操作，无需权限"
+    },
+    "read_tool_output": {
+        "requires_permission": False,
+        "description": "只读操作，无需权限"
     }
 }
@@ -0,0 +1,595 @@
+"""
+Persistent trigram index of the workspace for the grep tool.
+
+grep_engine reads every file under the search path. With the index
+enabled (TRIGRAM_INDEX_ENABLED), the set of byte trigrams of each file
+(ASCII-lowercased) is kept in posting lists, and a search first derives
+from the regex the trigrams every match must contain: literal runs of
+three or more characters, required together along a sequence and as
+alternatives across '|'. Only files whose postings contain them are read
+and verified by the normal search, so results do not change; patterns
+without such literals ('\\w+', 'a.b') search all files as before.
+
+The index is kept fresh incrementally: a stat walk of the root
+re-indexes files whose size or mtime changed, at most every
+TRIGRAM_INDEX_MAX_AGE seconds and before the next search after a
+filesystem-modifying tool ran (ToolRouter marks the index stale). Files
+changed by other programs can therefore be missed for up to MAX_AGE
+seconds. notify_changed() re-indexes given paths at once, for callers
+that watch the file system. With the workspace index enabled (see
+workspace_index.py), the index follows its change feed instead: the
+files it reports are re-indexed before the next search and the tree is
+no longer walked once it has been walked while the feed was live. The
+index is saved to TRIGRAM_INDEX_PATH, so after a restart only files
+changed meanwhile are read again.
+
+Command line:
+
+    python trigram_index.py rebuild [--root DIR] [--index FILE]
+    python trigram_index.py stats [--root DIR] [--index FILE]
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, List, Any, Callable, Iterable, Optional, Set, Tuple
+
+import config
+import grep_engine
+import workspace_index
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+
+# Opt-in: grep narrows the files it reads with the index
+ENABLED = getattr(config, 'TRIGRAM_INDEX_ENABLED', False)
+# Directory tree covered by the index (searches outside it walk the tree)
+ROOT = getattr(config, 'TRIGRAM_INDEX_ROOT', '/root/claude-web')
+# Index file (inside a hidden directory, so it is not indexed itself)
+INDEX_PATH = getattr(config, 'TRIGRAM_INDEX_PATH', '/root/claude-web/.trigram_index/index.pickle')
+# Seconds between stat walks that pick up changed files
+MAX_AGE = getattr(config, 'TRIGRAM_INDEX_MAX_AGE', 10)
+# Larger files are not indexed and are read by every search
+MAX_FILE_BYTES = getattr(config, 'TRIGRAM_INDEX_MAX_FILE_BYTES', 1024 * 1024)
+
+FORMAT_VERSION = 1
+# Minimum seconds between saves after incremental updates
+SAVE_INTERVAL = 60
+# Compact posting lists once this many file ids (and more than the live ones) are dead
+COMPACT_MIN_DEAD = 1000
+# Intersect by binary search when the candidates are this much fewer than a posting list
+PROBE_RATIO = 8
+
+_REPEATS = tuple(op for op in (getattr(sre_parse, name, None)
+                               for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'))
+                 if op is not None)
+_ATOMIC_GROUP = getattr(sre_parse, 'ATOMIC_GROUP', None)
+
+# ('lit', text) | ('and', [query, ...]) | ('or', [query, ...]); None matches every file
+TrigramQuery = Optional[Tuple[str, Any]]
+
+
+def _case_unstable(char: str, ascii_only: bool) -> bool:
+    """Whether a case-insensitive literal char can match bytes its lowercase form lacks."""
+    if ascii_only:
+        return False
+    # Besides non-ASCII letters, 'i', 'k' and 's' also match the dotted/dotless
+    # I, the Kelvin sign and the long s under Unicode case folding
+    return not char.isascii() or char in 'iksIKS'
+
+
+def _sequence(items: Iterable, ignore_case: bool, ascii_only: bool) -> TrigramQuery:
+    """Trigram query of a parsed regex sequence: all of its required parts."""
+    parts: List[TrigramQuery] = []
+    run = ''
+    for op, value in list(items) + [(None, None)]:
+        if op is sre_parse.LITERAL:
+            char = chr(value)
+            # Newlines are normalised when grep decodes a file, so they may be '\r\n' on disk
+            if char not in '\r\n' and not (ignore_case and _case_unstable(char, ascii_only)):
+                run += char
+                continue
+        if len(run) >= 3:
+            parts.append(('lit', run))
+        run = ''
+        if op is sre_parse.SUBPATTERN:
+            add_flags, del_flags, body = value[1], value[2], value[3]
+            inner = (ignore_case or bool(add_flags & re.IGNORECASE)) and not del_flags & re.IGNORECASE
+            parts.append(_sequence(body, inner, ascii_only))
+        elif op is sre_parse.BRANCH:
+            branches = [_sequence(branch, ignore_case, ascii_only) for branch in value[1]]
+            parts.append(None if any(branch is None for branch in branches) else ('or', branches))
+        elif op in _REPEATS and value[0] >= 1:
+            parts.append(_sequence(value[2], ignore_case, ascii_only))
+        elif _ATOMIC_GROUP is not None and op is _ATOMIC_GROUP:
+            parts.append(_sequence(value, ignore_case, ascii_only))
+
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else ('and', parts)
+
+
+def trigram_query(pattern: str, case_insensitive: bool = False) -> TrigramQuery:
+    """
+    Trigrams every match of a regex must contain.
+
+    Args:
+        pattern: Regular expression, as given to the grep tool
+        case_insensitive: Whether the search ignores case
+
+    Returns:
+        Query tree of 'lit', 'and' and 'or' nodes, or None if the pattern
+        requires no literal of three or more characters
+    """
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE if case_insensitive else 0)
+    except Exception:
+        return None
+    flags = parsed.state.flags
+    return _sequence(parsed, bool(flags & re.IGNORECASE), bool(flags & re.ASCII))
+
+
+def trigrams(data: bytes) -> List[int]:
+    """Distinct trigram keys of (ASCII-lowercased) bytes."""
+    data = data.lower()
+    return [a << 16 | b << 8 | c for a, b, c in set(zip(data, data[1:], data[2:]))]
+
+
+def _contains(posting: array, file_id: int) -> bool:
+    position = bisect.bisect_left(posting, file_id)
+    return position < len(posting) and posting[position] == file_id
+
+
+class TrigramIndex:
+    """Trigram posting lists of the files under one root, kept fresh by stat walks."""
+
+    def __init__(self, root: str = ROOT, index_path: Optional[str] = INDEX_PATH,
+                 max_age: float = MAX_AGE, max_file_bytes: int = MAX_FILE_BYTES):
+        """
+        Initialize trigram index.
+
+        Args:
+            root: Directory tree to index
+            index_path: File the index is saved to (None: memory only)
+            max_age: Seconds between stat walks for changed files
+            max_file_bytes: Larger files are not indexed (always candidates)
+        """
+        self.root = os.path.abspath(root)
+        self.index_path = index_path
+        self.max_age = max_age
+        self.max_file_bytes = max_file_bytes
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._stale = True
+        self.refreshed_at = 0.0
+        # Start of the last walk
+        self.walked_at = 0.0
+        self.saved_at = 0.0
+        # Workspace index whose change feed the index follows
+        self.tree: Optional['workspace_index.WorkspaceIndex'] = None
+        # Paths reported by the feed, re-indexed before the next search
+        self._queued: Set[str] = set()
+        self._queue_lock = threading.Lock()
+        self.stats = {'queries': 0, 'unfiltered_queries': 0, 'files_considered': 0, 'candidates': 0,
+                      'refreshes': 0, 'files_indexed': 0, 'last_refresh_ms': None, 'build_ms': None}
+        self._clear()
+
+    def _clear(self):
+        # File id -> path (None once the file changed or was removed)
+        self.paths: List[Optional[str]] = []
+        # path -> (file id, size, mtime_ns)
+        self.files: Dict[str, Tuple[int, int, int]] = {}
+        # trigram key -> ascending file ids
+        self.postings: Dict[int, array] = {}
+        # Ids of files too large (or unreadable) to index: candidates of every search
+        self.unindexed: Set[int] = set()
+        self.dead = 0
+        self._dirty = False
+
+    def covers(self, path: str) -> bool:
+        """Whether the index holds the files under an absolute path."""
+        if path == self.root:
+            return True
+        if not path.startswith(self.root.rstrip(os.sep) + os.sep):
+            return False
+        # Hidden directories are not indexed (grep does not descend into them)
+        parts = path[len(self.root):].strip(os.sep).split(os.sep)
+        return not any(part.startswith('.') for part in parts[:-1])
+
+    # ------------------------------------------------------------------
+    # Updates (called with the lock held)
+
+    def _read_trigrams(self, path: str, size: int) -> Optional[List[int]]:
+        """Trigram keys of a file, [] for binary files, None if it cannot be indexed."""
+        if size > self.max_file_bytes:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read(self.max_file_bytes + 1)
+        except OSError:
+            return None
+        if len(data) > self.max_file_bytes:
+            return None
+        if b'\0' in data[:grep_engine.SNIFF_BYTES]:
+            # grep skips binary files, so they are never candidates
+            return []
+        return trigrams(data)
+
+    def _drop(self, path: str):
+        file_id = self.files.pop(path)[0]
+        self.paths[file_id] = None
+        self.unindexed.discard(file_id)
+        self.dead += 1
+        self._dirty = True
+
+    def _index_file(self, path: str, size: int, mtime_ns: int):
+        if path in self.files:
+            self._drop(path)
+        file_id = len(self.paths)
+        self.paths.append(path)
+        self.files[path] = (file_id, size, mtime_ns)
+        keys = self._read_trigrams(path, size)
+        if keys is None:
+            self.unindexed.add(file_id)
+        else:
+            postings = self.postings
+            for key in keys:
+                posting = postings.get(key)
+                if posting is None:
+                    postings[key] = array('I', (file_id,))
+                else:
+                    posting.append(file_id)
+        self.stats['files_indexed'] += 1
+        self._dirty = True
+
+    def _compact(self):
+        """Renumber live files and drop dead ids from the posting lists."""
+        remap = [-1] * len(self.paths)
+        paths: List[Optional[str]] = []
+        for file_id, path in enumerate(self.paths):
+            if path is not None:
+                remap[file_id] = len(paths)
+                paths.append(path)
+        postings = {}
+        for key, posting in self.postings.items():
+            ids = array('I', [remap[i] for i in posting if remap[i] >= 0])
+            if ids:
+                postings[key] = ids
+        self.files = {path: (remap[file_id], size, mtime_ns)
+                      for path, (file_id, size, mtime_ns) in self.files.items()}
+        self.unindexed = {remap[file_id] for file_id in self.unindexed}
+        self.paths, self.postings, self.dead = paths, postings, 0
+
+    def refresh(self) -> int:
+        """
+        Re-index files whose size or mtime changed and drop removed ones.
+
+        Returns:
+            Number of files indexed or dropped
+        """
+        with self._lock:
+            started = time.perf_counter()
+            self.walked_at = time.time()
+            with self._queue_lock:
+                # The walk sees these changes
+                self._queued.clear()
+            seen = set()
+            changed = 0
+            for path in grep_engine.walk_files(self.root, include_hidden=True):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                known = self.files.get(path)
+                if known is None or known[1] != st.st_size or known[2] != st.st_mtime_ns:
+                    self._index_file(path, st.st_size, st.st_mtime_ns)
+                    changed += 1
+            for path in [path for path in self.files if path not in seen]:
+                self._drop(path)
+                changed += 1
+            if self.dead > max(COMPACT_MIN_DEAD, len(self.files)):
+                self._compact()
+
+            self._stale = False
+            self.refreshed_at = time.time()
+            self.stats['refreshes'] += 1
+            self.stats['last_refresh_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            if changed:
+                logger.info(f"Trigram index: {changed} files updated in {self.stats['last_refresh_ms']}ms")
+            if self._dirty and self.refreshed_at - self.saved_at >= SAVE_INTERVAL:
+                self.save()
+            return changed
+
+    def build(self) -> int:
+        """Index the whole root from scratch and save the index; returns the file count."""
+        with self._lock:
+            started = time.perf_counter()
+            self._clear()
+            self._loaded = True
+            self.refresh()
+            self.stats['build_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            self.save()
+            return len(self.files)
+
+    def notify_changed(self, paths: Iterable[str]):
+        """Re-index (or drop) the given files now, e.g. on file-watch events."""
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if path == self.root or not self.covers(path):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    st = None
+                if st is None or not os.path.isfile(path):
+                    if path in self.files:
+                        self._drop(path)
+                else:
+                    self._index_file(path, st.st_size, st.st_mtime_ns)
+
+    def follow(self, tree: 'workspace_index.WorkspaceIndex') -> bool:
+        """
+        Keep the index fresh from a workspace index's change feed instead of
+        walking the tree.
+
+        Returns:
+            False if the workspace index does not cover the root
+        """
+        if not tree.covers(self.root):
+            return False
+        self.tree = tree
+        tree.subscribe(self.queue_changed)
+        return True
+
+    def queue_changed(self, paths: Iterable[str]):
+        """Re-index the given files before the next search (does not wait for a running one)."""
+        with self._queue_lock:
+            self._queued.update(paths)
+
+    def mark_stale(self):
+        """Walk the tree for changes before the next search."""
+        self._stale = True
+
+    def _ensure_fresh(self):
+        if not self._loaded:
+            self._loaded = True
+            self.load()
+        if self.tree is not None and self.refreshed_at:
+            tree = workspace_index.lookup(self.root, self.tree)
+            # Changes since the last walk all came through the feed
+            if tree is not None and self.walked_at >= tree.ready_at:
+                with self._queue_lock:
+                    paths, self._queued = self._queued, set()
+                self.notify_changed(paths)
+                if self.dead > max(COMPACT_MIN_DEAD, len(self.files)):
+                    self._compact()
+                if self._dirty and time.time() - self.saved_at >= SAVE_INTERVAL:
+                    self.save()
+                return
+        if self._stale or time.time() - self.refreshed_at > self.max_age:
+            self.refresh()
+
+    # ------------------------------------------------------------------
+    # Persistence
+
+    def save(self) -> bool:
+        """Write the index to index_path (atomically); returns False on failure."""
+        if not self.index_path:
+            return False
+        with self._lock:
+            state = {
+                'version': FORMAT_VERSION, 'root': self.root, 'paths': self.paths,
+                'files': self.files, 'postings': self.postings,
+                'unindexed': self.unindexed, 'dead': self.dead
+            }
+            temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+                with open(temp_path, 'wb') as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, self.index_path)
+            except OSError as e:
+                logger.warning(f"Could not save trigram index to {self.index_path}: {e}")
+                return False
+            self.saved_at = time.time()
+            self._dirty = False
+            return True
+
+    def load(self) -> bool:
+        """Read the index saved for this root; returns False if there is none."""
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable trigram index {self.index_path}: {e}")
+            return False
+        if state.get('version') != FORMAT_VERSION or state.get('root') != self.root:
+            return False
+        with self._lock:
+            self._clear()
+            self.paths = state['paths']
+            self.files = state['files']
+            self.postings = state['postings']
+            self.unindexed = state['unindexed']
+            self.dead = state['dead']
+            self._loaded = True
+            self._stale = True
+            self.saved_at = os.path.getmtime(self.index_path)
+        return True
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def _evaluate(self, query: TrigramQuery) -> Optional[Set[int]]:
+        """File ids that may match (dead ids included), or None for all files."""
+        if query is None:
+            return None
+        kind, value = query
+        if kind == 'lit':
+            keys = trigrams(value.encode('utf-8'))
+            if not keys:
+                return None
+            empty = array('I')
+            postings = sorted((self.postings.get(key, empty) for key in keys), key=len)
+            result = set(postings[0])
+            for posting in postings[1:]:
+                if not result:
+                    break
+                if len(result) * PROBE_RATIO < len(posting):
+                    result = {file_id for file_id in result if _contains(posting, file_id)}
+                else:
+                    result.intersection_update(posting)
+            return result
+        if kind == 'and':
+            result = None
+            for part in value:
+                ids = self._evaluate(part)
+                if ids is not None:
+                    result = ids if result is None else result & ids
+            return result
+        result = set()
+        for part in value:
+            ids = self._evaluate(part)
+            if ids is None:
+                return None
+            result |= ids
+        return result
+
+    def candidates(self, path: str, pattern: str, case_insensitive: bool = False,
+                   file_filter: Optional[Callable[[str], bool]] = None,
+                   include_hidden: bool = False) -> Optional[List[str]]:
+        """
+        Files under path that may contain a match, in walk order.
+
+        Args:
+            path: Absolute directory being searched
+            pattern: Regular expression
+            case_insensitive: Whether the search ignores case
+            file_filter: relative path (to path) -> bool, as for walk_files
+            include_hidden: Also return hidden files
+
+        Returns:
+            Sorted candidate paths, or None when the index cannot narrow the
+            search (path outside the root, or no required trigrams): the
+            caller walks the tree instead
+        """
+        path = os.path.abspath(path)
+        if not self.covers(path) or not os.path.isdir(path):
+            return None
+        query = trigram_query(pattern, case_insensitive)
+        with self._lock:
+            self.stats['queries'] += 1
+            if query is None:
+                self.stats['unfiltered_queries'] += 1
+                return None
+            self._ensure_fresh()
+            ids = self._evaluate(query) | self.unindexed
+            live = self.paths
+            candidates = [live[file_id] for file_id in ids if live[file_id] is not None]
+            considered = len(self.files)
+
+        prefix = path.rstrip(os.sep) + os.sep
+        selected = []
+        for candidate in candidates:
+            if not candidate.startswith(prefix):
+                continue
+            rel_path = candidate[len(prefix):]
+            if not include_hidden and os.path.basename(rel_path).startswith('.'):
+                continue
+            if file_filter is None or file_filter(rel_path):
+                selected.append(candidate)
+        # walk_files order: compare path components
+        selected.sort(key=lambda candidate: candidate.split(os.sep))
+        with self._lock:
+            self.stats['files_considered'] += considered
+            self.stats['candidates'] += len(selected)
+        return selected
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Index size, freshness and query counters."""
+        with self._lock:
+            posting_bytes = sum(posting.itemsize * len(posting) for posting in self.postings.values())
+            # Rough in-memory size: posting arrays, their keys and the file table
+            memory_bytes = (posting_bytes + 100 * len(self.postings)
+                            + 200 * len(self.files) + 8 * len(self.paths))
+            try:
+                disk_bytes = os.path.getsize(self.index_path) if self.index_path else None
+            except OSError:
+                disk_bytes = None
+            considered = self.stats['files_considered']
+            return {
+                **self.stats,
+                'enabled': ENABLED,
+                'root': self.root,
+                'files': len(self.files),
+                'unindexed_files': len(self.unindexed),
+                'dead_ids': self.dead,
+                'trigrams': len(self.postings),
+                'postings': posting_bytes // 4,
+                'memory_bytes': memory_bytes,
+                'disk_bytes': disk_bytes,
+                'refresh_age_s': round(time.time() - self.refreshed_at, 1) if self.refreshed_at else None,
+                'stale': self._stale,
+                'follows_workspace_index': self.tree is not None,
+                'candidate_ratio': round(self.stats['candidates'] / considered, 4) if considered else None
+            }
+
+
+# Global instance
+_index = None
+
+
+def get_trigram_index() -> TrigramIndex:
+    """Get the global trigram index instance."""
+    global _index
+    if _index is None:
+        _index = TrigramIndex()
+        if workspace_index.ENABLED:
+            _index.follow(workspace_index.get_workspace_index())
+    return _index
+
+
+def mark_stale():
+    """Walk the global index for changes before its next search (files were modified)."""
+    if _index is not None:
+        _index.mark_stale()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build or inspect the grep trigram index')
+    parser.add_argument('command', choices=('rebuild', 'stats'))
+    parser.add_argument('--root', default=ROOT, help='Directory tree to index')
+    parser.add_argument('--index', default=INDEX_PATH, help='Index file')
+    args = parser.parse_args(argv)
+
+    index = TrigramIndex(args.root, args.index)
+    if args.command == 'rebuild':
+        index.build()
+    else:
+        index.load()
+        index.refresh()
+    print(json.dumps(index.get_stats(), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
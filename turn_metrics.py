@@ -0,0 +1,228 @@
+"""
+Per-turn latency breakdown of the agentic loop.
+
+Each chat turn records time to first byte and first text delta, model
+stream time per iteration, tool time by tool and source, database write
+time and token usage. The record is sent as the final 'metrics' event of
+the turn, stored in chat_turn_metrics, and aggregated into percentiles
+for the admin endpoint.
+"""
+
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+
+
+# Numeric columns of chat_turn_metrics reported as percentiles
+AGGREGATED_FIELDS = [
+    'total_ms', 'ttfb_ms', 'ttft_ms', 'model_ms', 'tool_ms', 'db_ms', 'iterations',
+    'input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens',
+    'retries'
+]
+PERCENTILES = (50, 95, 99)
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+class TurnMetrics:
+    """Timing and token counters of one chat turn."""
+
+    def __init__(self, model: str):
+        """
+        Initialize turn metrics.
+
+        Args:
+            model: Model alias the turn started with
+        """
+        self.model = model
+        self.started = time.perf_counter()
+        self.ttfb_ms: Optional[float] = None
+        self.ttft_ms: Optional[float] = None
+        self.db_ms = 0.0
+        # One entry per model call (retried calls included, marked 'failed')
+        self.calls: List[Dict[str, Any]] = []
+        # tool name -> {'source', 'count', 'cache_hits', 'total_ms', 'durations_ms'}
+        self.tools: Dict[str, Dict[str, Any]] = {}
+        self.tool_ms = 0.0
+        self._call_started = 0.0
+        self._tools_started: Optional[float] = None
+
+    def start(self):
+        """Mark the start of the turn (the loop, not the HTTP request)."""
+        self.started = time.perf_counter()
+
+    def start_call(self, iteration: int, model: str):
+        """A model call is about to be sent."""
+        self._call_started = time.perf_counter()
+        self.calls.append({
+            'iteration': iteration,
+            'model': model,
+            'ttfb_ms': None,
+            'ttft_ms': None,
+            'stream_ms': None
+        })
+
+    def first_byte(self):
+        """The model call returned its response headers."""
+        now = time.perf_counter()
+        self.calls[-1]['ttfb_ms'] = _ms(now - self._call_started)
+        if self.ttfb_ms is None:
+            self.ttfb_ms = _ms(now - self.started)
+
+    def text_delta(self):
+        """A text delta arrived; only the first one of each call is recorded."""
+        call = self.calls[-1]
+        if call['ttft_ms'] is not None:
+            return
+        now = time.perf_counter()
+        call['ttft_ms'] = _ms(now - self._call_started)
+        if self.ttft_ms is None:
+            self.ttft_ms = _ms(now - self.started)
+
+    def end_call(self, failed: bool = False):
+        """The model stream ended, or the call failed; no-op if no call is open."""
+        if not self.calls or self.calls[-1]['stream_ms'] is not None:
+            return
+        call = self.calls[-1]
+        call['stream_ms'] = _ms(time.perf_counter() - self._call_started)
+        if failed:
+            call['failed'] = True
+
+    def start_tools(self):
+        """The loop starts waiting for the current iteration's tool results."""
+        self._tools_started = time.perf_counter()
+
+    def end_tools(self):
+        """
+        All tool results of the iteration are in.
+
+        This is wall time after the model stream ended; calls started early
+        or run concurrently overlap, so it is at most the sum of durations.
+        """
+        if self._tools_started is None:
+            return
+        elapsed = _ms(time.perf_counter() - self._tools_started)
+        self._tools_started = None
+        self.tool_ms += elapsed
+        if self.calls:
+            self.calls[-1]['tool_ms'] = elapsed
+
+    def record_tool(self, name: str, source: Optional[str], duration_ms: Optional[float],
+                    cached: bool = False):
+        """Record the execution time of one tool call (cached: served from the result cache)."""
+        entry = self.tools.setdefault(name, {
+            'source': source or 'direct', 'count': 0, 'cache_hits': 0, 'total_ms': 0.0, 'durations_ms': []
+        })
+        duration_ms = duration_ms or 0.0
+        entry['count'] += 1
+        if cached:
+            entry['cache_hits'] += 1
+        entry['total_ms'] = round(entry['total_ms'] + duration_ms, 1)
+        entry['durations_ms'].append(duration_ms)
+
+    @contextmanager
+    def db_timer(self):
+        """Context manager adding the enclosed time to the DB write time."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+
+    def finish(self, status: str, usage: Dict[str, Any],
+               model_calls: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the turn's metrics record.
+
+        Args:
+            status: completed, waiting_user_input, permission_required or failed
+            usage: Token totals (prompt_cache.CacheUsage.totals())
+            model_calls: Call/retry/failover counts (ModelCaller.get_stats())
+
+        Returns:
+            Metrics record
+        """
+        by_source: Dict[str, float] = {}
+        for entry in self.tools.values():
+            by_source[entry['source']] = round(by_source.get(entry['source'], 0.0) + entry['total_ms'], 1)
+
+        return {
+            'model': model_calls.get('model', self.model),
+            'status': status,
+            'total_ms': _ms(time.perf_counter() - self.started),
+            'ttfb_ms': self.ttfb_ms,
+            'ttft_ms': self.ttft_ms,
+            'model_ms': round(sum(call['stream_ms'] or 0.0 for call in self.calls), 1),
+            'tool_ms': round(self.tool_ms, 1),
+            'db_ms': round(self.db_ms, 1),
+            'iterations': len({call['iteration'] for call in self.calls}),
+            'input_tokens': usage.get('input_tokens', 0),
+            'output_tokens': usage.get('output_tokens', 0),
+            'cache_read_input_tokens': usage.get('cache_read_input_tokens', 0),
+            'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0),
+            'retries': model_calls.get('retries', 0),
+            'failovers': model_calls.get('failovers', 0),
+            'calls': self.calls,
+            'tools': self.tools,
+            'tool_ms_by_source': by_source
+        }
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    """Count, mean and percentiles of a list of numbers."""
+    values = sorted(v for v in values if v is not None)
+    summary = {'count': len(values)}
+    if values:
+        summary['mean'] = round(sum(values) / len(values), 1)
+        for p in PERCENTILES:
+            summary[f'p{p}'] = percentile(values, p)
+    return summary
+
+
+def aggregate(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregate stored metrics records.
+
+    Args:
+        records: Rows from database.get_chat_turn_metrics()
+
+    Returns:
+        Percentiles per field, per tool and per tool source, and counts
+        per model and status
+    """
+    tool_calls: Dict[str, List[float]] = {}
+    source_times: Dict[str, List[float]] = {}
+    models: Dict[str, int] = {}
+    statuses: Dict[str, int] = {}
+
+    for record in records:
+        models[record['model']] = models.get(record['model'], 0) + 1
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        details = record.get('details') or {}
+        for name, entry in (details.get('tools') or {}).items():
+            tool_calls.setdefault(name, []).extend(entry.get('durations_ms', []))
+        for source, total in (details.get('tool_ms_by_source') or {}).items():
+            source_times.setdefault(source, []).append(total)
+
+    return {
+        'turns': len(records),
+        'models': models,
+        'statuses': statuses,
+        'fields': {
+            field: summarize([record.get(field) for record in records])
+            for field in AGGREGATED_FIELDS
+        },
+        'tools': {name: summarize(values) for name, values in sorted(tool_calls.items())},
+        'tool_sources': {source: summarize(values) for source, values in sorted(source_times.items())}
+    }
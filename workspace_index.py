@@ -0,0 +1,815 @@
+"""
+In-memory file tree of the workspace, kept fresh by inotify.
+
+The glob, grep and list_directory tools and the file browser's
+/api/files read directory listings from disk on every call. With the
+index enabled (WORKSPACE_INDEX_ENABLED), a background thread scans
+WORKSPACE_INDEX_ROOT once into a compact tree (per directory: the sorted
+entry names and parallel arrays of type flags, sizes and mtimes) and
+watches every directory with Linux inotify, applying each event to the
+tree. The tools take their listings from the tree and only read from
+disk the directories it does not hold: outside the root, reached through
+a symlink, or named in WORKSPACE_INDEX_EXCLUDE (.git, whose churn is of
+no use to the tools).
+
+Every query first applies the events the kernel has queued, so a change
+is visible to the next query once the call that made it has returned.
+Where inotify is unavailable (not Linux, or fs.inotify.max_user_watches
+reached) the tree is rescanned every WORKSPACE_INDEX_POLL_INTERVAL
+seconds and before the next query after a filesystem-modifying tool ran.
+With inotify a full rescan still runs every
+WORKSPACE_INDEX_RESCAN_INTERVAL seconds, and after the kernel's event
+queue overflowed.
+
+Entries are flagged as ignored when glob would not enter or return them
+through a wildcard (GLOB_IGNORED_DIRS, .gitignore rules as seen from the
+root, and everything below such a directory).
+
+Each batch of changes is published to subscribers as the list of
+affected paths (a directory that was removed, moved or replaced
+contributes everything that was under it): the trigram index re-indexes
+these files instead of walking the tree, and the tool result cache drops
+the results that read them. Subscribers are called outside the index
+lock and should look at the current state of the paths rather than rely
+on the order of batches.
+"""
+
+import bisect
+import ctypes
+import logging
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+from typing import Dict, List, Any, Callable, Iterable, Optional, Tuple
+
+import config
+import glob_engine
+
+logger = logging.getLogger(__name__)
+
+
+# Opt-in: tools list directories from the in-memory tree
+ENABLED = getattr(config, 'WORKSPACE_INDEX_ENABLED', False)
+# Directory tree held in memory
+ROOT = getattr(config, 'WORKSPACE_INDEX_ROOT', '/root/claude-web')
+# Directory names listed but neither scanned nor watched
+EXCLUDE = frozenset(getattr(config, 'WORKSPACE_INDEX_EXCLUDE', ('.git',)))
+# Watch the tree with inotify (otherwise poll)
+USE_INOTIFY = getattr(config, 'WORKSPACE_INDEX_INOTIFY', True)
+# Seconds between full rescans while inotify is watching
+RESCAN_INTERVAL = getattr(config, 'WORKSPACE_INDEX_RESCAN_INTERVAL', 600)
+# Seconds between full rescans without inotify
+POLL_INTERVAL = getattr(config, 'WORKSPACE_INDEX_POLL_INTERVAL', 10)
+# Seconds the watcher thread waits for more events before applying a batch
+DEBOUNCE = 0.05
+
+# Entry flags
+F_DIR = 1          # a directory (not a symlink to one)
+F_LINK = 2         # a symlink
+F_DIR_TARGET = 4   # a directory, following symlinks
+F_FILE = 8         # a regular file, following symlinks
+F_IGNORED = 16     # pruned by glob wildcards (ignored directory name or .gitignore)
+
+# inotify(7)
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+# Events that add, remove or replace an entry
+STRUCTURE_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT = struct.Struct('iIII')
+
+# (flags, size, mtime_ns)
+Record = Tuple[int, int, int]
+# Subset of os.stat_result returned by IndexEntry.stat()
+EntryStat = namedtuple('EntryStat', 'st_size st_mtime st_mtime_ns')
+
+
+class _Inotify:
+    """Minimal ctypes binding of the Linux inotify API (non-blocking)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.fd = fd
+
+    def add_watch(self, path: str) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self) -> List[Tuple[int, int, str]]:
+        """(watch descriptor, mask, name) of every queued event."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except (BlockingIOError, InterruptedError):
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class IndexEntry:
+    """os.DirEntry stand-in for an entry of the in-memory tree."""
+
+    __slots__ = ('name', 'path', 'flags', 'size', 'mtime_ns')
+
+    def __init__(self, name: str, path: str, flags: int, size: int, mtime_ns: int):
+        self.name = name
+        self.path = path
+        self.flags = flags
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def is_dir(self, follow_symlinks: bool = True) -> bool:
+        return bool(self.flags & (F_DIR_TARGET if follow_symlinks else F_DIR))
+
+    def is_file(self, follow_symlinks: bool = True) -> bool:
+        if not follow_symlinks and self.flags & F_LINK:
+            return False
+        return bool(self.flags & F_FILE)
+
+    def is_symlink(self) -> bool:
+        return bool(self.flags & F_LINK)
+
+    @property
+    def ignored(self) -> bool:
+        return bool(self.flags & F_IGNORED)
+
+    def stat(self, follow_symlinks: bool = True) -> EntryStat:
+        return EntryStat(self.size, self.mtime_ns / 1e9, self.mtime_ns)
+
+
+class _Dir:
+    """Entries of one directory: sorted names and parallel record arrays."""
+
+    __slots__ = ('names', 'flags', 'sizes', 'mtimes', 'ignore_files', 'ignored')
+
+    def __init__(self, ignore_files: tuple, ignored: bool):
+        self.names: List[str] = []
+        self.flags = bytearray()
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        # .gitignore files that apply to the entries
+        self.ignore_files = ignore_files
+        # The directory itself is ignored (so is everything in it)
+        self.ignored = ignored
+
+    def append(self, name: str, record: Record):
+        self.names.append(name)
+        self.flags.append(record[0])
+        self.sizes.append(record[1])
+        self.mtimes.append(record[2])
+
+    def find(self, name: str) -> int:
+        i = bisect.bisect_left(self.names, name)
+        return i if i < len(self.names) and self.names[i] == name else -1
+
+    def record(self, i: int) -> Record:
+        return self.flags[i], self.sizes[i], self.mtimes[i]
+
+    def records(self) -> Dict[str, Record]:
+        return dict(zip(self.names, zip(self.flags, self.sizes, self.mtimes)))
+
+    def set(self, name: str, record: Optional[Record]):
+        """Insert, replace or (record None) remove an entry."""
+        i = bisect.bisect_left(self.names, name)
+        present = i < len(self.names) and self.names[i] == name
+        if record is None:
+            if present:
+                del self.names[i], self.flags[i], self.sizes[i], self.mtimes[i]
+        elif present:
+            self.flags[i], self.sizes[i], self.mtimes[i] = record
+        else:
+            self.names.insert(i, name)
+            self.flags.insert(i, record[0])
+            self.sizes.insert(i, record[1])
+            self.mtimes.insert(i, record[2])
+
+
+class WorkspaceIndex:
+    """In-memory directory tree of one root, kept fresh by inotify or periodic rescans."""
+
+    def __init__(self, root: str = ROOT, exclude: Iterable[str] = EXCLUDE, use_inotify: bool = USE_INOTIFY,
+                 rescan_interval: float = RESCAN_INTERVAL, poll_interval: float = POLL_INTERVAL,
+                 ignored_dirs: Optional[Iterable[str]] = None, respect_gitignore: Optional[bool] = None):
+        """
+        Initialize workspace index.
+
+        Args:
+            root: Directory tree to hold
+            exclude: Directory names not scanned (listed from disk)
+            use_inotify: Watch the tree with inotify when available
+            rescan_interval: Seconds between full rescans with inotify
+            poll_interval: Seconds between full rescans without inotify
+            ignored_dirs: Directory names flagged as ignored (default GLOB_IGNORED_DIRS)
+            respect_gitignore: Flag entries excluded by .gitignore files
+                (default GLOB_RESPECT_GITIGNORE)
+        """
+        self.root = os.path.abspath(root)
+        self.exclude = frozenset(exclude)
+        self.use_inotify = use_inotify
+        self.rescan_interval = rescan_interval
+        self.poll_interval = poll_interval
+        self.ignored_dirs = frozenset(glob_engine.IGNORED_DIRS if ignored_dirs is None else ignored_dirs)
+        self.respect_gitignore = (glob_engine.RESPECT_GITIGNORE if respect_gitignore is None
+                                  else respect_gitignore)
+        # Directory path -> entries
+        self.dirs: Dict[str, _Dir] = {}
+        self._lock = threading.RLock()
+        # Signalled when a batch of changes has been published
+        self._published = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._scan_lock = threading.Lock()
+        # (directory, name) -> event mask of events applied during an unlocked rescan
+        self._scan_log: Optional[Dict[Tuple[str, str], int]] = None
+        self._inotify: Optional[_Inotify] = None
+        self._watches: Dict[str, int] = {}
+        self._wds: Dict[int, str] = {}
+        self._subscribers: List[Callable[[List[str]], Any]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.ready = False
+        self.ready_at = 0.0
+        self.scanned_at = 0.0
+        self._stale = False
+        # The kernel dropped events: rescan
+        self._overflow = False
+        self.inotify_error: Optional[str] = None
+        self.stats = {'events': 0, 'batches': 0, 'changes': 0, 'rescans': 0, 'overflows': 0,
+                      'listings': 0, 'last_scan_ms': None}
+
+    def covers(self, path: str) -> bool:
+        """Whether an absolute path is inside the root."""
+        return path == self.root or path.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    # ------------------------------------------------------------------
+    # Watches (called with the lock held)
+
+    def _watch(self, directory: str):
+        if self._inotify is None:
+            return
+        try:
+            wd = self._inotify.add_watch(directory)
+        except OSError as e:
+            if e.errno in (28, 24):  # ENOSPC (max_user_watches), EMFILE
+                self._disable_inotify(f"{e.strerror} watching {directory}")
+            return
+        self._watches[directory] = wd
+        self._wds[wd] = directory
+
+    def _unwatch(self, directory: str):
+        wd = self._watches.pop(directory, None)
+        # A directory moved within the tree keeps its watch under the new path
+        if wd is not None and self._wds.get(wd) == directory:
+            del self._wds[wd]
+            if self._inotify is not None:
+                self._inotify.rm_watch(wd)
+
+    def _disable_inotify(self, reason: str):
+        logger.warning(f"Workspace index: inotify unavailable ({reason}), "
+                       f"rescanning every {self.poll_interval}s instead")
+        self.inotify_error = reason
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._watches.clear()
+        self._wds.clear()
+
+    # ------------------------------------------------------------------
+    # Scanning
+
+    def _record(self, node: _Dir, path: str, name: str, is_dir: bool, is_link: bool,
+                st: Optional[os.stat_result]) -> Record:
+        flags = F_LINK if is_link else (F_DIR if is_dir else 0)
+        size = mtime_ns = 0
+        if st is not None:
+            if stat.S_ISDIR(st.st_mode):
+                flags |= F_DIR_TARGET
+            elif stat.S_ISREG(st.st_mode):
+                flags |= F_FILE
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        dir_target = bool(flags & F_DIR_TARGET)
+        if node.ignored or (dir_target and name in self.ignored_dirs) or (
+                node.ignore_files and glob_engine.is_ignored(node.ignore_files, path, name, dir_target)):
+            flags |= F_IGNORED
+        return flags, size, mtime_ns
+
+    def _stat_record(self, node: _Dir, path: str, name: str) -> Optional[Record]:
+        """Record of a path from disk, None if it no longer exists."""
+        try:
+            lst = os.lstat(path)
+        except OSError:
+            return None
+        is_link = stat.S_ISLNK(lst.st_mode)
+        st = lst
+        if is_link:
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+        return self._record(node, path, name, stat.S_ISDIR(lst.st_mode), is_link, st)
+
+    def _scan_dir(self, directory: str, ignore_files: tuple, ignored: bool) -> Optional[_Dir]:
+        """Read one directory from disk (watching it first, so no change is missed)."""
+        with self._lock:
+            self._watch(directory)
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return None
+        if self.respect_gitignore and any(entry.name == '.gitignore' for entry in entries):
+            own = glob_engine.read_gitignore(directory)
+            if own is not None:
+                ignore_files = ignore_files + (own,)
+        node = _Dir(ignore_files, ignored)
+        intern = sys.intern
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_link = entry.is_symlink()
+            except OSError:
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                st = None
+            node.append(intern(entry.name), self._record(node, entry.path, entry.name, is_dir, is_link, st))
+        return node
+
+    def _scan_tree(self, top: str, ignore_files: tuple, ignored: bool) -> Dict[str, _Dir]:
+        """Nodes of every directory under top (inclusive) that the index holds."""
+        nodes = {}
+        stack = [(top, ignore_files, ignored)]
+        while stack:
+            directory, inherited, dir_ignored = stack.pop()
+            node = self._scan_dir(directory, inherited, dir_ignored)
+            if node is None:
+                continue
+            nodes[directory] = node
+            for name, flags in zip(node.names, node.flags):
+                if flags & F_DIR and name not in self.exclude:
+                    stack.append((os.path.join(directory, name), node.ignore_files, bool(flags & F_IGNORED)))
+        return nodes
+
+    def _spec(self, directory: str) -> Optional[Tuple[tuple, bool]]:
+        """(inherited .gitignore files, ignored) of a directory the index holds, None if it holds none there."""
+        if directory == self.root:
+            inherited = glob_engine.parent_ignore_files(self.root) if self.respect_gitignore else ()
+            return inherited, False
+        parent = self.dirs.get(os.path.dirname(directory))
+        name = os.path.basename(directory)
+        if parent is None or name in self.exclude:
+            return None
+        i = parent.find(name)
+        if i < 0 or not parent.flags[i] & F_DIR:
+            return None
+        return parent.ignore_files, bool(parent.flags[i] & F_IGNORED)
+
+    @staticmethod
+    def _diff(directory: str, old: Optional[_Dir], new: Optional[_Dir], changed: List[str]):
+        old_records = old.records() if old is not None else {}
+        new_records = new.records() if new is not None else {}
+        if old_records == new_records:
+            return
+        for name in sorted(old_records.keys() | new_records.keys()):
+            if old_records.get(name) != new_records.get(name):
+                changed.append(os.path.join(directory, name))
+
+    def _replace_subtree(self, directory: str, new: Dict[str, _Dir], changed: List[str]):
+        """Swap the nodes under a directory for new ones, recording what differs."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        old = {path: node for path, node in self.dirs.items() if path == directory or path.startswith(prefix)}
+        for path in old.keys() | new.keys():
+            self._diff(path, old.get(path), new.get(path), changed)
+        for path in old:
+            if path not in new:
+                del self.dirs[path]
+                self._unwatch(path)
+        self.dirs.update(new)
+
+    def _rescan_subtree(self, directory: str, changed: List[str]):
+        spec = self._spec(directory)
+        self._replace_subtree(directory, self._scan_tree(directory, *spec) if spec else {}, changed)
+
+    def rescan(self) -> int:
+        """
+        Scan the whole root from disk; the first scan builds the tree.
+
+        The tree is read without holding the lock, so queries (and inotify
+        events) are served meanwhile; events applied during the scan are
+        applied again to the new tree.
+
+        Returns:
+            Number of changed paths published
+        """
+        with self._scan_lock:
+            return self._rescan()
+
+    def _rescan(self) -> int:
+        started = time.perf_counter()
+        with self._lock:
+            first = not self.ready
+            if first and self.use_inotify and self._inotify is None and self.inotify_error is None:
+                try:
+                    self._inotify = _Inotify()
+                except (OSError, AttributeError) as e:
+                    self._disable_inotify(str(e))
+            self._scan_log = {}
+            spec = self._spec(self.root)
+        try:
+            nodes = self._scan_tree(self.root, *spec)
+        except BaseException:
+            with self._lock:
+                self._scan_log = None
+            raise
+
+        changed: List[str] = []
+        with self._lock:
+            log, self._scan_log = self._scan_log, None
+            self._replace_subtree(self.root, nodes, changed)
+            # Events applied to the old tree while scanning
+            self._apply_pending(log, changed)
+            self.scanned_at = time.time()
+            self._stale = self._overflow = False
+            self.stats['rescans'] += 1
+            self.stats['last_scan_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            if first:
+                self.ready = True
+                self.ready_at = self.scanned_at
+                changed = []
+            self._in_flight += 1
+        self._finish(changed)
+        return len(changed)
+
+    # ------------------------------------------------------------------
+    # Events (called with the lock held)
+
+    def _update_entry(self, directory: str, name: str, structural: bool, changed: List[str]):
+        """Bring one entry up to date from disk, rescanning it if it is a new or replaced directory."""
+        node = self.dirs.get(directory)
+        if node is None:
+            return
+        path = os.path.join(directory, name)
+        i = node.find(name)
+        old = node.record(i) if i >= 0 else None
+        record = self._stat_record(node, path, name)
+        if record != old:
+            node.set(name, record)
+            changed.append(path)
+        was_dir = old is not None and old[0] & F_DIR
+        is_dir = record is not None and record[0] & F_DIR
+        if name in self.exclude:
+            return
+        if (was_dir and not is_dir) or (is_dir and (structural or not was_dir or path not in self.dirs)):
+            self._rescan_subtree(path, changed)
+
+    def _apply_pending(self, pending: Dict[Tuple[str, str], int], changed: List[str]):
+        gitignored = set()
+        touched = set()
+        for (directory, name), mask in pending.items():
+            structural = bool(mask & IN_ISDIR and mask & STRUCTURE_MASK)
+            self._update_entry(directory, name, structural, changed)
+            touched.add(directory)
+            if name == '.gitignore':
+                gitignored.add(directory)
+        for directory in sorted(gitignored):
+            if directory in self.dirs:
+                # The rules changed: recompute the flags below
+                self._rescan_subtree(directory, changed)
+        for directory in touched:
+            # The directory's own mtime changed with its entries
+            if directory != self.root and directory in self.dirs:
+                self._update_entry(os.path.dirname(directory), os.path.basename(directory), False, changed)
+
+    def _apply_events(self, events: List[Tuple[int, int, str]], changed: List[str]):
+        self.stats['events'] += len(events)
+        pending: Dict[Tuple[str, str], int] = {}
+        overflow = False
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            directory = self._wds.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # Watch removed (directory deleted): forget the descriptor
+                del self._wds[wd]
+                if self._watches.get(directory) == wd:
+                    del self._watches[directory]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # Handled by the parent's event, except for the root
+                overflow = overflow or directory == self.root
+                continue
+            if name:
+                key = (directory, name)
+                pending[key] = pending.get(key, 0) | mask
+        if self._scan_log is not None:
+            for key, mask in pending.items():
+                self._scan_log[key] = self._scan_log.get(key, 0) | mask
+        if overflow:
+            self.stats['overflows'] += 1
+            self._overflow = True
+        self._apply_pending(pending, changed)
+
+    # ------------------------------------------------------------------
+    # Change feed
+
+    def subscribe(self, callback: Callable[[List[str]], Any]):
+        """Call callback(paths) with the absolute paths of every batch of changes."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def _finish(self, changed: List[str]):
+        """Publish a batch taken under the lock (which counted it in flight)."""
+        try:
+            if changed:
+                paths = list(dict.fromkeys(changed))
+                with self._lock:
+                    self.stats['batches'] += 1
+                    self.stats['changes'] += len(paths)
+                    subscribers = list(self._subscribers)
+                for callback in subscribers:
+                    try:
+                        callback(paths)
+                    except Exception as e:
+                        logger.warning(f"Workspace index subscriber failed: {e}")
+        finally:
+            with self._published:
+                self._in_flight -= 1
+                self._published.notify_all()
+
+    def sync(self) -> bool:
+        """
+        Apply and publish the changes made so far: the queued inotify
+        events, or without inotify a rescan when the tree is stale or
+        older than poll_interval. Waits for batches other threads are
+        still publishing, so subscribers have seen them too.
+
+        Returns:
+            False before the first scan completed (read from disk instead)
+        """
+        if not self.ready:
+            return False
+        if self._inotify is None:
+            with self._scan_lock:
+                if self._inotify is None and (
+                        self._stale or time.time() - self.scanned_at >= self.poll_interval):
+                    self._rescan()
+            return True
+
+        changed: List[str] = []
+        with self._lock:
+            if self._inotify is not None:
+                events = self._inotify.read_events()
+                if events:
+                    self._apply_events(events, changed)
+            self._in_flight += 1
+        self._finish(changed)
+        if self._overflow:
+            self.rescan()
+        with self._published:
+            deadline = time.monotonic() + 5
+            while self._in_flight and time.monotonic() < deadline:
+                self._published.wait(0.1)
+        return True
+
+    def mark_stale(self):
+        """Rescan before the next query when there is no inotify watch (files were modified)."""
+        self._stale = True
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def entries(self, directory: str, names: Optional[Iterable[str]] = None) -> Optional[List[IndexEntry]]:
+        """
+        Entries of a directory, sorted by name.
+
+        Args:
+            directory: Absolute directory path
+            names: Only these names (those that exist)
+
+        Returns:
+            os.DirEntry stand-ins, or None when the tree does not hold the
+            directory (the caller reads it from disk)
+        """
+        with self._lock:
+            node = self.dirs.get(directory)
+            if node is None:
+                return None
+            self.stats['listings'] += 1
+            prefix = os.path.join(directory, '')
+            if names is None:
+                found = [IndexEntry(name, prefix + name, flags, size, mtime_ns)
+                         for name, flags, size, mtime_ns in zip(node.names, node.flags, node.sizes, node.mtimes)]
+            else:
+                found = []
+                for name in sorted(set(names)):
+                    i = node.find(name)
+                    if i >= 0:
+                        found.append(IndexEntry(name, prefix + name, *node.record(i)))
+            for entry in found:
+                if entry.flags & F_LINK:
+                    # No event tells when a symlink's target changes: stat it now
+                    record = self._stat_record(node, entry.path, entry.name)
+                    if record is not None:
+                        entry.flags, entry.size, entry.mtime_ns = record
+            return found
+
+    # ------------------------------------------------------------------
+    # Background thread
+
+    def start(self):
+        """Build the tree and keep it fresh on a daemon thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='workspace-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the thread and the inotify watches."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        with self._lock:
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self._watches.clear()
+            self._wds.clear()
+
+    def _run(self):
+        try:
+            self.rescan()
+            logger.info(f"Workspace index: {self.root} scanned in {self.stats['last_scan_ms']}ms "
+                        f"({'inotify' if self._inotify else 'polling'})")
+        except Exception as e:
+            logger.error(f"Workspace index scan failed: {e}")
+            return
+        while not self._stop.is_set():
+            try:
+                inotify = self._inotify
+                if inotify is None:
+                    wait = self.scanned_at + self.poll_interval - time.time()
+                    if not self._stop.wait(max(0.1, wait)):
+                        self.sync()
+                    continue
+                wait = self.scanned_at + self.rescan_interval - time.time()
+                if wait <= 0:
+                    self.rescan()
+                    continue
+                readable, _, _ = select.select([inotify.fd], [], [], min(wait, 1.0))
+                if readable and not self._stop.wait(DEBOUNCE):
+                    self.sync()
+            except (OSError, ValueError):
+                # The inotify descriptor was closed (watch limit reached or stopping)
+                continue
+            except Exception as e:
+                logger.error(f"Workspace index update failed: {e}")
+                self._stop.wait(1.0)
+
+    # ------------------------------------------------------------------
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the tree (interned names counted once)."""
+        with self._lock:
+            total = sys.getsizeof(self.dirs)
+            seen = set()
+            for path, node in self.dirs.items():
+                total += (sys.getsizeof(path) + sys.getsizeof(node) + sys.getsizeof(node.names)
+                          + sys.getsizeof(node.flags) + sys.getsizeof(node.sizes) + sys.getsizeof(node.mtimes))
+                for name in node.names:
+                    if id(name) not in seen:
+                        seen.add(id(name))
+                        total += sys.getsizeof(name)
+            return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Tree size, memory per 100k entries, watch state and event counters."""
+        memory = self.memory_bytes()
+        with self._lock:
+            entries = sum(len(node.names) for node in self.dirs.values())
+            files = sum(1 for node in self.dirs.values() for flags in node.flags if flags & F_FILE)
+            return {
+                **self.stats,
+                'enabled': True,
+                'root': self.root,
+                'ready': self.ready,
+                'directories': len(self.dirs),
+                'entries': entries,
+                'files': files,
+                'memory_bytes': memory,
+                'memory_mb_per_100k_entries': round(memory / entries * 100000 / 1e6, 1) if entries else None,
+                'inotify': self._inotify is not None,
+                'inotify_error': self.inotify_error,
+                'watches': len(self._wds),
+                'subscribers': len(self._subscribers),
+                'scan_age_s': round(time.time() - self.scanned_at, 1) if self.scanned_at else None
+            }
+
+
+# Global instance
+_index = None
+
+
+def get_workspace_index() -> WorkspaceIndex:
+    """Get the global workspace index (its background scan starts on first use)."""
+    global _index
+    if _index is None:
+        _index = WorkspaceIndex()
+        _index.start()
+    return _index
+
+
+def lookup(path: str, index: Optional[WorkspaceIndex] = None) -> Optional[WorkspaceIndex]:
+    """
+    The index to list a directory tree from, after applying pending changes.
+
+    Args:
+        path: Absolute path about to be read
+        index: A specific index (default: the global one, when enabled)
+
+    Returns:
+        The index, or None when it is disabled, still scanning or does not
+        cover path (read from disk)
+    """
+    if index is None:
+        if not ENABLED:
+            return None
+        index = get_workspace_index()
+    if not index.covers(path) or not index.sync():
+        return None
+    return index
+
+
+def scandir(directory: str) -> list:
+    """
+    Entries of a directory sorted by name: from the global index when it
+    holds the directory, otherwise os.DirEntry objects from disk.
+
+    Raises:
+        OSError: If the directory cannot be read
+    """
+    index = lookup(directory)
+    entries = index.entries(directory) if index is not None else None
+    if entries is None:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    return entries
+
+
+def subscribe(callback: Callable[[List[str]], Any]) -> bool:
+    """Subscribe to the global index's change feed; False when the index is disabled."""
+    if not ENABLED:
+        return False
+    get_workspace_index().subscribe(callback)
+    return True
+
+
+def mark_stale():
+    """Rescan the global index before its next query if it is polling (files were modified)."""
+    if _index is not None:
+        _index.mark_stale()